@@ -14,14 +14,262 @@ MESSAGE_STATUS_FAILED = 4
 MESSAGE_STATUS_PENDING = 5
 # 消息状态 暂停消费
 MESSAGE_STATUS_SUSPEND = 6
+# 消息状态 已转入死信队列 (达到消费失败次数上限后 从 Common Segment 移出)
+MESSAGE_STATUS_DEAD_LETTER = 7
+
+# 消息状态 -> 运维指标中使用的状态名称
+MESSAGE_STATUS_NAME_DICT = {
+    MESSAGE_STATUS_INIT: "init",
+    MESSAGE_STATUS_LOCKED: "locked",
+    MESSAGE_STATUS_DONE: "done",
+    MESSAGE_STATUS_DELETE: "delete",
+    MESSAGE_STATUS_FAILED: "failed",
+    MESSAGE_STATUS_PENDING: "pending",
+    MESSAGE_STATUS_SUSPEND: "suspend",
+    MESSAGE_STATUS_DEAD_LETTER: "dead_letter",
+}
+# Common Segment 中仍然存在的消息状态 运维指标中始终输出这些状态的积压数量 没有消息时为 0
+COMMON_SEGMENT_MESSAGE_STATUS_LIST = [
+    MESSAGE_STATUS_INIT, MESSAGE_STATUS_LOCKED, MESSAGE_STATUS_FAILED, MESSAGE_STATUS_PENDING, MESSAGE_STATUS_SUSPEND
+]
+# 消费组租约中 运维指标始终输出数量的状态 消费完成的租约只在乱序提交时短暂存在
+CONSUMER_GROUP_LEASE_STATUS_LIST = [
+    MESSAGE_STATUS_INIT, MESSAGE_STATUS_LOCKED, MESSAGE_STATUS_FAILED, MESSAGE_STATUS_PENDING
+]
 
 # 供外部使用的 Segment 接口 Ext Segment Key
 EXT_SQLITE_MQ_SEGMENT = "ext_sqlite_mq_segment"
 # 归档器 Segment Key
 ARCHIVER_SQLITE_MQ_SEGMENT = "archiver_sqlite_mq_segment"
 
-# 事务开启语句
-BEGIN_TRANSACTION = "BEGIN;"
+# Segment 类型 Common Segment 存放 Topic 消息
+SQLITE_MQ_SEGMENT_TYPE_COMMON = "common"
+# Segment 类型 Ext Segment 供外部使用
+SQLITE_MQ_SEGMENT_TYPE_EXT = "ext"
+# Segment 类型 Archiver Segment 归档存储
+SQLITE_MQ_SEGMENT_TYPE_ARCHIVER = "archiver"
+
+# 持久化配置 最安全 每次事务提交都会 fsync
+SQLITE_MQ_DURABILITY_PROFILE_SAFE = "safe"
+# 持久化配置 均衡 WAL 模式下仅在 Checkpoint 时 fsync 进程崩溃不丢数据 断电可能丢失最近的事务
+SQLITE_MQ_DURABILITY_PROFILE_BALANCED = "balanced"
+# 持久化配置 最快 不主动 fsync 交由操作系统刷盘 断电可能丢失数据
+SQLITE_MQ_DURABILITY_PROFILE_FAST = "fast"
+
+# 各个持久化配置下 每种 Segment 类型对应的 PRAGMA 设置 按顺序执行
+# WAL 模式下 读写互不阻塞 busy_timeout 让并发写入时等待锁 而不是直接报错
+# auto_vacuum 只对新建的文件直接生效 已有的文件在第一次 VACUUM 后生效 之后只需要 incremental_vacuum 回收空闲页
+# Archiver 的分区整体删除文件 不需要回收空闲页
+SQLITE_MQ_DURABILITY_PROFILE_DICT = {
+    SQLITE_MQ_DURABILITY_PROFILE_SAFE: {
+        SQLITE_MQ_SEGMENT_TYPE_COMMON: [
+            ("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "FULL"), ("cache_size", -8000),
+            ("mmap_size", 0), ("temp_store", "DEFAULT"), ("busy_timeout", 5000)
+        ],
+        SQLITE_MQ_SEGMENT_TYPE_EXT: [
+            ("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "FULL"), ("cache_size", -8000),
+            ("mmap_size", 0), ("temp_store", "DEFAULT"), ("busy_timeout", 5000)
+        ],
+        SQLITE_MQ_SEGMENT_TYPE_ARCHIVER: [
+            ("journal_mode", "WAL"), ("synchronous", "FULL"), ("cache_size", -2000),
+            ("mmap_size", 0), ("temp_store", "DEFAULT"), ("busy_timeout", 5000)
+        ],
+    },
+    SQLITE_MQ_DURABILITY_PROFILE_BALANCED: {
+        SQLITE_MQ_SEGMENT_TYPE_COMMON: [
+            ("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "NORMAL"), ("cache_size", -16000),
+            ("mmap_size", 67108864), ("temp_store", "MEMORY"), ("busy_timeout", 5000)
+        ],
+        SQLITE_MQ_SEGMENT_TYPE_EXT: [
+            ("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "NORMAL"), ("cache_size", -16000),
+            ("mmap_size", 67108864), ("temp_store", "MEMORY"), ("busy_timeout", 5000)
+        ],
+        SQLITE_MQ_SEGMENT_TYPE_ARCHIVER: [
+            ("journal_mode", "WAL"), ("synchronous", "NORMAL"), ("cache_size", -2000),
+            ("mmap_size", 0), ("temp_store", "MEMORY"), ("busy_timeout", 5000)
+        ],
+    },
+    SQLITE_MQ_DURABILITY_PROFILE_FAST: {
+        SQLITE_MQ_SEGMENT_TYPE_COMMON: [
+            ("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "OFF"), ("cache_size", -65536),
+            ("mmap_size", 268435456), ("temp_store", "MEMORY"), ("busy_timeout", 5000)
+        ],
+        SQLITE_MQ_SEGMENT_TYPE_EXT: [
+            ("auto_vacuum", "INCREMENTAL"), ("journal_mode", "WAL"), ("synchronous", "OFF"), ("cache_size", -32768),
+            ("mmap_size", 268435456), ("temp_store", "MEMORY"), ("busy_timeout", 5000)
+        ],
+        SQLITE_MQ_SEGMENT_TYPE_ARCHIVER: [
+            ("journal_mode", "WAL"), ("synchronous", "OFF"), ("cache_size", -2000),
+            ("mmap_size", 0), ("temp_store", "MEMORY"), ("busy_timeout", 5000)
+        ],
+    },
+}
+
+# 各个持久化配置下 Commit Log 每次追加记录后是否 fsync
+SQLITE_MQ_COMMIT_LOG_FSYNC_DICT = {
+    SQLITE_MQ_DURABILITY_PROFILE_SAFE: True,
+    SQLITE_MQ_DURABILITY_PROFILE_BALANCED: False,
+    SQLITE_MQ_DURABILITY_PROFILE_FAST: False,
+}
+
+# Ext Segment 同步操作类型 新增消息
+EXT_SYNC_OPERATION_ADD = "add"
+# Ext Segment 同步操作类型 更新消息
+EXT_SYNC_OPERATION_UPDATE = "update"
+# Ext Segment 同步操作类型 删除消息 并写入 Archiver
+EXT_SYNC_OPERATION_DELETE = "delete"
+
+# Ext Segment 同步队列的最大长度 超过后写入方阻塞等待 形成背压
+EXT_SYNC_MAX_QUEUE_SIZE = 10000
+# Ext Segment 同步时 一个事务中最多处理的同步操作数量
+EXT_SYNC_MAX_BATCH_SIZE = 1000
+
+# Archiver 分区周期 每天一个归档文件
+SQLITE_MQ_ARCHIVE_PARTITION_DAY = "day"
+# Archiver 分区周期 每周一个归档文件 从周一开始
+SQLITE_MQ_ARCHIVE_PARTITION_WEEK = "week"
+# 各个分区周期的 (秒数, 对齐偏移秒数) 分区按 UTC 时间对齐 1970-01-01 为周四 偏移 4 天后对齐到周一
+SQLITE_MQ_ARCHIVE_PARTITION_DICT = {
+    SQLITE_MQ_ARCHIVE_PARTITION_DAY: (86400, 0),
+    SQLITE_MQ_ARCHIVE_PARTITION_WEEK: (7 * 86400, 4 * 86400),
+}
+# Archiver 分区文件所在的目录名
+SQLITE_MQ_ARCHIVE_DIR_NAME = "archive"
+# Archiver 分区文件名 Archiver Key + 分区周期 + 分区起始日期
+SQLITE_MQ_ARCHIVE_PARTITION_FILE_NAME_FORMAT = ARCHIVER_SQLITE_MQ_SEGMENT + "_%s_%s.sqlite"
+SQLITE_MQ_ARCHIVE_PARTITION_FILE_NAME_PATTERN = r"^" + ARCHIVER_SQLITE_MQ_SEGMENT + r"_(day|week)_(\d{8})\.sqlite$"
+# Archiver 分区文件名中的日期格式
+SQLITE_MQ_ARCHIVE_PARTITION_DATE_FORMAT = "%Y%m%d"
+# 检查 Archiver 保留策略的间隔秒数
+SQLITE_MQ_ARCHIVE_RETENTION_CHECK_SECONDS = 600
+
+# 空闲页占总页数的比例超过该值时 才回收 Segment 的空闲页
+SQLITE_MQ_VACUUM_FREE_PAGE_RATIO = 0.2
+# 每次 incremental_vacuum 回收的页数 批次之间释放 Segment 的锁 不长时间阻塞读写
+SQLITE_MQ_INCREMENTAL_VACUUM_PAGES = 2000
+# PRAGMA auto_vacuum 的取值 INCREMENTAL
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+
+# 幂等键的去重窗口秒数 窗口内使用相同幂等键重复发布 直接返回原消息 为 0 时不去重
+SQLITE_MQ_IDEMPOTENCY_WINDOW_SECONDS = 24 * 3600
+# 清理过期幂等键的间隔秒数
+SQLITE_MQ_IDEMPOTENCY_PRUNE_SECONDS = 60
+# 清理过期幂等键时 每个事务中删除的数量 批次之间释放 Segment 的锁
+SQLITE_MQ_IDEMPOTENCY_PRUNE_BATCH_SIZE = 1000
+
+# 消费组 已经被所有消费组提交的消息 每隔该秒数分批从 Common Segment 删除并归档
+SQLITE_MQ_CONSUMER_GROUP_RETENTION_SECONDS = 10
+# 删除已经被所有消费组提交的消息时 每个事务中删除的数量 批次之间释放 Segment 的锁
+SQLITE_MQ_CONSUMER_GROUP_RETENTION_BATCH_SIZE = 1000
+# Broker 缓存各个 Topic 消费组列表的秒数 多进程模式下 其他进程创建的消费组在该秒数内生效
+# 普通消费方式的写事务中还会校验 Segment 中是否存在消费组 缓存过期前同样会拒绝普通消费
+SQLITE_MQ_CONSUMER_GROUP_CACHE_SECONDS = 5
+
+# 单个 Topic 最多的 Shard 数量 每个 Shard 为一个独立的 Common Segment 文件 以及一个独立的锁
+SQLITE_MQ_MAX_TOPIC_SHARD_COUNT = 64
+# 非 0 号 Shard 的消息 UUID 以 分隔符 + Shard 编号 结尾 0 号 Shard 的 UUID 与未分片的 Topic 相同
+SQLITE_MQ_SHARD_UUID_SEPARATOR = "."
+# Broker 缓存各个 Topic Shard 列表的秒数 多进程模式下 其他进程新建的 Shard 文件在该秒数内被发现
+SQLITE_MQ_TOPIC_SHARD_CACHE_SECONDS = 5
+
+# 多进程模式下 每个进程的 Commit Log 存放在该目录下 以进程标识命名的子目录中
+SQLITE_MQ_PROCESS_COMMIT_LOG_DIR_NAME = "process_commit_log"
+# 多进程模式下 选举 Leader 进程的文件锁 Leader 负责恢复过期消息 同步 Ext Segment 以及归档等定期任务
+SQLITE_MQ_LEADER_LOCK_FILE_NAME = "leader.lock"
+# 多进程模式下 Leader 读取各个进程 Commit Log 的间隔秒数 以及其他进程竞选 Leader 的间隔秒数
+SQLITE_MQ_PROCESS_SYNC_INTERVAL_SECONDS = 0.05
+SQLITE_MQ_LEADER_ELECTION_INTERVAL_SECONDS = 1
+# 多进程模式下 其他进程添加的消息无法在进程内通知 等待消息的消费者每隔该秒数重新查询一次
+SQLITE_MQ_PROCESS_POLL_SECONDS = 0.1
+
+# MQ Server 默认监听的地址 (host, port) 为 TCP 字符串为 Unix Socket 文件路径
+SQLITE_MQ_SERVER_DEFAULT_ADDRESS = ("127.0.0.1", 9527)
+SQLITE_MQ_SERVER_LISTEN_BACKLOG = 128
+# 每一帧的帧头 依次为 负载长度 请求编号 请求的操作码 / 响应的状态码 均为网络字节序
+SQLITE_MQ_SERVER_FRAME_HEADER_FORMAT = ">IIB"
+# 单帧负载的最大字节数 超过时视为协议错误并断开连接
+SQLITE_MQ_SERVER_MAX_FRAME_SIZE = 64 * 1024 * 1024
+# 每次从 Socket 读取的最大字节数 一次读取到的多个请求连续处理 响应合并发送
+SQLITE_MQ_SERVER_RECV_BUFFER_SIZE = 256 * 1024
+# 负载使用的 marshal 格式版本 Python 2 与 Python 3 均支持
+SQLITE_MQ_SERVER_MARSHAL_VERSION = 2
+SQLITE_MQ_SERVER_STATUS_OK = 0
+SQLITE_MQ_SERVER_STATUS_ERROR = 1
+
+# 异步接口 执行 MQ 调用的线程数量 调用的并发度与正在等待的请求数量无关
+SQLITE_MQ_ASYNC_EXECUTOR_WORKERS = 4
+# 异步接口 合并多个 add_message 为一次 add_messages 时 每批最多包含的消息数量
+SQLITE_MQ_ASYNC_MAX_BATCH_SIZE = 500
+# 异步接口 等待消息到达的线程单次最多等待的秒数 到期后重新收集等待的 Topic 与超时时间
+SQLITE_MQ_ASYNC_ARRIVAL_WAIT_SECONDS = 1
+
+# 运维指标 计数器名称 按 Topic 统计
+SQLITE_MQ_METRIC_ENQUEUE = "enqueue"
+SQLITE_MQ_METRIC_DEQUEUE = "dequeue"
+SQLITE_MQ_METRIC_COMMIT = "commit"
+SQLITE_MQ_METRIC_FAILED = "failed"
+SQLITE_MQ_METRIC_COUNTER_LIST = [
+    SQLITE_MQ_METRIC_ENQUEUE, SQLITE_MQ_METRIC_DEQUEUE, SQLITE_MQ_METRIC_COMMIT, SQLITE_MQ_METRIC_FAILED
+]
+# 运维指标 直方图名称 Common Segment 提交事务的耗时 (包含追加 Commit Log 与 fsync)
+SQLITE_MQ_METRIC_TRANSACTION_SECONDS = "transaction_seconds"
+# 直方图各个桶的上限秒数 最后隐含一个 +Inf 桶
+SQLITE_MQ_METRICS_LATENCY_BUCKET_LIST = [
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+]
+# Prometheus 文本格式中 所有指标名称的前缀
+SQLITE_MQ_METRICS_PROMETHEUS_PREFIX = "pava_mq_"
+SQLITE_MQ_METRICS_PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 指标 HTTP 接口默认监听的地址 以及路径
+SQLITE_MQ_METRICS_HTTP_DEFAULT_ADDRESS = ("127.0.0.1", 9464)
+SQLITE_MQ_METRICS_HTTP_PATH = "/metrics"
+
+# 死信队列文件所在的目录名 每个 Topic 一个文件 文件名为 Topic + .sqlite 表结构与 Ext Segment 相同
+SQLITE_MQ_DEAD_LETTER_DIR_NAME = "dead_letter"
+# 定期将 Common Segment 中遗留的挂起消息转入死信队列的间隔秒数 (转移中途中断 以及升级前挂起的消息)
+SQLITE_MQ_DEAD_LETTER_SWEEP_SECONDS = 60
+# 转入死信队列 以及从死信队列移回时 每个事务中处理的消息数量
+SQLITE_MQ_DEAD_LETTER_BATCH_SIZE = 1000
+
+# 恢复过期消息时 每个事务中恢复的消息数量 一次恢复会连续处理多页 直到没有过期的消息
+RECOVER_MESSAGE_BATCH_SIZE = 1000
+
+# 每个连接缓存的预编译语句数量 所有语句均使用 ? 占位符 语句文本固定 可以被缓存复用
+SQLITE_STATEMENT_CACHE_SIZE = 256
+
+# 消息体存储方式 Base64 文本 兼容旧版本写入的 Segment
+SQLITE_MQ_MESSAGE_STORAGE_BASE64 = "base64"
+# 消息体存储方式 二进制 BLOB 通过绑定参数写入 读写均无需 Base64 编解码
+SQLITE_MQ_MESSAGE_STORAGE_BINARY = "binary"
+
+# 消息体压缩算法 zlib
+SQLITE_MQ_COMPRESS_ALGORITHM_ZLIB = "zlib"
+# 消息体压缩算法 lzma 压缩率更高 但更耗 CPU 需要运行环境提供 lzma 模块
+SQLITE_MQ_COMPRESS_ALGORITHM_LZMA = "lzma"
+# 消息体超过该字节数时才尝试压缩 压缩后没有变小则按原文存储
+SQLITE_MQ_COMPRESS_THRESHOLD = 4096
+
+# 消息体存储编码 Base64 文本 (表结构升级前写入的消息均为该编码)
+MESSAGE_ENCODING_BASE64 = 0
+# 消息体存储编码 原始字节
+MESSAGE_ENCODING_BINARY = 1
+# 消息体存储编码 zlib 压缩后的字节
+MESSAGE_ENCODING_ZLIB = 2
+# 消息体存储编码 lzma 压缩后的字节
+MESSAGE_ENCODING_LZMA = 3
+
+# 存储方式迁移时 每个事务中重写的消息数量
+MESSAGE_STORAGE_MIGRATE_BATCH_SIZE = 1000
+
+# 消息的默认优先级 数值越大越先被消费 允许为负数
+MESSAGE_PRIORITY_DEFAULT = 0
+# 优先级老化 消息每等待该秒数 出队时的有效优先级提升 1 避免低优先级的消息一直无法被消费 为 0 时不老化
+SQLITE_MQ_PRIORITY_AGING_SECONDS = 60
+
+# 事务开启语句 所有事务都会写入 开始时就获取写锁 多进程并发时由 busy_timeout 等待 而不是在读升级为写时直接失败
+BEGIN_TRANSACTION = "BEGIN IMMEDIATE;"
+COMMIT_TRANSACTION = "COMMIT;"
+ROLLBACK_TRANSACTION = "ROLLBACK;"
 
 # 存储消息的 主要 Segment 表名 一般的 Topic 都存放这里
 # 根据文档 https://www.sqlite.org/autoinc.html
@@ -63,9 +311,9 @@ CREATE_INDEX_UUID = """
     CREATE INDEX IF NOT EXISTS idx_uuid ON simple_sqlite_mq (uuid);
 """
 
-# 在 Topic 上建立索引 供 Ext Segment 在管理消息时使用
-CREATE_INDEX_MESSAGE_TOPIC = """
-    CREATE INDEX IF NOT EXISTS idx_message_topic ON simple_sqlite_mq (message_topic);
+# Ext Segment 早期版本在 Topic 上建立的索引 已经被 (message_topic, update_time) 复合索引覆盖
+DROP_INDEX_MESSAGE_TOPIC = """
+    DROP INDEX IF EXISTS idx_message_topic;
 """
 
 # 在 Expire Time 上建立索引 供 Ext Segment 在 Recover Message 时使用
@@ -78,6 +326,225 @@ CREATE_INDEX_UPDATE_TIME = """
     CREATE INDEX IF NOT EXISTS idx_update_time ON simple_sqlite_mq (update_time);
 """
 
+# 在 消息状态 与 Message ID 上建立复合索引 供 Common Segment 按 FIFO 顺序获取未消费的消息
+# 避免 DONE / FAILED / PENDING 的消息堆积时 每次出队都需要全表扫描
+CREATE_INDEX_MESSAGE_STATUS_MESSAGE_ID = """
+    CREATE INDEX IF NOT EXISTS idx_message_status_message_id ON simple_sqlite_mq (message_status, message_id);
+"""
+
+# 在 消息状态 可见时间 与 Message ID 上建立复合索引 供 Common Segment 获取已经可见的消息
+# 延迟消息的可见时间在未来 出队时沿索引只扫描可见时间已到的部分 不会扫描大量未到期的延迟消息
+CREATE_INDEX_MESSAGE_STATUS_VISIBLE_TIME_MESSAGE_ID = """
+    CREATE INDEX IF NOT EXISTS idx_message_status_visible_time_message_id
+    ON simple_sqlite_mq (message_status, visible_time, message_id);
+"""
+
+# 出队已经改为使用 可见时间 复合索引 删除不再使用的 状态 与 Message ID 复合索引 减少写入开销
+DROP_INDEX_MESSAGE_STATUS_MESSAGE_ID = """
+    DROP INDEX IF EXISTS idx_message_status_message_id;
+"""
+
+# 在 消息状态 优先级 可见时间 与 Message ID 上建立复合索引 供 Common Segment 按优先级获取已经可见的消息
+# 出队时沿索引逐个优先级跳跃 每个优先级内只扫描可见时间已到的部分
+CREATE_INDEX_MESSAGE_STATUS_PRIORITY_VISIBLE_TIME_MESSAGE_ID = """
+    CREATE INDEX IF NOT EXISTS idx_message_status_priority_visible_time_message_id
+    ON simple_sqlite_mq (message_status, priority DESC, visible_time, message_id);
+"""
+
+# 在 消息状态 与 过期时间 上建立复合索引 供 Common Segment 恢复租约过期的 消费中 / 消费失败 的消息
+CREATE_INDEX_MESSAGE_STATUS_EXPIRE_TIME = """
+    CREATE INDEX IF NOT EXISTS idx_message_status_expire_time ON simple_sqlite_mq (message_status, expire_time);
+"""
+
+# 出队已经改为使用 优先级 复合索引 删除不再使用的 可见时间 复合索引
+DROP_INDEX_MESSAGE_STATUS_VISIBLE_TIME_MESSAGE_ID = """
+    DROP INDEX IF EXISTS idx_message_status_visible_time_message_id;
+"""
+
+# 在 Topic 消息状态 与 优先级 上建立复合索引 供 Ext Segment 统计各个优先级堆积的消息数量
+CREATE_INDEX_MESSAGE_TOPIC_MESSAGE_STATUS_PRIORITY = """
+    CREATE INDEX IF NOT EXISTS idx_message_topic_message_status_priority
+    ON simple_sqlite_mq (message_topic, message_status, priority);
+"""
+
+# 读取 Segment 文件的表结构版本
+GET_SCHEMA_VERSION_SQL = "PRAGMA user_version;"
+
+# 写入 Segment 文件的表结构版本
+SET_SCHEMA_VERSION_SQL = "PRAGMA user_version = %s;"
+
+# 设置 SQLite 连接的 PRAGMA
+SET_PRAGMA_SQL = "PRAGMA %s = %s;"
+
+# 读取 SQLite 连接的 PRAGMA
+GET_PRAGMA_SQL = "PRAGMA %s;"
+
+# 回收指定数量的空闲页 仅在 auto_vacuum 为 INCREMENTAL 时有效 每回收一页返回一行 需要读取完所有结果
+INCREMENTAL_VACUUM_SQL = "PRAGMA incremental_vacuum(%s);"
+
+# 重建整个数据库文件 同时使 auto_vacuum 的设置生效
+VACUUM_SQL = "VACUUM;"
+
+# Common Segment 表结构升级列表 第 N 个元素为升级到版本 N + 1 所需执行的 SQL
+# 启动时根据 Segment 文件中记录的版本 自动执行尚未执行过的升级 已有的 Segment 文件无需手动迁移
+# 为消息增加 消息体存储编码 列 已有的消息均为 Base64 文本
+ADD_COLUMN_MESSAGE_ENCODING = """
+    ALTER TABLE simple_sqlite_mq ADD COLUMN message_encoding INTEGER NOT NULL DEFAULT 0;
+"""
+
+# 为消息增加 可见时间 列 已有的消息均立即可见
+ADD_COLUMN_VISIBLE_TIME = """
+    ALTER TABLE simple_sqlite_mq ADD COLUMN visible_time INTEGER NOT NULL DEFAULT 0;
+"""
+
+# 为消息增加 优先级 列 已有的消息均为默认优先级
+ADD_COLUMN_PRIORITY = """
+    ALTER TABLE simple_sqlite_mq ADD COLUMN priority INTEGER NOT NULL DEFAULT 0;
+"""
+
+# 生产者幂等键 消息被消费提交后会从 simple_sqlite_mq 中删除 所以幂等键单独存放 在去重窗口内保留
+# 记录原消息发布时的属性 重复发布时据此返回原消息
+CREATE_SIMPLE_SQLITE_MQ_IDEMPOTENCY_KEY_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS simple_sqlite_mq_idempotency_key (
+        idempotency_key  TEXT NOT NULL,
+        message_id       INTEGER,
+        message_uuid     TEXT,
+        producer         TEXT,
+        create_time      INTEGER,
+        visible_time     INTEGER,
+        priority         INTEGER,
+        message_encoding INTEGER,
+        expire_time      INTEGER
+    );
+"""
+
+# 幂等键唯一索引
+CREATE_INDEX_IDEMPOTENCY_KEY = """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_idempotency_key ON simple_sqlite_mq_idempotency_key (idempotency_key);
+"""
+
+# 在幂等键的过期时间上建立索引 供后台分批清理
+CREATE_INDEX_IDEMPOTENCY_KEY_EXPIRE_TIME = """
+    CREATE INDEX IF NOT EXISTS idx_idempotency_key_expire_time ON simple_sqlite_mq_idempotency_key (expire_time);
+"""
+
+# 原消息离开 Common Segment (消费完成 删除 转入死信队列) 时 在幂等键上记录消息最终的消息体与状态
+# 去重窗口内重复发布时 原消息已经不在 Common Segment 中 据此返回原消息
+ADD_COLUMN_IDEMPOTENCY_KEY_MESSAGE_TEXT = """
+    ALTER TABLE simple_sqlite_mq_idempotency_key ADD COLUMN message_text;
+"""
+
+ADD_COLUMN_IDEMPOTENCY_KEY_MESSAGE_STATUS = """
+    ALTER TABLE simple_sqlite_mq_idempotency_key ADD COLUMN message_status INTEGER;
+"""
+
+ADD_COLUMN_IDEMPOTENCY_KEY_UPDATE_TIME = """
+    ALTER TABLE simple_sqlite_mq_idempotency_key ADD COLUMN update_time INTEGER;
+"""
+
+ADD_COLUMN_IDEMPOTENCY_KEY_MESSAGE_EXPIRE_TIME = """
+    ALTER TABLE simple_sqlite_mq_idempotency_key ADD COLUMN message_expire_time INTEGER;
+"""
+
+ADD_COLUMN_IDEMPOTENCY_KEY_CONSUMER = """
+    ALTER TABLE simple_sqlite_mq_idempotency_key ADD COLUMN consumer TEXT;
+"""
+
+ADD_COLUMN_IDEMPOTENCY_KEY_FAILED_TIMES = """
+    ALTER TABLE simple_sqlite_mq_idempotency_key ADD COLUMN failed_times INTEGER;
+"""
+
+# 消息离开 Common Segment 时 按 UUID 找到对应的幂等键
+CREATE_INDEX_IDEMPOTENCY_KEY_MESSAGE_UUID = """
+    CREATE INDEX IF NOT EXISTS idx_idempotency_key_message_uuid ON simple_sqlite_mq_idempotency_key (message_uuid);
+"""
+
+# 消费组 每个消费组在 Topic 的每个 Shard 中一行 消息只写入一次 各个消费组按 Message ID 顺序各自读取
+# committed_offset 及之前的消息 该消费组均已提交或挂起 read_offset 及之前的消息 均已投递或已安排投递
+CREATE_SIMPLE_SQLITE_MQ_CONSUMER_GROUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS simple_sqlite_mq_consumer_group (
+        consumer_group   TEXT PRIMARY KEY,
+        committed_offset INTEGER NOT NULL,
+        read_offset      INTEGER NOT NULL,
+        create_time      INTEGER,
+        update_time      INTEGER
+    );
+"""
+
+# 消费组租约 已经读取但尚未越过 committed_offset 的消息 每个消费组每条消息一行
+# 状态为 初始化 (延迟消息 / 移回的消息 到达 expire_time 后投递) 消费中 消费失败 消费完成 (乱序提交) 挂起
+CREATE_SIMPLE_SQLITE_MQ_CONSUMER_GROUP_LEASE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS simple_sqlite_mq_consumer_group_lease (
+        consumer_group TEXT NOT NULL,
+        message_id     INTEGER NOT NULL,
+        message_status INTEGER,
+        consumer       TEXT,
+        expire_time    INTEGER,
+        failed_times   INTEGER,
+        update_time    INTEGER,
+        PRIMARY KEY (consumer_group, message_id)
+    );
+"""
+
+# 在 消费组 状态 与 过期时间 上建立复合索引 供消费组获取租约过期 / 到达重试时间的消息
+CREATE_INDEX_CONSUMER_GROUP_LEASE_STATUS_EXPIRE_TIME = """
+    CREATE INDEX IF NOT EXISTS idx_consumer_group_lease_status_expire_time
+    ON simple_sqlite_mq_consumer_group_lease (consumer_group, message_status, expire_time);
+"""
+
+COMMON_SEGMENT_SCHEMA_MIGRATION_LIST = [
+    # 版本 1: 状态 与 FIFO 顺序复合索引
+    [CREATE_INDEX_MESSAGE_STATUS_MESSAGE_ID],
+    # 版本 2: 消息体存储编码
+    [ADD_COLUMN_MESSAGE_ENCODING],
+    # 版本 3: 可见时间 (延迟消息) 以及按可见时间出队的复合索引
+    [ADD_COLUMN_VISIBLE_TIME, CREATE_INDEX_MESSAGE_STATUS_VISIBLE_TIME_MESSAGE_ID, DROP_INDEX_MESSAGE_STATUS_MESSAGE_ID],
+    # 版本 4: 优先级 以及按优先级出队的复合索引
+    [ADD_COLUMN_PRIORITY, CREATE_INDEX_MESSAGE_STATUS_PRIORITY_VISIBLE_TIME_MESSAGE_ID,
+     DROP_INDEX_MESSAGE_STATUS_VISIBLE_TIME_MESSAGE_ID],
+    # 版本 5: 按过期时间恢复消息的复合索引
+    [CREATE_INDEX_MESSAGE_STATUS_EXPIRE_TIME],
+    # 版本 6: 生产者幂等键
+    [CREATE_SIMPLE_SQLITE_MQ_IDEMPOTENCY_KEY_TABLE_SQL, CREATE_INDEX_IDEMPOTENCY_KEY,
+     CREATE_INDEX_IDEMPOTENCY_KEY_EXPIRE_TIME],
+    # 版本 7: 消费组 以及消费组租约
+    [CREATE_SIMPLE_SQLITE_MQ_CONSUMER_GROUP_TABLE_SQL, CREATE_SIMPLE_SQLITE_MQ_CONSUMER_GROUP_LEASE_TABLE_SQL,
+     CREATE_INDEX_CONSUMER_GROUP_LEASE_STATUS_EXPIRE_TIME],
+    # 版本 8: 幂等键记录原消息离开 Common Segment 时的消息体与状态
+    [ADD_COLUMN_IDEMPOTENCY_KEY_MESSAGE_TEXT, ADD_COLUMN_IDEMPOTENCY_KEY_MESSAGE_STATUS,
+     ADD_COLUMN_IDEMPOTENCY_KEY_UPDATE_TIME, ADD_COLUMN_IDEMPOTENCY_KEY_MESSAGE_EXPIRE_TIME,
+     ADD_COLUMN_IDEMPOTENCY_KEY_CONSUMER, ADD_COLUMN_IDEMPOTENCY_KEY_FAILED_TIMES,
+     CREATE_INDEX_IDEMPOTENCY_KEY_MESSAGE_UUID],
+]
+
+# Ext Segment 以及 Archiver Segment 表结构升级列表 规则与 Common Segment 相同
+# 以下复合索引供 Ext Segment 按 (update_time, rowid) 倒序分页检索消息 rowid 隐含在索引的末尾
+# 任意组合 Topic / 消息状态 / 时间范围 筛选时 都可以沿索引直接定位到下一页 无需排序
+CREATE_INDEX_MESSAGE_TOPIC_UPDATE_TIME = """
+    CREATE INDEX IF NOT EXISTS idx_message_topic_update_time ON simple_sqlite_mq (message_topic, update_time);
+"""
+
+CREATE_INDEX_MESSAGE_STATUS_UPDATE_TIME = """
+    CREATE INDEX IF NOT EXISTS idx_message_status_update_time ON simple_sqlite_mq (message_status, update_time);
+"""
+
+CREATE_INDEX_MESSAGE_TOPIC_MESSAGE_STATUS_UPDATE_TIME = """
+    CREATE INDEX IF NOT EXISTS idx_message_topic_message_status_update_time
+    ON simple_sqlite_mq (message_topic, message_status, update_time);
+"""
+
+EXT_SEGMENT_SCHEMA_MIGRATION_LIST = [
+    # 版本 1: 消息体存储编码
+    [ADD_COLUMN_MESSAGE_ENCODING],
+    # 版本 2: 可见时间
+    [ADD_COLUMN_VISIBLE_TIME],
+    # 版本 3: 优先级 以及统计各个优先级堆积数量的复合索引
+    [ADD_COLUMN_PRIORITY, CREATE_INDEX_MESSAGE_TOPIC_MESSAGE_STATUS_PRIORITY],
+    # 版本 4: 分页检索消息的复合索引 替代单独的 Topic 索引
+    [CREATE_INDEX_MESSAGE_TOPIC_UPDATE_TIME, CREATE_INDEX_MESSAGE_STATUS_UPDATE_TIME,
+     CREATE_INDEX_MESSAGE_TOPIC_MESSAGE_STATUS_UPDATE_TIME, DROP_INDEX_MESSAGE_TOPIC],
+]
+
 # 向 Common Segment 添加消息的 SQL
 ADD_MESSAGE_TO_COMMON_SEGMENT_TABLE_SQL = """
     INSERT INTO simple_sqlite_mq (
@@ -89,21 +556,42 @@ ADD_MESSAGE_TO_COMMON_SEGMENT_TABLE_SQL = """
         failed_times,
         producer,
         consumer,
-        uuid
-    ) VALUES (
-        '%s',
-        %s,
-        %s,
-        %s,
-        %s,
-        0,
-        '%s',
-        '%s',
-        '%s'
-    )
+        uuid,
+        message_encoding,
+        visible_time,
+        priority
+    ) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)
 """
 
-# 向 Ext Segment 以及 Archiver Segment 添加消息的 SQL
+# 向 Common Segment 批量添加消息的 SQL 配合 executemany 使用
+# Message ID 由批量写入时显式指定 以便在同一个事务内一次性返回所有消息的 ID
+ADD_MESSAGE_LIST_TO_COMMON_SEGMENT_TABLE_SQL = """
+    INSERT INTO simple_sqlite_mq (
+        message_id,
+        message_text,
+        message_status,
+        create_time,
+        update_time,
+        expire_time,
+        failed_times,
+        producer,
+        consumer,
+        uuid,
+        message_encoding,
+        visible_time,
+        priority
+    ) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)
+"""
+
+# 获取 Common Segment 当前最大的 Message ID 批量写入时使用
+GET_COMMON_SEGMENT_MAX_MESSAGE_ID_SQL = """
+    SELECT
+        MAX(message_id)
+    FROM
+        simple_sqlite_mq
+"""
+
+# 向 Ext Segment 以及 Archiver Segment 添加消息的 SQL 批量添加时配合 executemany 使用
 ADD_MESSAGE_TO_EXT_SEGMENT_TABLE_SQL = """
     INSERT INTO simple_sqlite_mq (
         message_id,
@@ -116,36 +604,162 @@ ADD_MESSAGE_TO_EXT_SEGMENT_TABLE_SQL = """
         failed_times,
         producer,
         consumer,
-        uuid
-    ) VALUES (
-        '%s',
-        '%s',
-        '%s',
-        %s,
-        %s,
-        %s,
-        %s,
-        %s,
-        '%s',
-        '%s',
-        '%s'
+        uuid,
+        message_encoding,
+        visible_time,
+        priority
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# 递归查询 Common Segment 中存在未消费消息的各个优先级 从高到低
+# 每一步都沿 优先级 复合索引 定位到比上一个优先级更低的最大优先级 只需要访问 优先级数量 次索引
+COMMON_SEGMENT_MESSAGE_PRIORITY_CTE_STR = """
+    WITH RECURSIVE message_priority(priority) AS (
+        SELECT
+            MAX(priority)
+        FROM
+            simple_sqlite_mq
+        WHERE
+            message_status = 0
+        UNION ALL
+        SELECT
+            (
+                SELECT
+                    MAX(priority)
+                FROM
+                    simple_sqlite_mq
+                WHERE
+                    message_status = 0
+                AND
+                    priority < message_priority.priority
+            )
+        FROM
+            message_priority
+        WHERE
+            message_priority.priority IS NOT NULL
     )
 """
 
-# 用于 Common Segment 获取未消费的消息
-GET_COMMON_SEGMENT_MESSAGE_SQL = """
+# 用于 Common Segment 按优先级获取已经可见 且未消费的消息 两处 LIMIT 均为获取的数量
+# 每个优先级内按 可见时间 与 Message ID 的 FIFO 顺序取出最早的 N 条 再按有效优先级合并
+# 有效优先级 = 优先级 + 已经等待的秒数 / 老化秒数 老化秒数为 0 时除法结果为 NULL 即不老化
+# 同一优先级内越早的消息有效优先级越高 所以每个优先级只需要取出最早的 N 条
+# 这条语句在 BEGIN IMMEDIATE 的事务中执行 Python 2 的 sqlite3 会在执行 WITH 开头的语句之前自动提交当前事务
+# 所以外层再包一层 SELECT 保证查询与锁定在同一个事务中
+GET_COMMON_SEGMENT_MESSAGE_TEMPLATE_SQL = "SELECT * FROM (" + COMMON_SEGMENT_MESSAGE_PRIORITY_CTE_STR + """
+    SELECT
+        simple_sqlite_mq.message_id,
+        simple_sqlite_mq.message_text,
+        simple_sqlite_mq.create_time,
+        simple_sqlite_mq.failed_times,
+        simple_sqlite_mq.producer,
+        simple_sqlite_mq.uuid,
+        simple_sqlite_mq.message_encoding,
+        simple_sqlite_mq.visible_time,
+        simple_sqlite_mq.priority
+    FROM
+        message_priority CROSS JOIN simple_sqlite_mq
+    WHERE
+        simple_sqlite_mq.message_id IN (
+            SELECT
+                level_message.message_id
+            FROM
+                simple_sqlite_mq AS level_message
+            WHERE
+                level_message.message_status = 0
+            AND
+                level_message.priority = message_priority.priority
+            AND
+                level_message.visible_time <= ?
+            ORDER BY
+                level_message.visible_time,
+                level_message.message_id
+            LIMIT %s
+        )
+    ORDER BY
+        simple_sqlite_mq.priority + IFNULL((? - simple_sqlite_mq.visible_time) / ?, 0) DESC,
+        simple_sqlite_mq.visible_time,
+        simple_sqlite_mq.message_id
+    LIMIT %s
+)
+"""
+
+# 单条获取已经可见 且未消费的消息 参数依次为 当前时间 当前时间 老化秒数
+GET_COMMON_SEGMENT_MESSAGE_SQL = GET_COMMON_SEGMENT_MESSAGE_TEMPLATE_SQL % (1, 1)
+
+# 批量获取已经可见 且未消费的消息 参数依次为 当前时间 获取的数量 当前时间 老化秒数 获取的数量
+GET_COMMON_SEGMENT_MESSAGE_LIST_SQL = GET_COMMON_SEGMENT_MESSAGE_TEMPLATE_SQL % ("?", "?")
+
+# 获取 Common Segment 中 下一条延迟消息的可见时间 用于在消息可见时唤醒消费者
+# 逐个优先级沿索引查询 不会扫描已经可见的消息
+GET_COMMON_SEGMENT_NEXT_VISIBLE_TIME_SQL = COMMON_SEGMENT_MESSAGE_PRIORITY_CTE_STR + """
+    SELECT
+        MIN(
+            (
+                SELECT
+                    MIN(visible_time)
+                FROM
+                    simple_sqlite_mq
+                WHERE
+                    message_status = 0
+                AND
+                    priority = message_priority.priority
+                AND
+                    visible_time > ?
+            )
+        )
+    FROM
+        message_priority
+"""
+
+# 用于 Common Segment 批量锁定消息 配合 executemany 使用
+LOCK_COMMON_SEGMENT_MESSAGE_LIST_SQL = """
+    UPDATE
+        simple_sqlite_mq
+    SET
+        message_status = ?,
+        update_time = ?,
+        consumer = ?,
+        expire_time = ?
+    WHERE
+        message_id = ?
+    AND
+        message_status = 0
+"""
+
+# 用于 Common Segment 批量 Hold 消息时 逐条查询仍在消费中的消息
+FETCH_COMMON_LOCKED_MESSAGE_BY_UUID_SQL = """
     SELECT
         message_id,
         message_text,
         create_time,
+        expire_time,
+        consumer,
         failed_times,
         producer,
-        uuid
+        uuid,
+        message_encoding,
+        visible_time,
+        priority
     FROM
         simple_sqlite_mq
     WHERE
-        message_status = 0
-    LIMIT 1
+        message_status = 1
+    AND
+        uuid = ?
+"""
+
+# 用于 Common Segment 批量 Hold 消息 配合 executemany 使用
+HOLD_COMMON_SEGMENT_MESSAGE_LIST_SQL = """
+    UPDATE
+        simple_sqlite_mq
+    SET
+        update_time = ?,
+        expire_time = ?
+    WHERE
+        message_id = ?
+    AND
+        message_status = 1
 """
 
 # 用于 Common Segment 更新消息
@@ -153,27 +767,27 @@ UPDATE_COMMON_SEGMENT_MESSAGE_SQL = """
     UPDATE
         simple_sqlite_mq
     SET
-        message_status = %s,
-        update_time = %s,
-        consumer= '%s',
-        expire_time= %s,
-        failed_times= %s
+        message_status = ?,
+        update_time = ?,
+        consumer= ?,
+        expire_time= ?,
+        failed_times= ?
     WHERE
-        uuid = '%s'
+        uuid = ?
 """
 
-# 用于 Ext Segment 更新消息
+# 用于 Ext Segment 更新消息 批量更新时配合 executemany 使用
 UPDATE_EXT_SEGMENT_MESSAGE_SQL = """
     UPDATE
         simple_sqlite_mq
     SET
-        message_status = %s,
-        update_time = %s,
-        consumer= '%s',
-        expire_time= %s,
-        failed_times= %s
+        message_status = ?,
+        update_time = ?,
+        consumer= ?,
+        expire_time= ?,
+        failed_times= ?
     WHERE
-        uuid = '%s'
+        uuid = ?
 """
 
 
@@ -182,20 +796,22 @@ DELETE_COMMON_SEGMENT_MESSAGE_SQL = """
     DELETE FROM
         simple_sqlite_mq
     WHERE
-        uuid = '%s'
+        uuid = ?
 """
 
-# 删除 Ext Segment 的 Message
+# 删除 Ext Segment 的 Message 批量删除时配合 executemany 使用
+# message_topic 前的 + 使其不参与索引选择 否则 SQLite 会选用 Topic 索引 在消息堆积的 Topic 中逐条比较 UUID
 DELETE_EXT_SEGMENT_MESSAGE_SQL = """
     DELETE FROM
         simple_sqlite_mq
     WHERE
-        message_topic = '%s'
+        +message_topic = ?
     AND
-        uuid = '%s'
+        uuid = ?
 """
 
-# Ext Segment 在检索消息的时候使用
+# Ext Segment 在检索消息的时候使用 按 (update_time, rowid) 倒序 rowid 在同一秒内更新的消息之间确定先后
+# message_id 只在同一个 Topic 内唯一 所以使用 Ext 表自身的 rowid 作为分页位置
 SCAN_EXT_SEGMENT_MESSAGE_SQL = """
     SELECT
         message_id,
@@ -208,79 +824,166 @@ SCAN_EXT_SEGMENT_MESSAGE_SQL = """
         expire_time,
         failed_times,
         producer,
-        uuid
+        uuid,
+        message_encoding,
+        visible_time,
+        priority,
+        rowid
     FROM
         simple_sqlite_mq %s
     ORDER BY
-        update_time DESC
-    LIMIT %s, %s
+        update_time DESC, rowid DESC
+    LIMIT ?, ?
+"""
+
+# 统计 Ext Segment 中 指定 Topic 各个优先级尚未被消费的消息数量
+COUNT_EXT_SEGMENT_PRIORITY_BACKLOG_SQL = """
+    SELECT
+        priority,
+        COUNT(1)
+    FROM
+        simple_sqlite_mq
+    WHERE
+        message_topic = ?
+    AND
+        message_status = 0
+    GROUP BY
+        priority
 """
 
 # Ext Segment 在检索消息的时候 指定 Topic
-WHERE_MESSAGE_TOPIC_STR = "WHERE message_topic = '%s'"
+SCAN_CONDITION_MESSAGE_TOPIC_STR = "message_topic = ?"
 
 # Ext Segment 在检索消息的时候 指定 状态
-WHERE_MESSAGE_STATUS_STR = "WHERE message_status = %s"
+SCAN_CONDITION_MESSAGE_STATUS_STR = "message_status = ?"
+
+# Ext Segment 在检索消息的时候 指定 更新时间范围的起始 (包含)
+SCAN_CONDITION_BEGIN_TIME_STR = "update_time >= ?"
+
+# Ext Segment 在检索消息的时候 指定 更新时间范围的结束 (不包含)
+SCAN_CONDITION_END_TIME_STR = "update_time < ?"
+
+# Ext Segment 在检索消息的时候 从上一页最后一条消息的 (update_time, rowid) 之后继续
+# 不使用行值比较 兼容较旧的 SQLite 版本 update_time <= ? 作为索引上的范围条件
+SCAN_CONDITION_CONTINUATION_STR = "update_time <= ? AND (update_time < ? OR rowid < ?)"
+
+# 多个检索条件之间使用 AND 连接
+SCAN_CONDITION_SEPARATOR_STR = " AND "
+
+# Continuation Token 的版本 Token 的格式变化时递增
+SCAN_CONTINUATION_TOKEN_VERSION = 1
 
-# 获取 Ext Segment 中 需要进行 Recover 的消息
-SCAN_EXT_SEGMENT_EXPIRE_MESSAGE_SQL = """
+# Continuation Token 中记录的检索来源 各个来源的 rowid 相互独立 Token 不能混用
+SCAN_SOURCE_EXT = 0
+SCAN_SOURCE_ARCHIVER = 1
+SCAN_SOURCE_DEAD_LETTER = 2
+
+# 分页获取 Common Segment 中 租约已经过期的 消费中 / 消费失败 的消息
+# 沿 (message_status, expire_time) 索引 只扫描两个状态下已经过期的部分 expire_time 为 0 表示不会过期
+SCAN_COMMON_SEGMENT_EXPIRE_MESSAGE_SQL = """
     SELECT
-        message_topic,
-        uuid
+        message_id,
+        uuid,
+        consumer,
+        failed_times
     FROM
         simple_sqlite_mq
     WHERE
-        expire_time < %s
+        message_status IN (1, 4)
     AND
         expire_time > 1
     AND
-        (
-            message_status = %s
-        OR
-            message_status = %s
-        )
-    LIMIT 50
+        expire_time < ?
+    LIMIT ?
 """
 
-# 对 Common Segment 中的 Message 进行恢复
-RECOVER_COMMON_SEGMENT_MESSAGE_SQL = """
+# 分批获取 Common Segment 中 挂起的消息 转入死信队列 沿 (message_status, priority, ...) 索引只扫描挂起的部分
+SCAN_COMMON_SEGMENT_PENDING_MESSAGE_SQL = """
     SELECT
-        message_topic,
+        message_id,
+        message_text,
+        message_status,
+        create_time,
+        update_time,
+        expire_time,
+        consumer,
+        failed_times,
+        producer,
+        message_encoding,
+        visible_time,
+        priority,
         uuid
     FROM
         simple_sqlite_mq
     WHERE
-        expire_time < %s
-    AND
-        expire_time > 1
-    AND
-        (
-            message_status = %s
-        OR
-            message_status = %s
-        )
-    LIMIT 50
+        message_status = 5
+    LIMIT ?
+"""
+
+# 统计 Common Segment 中各个状态的消息数量 沿 (message_status, ...) 索引计数
+COUNT_COMMON_SEGMENT_MESSAGE_BY_STATUS_SQL = """
+    SELECT
+        message_status,
+        COUNT(*)
+    FROM
+        simple_sqlite_mq
+    GROUP BY
+        message_status
+"""
+
+# 消费中的消息里 最早被锁定 (或最后一次 Hold) 的时间 即最老的租约
+GET_COMMON_SEGMENT_OLDEST_LOCKED_UPDATE_TIME_SQL = """
+    SELECT
+        MIN(update_time)
+    FROM
+        simple_sqlite_mq
+    WHERE
+        message_status = 1
 """
 
-# Common Segment 与 Ext Segment 执行 Recover Message
-SEGMENT_RECOVER_MESSAGE_SQL = """
+# Common Segment 恢复过期的消息 配合 executemany 使用
+# 与查询在同一个事务中执行 保留过期条件 防止恢复刚刚被 Hold 的消息
+RECOVER_COMMON_SEGMENT_MESSAGE_LIST_SQL = """
     UPDATE
         simple_sqlite_mq
     SET
         message_status = 0,
+        update_time = ?,
         expire_time = 0
     WHERE
-        (
-            message_status = 1
-        OR
-            message_status = 4
-        )
+        message_id = ?
     AND
-        uuid in (%s)
+        message_status IN (1, 4)
     AND
-        expire_time > 0
+        expire_time > 1
     AND
-        expire_time < %s
+        expire_time < ?
+"""
+
+# 获取 Common Segment 中 消费中 与 消费失败 的消息最早的过期时间 用于在租约过期时唤醒恢复
+# 两个状态分别沿索引读取一行
+GET_COMMON_SEGMENT_NEXT_EXPIRE_TIME_SQL = """
+    SELECT
+        (
+            SELECT
+                MIN(expire_time)
+            FROM
+                simple_sqlite_mq
+            WHERE
+                message_status = 1
+            AND
+                expire_time > 1
+        ),
+        (
+            SELECT
+                MIN(expire_time)
+            FROM
+                simple_sqlite_mq
+            WHERE
+                message_status = 4
+            AND
+                expire_time > 1
+        )
 """
 
 # 用于 Ext Segment 更新消息
@@ -295,11 +998,14 @@ FETCH_EXT_MESSAGE_BY_MESSAGE_UUID_SQL = """
         expire_time,
         consumer,
         failed_times,
-        producer
+        producer,
+        message_encoding,
+        visible_time,
+        priority
     FROM
         simple_sqlite_mq
     WHERE
-        uuid = '%s'
+        uuid = ?
     LIMIT 1
 """
 
@@ -314,10 +1020,430 @@ FETCH_COMMON_MESSAGE_BY_MESSAGE_UUID_SQL = """
         expire_time,
         consumer,
         failed_times,
-        producer
+        producer,
+        message_encoding,
+        visible_time,
+        priority
+    FROM
+        simple_sqlite_mq
+    WHERE
+        uuid = ?
+    LIMIT 1
+"""
+
+# 存储方式迁移时 按 ROWID 顺序分批读取 Base64 编码的消息 Common / Ext / Archiver Segment 通用
+SCAN_BASE64_ENCODING_MESSAGE_SQL = """
+    SELECT
+        rowid,
+        message_text
+    FROM
+        simple_sqlite_mq
+    WHERE
+        message_encoding = 0
+    AND
+        rowid > ?
+    ORDER BY
+        rowid
+    LIMIT ?
+"""
+
+# 死信队列按 ROWID 顺序分批读取消息 从死信队列移回 Common Segment 时使用 先进入死信队列的消息先移回
+SCAN_EXT_SEGMENT_MESSAGE_BY_ROWID_SQL = """
+    SELECT
+        message_id,
+        message_topic,
+        message_text,
+        message_status,
+        create_time,
+        update_time,
+        consumer,
+        expire_time,
+        failed_times,
+        producer,
+        uuid,
+        message_encoding,
+        visible_time,
+        priority,
+        rowid
     FROM
         simple_sqlite_mq
     WHERE
-        uuid = '%s'
+        rowid > ?
+    ORDER BY
+        rowid
+    LIMIT ?
+"""
+
+# 统计 Ext Segment 中的消息数量 供死信队列统计各个 Topic 堆积的死信数量
+COUNT_EXT_SEGMENT_MESSAGE_SQL = """
+    SELECT
+        COUNT(*)
+    FROM
+        simple_sqlite_mq
+"""
+
+# 存储方式迁移时 重写消息体 配合 executemany 使用
+UPDATE_MESSAGE_STORAGE_SQL = """
+    UPDATE
+        simple_sqlite_mq
+    SET
+        message_text = ?,
+        message_encoding = ?
+    WHERE
+        rowid = ?
+    AND
+        message_encoding = 0
+"""
+
+# 查询去重窗口内的幂等键 已经过期但尚未清理的幂等键视为不存在
+GET_IDEMPOTENCY_KEY_SQL = """
+    SELECT
+        message_id,
+        message_uuid,
+        producer,
+        create_time,
+        visible_time,
+        priority,
+        message_encoding,
+        message_text,
+        message_status,
+        update_time,
+        message_expire_time,
+        consumer,
+        failed_times
+    FROM
+        simple_sqlite_mq_idempotency_key
+    WHERE
+        idempotency_key = ?
+    AND
+        expire_time > ?
+"""
+
+# 记录幂等键 覆盖已经过期但尚未清理的同名幂等键
+ADD_IDEMPOTENCY_KEY_SQL = """
+    INSERT OR REPLACE INTO simple_sqlite_mq_idempotency_key (
+        idempotency_key, message_id, message_uuid, producer, create_time, visible_time, priority, message_encoding,
+        expire_time
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# 消息离开 Common Segment 时 记录消息最终的消息体与状态 没有幂等键的消息不会匹配任何行 批量时配合 executemany 使用
+UPDATE_IDEMPOTENCY_KEY_FINAL_MESSAGE_SQL = """
+    UPDATE
+        simple_sqlite_mq_idempotency_key
+    SET
+        message_text = ?,
+        message_status = ?,
+        update_time = ?,
+        message_expire_time = ?,
+        consumer = ?,
+        failed_times = ?
+    WHERE
+        message_uuid = ?
+"""
+
+# 沿过期时间索引 分批删除已经过期的幂等键
+PRUNE_IDEMPOTENCY_KEY_SQL = """
+    DELETE FROM
+        simple_sqlite_mq_idempotency_key
+    WHERE
+        rowid IN (
+            SELECT
+                rowid
+            FROM
+                simple_sqlite_mq_idempotency_key
+            WHERE
+                expire_time <= ?
+            LIMIT ?
+        )
+"""
+
+# 创建消费组 已经存在时保留原有的 Offset
+ADD_CONSUMER_GROUP_SQL = """
+    INSERT OR IGNORE INTO simple_sqlite_mq_consumer_group (
+        consumer_group, committed_offset, read_offset, create_time, update_time
+    ) VALUES (?, ?, ?, ?, ?)
+"""
+
+# 查询消费组的 Offset
+GET_CONSUMER_GROUP_SQL = """
+    SELECT
+        committed_offset,
+        read_offset
+    FROM
+        simple_sqlite_mq_consumer_group
+    WHERE
+        consumer_group = ?
+"""
+
+# 查询所有的消费组 以及各自的 committed_offset
+LIST_CONSUMER_GROUP_SQL = """
+    SELECT
+        consumer_group,
+        committed_offset
+    FROM
+        simple_sqlite_mq_consumer_group
+    ORDER BY
+        consumer_group
+"""
+
+# 查询 Segment 中是否存在消费组 在普通消费方式的写事务中校验
+EXISTS_CONSUMER_GROUP_SQL = """
+    SELECT
+        1
+    FROM
+        simple_sqlite_mq_consumer_group
     LIMIT 1
-"""
\ No newline at end of file
+"""
+
+# 更新消费组的 Offset
+UPDATE_CONSUMER_GROUP_OFFSET_SQL = """
+    UPDATE
+        simple_sqlite_mq_consumer_group
+    SET
+        committed_offset = ?,
+        read_offset = ?,
+        update_time = ?
+    WHERE
+        consumer_group = ?
+"""
+
+# 删除消费组 以及消费组的所有租约
+DELETE_CONSUMER_GROUP_SQL = """
+    DELETE FROM
+        simple_sqlite_mq_consumer_group
+    WHERE
+        consumer_group = ?
+"""
+
+DELETE_CONSUMER_GROUP_LEASE_SQL = """
+    DELETE FROM
+        simple_sqlite_mq_consumer_group_lease
+    WHERE
+        consumer_group = ?
+"""
+
+# 所有消费组中最小的 committed_offset 该 Offset 及之前的消息 所有消费组均已提交或挂起
+GET_MIN_CONSUMER_GROUP_COMMITTED_OFFSET_SQL = """
+    SELECT
+        MIN(committed_offset)
+    FROM
+        simple_sqlite_mq_consumer_group
+"""
+
+# 获取消费组中 到达投递时间的租约 (延迟消息可见 / 消费失败到达重试时间 / 消费中的租约过期) 以及对应的消息
+# expire_time 为 0 的消费中租约不会过期 消息已经不存在时 (被直接删除) message_text 等列为 NULL
+SCAN_CONSUMER_GROUP_DUE_LEASE_SQL = """
+    SELECT
+        lease.message_id,
+        lease.failed_times,
+        message.message_text,
+        message.create_time,
+        message.producer,
+        message.uuid,
+        message.message_encoding,
+        message.visible_time,
+        message.priority
+    FROM
+        simple_sqlite_mq_consumer_group_lease AS lease
+    LEFT JOIN
+        simple_sqlite_mq AS message
+    ON
+        message.message_id = lease.message_id
+    WHERE
+        lease.consumer_group = ?
+    AND
+        lease.message_status IN (0, 1, 4)
+    AND
+        lease.expire_time > 0
+    AND
+        lease.expire_time <= ?
+    ORDER BY
+        lease.expire_time,
+        lease.message_id
+    LIMIT ?
+"""
+
+# 按 Message ID 顺序 获取消费组尚未读取的消息 沿 ROWID 直接定位
+SCAN_CONSUMER_GROUP_NEW_MESSAGE_SQL = """
+    SELECT
+        message_id,
+        message_text,
+        create_time,
+        producer,
+        uuid,
+        message_encoding,
+        visible_time,
+        priority
+    FROM
+        simple_sqlite_mq
+    WHERE
+        message_id > ?
+    ORDER BY
+        message_id
+    LIMIT ?
+"""
+
+# 记录消费组租约 配合 executemany 使用
+ADD_CONSUMER_GROUP_LEASE_SQL = """
+    INSERT OR REPLACE INTO simple_sqlite_mq_consumer_group_lease (
+        consumer_group, message_id, message_status, consumer, expire_time, failed_times, update_time
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# 更新消费组租约 配合 executemany 使用
+UPDATE_CONSUMER_GROUP_LEASE_SQL = """
+    UPDATE
+        simple_sqlite_mq_consumer_group_lease
+    SET
+        message_status = ?,
+        consumer = ?,
+        expire_time = ?,
+        failed_times = ?,
+        update_time = ?
+    WHERE
+        consumer_group = ?
+    AND
+        message_id = ?
+"""
+
+# 按消息 UUID 查询消费组租约 以及对应的消息
+FETCH_CONSUMER_GROUP_LEASE_BY_UUID_SQL = """
+    SELECT
+        lease.message_id,
+        lease.message_status,
+        lease.consumer,
+        lease.expire_time,
+        lease.failed_times,
+        message.message_text,
+        message.create_time,
+        message.producer,
+        message.message_encoding,
+        message.visible_time,
+        message.priority
+    FROM
+        simple_sqlite_mq AS message
+    JOIN
+        simple_sqlite_mq_consumer_group_lease AS lease
+    ON
+        lease.message_id = message.message_id
+    WHERE
+        message.uuid = ?
+    AND
+        lease.consumer_group = ?
+"""
+
+# committed_offset 之后 消费组中最早的 未提交也未挂起的消息 即 committed_offset 可以推进到的位置
+GET_CONSUMER_GROUP_MIN_UNSETTLED_MESSAGE_ID_SQL = """
+    SELECT
+        MIN(message_id)
+    FROM
+        simple_sqlite_mq_consumer_group_lease
+    WHERE
+        consumer_group = ?
+    AND
+        message_id > ?
+    AND
+        message_status IN (0, 1, 4)
+"""
+
+# 删除 committed_offset 及之前 已经提交的租约
+DELETE_CONSUMER_GROUP_DONE_LEASE_SQL = """
+    DELETE FROM
+        simple_sqlite_mq_consumer_group_lease
+    WHERE
+        consumer_group = ?
+    AND
+        message_id <= ?
+    AND
+        message_status = 2
+"""
+
+# 将消费组中挂起的消息重新投递 立即可见 失败次数清零
+REDRIVE_CONSUMER_GROUP_LEASE_SQL = """
+    UPDATE
+        simple_sqlite_mq_consumer_group_lease
+    SET
+        message_status = 0,
+        consumer = '',
+        expire_time = ?,
+        failed_times = 0,
+        update_time = ?
+    WHERE
+        consumer_group = ?
+    AND
+        message_status = 5
+"""
+
+# 分批获取 所有消费组的 committed_offset 均已越过的消息 参数依次为 最小的 committed_offset 当前最大的 Message ID 获取的数量
+# 最大 Message ID 的消息始终保留 挂起 / 移回后尚未提交的租约引用的消息同样保留
+SCAN_CONSUMER_GROUP_RETAINED_MESSAGE_SQL = """
+    SELECT
+        message_id,
+        message_text,
+        message_status,
+        create_time,
+        update_time,
+        expire_time,
+        consumer,
+        failed_times,
+        producer,
+        message_encoding,
+        visible_time,
+        priority,
+        uuid
+    FROM
+        simple_sqlite_mq
+    WHERE
+        message_id <= ?
+    AND
+        message_id < ?
+    AND
+        message_id NOT IN (
+            SELECT
+                message_id
+            FROM
+                simple_sqlite_mq_consumer_group_lease
+            WHERE
+                message_status != 2
+        )
+    ORDER BY
+        message_id
+    LIMIT ?
+"""
+
+# 统计消费组中 各个状态的租约数量
+COUNT_CONSUMER_GROUP_LEASE_BY_STATUS_SQL = """
+    SELECT
+        message_status,
+        COUNT(*)
+    FROM
+        simple_sqlite_mq_consumer_group_lease
+    WHERE
+        consumer_group = ?
+    GROUP BY
+        message_status
+"""
+
+# 统计 committed_offset 之后的消息数量 以及其中消费组已经提交或挂起的数量 两者之差为消费组的积压
+COUNT_COMMON_SEGMENT_MESSAGE_AFTER_ID_SQL = """
+    SELECT
+        COUNT(*)
+    FROM
+        simple_sqlite_mq
+    WHERE
+        message_id > ?
+"""
+
+COUNT_CONSUMER_GROUP_SETTLED_LEASE_AFTER_ID_SQL = """
+    SELECT
+        COUNT(*)
+    FROM
+        simple_sqlite_mq_consumer_group_lease
+    WHERE
+        consumer_group = ?
+    AND
+        message_id > ?
+    AND
+        message_status IN (2, 5)
+"""
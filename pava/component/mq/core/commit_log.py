@@ -5,11 +5,21 @@ from pava.decorator.decorator_impl.type_check_decorator import type_check
 
 
 class CommitLog(object):
-    @type_check(None, int, str, MQMessage)
-    def __init__(self, commit_log_id=None, commit_log_file=None, mq_message=None):
+    @type_check(None, int, str, MQMessage, list)
+    def __init__(self, commit_log_id=None, commit_log_file=None, mq_message=None, mq_message_list=None):
         self.commit_log_id = commit_log_id  # type: int
         self.mq_message = mq_message  # type: MQMessage
         self.commit_log_file = commit_log_file  # type: str
+        # 批量操作时 一个 Commit Log File 对应多条消息
+        self.mq_message_list = mq_message_list  # type: list
+
+    def get_mq_message_list(self):
+        """
+        :rtype: list
+        """
+        if self.mq_message_list is not None:
+            return self.mq_message_list
+        return [self.mq_message]
 
     def __lt__(self, other_commit_log):
         return self.commit_log_id < other_commit_log.commit_log_id
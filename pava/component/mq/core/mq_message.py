@@ -3,12 +3,22 @@ from pava.utils.object_utils import NoneType
 
 from pava.decorator.decorator_impl.type_check_decorator import type_check
 
+# MQ Message 的所有字段 与 __init__ 的参数顺序一致 也是 to_field_tuple 返回的字段顺序
+MQ_MESSAGE_FIELD_NAME_TUPLE = (
+    "message_id", "message_topic", "message_text", "message_status", "create_time", "update_time", "consumer",
+    "expire_time", "failed_times", "producer", "message_uuid", "message_encoding", "visible_time", "priority"
+)
+
 
 class MQMessage(object):
-    @type_check(None, int, str, str, int, int, int, str, int, int, str, str)
+    # 批量读取时会创建大量实例 不为每个实例创建 __dict__ 减少内存占用以及创建实例的开销
+    __slots__ = MQ_MESSAGE_FIELD_NAME_TUPLE
+
+    @type_check(None, int, str, str, int, int, int, str, int, int, str, str, int, int, int)
     def __init__(self, message_id=None, message_topic=None, message_text=None, message_status=None,
                  create_time=None, update_time=None, consumer=None, expire_time=None, failed_times=None, producer=None,
-                 message_uuid=None):
+                 message_uuid=None, message_encoding=None, visible_time=None,
+                 priority=None):
         self.message_id = message_id
         self.message_topic = message_topic
         self.message_text = message_text
@@ -20,6 +30,58 @@ class MQMessage(object):
         self.failed_times = failed_times
         self.producer = producer
         self.message_uuid = message_uuid
+        # 消息体在 Segment 中的存储编码 为 None 时视为 Base64 (旧版本写入的消息)
+        self.message_encoding = message_encoding
+        # 消息可以被消费的时间 延迟消息在此之前不会被获取
+        self.visible_time = visible_time
+        # 消息的优先级 数值越大越先被消费 为 None 时视为默认优先级 (旧版本写入的消息)
+        self.priority = priority
+
+    @classmethod
+    def from_trusted_fields(cls, message_id=None, message_topic=None, message_text=None, message_status=None,
+                            create_time=None, update_time=None, consumer=None, expire_time=None, failed_times=None,
+                            producer=None, message_uuid=None, message_encoding=None, visible_time=None,
+                            priority=None):
+        """
+        不做类型检查的构造方法 参数与 __init__ 一致
+        只用于 Segment 读取到的行 以及 MQ 内部生成的消息等 字段类型已经确定的情况 外部输入应当使用 __init__ 或 from_dict
+        :rtype: MQMessage
+        """
+        mq_message = object.__new__(cls)
+        mq_message.message_id = message_id
+        mq_message.message_topic = message_topic
+        mq_message.message_text = message_text
+        mq_message.message_status = message_status
+        mq_message.create_time = create_time
+        mq_message.update_time = update_time
+        mq_message.consumer = consumer
+        mq_message.expire_time = expire_time
+        mq_message.failed_times = failed_times
+        mq_message.producer = producer
+        mq_message.message_uuid = message_uuid
+        mq_message.message_encoding = message_encoding
+        mq_message.visible_time = visible_time
+        mq_message.priority = priority
+        return mq_message
+
+    def to_field_tuple(self):
+        """
+        :return: 按 MQ_MESSAGE_FIELD_NAME_TUPLE 顺序排列的字段值 可以通过 from_trusted_fields(*field_tuple) 还原
+        :rtype: tuple
+        """
+        return (
+            self.message_id, self.message_topic, self.message_text, self.message_status, self.create_time,
+            self.update_time, self.consumer, self.expire_time, self.failed_times, self.producer, self.message_uuid,
+            self.message_encoding, self.visible_time, self.priority
+        )
+
+    def __getstate__(self):
+        # 定义了 __slots__ 的类 需要自行提供序列化的状态
+        return self.to_field_tuple()
+
+    def __setstate__(self, field_tuple):
+        for field_name, field_value in zip(MQ_MESSAGE_FIELD_NAME_TUPLE, field_tuple):
+            setattr(self, field_name, field_value)
 
     @type_check(None, [int, NoneType])
     def set_message_id(self, message_id):
@@ -76,20 +138,23 @@ class MQMessage(object):
         self.message_uuid = message_uuid
         return self
 
+    @type_check(None, [int, NoneType])
+    def set_message_encoding(self, message_encoding):
+        self.message_encoding = message_encoding
+        return self
+
+    @type_check(None, [int, NoneType])
+    def set_visible_time(self, visible_time):
+        self.visible_time = visible_time
+        return self
+
+    @type_check(None, [int, NoneType])
+    def set_priority(self, priority):
+        self.priority = priority
+        return self
+
     def copy(self):
-        another_mq_message = MQMessage()
-        another_mq_message.message_id = self.message_id
-        another_mq_message.message_topic = self.message_topic
-        another_mq_message.message_text = self.message_text
-        another_mq_message.message_status = self.message_status
-        another_mq_message.create_time = self.create_time
-        another_mq_message.update_time = self.update_time
-        another_mq_message.consumer = self.consumer
-        another_mq_message.expire_time = self.expire_time
-        another_mq_message.failed_times = self.failed_times
-        another_mq_message.producer = self.producer
-        another_mq_message.message_uuid = self.message_uuid
-        return another_mq_message
+        return self.from_trusted_fields(*self.to_field_tuple())
 
     def to_dict(self):
         return {
@@ -103,25 +168,21 @@ class MQMessage(object):
             "expire_time": self.expire_time,
             "failed_times": self.failed_times,
             "producer": self.producer,
-            "message_uuid": self.message_uuid
+            "message_uuid": self.message_uuid,
+            "message_encoding": self.message_encoding,
+            "visible_time": self.visible_time,
+            "priority": self.priority
         }
 
     @classmethod
     @type_check(None, dict)
     def from_dict(cls, dict_object):
-        message = MQMessage()
-        message.set_message_id(dict_object.get("message_id", None))
-        message.set_message_topic(dict_object.get("message_topic", None))
-        message.set_message_text(dict_object.get("message_text", None))
-        message.set_message_status(dict_object.get("message_status", None))
-        message.set_create_time(dict_object.get("create_time", None))
-        message.set_update_time(dict_object.get("update_time", None))
-        message.set_consumer(dict_object.get("consumer", None))
-        message.set_expire_time(dict_object.get("expire_time", None))
-        message.set_failed_times(dict_object.get("failed_times", None))
-        message.set_producer(dict_object.get("producer", None))
-        message.set_message_uuid(dict_object.get("message_uuid", None))
-        return message
+        """
+        字段类型由 __init__ 统一检查
+        """
+        return cls(**dict([
+            (field_name, dict_object.get(field_name, None)) for field_name in MQ_MESSAGE_FIELD_NAME_TUPLE
+        ]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+# coding=utf-8
+import calendar
+import os
+import re
+import time
+from threading import RLock
+
+from pava.component.mq.core.mq_message import MQMessage
+from pava.component.mq.interface.abstract_mq_ext_segment import AbstractMQBrokerExtSegment
+from pava.component.p_log import PLog
+from pava.entity.file_domain import FileDomain
+from pava.component.mq import *
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 按时间分区的归档器
+已经删除的消息按 update_time 写入对应周期 (天 / 周) 的分区文件 每个分区文件是一个独立的 Ext Segment
+保留策略按分区整体生效 超过保留时间或者总大小超过上限时 直接关闭并删除最旧的分区文件 无需 DELETE 与 VACUUM
+旧版本的单个归档文件作为最旧的分区继续读取 不再写入
+"""
+
+
+class _ArchivePartition(object):
+
+    def __init__(self, partition_name, start_time, end_time, segment):
+        """
+        :param partition_name: 分区名称 即文件名去掉 .sqlite 后缀
+        :param start_time: 分区包含的 update_time 的起始 (包含)
+        :param end_time: 分区包含的 update_time 的结束 (不包含)
+        """
+        self.partition_name = partition_name
+        self.start_time = start_time
+        self.end_time = end_time
+        self.segment = segment  # type: AbstractMQBrokerExtSegment
+
+    def get_partition_key(self):
+        # 分区之间按 (end_time, start_time) 排序 也作为 continuation_key 的前两位
+        return self.end_time, self.start_time
+
+    def get_file_size(self):
+        db_path = self.segment.get_db_path()
+        file_size = 0
+        for file_path in (db_path, db_path + "-wal"):
+            if os.path.exists(file_path):
+                file_size += os.path.getsize(file_path)
+        return file_size
+
+
+class SimpleSQLiteMQArchiver(object):
+
+    def __init__(self, archive_path, legacy_db_path, generate_partition_segment_function,
+                 partition_period=SQLITE_MQ_ARCHIVE_PARTITION_DAY, retention_seconds=0, retention_bytes=0):
+        """
+        :param archive_path: 分区文件所在的目录
+        :param legacy_db_path: 旧版本的单个归档文件 存在时作为最旧的分区只读
+        :param generate_partition_segment_function: 根据文件路径生成分区使用的 Ext Segment
+        :param partition_period: 分区周期 day / week
+        :param retention_seconds: 分区的结束时间早于该秒数之前时删除 为 0 时不按时间删除
+        :param retention_bytes: 所有分区文件的总字节数超过该值时 从最旧的分区开始删除 为 0 时不按大小删除
+        """
+        if partition_period not in SQLITE_MQ_ARCHIVE_PARTITION_DICT:
+            raise Exception("[SimpleSQLiteMQArchiver] Unknown archive partition period '%s', should be one of %s" % (
+                partition_period, sorted(SQLITE_MQ_ARCHIVE_PARTITION_DICT.keys())))
+        for retention_name, retention_value in (("retention_seconds", retention_seconds),
+                                                ("retention_bytes", retention_bytes)):
+            if type(retention_value) not in (int, long) or retention_value < 0:
+                raise Exception("[SimpleSQLiteMQArchiver] %s should be a non-negative int instead of '%s'" % (
+                    retention_name, retention_value))
+
+        self._archive_path = archive_path
+        self._generate_partition_segment_function = generate_partition_segment_function
+        self._partition_period = partition_period
+        self._retention_seconds = retention_seconds
+        self._retention_bytes = retention_bytes
+
+        # 保护分区的创建与删除 读写分区时同样持有 避免正在读写的分区被删除
+        self._partition_lock = RLock()
+        # 分区名称 -> 分区
+        self._partition_dict = dict()
+
+        FileDomain(archive_path).create_dir()
+        for file_name in os.listdir(archive_path):
+            match_result = re.match(SQLITE_MQ_ARCHIVE_PARTITION_FILE_NAME_PATTERN, file_name)
+            if match_result is not None:
+                self._open_partition(match_result.group(1), match_result.group(2))
+
+        if os.path.exists(legacy_db_path):
+            self._open_legacy_partition(legacy_db_path)
+
+        PLog.gets().info(
+            "[SimpleSQLiteMQArchiver] Open %s archive partitions in '%s', partition period: %s, "
+            "retention seconds: %s, retention bytes: %s" % (
+                len(self._partition_dict), archive_path, partition_period, retention_seconds, retention_bytes)
+        )
+
+    def _open_partition(self, partition_period, partition_date_str):
+        period_seconds = SQLITE_MQ_ARCHIVE_PARTITION_DICT[partition_period][0]
+        file_name = SQLITE_MQ_ARCHIVE_PARTITION_FILE_NAME_FORMAT % (partition_period, partition_date_str)
+        start_time = calendar.timegm(time.strptime(partition_date_str, SQLITE_MQ_ARCHIVE_PARTITION_DATE_FORMAT))
+        partition = _ArchivePartition(
+            file_name[:-len(".sqlite")], start_time, start_time + period_seconds,
+            self._generate_partition_segment_function(os.path.join(self._archive_path, file_name))
+        )
+        self._partition_dict[partition.partition_name] = partition
+        return partition
+
+    def reload_partition(self):
+        """
+        多进程模式下 分区由 Leader 进程创建与删除 读取前重新扫描分区目录 打开新建的分区 关闭已经被删除的分区
+        """
+        with self._partition_lock:
+            partition_name_set = set()
+            for file_name in os.listdir(self._archive_path):
+                match_result = re.match(SQLITE_MQ_ARCHIVE_PARTITION_FILE_NAME_PATTERN, file_name)
+                if match_result is None:
+                    continue
+                partition_name_set.add(file_name[:-len(".sqlite")])
+                if file_name[:-len(".sqlite")] not in self._partition_dict:
+                    self._open_partition(match_result.group(1), match_result.group(2))
+            for partition in list(self._partition_dict.values()):
+                if partition.partition_name != ARCHIVER_SQLITE_MQ_SEGMENT and \
+                        partition.partition_name not in partition_name_set:
+                    self._partition_dict.pop(partition.partition_name)
+                    partition.segment.close()
+
+    def _open_legacy_partition(self, legacy_db_path):
+        segment = self._generate_partition_segment_function(legacy_db_path)
+        # 旧版本的归档文件不再写入 最新一条消息的 update_time 之后即为分区的结束时间
+        mq_message_list, _ = segment.scan_message(None, 1, 0)
+        end_time = 0 if list_is_empty(mq_message_list) else mq_message_list[0].update_time + 1
+        partition = _ArchivePartition(ARCHIVER_SQLITE_MQ_SEGMENT, 0, end_time, segment)
+        self._partition_dict[partition.partition_name] = partition
+
+    def _get_partition_name_and_date(self, timestamp):
+        period_seconds, align_offset_seconds = SQLITE_MQ_ARCHIVE_PARTITION_DICT[self._partition_period]
+        start_time = timestamp - (timestamp - align_offset_seconds) % period_seconds
+        partition_date_str = time.strftime(SQLITE_MQ_ARCHIVE_PARTITION_DATE_FORMAT, time.gmtime(start_time))
+        partition_name = (SQLITE_MQ_ARCHIVE_PARTITION_FILE_NAME_FORMAT % (
+            self._partition_period, partition_date_str))[:-len(".sqlite")]
+        return partition_name, partition_date_str
+
+    def _get_write_partition(self, timestamp):
+        """
+        :rtype: _ArchivePartition
+        """
+        partition_name, partition_date_str = self._get_partition_name_and_date(timestamp)
+        partition = self._partition_dict.get(partition_name, None)
+        if partition is None:
+            partition = self._open_partition(self._partition_period, partition_date_str)
+            PLog.gets().info("[SimpleSQLiteMQArchiver] Create archive partition '%s'" % partition_name)
+        return partition
+
+    def _get_sorted_partition_list(self, reverse=True):
+        return sorted(self._partition_dict.values(), key=lambda element: element.get_partition_key(),
+                      reverse=reverse)
+
+    def add_message(self, mq_message, commit_log_offset):
+        """
+        :type mq_message: MQMessage
+        """
+        self.add_message_list([mq_message], commit_log_offset)
+
+    def add_message_list(self, mq_message_list, commit_log_offset):
+        """
+        消息按 update_time 写入各自的分区 每个分区一个事务
+        :param commit_log_offset: 归档不标记 Commit Log 由删除消息的 Ext Segment 统一标记
+        """
+        partition_message_list_dict = dict()
+        with self._partition_lock:
+            for mq_message in mq_message_list:
+                update_time = int(time.time()) if mq_message.update_time is None else mq_message.update_time
+                partition = self._get_write_partition(update_time)
+                partition_message_list_dict.setdefault(partition.partition_name, list()).append(mq_message)
+
+            for partition_name, partition_message_list in partition_message_list_dict.items():
+                self._partition_dict[partition_name].segment.add_message_list(partition_message_list, None)
+
+    def scan_message(self, message_topic, every_page_quantity, page_number, message_status=None,
+                     begin_time=None, end_time=None, continuation_key=None):
+        """
+        从最新的分区开始 按 (update_time, rowid) 倒序检索消息 时间范围之外的分区直接跳过
+        :param page_number: 从 0 开始的页码 分区之间无法直接跳过 逐页向后检索
+        :param continuation_key: 上一页返回的 (分区 end_time, 分区 start_time, update_time, rowid)
+        :return: 消息列表 与 下一页的 continuation_key 已经没有更多消息时为 None
+        :rtype: (list, tuple)
+        """
+        every_page_quantity = get_int_value(every_page_quantity)
+        with self._partition_lock:
+            for _ in range(get_int_value(page_number)):
+                _, continuation_key = self._scan_page(message_topic, every_page_quantity, message_status, begin_time,
+                                                      end_time, continuation_key)
+                if continuation_key is None:
+                    return list(), None
+            return self._scan_page(message_topic, every_page_quantity, message_status, begin_time, end_time,
+                                   continuation_key)
+
+    def _scan_page(self, message_topic, every_page_quantity, message_status, begin_time, end_time, continuation_key):
+        result = list()
+        for partition in self._get_sorted_partition_list():
+            if begin_time is not None and partition.end_time <= begin_time:
+                continue
+            if end_time is not None and partition.start_time >= end_time:
+                continue
+
+            partition_key = partition.get_partition_key()
+            segment_continuation_key = None
+            if continuation_key is not None:
+                if partition_key > continuation_key[:2]:
+                    continue
+                if partition_key == continuation_key[:2]:
+                    segment_continuation_key = continuation_key[2:]
+
+            mq_message_list, next_segment_continuation_key = partition.segment.scan_message(
+                message_topic, every_page_quantity - len(result), 0, message_status, begin_time, end_time,
+                segment_continuation_key
+            )
+            result.extend(mq_message_list)
+            # 取满一页时 分区返回的位置一定不为空
+            if len(result) == every_page_quantity:
+                return result, partition_key + next_segment_continuation_key
+        return result, None
+
+    def fetch_message_by_uuid(self, message_uuid):
+        """
+        :rtype: MQMessage
+        """
+        with self._partition_lock:
+            for partition in self._get_sorted_partition_list():
+                mq_message = partition.segment.fetch_message_by_uuid(message_uuid)
+                if mq_message is not None:
+                    return mq_message
+        return None
+
+    def delete_message_by_uuid(self, message_topic, message_uuid):
+        with self._partition_lock:
+            for partition in self._get_sorted_partition_list():
+                partition.segment.delete_message_by_uuid(message_topic, message_uuid)
+
+    def migrate_message_storage(self, message_codec, batch_size):
+        migrate_count = 0
+        with self._partition_lock:
+            for partition in self._get_sorted_partition_list():
+                migrate_count += partition.segment.migrate_message_storage(message_codec, batch_size)
+        return migrate_count
+
+    def enforce_retention(self):
+        """
+        按保留策略删除过期的分区 正在写入的当前分区不会被删除
+        :return: 删除的分区名称列表
+        :rtype: list
+        """
+        dropped_partition_name_list = list()
+        if self._retention_seconds == 0 and self._retention_bytes == 0:
+            return dropped_partition_name_list
+
+        with self._partition_lock:
+            current_time = int(time.time())
+            current_partition_name, _ = self._get_partition_name_and_date(current_time)
+            partition_list = [
+                partition for partition in self._get_sorted_partition_list(reverse=False)
+                if partition.partition_name != current_partition_name
+            ]
+
+            if self._retention_seconds > 0:
+                for partition in list(partition_list):
+                    if partition.end_time <= current_time - self._retention_seconds:
+                        self._drop_partition(partition)
+                        partition_list.remove(partition)
+                        dropped_partition_name_list.append(partition.partition_name)
+
+            if self._retention_bytes > 0:
+                total_file_size = sum([partition.get_file_size() for partition in self._partition_dict.values()])
+                for partition in partition_list:
+                    if total_file_size <= self._retention_bytes:
+                        break
+                    total_file_size -= partition.get_file_size()
+                    self._drop_partition(partition)
+                    dropped_partition_name_list.append(partition.partition_name)
+        return dropped_partition_name_list
+
+    def _drop_partition(self, partition):
+        """
+        :type partition: _ArchivePartition
+        """
+        self._partition_dict.pop(partition.partition_name, None)
+        db_path = partition.segment.get_db_path()
+        partition.segment.close()
+        for file_path in (db_path, db_path + "-wal", db_path + "-shm"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        PLog.gets().info("[SimpleSQLiteMQArchiver] Drop archive partition '%s', update time from %s to %s" % (
+            partition.partition_name, partition.start_time, partition.end_time))
+
+    def get_partition_list(self):
+        """
+        :return: 所有分区的名称 时间范围 以及文件大小 从新到旧
+        :rtype: list
+        """
+        with self._partition_lock:
+            return [
+                {
+                    "partition_name": partition.partition_name,
+                    "start_time": partition.start_time,
+                    "end_time": partition.end_time,
+                    "file_size": partition.get_file_size(),
+                }
+                for partition in self._get_sorted_partition_list()
+            ]
+
+    def get_db_path(self):
+        return self._archive_path
@@ -0,0 +1,411 @@
+# coding=utf-8
+import time
+from concurrent.futures import Future
+from threading import Condition, Lock
+
+from pava.component.mq import *
+from pava.component.mq.interface.abstract_simple_sqlite_mq_broker import AbstractSimpleSQLiteMQBroker
+from pava.component.p_log import PLog
+from pava.component.thread_pool.core.thread_pool_executor_wrapper import ThreadPoolExecutorWrapper
+from pava.utils.async_utils import async_execute
+from pava.utils.object_utils import object_type_is_unicode
+
+"""
+简易的基于 SQLite 的消息队列 异步接口
+包装 SimpleSQLiteMQBroker 或 SimpleSQLiteMQClient 所有方法立即返回 concurrent.futures.Future 不阻塞调用方
+同时进行的多个 add_message 在上一批写入期间积累 合并为一次 add_messages 在同一个事务中写入
+等待新消息到达的请求不占用线程 由一个线程统一等待 MQ 的消息到达通知 再通过 Future 回调唤醒
+Python 3 的 asyncio 中可以通过 asyncio.wrap_future 等待返回的 Future
+"""
+
+
+class AsyncSimpleSQLiteMQBroker(object):
+
+    def __init__(self, mq_instance, executor_workers=SQLITE_MQ_ASYNC_EXECUTOR_WORKERS,
+                 max_batch_size=SQLITE_MQ_ASYNC_MAX_BATCH_SIZE):
+        """
+        :param mq_instance: 被包装的 MQ 实例
+        :type mq_instance: AbstractSimpleSQLiteMQBroker
+        :param executor_workers: 执行 MQ 调用的线程数量
+        :param max_batch_size: 合并 add_message 时 每批最多包含的消息数量
+        """
+        self._mq_instance = mq_instance
+        self._executor = ThreadPoolExecutorWrapper(max_workers=executor_workers)
+        self._max_batch_size = max_batch_size
+
+        # 等待合并写入的 add_message 请求 元素为 (合并键, 消息体, Future) 合并键相同的请求可以合并为一次 add_messages
+        self._add_message_lock = Lock()
+        self._pending_add_message_list = list()
+        # 是否已经有任务在写入 写入期间到达的请求由该任务在下一批写入
+        self._add_message_flushing = False
+
+        # 等待消息到达的请求 元素为 [Topic 列表, 消息到达版本号, 超时时间戳, Future]
+        self._arrival_condition = Condition()
+        self._arrival_waiter_list = list()
+        # 正在进行的等待 所等待的 Topic 列表与消息到达版本号 没有等待时为 None
+        # 等待期间新注册的请求 Topic 追加到该列表中 被包装的 SimpleSQLiteMQBroker 在发布消息的通知唤醒时会重新检查
+        self._arrival_topic_list = None
+        self._arrival_version = None
+        self._running = True
+        async_execute(self._arrival_loop)
+
+    def get_mq_instance(self):
+        """
+        :rtype: AbstractSimpleSQLiteMQBroker
+        """
+        return self._mq_instance
+
+    def close(self):
+        """
+        停止等待消息到达的线程 所有尚未唤醒的等待返回 False 正在等待新消息的获取请求返回没有消息
+        关闭执行 MQ 调用的线程池 已经提交的调用仍然会执行完成
+        """
+        with self._arrival_condition:
+            self._running = False
+            waiter_list, self._arrival_waiter_list = self._arrival_waiter_list, list()
+            self._arrival_condition.notify_all()
+        for waiter in waiter_list:
+            waiter[3].set_result(False)
+        # 可能在执行线程的回调中关闭 不等待已经提交的调用
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _run(future, execute_function, *args, **kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(execute_function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _submit(self, execute_function, *args, **kwargs):
+        """
+        :rtype: Future
+        """
+        future = Future()
+        self._executor.submit(self._run, future, execute_function, *args, **kwargs)
+        return future
+
+    def add_message(self, message_topic, message_text, producer=None, deliver_at=None, deliver_after=None,
+                    priority=MESSAGE_PRIORITY_DEFAULT, idempotency_key=None):
+        """
+        指定了幂等键的消息单独写入 其他消息与 Topic 及参数相同的请求合并写入
+        消息体不是字符串的请求同样单独写入 合并写入失败时整批请求都会失败 不能因为一个请求影响其他请求
+        :return: Future 结果为添加的 MQ Message
+        :rtype: Future
+        """
+        if idempotency_key is not None or (type(message_text) is not str and not object_type_is_unicode(message_text)):
+            return self._submit(self._mq_instance.add_message, message_topic, message_text, producer, deliver_at,
+                                deliver_after, priority, idempotency_key)
+        future = Future()
+        merge_key = (message_topic, producer, deliver_at, deliver_after, priority)
+        with self._add_message_lock:
+            self._pending_add_message_list.append((merge_key, message_text, future))
+            if self._add_message_flushing:
+                return future
+            self._add_message_flushing = True
+        self._executor.submit(self._flush_add_message)
+        return future
+
+    def _flush_add_message(self):
+        """
+        持续写入积累的 add_message 请求 直到没有新的请求
+        """
+        while True:
+            with self._add_message_lock:
+                if not self._pending_add_message_list:
+                    self._add_message_flushing = False
+                    return
+                pending_add_message_list, self._pending_add_message_list = self._pending_add_message_list, list()
+
+            # 按合并键分组 保持同一组内的请求顺序
+            merge_key_list = list()
+            merge_request_dict = dict()
+            for merge_key, message_text, future in pending_add_message_list:
+                if merge_key not in merge_request_dict:
+                    merge_key_list.append(merge_key)
+                    merge_request_dict[merge_key] = list()
+                merge_request_dict[merge_key].append((message_text, future))
+
+            for merge_key in merge_key_list:
+                request_list = merge_request_dict[merge_key]
+                for begin_index in range(0, len(request_list), self._max_batch_size):
+                    self._add_message_batch(merge_key, request_list[begin_index:begin_index + self._max_batch_size])
+
+    def _add_message_batch(self, merge_key, request_list):
+        message_topic, producer, deliver_at, deliver_after, priority = merge_key
+        # 跳过已经被取消的请求
+        request_list = [(message_text, future) for message_text, future in request_list
+                        if future.set_running_or_notify_cancel()]
+        if not request_list:
+            return
+        message_text_list = [message_text for message_text, _ in request_list]
+        future_list = [future for _, future in request_list]
+        try:
+            mq_message_list = self._mq_instance.add_messages(
+                message_topic, message_text_list, producer, deliver_at, deliver_after, priority
+            )
+        except Exception as e:
+            for future in future_list:
+                future.set_exception(e)
+            return
+        for future, mq_message in zip(future_list, mq_message_list):
+            future.set_result(mq_message)
+
+    def add_messages(self, message_topic, message_text_list, producer=None, deliver_at=None, deliver_after=None,
+                     priority=MESSAGE_PRIORITY_DEFAULT):
+        return self._submit(self._mq_instance.add_messages, message_topic, message_text_list, producer, deliver_at,
+                            deliver_after, priority)
+
+    def get_message(self, message_topic, consumer=None, max_consume_time=3600, wait_timeout=0):
+        """
+        :param wait_timeout: 没有消息时 最多等待新消息到达的秒数 等待期间不占用线程
+        :return: Future 结果为获取到的 MQ Message 超时仍没有消息时为 None
+        :rtype: Future
+        """
+        future = Future()
+        if future.set_running_or_notify_cancel():
+            self._executor.submit(self._wait_message, future, message_topic, time.time() + wait_timeout,
+                                  self._mq_instance.get_message, message_topic, consumer, max_consume_time)
+        return future
+
+    def get_messages(self, message_topic, message_count, consumer=None, max_consume_time=3600, wait_timeout=0):
+        """
+        :param wait_timeout: 没有消息时 最多等待新消息到达的秒数 等待期间不占用线程
+        :return: Future 结果为获取到的 MQ Message 列表
+        :rtype: Future
+        """
+        future = Future()
+        if future.set_running_or_notify_cancel():
+            self._executor.submit(self._wait_message, future, message_topic, time.time() + wait_timeout,
+                                  self._mq_instance.get_messages, message_topic, message_count, consumer,
+                                  max_consume_time)
+        return future
+
+    def _wait_message(self, future, message_topic, deadline, get_message_function, *args):
+        """
+        获取一次消息 没有消息且没有超时时 注册消息到达的等待 到达后在执行线程中重试
+        :type future: Future
+        """
+        try:
+            arrival_version = self._mq_instance.get_message_arrival_version()
+            mq_message = get_message_function(*args)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        # 批量获取时返回的是 MQ Message 列表
+        message_exist_bool = len(mq_message) > 0 if type(mq_message) is list else mq_message is not None
+        current_time = time.time()
+        if message_exist_bool or current_time >= deadline:
+            future.set_result(mq_message)
+            return
+
+        def retry(_):
+            # 已经关闭时 等待立即返回 不再重新获取 返回没有消息
+            if not self._running:
+                future.set_result(mq_message)
+                return
+            try:
+                self._executor.submit(self._wait_message, future, message_topic, deadline, get_message_function,
+                                      *args)
+            except RuntimeError:
+                # 检查之后线程池被关闭
+                future.set_result(mq_message)
+
+        # 其他进程添加的消息不会通知本进程 等待时间不超过一次等待到达的间隔 以便重新查询
+        self.wait_message_arrival(
+            [message_topic], arrival_version, min(deadline - current_time, SQLITE_MQ_ASYNC_ARRIVAL_WAIT_SECONDS)
+        ).add_done_callback(retry)
+
+    def get_message_arrival_version(self):
+        return self._submit(self._mq_instance.get_message_arrival_version)
+
+    def wait_message_arrival(self, message_topic_list, arrival_version, wait_timeout):
+        """
+        :return: Future 结果为是否有新消息到达 可能在没有新消息时提前返回 True 调用方重新获取消息即可
+        :rtype: Future
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        waiter = [list(message_topic_list), arrival_version, time.time() + wait_timeout, future]
+        with self._arrival_condition:
+            if not self._running:
+                future.set_result(False)
+                return future
+            self._arrival_waiter_list.append(waiter)
+            self._arrival_condition.notify_all()
+            if self._arrival_topic_list is None:
+                return future
+            # 正在进行的等待只检查其版本号之后到达的消息 新追加的 Topic 在下一次发布消息的通知时才被检查
+            # 因此请求的版本号更早 或者有新追加的 Topic 时 需要单独检查一次已经到达的消息
+            check_bool = arrival_version is not None and arrival_version < self._arrival_version
+            for message_topic in message_topic_list:
+                if message_topic not in self._arrival_topic_list:
+                    self._arrival_topic_list.append(message_topic)
+                    check_bool = arrival_version is not None
+        if check_bool:
+            self._executor.submit(self._check_arrival_waiter, waiter)
+        return future
+
+    def _check_arrival_waiter(self, waiter):
+        """
+        不等待 检查一次请求等待的 Topic 是否已经有新消息到达 已经到达时立即唤醒
+        """
+        try:
+            arrived = self._mq_instance.wait_message_arrival(waiter[0], waiter[1], 0)
+        except Exception as e:
+            PLog.gets().warning("[AsyncSimpleSQLiteMQBroker] Cannot check message arrival, exception '%s'" % str(e))
+            return
+        if not arrived:
+            return
+        with self._arrival_condition:
+            if waiter not in self._arrival_waiter_list:
+                return
+            self._arrival_waiter_list.remove(waiter)
+        waiter[3].set_result(True)
+
+    def _arrival_loop(self):
+        """
+        合并所有等待的 Topic 与最早的消息到达版本号 一次调用 MQ 的 wait_message_arrival 等待任意一个 Topic 有新消息到达
+        """
+        while True:
+            with self._arrival_condition:
+                while self._running and not self._arrival_waiter_list:
+                    self._arrival_condition.wait()
+                if not self._running:
+                    return
+
+                arrival_topic_list = list()
+                arrival_version = None
+                deadline = None
+                for message_topic_list, waiter_arrival_version, waiter_deadline, _ in self._arrival_waiter_list:
+                    for message_topic in message_topic_list:
+                        if message_topic not in arrival_topic_list:
+                            arrival_topic_list.append(message_topic)
+                    if waiter_arrival_version is not None:
+                        arrival_version = waiter_arrival_version if arrival_version is None \
+                            else min(arrival_version, waiter_arrival_version)
+                    deadline = waiter_deadline if deadline is None else min(deadline, waiter_deadline)
+                if arrival_version is not None:
+                    self._arrival_topic_list = arrival_topic_list
+                    self._arrival_version = arrival_version
+            wait_seconds = min(deadline - time.time(), SQLITE_MQ_ASYNC_ARRIVAL_WAIT_SECONDS)
+
+            arrived = False
+            if wait_seconds > 0:
+                try:
+                    if arrival_version is None:
+                        # MQ 实例不支持消息到达通知 只能等待超时
+                        with self._arrival_condition:
+                            self._arrival_condition.wait(wait_seconds)
+                    else:
+                        arrived = self._mq_instance.wait_message_arrival(
+                            arrival_topic_list, arrival_version, wait_seconds
+                        )
+                except Exception as e:
+                    PLog.gets().warning(
+                        "[AsyncSimpleSQLiteMQBroker] Cannot wait message arrival, exception '%s'" % str(e))
+                    with self._arrival_condition:
+                        self._arrival_condition.wait(wait_seconds)
+
+            # 有新消息到达时唤醒所有请求 等待期间新注册的请求 Topic 也已经加入本次等待 其余只唤醒已经超时的请求
+            current_time = time.time()
+            wake_list = list()
+            with self._arrival_condition:
+                self._arrival_topic_list = None
+                self._arrival_version = None
+                remain_waiter_list = list()
+                for waiter in self._arrival_waiter_list:
+                    if arrived:
+                        wake_list.append((waiter[3], True))
+                    elif waiter[2] <= current_time:
+                        wake_list.append((waiter[3], False))
+                    else:
+                        remain_waiter_list.append(waiter)
+                self._arrival_waiter_list = remain_waiter_list
+            for future, result in wake_list:
+                future.set_result(result)
+
+    def commit_message(self, message_topic, message_uuid):
+        return self._submit(self._mq_instance.commit_message, message_topic, message_uuid)
+
+    def hold_message(self, message_topic, message_uuid, hold_consume_time=6000):
+        return self._submit(self._mq_instance.hold_message, message_topic, message_uuid, hold_consume_time)
+
+    def hold_messages(self, message_topic, message_uuid_list, hold_consume_time=6000):
+        return self._submit(self._mq_instance.hold_messages, message_topic, message_uuid_list, hold_consume_time)
+
+    def consume_failed(self, message_topic, message_uuid, max_failed_times, retry_times_interval=300):
+        return self._submit(self._mq_instance.consume_failed, message_topic, message_uuid, max_failed_times,
+                            retry_times_interval)
+
+    def delete_message(self, message_topic, message_uuid, is_archiver_read=False):
+        return self._submit(self._mq_instance.delete_message, message_topic, message_uuid, is_archiver_read)
+
+    def scan_message(self, message_topic=None, every_page_quantity=10, page_number=1, is_archiver_read=False,
+                     message_status=None, begin_time=None, end_time=None, continuation_token=None,
+                     is_dead_letter_read=False):
+        return self._submit(self._mq_instance.scan_message, message_topic, every_page_quantity, page_number,
+                            is_archiver_read, message_status, begin_time, end_time, continuation_token,
+                            is_dead_letter_read)
+
+    def fetch_message_by_uuid(self, message_topic, message_uuid):
+        return self._submit(self._mq_instance.fetch_message_by_uuid, message_topic, message_uuid)
+
+    def get_priority_backlog(self, message_topic):
+        return self._submit(self._mq_instance.get_priority_backlog, message_topic)
+
+    def redrive(self, message_topic, message_filter=None, limit=None, batch_size=SQLITE_MQ_DEAD_LETTER_BATCH_SIZE):
+        return self._submit(self._mq_instance.redrive, message_topic, message_filter, limit, batch_size)
+
+    def stats(self):
+        return self._submit(self._mq_instance.stats)
+
+    def create_consumer_group(self, message_topic, consumer_group, start_from_latest=False):
+        return self._submit(self._mq_instance.create_consumer_group, message_topic, consumer_group, start_from_latest)
+
+    def delete_consumer_group(self, message_topic, consumer_group):
+        return self._submit(self._mq_instance.delete_consumer_group, message_topic, consumer_group)
+
+    def get_consumer_groups(self, message_topic):
+        return self._submit(self._mq_instance.get_consumer_groups, message_topic)
+
+    def get_group_message(self, message_topic, consumer_group, consumer=None, max_consume_time=3600, wait_timeout=0):
+        """
+        :return: Future 结果为消费组获取到的 MQ Message 超时仍没有消息时为 None
+        :rtype: Future
+        """
+        future = Future()
+        if future.set_running_or_notify_cancel():
+            self._executor.submit(self._wait_message, future, message_topic, time.time() + wait_timeout,
+                                  self._mq_instance.get_group_message, message_topic, consumer_group, consumer,
+                                  max_consume_time)
+        return future
+
+    def get_group_messages(self, message_topic, consumer_group, message_count, consumer=None, max_consume_time=3600,
+                           wait_timeout=0):
+        """
+        :return: Future 结果为消费组获取到的 MQ Message 列表
+        :rtype: Future
+        """
+        future = Future()
+        if future.set_running_or_notify_cancel():
+            self._executor.submit(self._wait_message, future, message_topic, time.time() + wait_timeout,
+                                  self._mq_instance.get_group_messages, message_topic, consumer_group, message_count,
+                                  consumer, max_consume_time)
+        return future
+
+    def hold_group_message(self, message_topic, consumer_group, message_uuid, hold_consume_time=6000):
+        return self._submit(self._mq_instance.hold_group_message, message_topic, consumer_group, message_uuid,
+                            hold_consume_time)
+
+    def commit_group_message(self, message_topic, consumer_group, message_uuid):
+        return self._submit(self._mq_instance.commit_group_message, message_topic, consumer_group, message_uuid)
+
+    def group_consume_failed(self, message_topic, consumer_group, message_uuid, max_failed_times,
+                             retry_times_interval=300):
+        return self._submit(self._mq_instance.group_consume_failed, message_topic, consumer_group, message_uuid,
+                            max_failed_times, retry_times_interval)
+
+    def redrive_consumer_group(self, message_topic, consumer_group):
+        return self._submit(self._mq_instance.redrive_consumer_group, message_topic, consumer_group)
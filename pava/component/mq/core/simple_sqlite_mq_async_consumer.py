@@ -0,0 +1,249 @@
+# coding=utf-8
+from abc import ABCMeta
+
+from pava.component.mq.core.mq_message import MQMessage
+from pava.component.mq.core.simple_sqlite_mq_async_broker import AsyncSimpleSQLiteMQBroker
+from pava.component.mq.core.simple_sqlite_mq_consumer import SimpleSQLiteMQConsumer
+from pava.component.p_log import PLog
+from pava.utils.async_utils import async_execute, cycle_execute
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 异步消费者
+处理消息的函数返回 Future (或任何带有 add_done_callback 的对象) 时 不等待其完成 由回调 提交 / 标记消费失败
+一个线程负责获取消息 同时消费的消息数量由 max_in_flight 与每个主题的 max_concurrency 限制 与线程数量无关
+Hold Message 心跳 提交 消费失败 均通过 AsyncSimpleSQLiteMQBroker 发出 不阻塞获取消息与处理消息
+处理消息的函数直接返回普通值时视为同步完成 该函数在获取消息的线程中执行 耗时的处理应当返回 Future
+"""
+
+
+class AsyncSQLiteMQConsumer(SimpleSQLiteMQConsumer):
+    __metaclass__ = ABCMeta
+
+    @type_check(None, AsyncSimpleSQLiteMQBroker, int, [int, float], int, [int, float])
+    def __init__(self, async_mq_instance, max_in_flight=100, hold_message_heart_beat=30, consume_batch_size=10,
+                 max_idle_wait_seconds=10):
+        """
+        :param async_mq_instance: 异步接口 各个方法返回 Future
+        :param max_in_flight: 所有主题同时消费的消息数量上限
+        :param consume_batch_size: 每次从一个主题最多获取的消息数量
+        """
+        SimpleSQLiteMQConsumer.__init__(self, async_mq_instance, hold_message_heart_beat, consume_batch_size,
+                                        max_idle_wait_seconds)
+        self._max_in_flight = 1 if max_in_flight < 1 else max_in_flight
+        self._running = False
+
+    def start(self):
+        self._running = True
+        cycle_execute("%s_hold_message" % id(self), self._hold_message, self._hold_message_heart_beat)
+        async_execute(self._work)
+
+    def stop(self):
+        """
+        停止获取新的消息 正在消费的消息不受影响
+        """
+        with self._synchronize_message_lock:
+            self._running = False
+            self._synchronize_message_condition.notify_all()
+
+    def _work(self):
+        self._pre_consume_check()
+        while self._running:
+            try:
+                self._consume_or_wait()
+            except Exception as e:
+                PLog.gets().exception(e)
+                time_sleep(1)
+
+    def _get_topic_free_count(self, message_topic):
+        """
+        调用时需要持有 _synchronize_message_lock
+        :return: 该主题还可以同时消费的消息数量
+        """
+        max_concurrency = self._consume_topic_max_concurrency.get(message_topic, None)
+        if max_concurrency is None:
+            return self._max_in_flight
+        return max_concurrency - self._consume_topic_in_flight_count[message_topic]
+
+    def _consume_or_wait(self):
+        # 先获取消息到达版本号 再获取消息 这样不会错过两者之间到达的消息
+        arrival_version = self._mq_instance.get_message_arrival_version().result()
+
+        with self._synchronize_message_lock:
+            # 达到同时消费的上限 等待有消息消费完成
+            while self._running and len(self._in_flight_message_dict) >= self._max_in_flight:
+                self._synchronize_message_condition.wait(self._max_idle_wait_seconds)
+            free_count = self._max_in_flight - len(self._in_flight_message_dict)
+            # 从上次获取到消息的主题的下一个主题开始 轮询所有主题 避免排在后面的主题饥饿
+            topic_count = len(self._consume_topic_list)
+            topic_index_list = [(self._next_topic_index + offset) % topic_count for offset in range(topic_count)]
+
+        available_topic_list = list()
+        message_exist_bool = False
+        for topic_index in topic_index_list:
+            if free_count <= 0 or not self._running:
+                break
+            topic = self._consume_topic_list[topic_index]
+            with self._synchronize_message_lock:
+                message_count = min(self._consume_batch_size, free_count, self._get_topic_free_count(topic))
+            if message_count <= 0:
+                continue
+            available_topic_list.append(topic)
+
+            mq_message_list = self._mq_instance.get_messages(
+                message_topic=topic,
+                message_count=message_count,
+                consumer=self._get_consumer(topic),
+                max_consume_time=get_int_value(self._get_consume_expire_time(topic))
+            ).result()
+            if list_is_empty(mq_message_list):
+                continue
+
+            with self._synchronize_message_lock:
+                self._next_topic_index = (topic_index + 1) % len(self._consume_topic_list)
+                for mq_message in mq_message_list:
+                    self._start_consume(mq_message)
+            for mq_message in mq_message_list:
+                self._handle_message(mq_message)
+            free_count -= len(mq_message_list)
+            message_exist_bool = True
+
+        if message_exist_bool or not self._running:
+            return
+
+        # 所有主题都达到并发上限 等待其他消息消费完成
+        if list_is_empty(available_topic_list):
+            with self._synchronize_message_lock:
+                self._synchronize_message_condition.wait(self._max_idle_wait_seconds)
+            return
+
+        PLog.gets().debug(
+            "[AsyncSQLiteMQConsumer] No message can be consumed, will wait at most %s seconds for new message ..." %
+            self._max_idle_wait_seconds
+        )
+        self._mq_instance.wait_message_arrival(
+            available_topic_list, arrival_version, self._max_idle_wait_seconds
+        ).result()
+
+    def _handle_message(self, mq_message):
+        """
+        :type mq_message: MQMessage
+        """
+        PLog.gets().info("[AsyncSQLiteMQConsumer] Receive message: %s from %s, handle it..." % (
+            mq_message.message_uuid, mq_message.message_topic))
+        try:
+            consume_result = self._consume_topic_handler[mq_message.message_topic](mq_message)
+        except Exception as e:
+            self._do_exception(mq_message, e)
+            return
+        if callable(getattr(consume_result, "add_done_callback", None)):
+            consume_result.add_done_callback(lambda future: self._handle_consume_future(mq_message, future))
+        else:
+            self._commit(mq_message)
+
+    def _handle_consume_future(self, mq_message, future):
+        if future.cancelled():
+            self._do_exception(mq_message, Exception("[AsyncSQLiteMQConsumer] Consume future is cancelled"))
+            return
+        exception_object = future.exception()
+        if exception_object is None:
+            self._commit(mq_message)
+        else:
+            self._do_exception(mq_message, exception_object)
+
+    def _commit(self, mq_message):
+        """
+        提交完成后才释放并发名额 提交期间消息仍然处于锁定状态 计入正在消费的数量
+        """
+        commit_future = self._mq_instance.commit_message(mq_message.message_topic, mq_message.message_uuid)
+        commit_future.add_done_callback(lambda future: self._finish_request(
+            future, mq_message, "commit message"
+        ))
+
+    def _finish_request(self, future, mq_message, action_name):
+        """
+        提交 / 标记消费失败 的请求完成后 释放消息占用的并发名额
+        """
+        self._finish_consume(mq_message)
+        self._log_future_exception(future, action_name, mq_message.message_topic, [mq_message.message_uuid])
+
+    def _do_exception(self, mq_message, exception_object):
+        """
+        标记消费失败的请求同样通过异步接口发出 SimpleSQLiteMQConsumer 中的重试策略不变 请求完成后才释放并发名额
+        """
+        message_topic = mq_message.message_topic
+        message_uuid = mq_message.message_uuid
+        retry_times_interval = get_int_value(self._get_retry_interval(message_topic))
+        failed_times = get_int_value(mq_message.failed_times)
+        max_failed_times = get_int_value(self._get_max_failed_times(message_topic))
+
+        if failed_times >= max_failed_times:
+            PLog.gets().exception(
+                Exception(
+                    "[AsyncSQLiteMQConsumer] Occurred exception when consume message topic: %s, message_uuid: %s, "
+                    "maximum number of failed times: %s, this message cannot be consumed..." % (
+                        message_topic, message_uuid, failed_times
+                    ), exception_object)
+            )
+        else:
+            PLog.gets().exception(
+                Exception(
+                    "[AsyncSQLiteMQConsumer] Occurred exception when consume message topic: %s, message_uuid: %s, "
+                    "will retry after %s seconds" % (
+                        message_topic, message_uuid, retry_times_interval
+                    ), exception_object)
+            )
+
+        consume_failed_future = self._mq_instance.consume_failed(
+            message_topic=message_topic,
+            message_uuid=message_uuid,
+            max_failed_times=max_failed_times,
+            retry_times_interval=retry_times_interval
+        )
+        consume_failed_future.add_done_callback(lambda future: self._finish_request(
+            future, mq_message, "mark consume failed"
+        ))
+
+    def _do_hold(self, message_topic, message_uuid_list):
+        """
+        发出批量 Hold Message 请求后立即返回 在回调中检查结果
+        """
+        if PLog.log_level_is_debug():
+            PLog.gets().debug("[AsyncSQLiteMQConsumer] hold %s messages topic: %s ..." % (
+                len(message_uuid_list), message_topic))
+
+        hold_future = self._mq_instance.hold_messages(
+            message_topic=message_topic,
+            message_uuid_list=message_uuid_list,
+            hold_consume_time=self._get_consume_expire_time(message_topic)
+        )
+        hold_future.add_done_callback(
+            lambda future: self._check_hold_result(future, message_topic, message_uuid_list)
+        )
+
+    def _check_hold_result(self, future, message_topic, message_uuid_list):
+        if self._log_future_exception(future, "hold messages", message_topic, message_uuid_list):
+            return
+        hold_mq_message_list = future.result()
+        if hold_mq_message_list is not None and len(hold_mq_message_list) != len(message_uuid_list):
+            PLog.gets().warning(
+                "[AsyncSQLiteMQConsumer] Only hold %s of %s messages topic: %s, others may have been recovered" % (
+                    len(hold_mq_message_list), len(message_uuid_list), message_topic)
+            )
+
+    @staticmethod
+    def _log_future_exception(future, action_name, message_topic, message_uuid_list):
+        """
+        :return: 请求是否失败
+        :rtype: bool
+        """
+        exception_object = future.exception()
+        if exception_object is None:
+            return False
+        PLog.gets().exception(
+            Exception(
+                "[AsyncSQLiteMQConsumer] Occurred exception when %s topic: %s, message_uuid: %s" % (
+                    action_name, message_topic, ", ".join(message_uuid_list)
+                ), exception_object)
+        )
+        return True
@@ -1,15 +1,27 @@
 # coding=utf-8
+import base64
 import bisect
+import itertools
+import math
 import re
-from threading import Lock
+import time
+import zlib
+from threading import Lock, Condition
 
 from pava.component.mq.core.commit_log import CommitLog
+from pava.component.mq.core.simple_sqlite_mq_archiver import SimpleSQLiteMQArchiver
+from pava.component.mq.core.simple_sqlite_mq_commit_log import SimpleSQLiteMQCommitLog
+from pava.component.mq.core.simple_sqlite_mq_dead_letter_queue import SimpleSQLiteMQDeadLetterQueue
+from pava.component.mq.core.simple_sqlite_mq_ext_synchronizer import SimpleSQLiteMQExtSynchronizer
+from pava.component.mq.core.simple_sqlite_mq_message_codec import SimpleSQLiteMQMessageCodec
+from pava.component.mq.core.simple_sqlite_mq_message_recoverer import SimpleSQLiteMQMessageRecoverer
+from pava.component.mq.core.simple_sqlite_mq_metrics import SimpleSQLiteMQMetricsRegistry
+from pava.component.mq.core.simple_sqlite_mq_process_coordinator import SimpleSQLiteMQProcessCoordinator
 from pava.component.mq.interface.abstract_mq_broker import AbstractMQBroker
 
 from pava.component.mq.core.simple_sqlite_mq_ext_segment import _get_simple_sqlite_mq_broker_ext_segment
 from pava.component.mq.interface.abstract_mq_common_segment import AbstractMQBrokerCommonSegment
 from pava.component.mq.interface.abstract_mq_ext_segment import AbstractMQBrokerExtSegment
-from pava.component.thread_pool.core.thread_pool_executor_wrapper import ThreadPoolExecutorWrapper
 from pava.utils.time_utils import get_current_timestamp
 from pava.utils.web_utils import get_local_host_ip
 
@@ -23,7 +35,7 @@ from pava.component.p_log import PLog
 
 from pava.decorator.decorator_impl.synchronized_decorator import synchronized
 from pava.component.mq import *
-from pava.utils.async_utils import cycle_execute, async_execute
+from pava.utils.async_utils import cycle_execute
 from pava.utils.object_utils import *
 
 from pava.decorator.decorator_impl.type_check_decorator import type_check
@@ -36,46 +48,224 @@ from pava.decorator.decorator_impl.type_check_decorator import type_check
 
 SIMPLE_SQLITE_MQ_LOCK_KEY_PREFIX = "SimpleSQLiteMQWrapper_"
 SIMPLE_SQLITE_MQ_LOCK_KEY_COUNT = 0
+# Common Segment 文件名后缀 文件名为 Topic + 后缀
+SEGMENT_FILE_SUFFIX = "_segment.sqlite"
+# Topic 与 Shard 编号之间的分隔符 非 0 号 Shard 的文件位于以 Topic 命名的目录中 文件名为 Shard 编号 + 后缀
+TOPIC_SHARD_SEPARATOR = "/"
 ALL_SQLITE_MQ_PATH = dict()
 
 
 class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
     @synchronized(SIMPLE_SQLITE_MQ_LOCK_KEY_PREFIX)
-    def __init__(self, mq_path, recover_message_heart_beat=30):
+    def __init__(self, mq_path, recover_message_heart_beat=30, durability_profile=SQLITE_MQ_DURABILITY_PROFILE_SAFE,
+                 ext_sync_max_queue_size=EXT_SYNC_MAX_QUEUE_SIZE, message_storage_mode=SQLITE_MQ_MESSAGE_STORAGE_BASE64,
+                 compress_algorithm=None, compress_threshold=SQLITE_MQ_COMPRESS_THRESHOLD,
+                 priority_aging_seconds=SQLITE_MQ_PRIORITY_AGING_SECONDS,
+                 archive_partition_period=SQLITE_MQ_ARCHIVE_PARTITION_DAY, archive_retention_seconds=0,
+                 archive_retention_bytes=0, vacuum_interval_seconds=0,
+                 idempotency_window_seconds=SQLITE_MQ_IDEMPOTENCY_WINDOW_SECONDS, topic_shard_count_dict=None,
+                 multi_process=False, dead_letter_enabled=True, metrics_enabled=True):
+        """
+        :param mq_path: MQ 存储路径
+        :param recover_message_heart_beat: 持久化 Commit Log Checkpoint 的间隔秒数 同时也是全量检查过期消息的间隔秒数
+            租约过期的消息在过期时立即恢复 不受该间隔影响
+        :param durability_profile: 持久化配置 safe / balanced / fast 决定各个 Segment 的 PRAGMA 设置
+        :param ext_sync_max_queue_size: Ext Segment 同步队列的最大长度 队列满时写入操作阻塞等待
+        :param message_storage_mode: 新消息的消息体存储方式 base64 / binary 已有的消息不受影响 读取时按各自的编码解码
+        :param compress_algorithm: 消息体压缩算法 zlib / lzma 为 None 时不压缩 仅在 binary 存储方式下可用
+        :param compress_threshold: 消息体超过该字节数时才尝试压缩
+        :param priority_aging_seconds: 优先级老化秒数 消息每等待该秒数 出队时的有效优先级提升 1 为 0 时不老化
+        :param archive_partition_period: 归档分区周期 day / week 每个周期一个归档文件
+        :param archive_retention_seconds: 归档分区的保留秒数 为 0 时不按时间删除
+        :param archive_retention_bytes: 所有归档分区文件的总字节数上限 为 0 时不按大小删除
+        :param vacuum_interval_seconds: 回收 Common / Ext Segment 空闲页的间隔秒数 为 0 时不自动回收
+        :param idempotency_window_seconds: 幂等键的去重窗口秒数 窗口内使用相同幂等键重复发布时返回原消息 为 0 时不去重
+        :param topic_shard_count_dict: Topic -> Shard 数量 每个 Shard 为一个独立的 Common Segment 文件与锁
+            生产者在 Shard 之间轮转写入 消费者轮流从各个 Shard 读取 未配置的 Topic 只有一个 Shard
+        :param multi_process: 多进程模式 多个进程可以同时使用同一个 MQ 目录 各个进程的配置需要保持一致
+            每个进程写入自己的 Commit Log 由文件锁选出的 Leader 进程同步 Ext Segment 恢复过期消息 并执行归档等定期任务
+        :param dead_letter_enabled: 达到消费失败次数上限的消息 是否从 Common Segment 移入所属 Topic 的死信队列
+            为 False 时消息以挂起状态留在 Common Segment 中 与之前的版本相同
+        :param metrics_enabled: 是否统计各个 Topic 的 出队 / 入队 / 提交 计数 以及事务提交耗时 供 stats() 使用
+            为 False 时 stats() 中只有积压数量等按需查询的数据
+        """
+        # 检查持久化配置是否合法
+        self._durability_profile_dict = SQLITE_MQ_DURABILITY_PROFILE_DICT.get(durability_profile, None)
+        if self._durability_profile_dict is None:
+            raise Exception("[SimpleSQLiteMQBroker] Unknown durability profile '%s', should be one of %s" % (
+                durability_profile, sorted(SQLITE_MQ_DURABILITY_PROFILE_DICT.keys())))
+        self._durability_profile = durability_profile
+
+        # 检查消息体存储方式 与 压缩配置是否合法
+        self._message_codec = SimpleSQLiteMQMessageCodec(message_storage_mode, compress_algorithm, compress_threshold)
+
+        # 检查优先级老化配置是否合法
+        if type(priority_aging_seconds) is not int or priority_aging_seconds < 0:
+            raise Exception(
+                "[SimpleSQLiteMQBroker] priority_aging_seconds should be a non-negative int instead of '%s'" % (
+                    priority_aging_seconds)
+            )
+        self._priority_aging_seconds = priority_aging_seconds
+
+        # 检查幂等键去重窗口配置是否合法
+        if type(idempotency_window_seconds) is not int or idempotency_window_seconds < 0:
+            raise Exception(
+                "[SimpleSQLiteMQBroker] idempotency_window_seconds should be a non-negative int instead of '%s'" % (
+                    idempotency_window_seconds)
+            )
+        self._idempotency_window_seconds = idempotency_window_seconds
+
+        # 检查 Topic Shard 数量配置是否合法
+        self._topic_shard_count_dict = dict()
+        for message_topic, shard_count in (topic_shard_count_dict or dict()).items():
+            if type(shard_count) is not int or shard_count <= 0 or shard_count > SQLITE_MQ_MAX_TOPIC_SHARD_COUNT:
+                raise Exception(
+                    "[SimpleSQLiteMQBroker] Shard count of topic '%s' should be an int between 1 and %s "
+                    "instead of '%s'" % (message_topic, SQLITE_MQ_MAX_TOPIC_SHARD_COUNT, shard_count)
+                )
+            self._topic_shard_count_dict[message_topic] = shard_count
+
         # 检查 MQ Path 是否合法有效
         self._path_check(mq_path)
         self._mq_path = mq_path
         self._segment_path = os.path.join(mq_path, "segment")
         FileDomain(self._segment_path).create_dir()
-        self._commit_path = os.path.join(mq_path, "commit")
-        FileDomain(self._commit_path).create_dir()
+        # 旧版本 每次操作生成一个 Commit Log File 的目录 仅在启动时处理遗留文件
+        self._legacy_commit_path = os.path.join(mq_path, "commit")
+        # 追加写入的 Commit Log 所有 Common Segment 共用 多进程模式下每个进程一个 Commit Log
+        self._process_coordinator = None
+        if multi_process:
+            self._process_coordinator = SimpleSQLiteMQProcessCoordinator(
+                mq_path, self._sync_mq_message_data_from_common_segment, self._handle_legacy_commit_log_file,
+                fsync_enabled=SQLITE_MQ_COMMIT_LOG_FSYNC_DICT[durability_profile]
+            )
+            self._commit_log = self._process_coordinator.get_commit_log()
+        else:
+            self._commit_log = SimpleSQLiteMQCommitLog(
+                os.path.join(mq_path, "commit_log"),
+                fsync_enabled=SQLITE_MQ_COMMIT_LOG_FSYNC_DICT[durability_profile]
+            )
+
+        # 运维指标 在生成 Segment 之前创建 Common Segment 记录事务提交耗时
+        self._metrics_registry = SimpleSQLiteMQMetricsRegistry() if metrics_enabled else None
+        self._start_time = time.time()
 
         # 避免重复生成 Segment
         self._generate_segment_lock = Lock()
 
-        # 存放所有的 Topic Segment
+        # 存放所有的 Topic Segment Key 为 Topic 非 0 号 Shard 为 Topic + 分隔符 + Shard 编号
         self._segment_dict = dict()
+        # 每个 Topic 所有 Shard 的 Segment 列表缓存 Topic -> (加载时间, Segment 列表 下标即 Shard 编号)
+        self._topic_shard_segment_list_dict = dict()
+        # 每个 Topic 生产者 / 消费者 轮转 Shard 的计数器
+        self._topic_produce_counter_dict = dict()
+        self._topic_consume_counter_dict = dict()
+        # 每个 Topic 的消费组列表缓存 Topic -> (加载时间, 消费组名称列表)
+        self._topic_consumer_group_dict = dict()
+        # 已经确认创建了消费组的 (Segment Key, 消费组) 消费组创建之后新增的 Shard 中按需创建
+        self._consumer_group_segment_key_set = set()
+
+        # 消息到达通知 有新的可消费消息时 唤醒等待该 Topic 的消费者
+        self._message_arrival_condition = Condition()
+        # 每有一次消息到达 版本号加一
+        self._message_arrival_version = 0
+        # 每个 Topic 最后一次消息到达时的版本号
+        self._topic_arrival_version_dict = dict()
+        # 每个 Topic 尚未可见的延迟消息中 最早的可见时间 到达该时间时唤醒等待的消费者
+        self._topic_next_visible_time_dict = dict()
 
         # 生成供外部接入的 Ext Segment
         self._ext_segment = self._get_topic_segment(EXT_SQLITE_MQ_SEGMENT)  # type: AbstractMQBrokerExtSegment
 
-        # 生成 归档器
-        self._archiver_segment = self._get_topic_segment(
-            ARCHIVER_SQLITE_MQ_SEGMENT
-        )  # type: AbstractMQBrokerExtSegment
+        # 生成 按时间分区的归档器 旧版本的单个归档文件作为最旧的分区
+        self._archiver_segment = SimpleSQLiteMQArchiver(
+            os.path.join(mq_path, SQLITE_MQ_ARCHIVE_DIR_NAME),
+            os.path.join(self._segment_path, ARCHIVER_SQLITE_MQ_SEGMENT + ".sqlite"),
+            self._generate_archive_partition_segment,
+            partition_period=archive_partition_period,
+            retention_seconds=archive_retention_seconds,
+            retention_bytes=archive_retention_bytes
+        )
 
         self._ext_segment.archiver_segment_ = self._archiver_segment
+        self._ext_segment.commit_log_ = self._commit_log
+
+        # 生成 每个 Topic 一个文件的死信队列 关闭自动转入时 已有的死信仍然可以检索与移回
+        self._dead_letter_enabled = dead_letter_enabled
+        self._dead_letter_queue = SimpleSQLiteMQDeadLetterQueue(
+            os.path.join(mq_path, SQLITE_MQ_DEAD_LETTER_DIR_NAME), self._generate_dead_letter_segment
+        )
+
+        if multi_process:
+            # 多进程模式下 由 Leader 读取各个进程的 Commit Log 按 Common Segment 当前的状态同步至 Ext Segment
+            self._ext_synchronizer = self._process_coordinator
+            self._process_coordinator.start()
+        else:
+            # 处理突然中断的 还没来得及处理的消息
+            self._handle_commit_log()
+
+            # 按 Commit Log 顺序 批量将变更同步至 Ext Segment
+            self._ext_synchronizer = SimpleSQLiteMQExtSynchronizer(
+                self._ext_segment, self._commit_log, max_queue_size=ext_sync_max_queue_size
+            )
 
-        # 处理突然中断的 还没来得及处理的消息
-        self._handle_log_commit_file()
+            # 定期持久化 Commit Log 的 Checkpoint 并清理已经同步完成的 Log Segment
+            cycle_execute("%s_persist_commit_log_checkpoint" % id(self), self._commit_log.persist_checkpoint,
+                          recover_message_heart_beat)
+
+        # 定期按保留策略删除过期的归档分区
+        if archive_retention_seconds > 0 or archive_retention_bytes > 0:
+            self._execute_leader_task(self.enforce_archive_retention)
+            cycle_execute("%s_enforce_archive_retention" % id(self),
+                          lambda: self._execute_leader_task(self.enforce_archive_retention),
+                          SQLITE_MQ_ARCHIVE_RETENTION_CHECK_SECONDS)
+
+        # 定期分批清理超出去重窗口的幂等键
+        if idempotency_window_seconds > 0:
+            cycle_execute("%s_prune_idempotency_keys" % id(self),
+                          lambda: self._execute_leader_task(self.prune_idempotency_keys),
+                          SQLITE_MQ_IDEMPOTENCY_PRUNE_SECONDS)
+
+        # 定期将 Common Segment 中遗留的挂起消息转入死信队列 包括转移中途中断的消息 以及升级前挂起的消息
+        if dead_letter_enabled:
+            cycle_execute("%s_sweep_dead_letter_messages" % id(self),
+                          lambda: self._execute_leader_task(self.sweep_dead_letter_messages),
+                          SQLITE_MQ_DEAD_LETTER_SWEEP_SECONDS)
+
+        # 定期删除并归档已经被所有消费组提交的消息
+        cycle_execute("%s_trim_consumer_group_messages" % id(self),
+                      lambda: self._execute_leader_task(self.trim_consumer_group_messages),
+                      SQLITE_MQ_CONSUMER_GROUP_RETENTION_SECONDS)
+
+        # 定期回收 Common / Ext Segment 中删除消息后留下的空闲页
+        if get_int_value(vacuum_interval_seconds) > 0:
+            cycle_execute("%s_vacuum_segments" % id(self), lambda: self._execute_leader_task(self.vacuum_segments),
+                          vacuum_interval_seconds)
+
+        # 恢复消息线程 在最早一条租约过期时唤醒 按 Common Segment 分页恢复
+        # 恢复器以 Segment Key 区分各个 Shard 多进程模式下只有 Leader 恢复
+        self._message_recoverer = SimpleSQLiteMQMessageRecoverer(
+            self._get_segment_by_segment_key, self._get_segment_file_key_list, self._ext_synchronizer,
+            self._notify_segment_message_arrival, recover_message_heart_beat,
+            recover_enabled_function=None if self._process_coordinator is None else self._process_coordinator.is_leader
+        )
 
-        # 恢复消息线程 每 30 秒运行一次
-        cycle_execute("%s_recover_message" % id(self), self._recover_message, recover_message_heart_beat)
+        PLog.gets().info(
+            "[SimpleSQLiteMQBroker] All message queue component start successfully, durability profile: %s, "
+            "message storage mode: %s, compress algorithm: %s, multi process: %s" % (
+                self._durability_profile, message_storage_mode, compress_algorithm, multi_process)
+        )
 
-        # 将 Commit 日志 一个一个 顺序执行 用于 Ext Segment
-        self._order_log_executor = ThreadPoolExecutorWrapper(max_workers=1)
+    def _increase_metric(self, metric_name, message_topic, value):
+        if self._metrics_registry is not None:
+            self._metrics_registry.increase(metric_name, message_topic, value)
 
-        PLog.gets().info("[SimpleSQLiteMQBroker] All message queue component start successfully")
+    def _execute_leader_task(self, task_function):
+        """
+        多进程模式下 定期任务只在 Leader 进程中执行
+        """
+        if self._process_coordinator is None or self._process_coordinator.is_leader():
+            task_function()
 
     def _path_check(self, mq_path):
         """
@@ -92,57 +282,345 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
         if str_is_blank(mq_path):
             raise Exception("[SimpleSQLiteMQBroker] MQ Path is blank when create sqlite mq connection")
 
-    def _generate_topic_segment_by_message_topic(self, message_topic):
+    def _generate_mq_operation_lock_key(self):
+        # 生成并发锁 Key
+        global SIMPLE_SQLITE_MQ_LOCK_KEY_COUNT
+        SIMPLE_SQLITE_MQ_LOCK_KEY_COUNT += 1
+        # 如果创建多个 Broker 防止防重 Key 冲突
+        return SIMPLE_SQLITE_MQ_LOCK_KEY_PREFIX + str(id(self)) + str(SIMPLE_SQLITE_MQ_LOCK_KEY_COUNT)
+
+    def _generate_archive_partition_segment(self, db_path):
         """
+        归档分区与 Ext Segment 表结构相同
+        :rtype: AbstractMQBrokerExtSegment
+        """
+        return _get_simple_sqlite_mq_broker_ext_segment(
+            db_path=db_path,
+            mq_operation_lock_key=self._generate_mq_operation_lock_key(),
+            pragma_list=self._durability_profile_dict[SQLITE_MQ_SEGMENT_TYPE_ARCHIVER]
+        )
+
+    def _generate_dead_letter_segment(self, db_path):
+        """
+        死信队列与 Ext Segment 表结构相同 存放尚未处理的消息 使用 Common Segment 的持久化设置
+        :rtype: AbstractMQBrokerExtSegment
+        """
+        return _get_simple_sqlite_mq_broker_ext_segment(
+            db_path=db_path,
+            mq_operation_lock_key=self._generate_mq_operation_lock_key(),
+            pragma_list=self._durability_profile_dict[SQLITE_MQ_SEGMENT_TYPE_COMMON]
+        )
+
+    def _generate_topic_segment_by_message_topic(self, message_topic, shard_id=0):
+        """
+        :param shard_id: Topic 的 Shard 编号 0 号 Shard 使用未分片时的 Segment 文件
         :rtype: AbstractMQBroker
         """
+        if TOPIC_SHARD_SEPARATOR in message_topic:
+            raise Exception("[SimpleSQLiteMQBroker] message_topic '%s' cannot contain '%s'" % (
+                message_topic, TOPIC_SHARD_SEPARATOR))
+        segment_key = self._get_segment_key(message_topic, shard_id)
         with self._generate_segment_lock:
             # 并发情况下已经生成 Segment 就可以返回了
-            sqlite_mq_segment_instance = self._segment_dict.get(message_topic, None)
+            sqlite_mq_segment_instance = self._segment_dict.get(segment_key, None)
             if sqlite_mq_segment_instance is not None:
                 return sqlite_mq_segment_instance
 
-            # 生成并发锁 Key
-            global SIMPLE_SQLITE_MQ_LOCK_KEY_COUNT
-            SIMPLE_SQLITE_MQ_LOCK_KEY_COUNT += 1
-            # 如果创建多个 Broker 防止防重 Key 冲突
-            mq_operation_lock_key = SIMPLE_SQLITE_MQ_LOCK_KEY_PREFIX + str(id(self)) + str(
-                SIMPLE_SQLITE_MQ_LOCK_KEY_COUNT
-            )
+            mq_operation_lock_key = self._generate_mq_operation_lock_key()
 
             # 判断是否为 Ext Segment
-            ext_segment_inner_instance_bool = message_topic == EXT_SQLITE_MQ_SEGMENT \
-                                              or message_topic == ARCHIVER_SQLITE_MQ_SEGMENT
+            ext_segment_inner_instance_bool = message_topic == EXT_SQLITE_MQ_SEGMENT
             # 生成独立的 Topic SQLite 文件
             if ext_segment_inner_instance_bool:
                 sqlite_mq_segment_instance = _get_simple_sqlite_mq_broker_ext_segment(
                     db_path=os.path.join(self._segment_path, message_topic + ".sqlite"),
-                    mq_operation_lock_key=mq_operation_lock_key
+                    mq_operation_lock_key=mq_operation_lock_key,
+                    pragma_list=self._durability_profile_dict[SQLITE_MQ_SEGMENT_TYPE_EXT]
                 )
             else:
+                if shard_id > 0:
+                    FileDomain(os.path.join(self._segment_path, message_topic)).create_dir()
                 sqlite_mq_segment_instance = _get_simple_sqlite_mq_broker_common_segment(
                     message_topic=message_topic,
-                    db_path=os.path.join(self._segment_path, "%s_segment.sqlite" % message_topic),
-                    commit_path=self._commit_path,
-                    mq_operation_lock_key=mq_operation_lock_key
+                    db_path=os.path.join(self._segment_path, segment_key + SEGMENT_FILE_SUFFIX),
+                    commit_log=self._commit_log,
+                    mq_operation_lock_key=mq_operation_lock_key,
+                    pragma_list=self._durability_profile_dict[SQLITE_MQ_SEGMENT_TYPE_COMMON],
+                    priority_aging_seconds=self._priority_aging_seconds,
+                    idempotency_window_seconds=self._idempotency_window_seconds,
+                    shard_id=shard_id,
+                    metrics_registry=self._metrics_registry
                 )
-            # 记录 Segment, Ext Segment 和 Archiver Segment 直接就能取到 无需加入 Segment Dict
+            # 记录 Segment, Ext Segment 直接就能取到 无需加入 Segment Dict
             if not ext_segment_inner_instance_bool:
-                self._segment_dict[message_topic] = sqlite_mq_segment_instance
+                self._segment_dict[segment_key] = sqlite_mq_segment_instance
+                # 已有的 Segment 文件中可能存在延迟消息
+                self._update_next_visible_time(message_topic, sqlite_mq_segment_instance)
 
             return sqlite_mq_segment_instance
 
-    def _get_topic_segment(self, message_topic):
+    def _get_segment_file_key_list(self):
+        """
+        :return: Segment 目录中已经存在 Common Segment 文件的 Segment Key 列表 包含各个 Topic 的非 0 号 Shard
+        """
+        segment_key_list = list()
+        for file_name in os.listdir(self._segment_path):
+            # 非 0 号 Shard 的文件位于以 Topic 命名的目录中
+            if os.path.isdir(os.path.join(self._segment_path, file_name)):
+                for shard_id in self._get_segment_dir_shard_id_list(file_name):
+                    segment_key_list.append(self._get_segment_key(file_name, shard_id))
+                continue
+            if not file_name.endswith(SEGMENT_FILE_SUFFIX):
+                continue
+            # Ext Segment 与 Archiver Segment 的文件名 恰好也以 Segment 文件后缀结尾
+            if file_name in (EXT_SQLITE_MQ_SEGMENT + ".sqlite", ARCHIVER_SQLITE_MQ_SEGMENT + ".sqlite"):
+                continue
+            segment_key_list.append(file_name[:-len(SEGMENT_FILE_SUFFIX)])
+        return sorted(segment_key_list)
+
+    def _get_segment_dir_shard_id_list(self, message_topic):
+        """
+        :return: Topic 目录中已经存在 Segment 文件的 Shard 编号列表
+        """
+        segment_dir_path = os.path.join(self._segment_path, message_topic)
+        if not os.path.isdir(segment_dir_path):
+            return list()
+        shard_id_list = list()
+        for file_name in os.listdir(segment_dir_path):
+            shard_id_str = file_name[:-len(SEGMENT_FILE_SUFFIX)]
+            if file_name.endswith(SEGMENT_FILE_SUFFIX) and shard_id_str.isdigit() and int(shard_id_str) > 0:
+                shard_id_list.append(int(shard_id_str))
+        return sorted(shard_id_list)
+
+    @staticmethod
+    def _get_segment_key(message_topic, shard_id):
+        if shard_id == 0:
+            return message_topic
+        return "%s%s%s" % (message_topic, TOPIC_SHARD_SEPARATOR, shard_id)
+
+    @staticmethod
+    def _get_segment_key_topic(segment_key):
+        return segment_key.rsplit(TOPIC_SHARD_SEPARATOR, 1)[0]
+
+    def _get_segment_by_segment_key(self, segment_key):
+        """
+        :rtype: AbstractMQBrokerCommonSegment
+        """
+        if TOPIC_SHARD_SEPARATOR in segment_key:
+            message_topic, shard_id_str = segment_key.rsplit(TOPIC_SHARD_SEPARATOR, 1)
+            return self._get_topic_segment(message_topic, int(shard_id_str))
+        return self._get_topic_segment(segment_key)
+
+    def _get_topic_segment(self, message_topic, shard_id=0):
         """
         :rtype: AbstractMQBrokerCommonSegment or AbstractMQBrokerExtSegment
         """
-        message_topic_segment = self._segment_dict.get(message_topic, None)
+        message_topic_segment = self._segment_dict.get(self._get_segment_key(message_topic, shard_id), None)
         if message_topic_segment is None:
-            return self._generate_topic_segment_by_message_topic(message_topic)
+            return self._generate_topic_segment_by_message_topic(message_topic, shard_id)
         return message_topic_segment
 
-    def _handle_log_commit_file(self):
-        file_domain_list = FileDomain(self._commit_path).get_children_file_domain()
+    def _get_topic_shard_segment_list(self, message_topic):
+        """
+        :return: Topic 所有 Shard 的 Segment 列表 下标即 Shard 编号
+        :rtype: list
+        """
+        current_time = time.time()
+        shard_segment_list_cache = self._topic_shard_segment_list_dict.get(message_topic, None)
+        if shard_segment_list_cache is not None and \
+                current_time - shard_segment_list_cache[0] < SQLITE_MQ_TOPIC_SHARD_CACHE_SECONDS:
+            return shard_segment_list_cache[1]
+        # 配置的 Shard 数量减少后 多出的 Shard 文件中仍可能有消息 消费者继续从中读取 生产者不再写入
+        # 多进程模式下 其他进程可能按更大的 Shard 数量新建了 Shard 文件 缓存过期后重新扫描 Topic 目录
+        shard_count = max(
+            [self._topic_shard_count_dict.get(message_topic, 1) - 1] +
+            self._get_segment_dir_shard_id_list(message_topic)
+        ) + 1
+        shard_segment_list = [self._get_topic_segment(message_topic, shard_id) for shard_id in range(shard_count)]
+        self._topic_shard_segment_list_dict[message_topic] = (current_time, shard_segment_list)
+        return shard_segment_list
+
+    @staticmethod
+    def _get_topic_counter(topic_counter_dict, message_topic):
+        topic_counter = topic_counter_dict.get(message_topic, None)
+        if topic_counter is None:
+            topic_counter = topic_counter_dict.setdefault(message_topic, itertools.count())
+        return topic_counter
+
+    def _get_producer_shard_segment(self, message_topic, idempotency_key=None):
+        """
+        生产者在 Shard 之间轮转写入 指定了幂等键时按幂等键的哈希选择 Shard 重试时才能在同一个 Shard 中去重
+        :rtype: AbstractMQBrokerCommonSegment
+        """
+        shard_segment_list = self._get_topic_shard_segment_list(message_topic)
+        shard_count = self._topic_shard_count_dict.get(message_topic, 1)
+        if shard_count == 1:
+            return shard_segment_list[0]
+        if str_not_blank(idempotency_key):
+            shard_id = (zlib.crc32(idempotency_key) & 0xffffffff) % shard_count
+        else:
+            shard_id = next(self._get_topic_counter(self._topic_produce_counter_dict, message_topic)) % shard_count
+        return shard_segment_list[shard_id]
+
+    @staticmethod
+    def _get_message_shard_id(message_uuid):
+        """
+        :return: 消息 UUID 中编码的 Shard 编号 没有 Shard 编号的 UUID 属于 0 号 Shard
+        :rtype: int
+        """
+        if SQLITE_MQ_SHARD_UUID_SEPARATOR not in message_uuid:
+            return 0
+        shard_id_str = message_uuid.rsplit(SQLITE_MQ_SHARD_UUID_SEPARATOR, 1)[1]
+        if not shard_id_str.isdigit():
+            raise Exception("[SimpleSQLiteMQBroker] Invalid shard id in message uuid '%s'" % message_uuid)
+        return int(shard_id_str)
+
+    def _get_message_segment(self, message_topic, message_uuid):
+        """
+        按消息 UUID 中编码的 Shard 编号 路由至消息所在的 Segment
+        :rtype: AbstractMQBrokerCommonSegment
+        """
+        shard_id = self._get_message_shard_id(message_uuid)
+        shard_segment_list = self._get_topic_shard_segment_list(message_topic)
+        if shard_id >= len(shard_segment_list):
+            # 其他进程可能新建了 Shard 文件 重新扫描 Topic 目录
+            self._topic_shard_segment_list_dict.pop(message_topic, None)
+            shard_segment_list = self._get_topic_shard_segment_list(message_topic)
+        if shard_id >= len(shard_segment_list):
+            raise Exception("[SimpleSQLiteMQBroker] Message uuid '%s' does not belong to any shard of topic '%s'" % (
+                message_uuid, message_topic))
+        return shard_segment_list[shard_id]
+
+    def _get_message_segment_key(self, mq_message):
+        """
+        :type mq_message: MQMessage
+        """
+        return self._get_segment_key(mq_message.message_topic, self._get_message_shard_id(mq_message.message_uuid))
+
+    def _get_shard_message(self, message_topic, consumer, max_consume_time):
+        """
+        消费者每次从下一个 Shard 开始读取 各个 Shard 被公平地消费
+        :return: MQ Message 与 Commit Log Offset
+        """
+        shard_segment_list = self._get_topic_shard_segment_list(message_topic)
+        begin_index = next(self._get_topic_counter(self._topic_consume_counter_dict, message_topic))
+        for index in range(len(shard_segment_list)):
+            shard_segment = shard_segment_list[(begin_index + index) % len(shard_segment_list)]
+            mq_message, commit_log_offset = shard_segment.get_message(consumer, max_consume_time)
+            if mq_message is not None:
+                return mq_message, commit_log_offset
+        return None, None
+
+    def _get_shard_message_list(self, message_topic, consumer, max_consume_time, message_count):
+        """
+        从下一个 Shard 开始 依次从各个 Shard 读取 直到凑满 message_count 条消息
+        :return: MQ Message 列表 与 各个 Shard 的 (MQ Message 列表, Commit Log Offset) 列表
+        """
+        shard_segment_list = self._get_topic_shard_segment_list(message_topic)
+        begin_index = next(self._get_topic_counter(self._topic_consume_counter_dict, message_topic))
+        mq_message_list = list()
+        shard_message_list = list()
+        for index in range(len(shard_segment_list)):
+            if len(mq_message_list) >= message_count:
+                break
+            shard_segment = shard_segment_list[(begin_index + index) % len(shard_segment_list)]
+            shard_mq_message_list, commit_log_offset = shard_segment.get_message_list(
+                consumer, max_consume_time, message_count - len(mq_message_list)
+            )
+            if list_not_empty(shard_mq_message_list):
+                mq_message_list.extend(shard_mq_message_list)
+                shard_message_list.append((shard_mq_message_list, commit_log_offset))
+        return mq_message_list, shard_message_list
+
+    def _get_topic_consumer_group_list(self, message_topic, reload=False):
+        """
+        :param reload: 忽略缓存 重新从各个 Shard 读取
+        :return: Topic 的消费组名称列表 多进程模式下其他进程创建的消费组在缓存过期后生效
+        :rtype: list
+        """
+        current_time = time.time()
+        consumer_group_cache = self._topic_consumer_group_dict.get(message_topic, None)
+        if not reload and consumer_group_cache is not None and \
+                current_time - consumer_group_cache[0] < SQLITE_MQ_CONSUMER_GROUP_CACHE_SECONDS:
+            return consumer_group_cache[1]
+        consumer_group_set = set()
+        for shard_segment in self._get_topic_shard_segment_list(message_topic):
+            consumer_group_set.update(shard_segment.get_consumer_group_list())
+        consumer_group_list = sorted(consumer_group_set)
+        self._topic_consumer_group_dict[message_topic] = (current_time, consumer_group_list)
+        return consumer_group_list
+
+    def _check_topic_without_consumer_group(self, message_topic, operation_name):
+        """
+        存在消费组的 Topic 中 消息由保留策略在所有消费组提交后删除 不能再以普通的方式消费
+        """
+        consumer_group_list = self._get_topic_consumer_group_list(message_topic)
+        if list_not_empty(consumer_group_list):
+            raise Exception(
+                "[SimpleSQLiteMQBroker] Cannot %s of topic '%s' which has consumer groups %s, "
+                "use the consumer group methods instead" % (operation_name, message_topic, consumer_group_list)
+            )
+
+    def _get_consumer_group_shard_segment_list(self, message_topic, consumer_group):
+        """
+        :return: 消费组所在 Topic 所有 Shard 的 Segment 列表 消费组创建之后新增的 Shard 中 从最早的消息开始消费
+        :rtype: list
+        """
+        if str_is_blank(message_topic) or str_is_blank(consumer_group):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic and consumer_group cannot be blank")
+        if consumer_group not in self._get_topic_consumer_group_list(message_topic) and \
+                consumer_group not in self._get_topic_consumer_group_list(message_topic, reload=True):
+            raise Exception("[SimpleSQLiteMQBroker] Consumer group '%s' of topic '%s' does not exist" % (
+                consumer_group, message_topic))
+        shard_segment_list = self._get_topic_shard_segment_list(message_topic)
+        for shard_id, shard_segment in enumerate(shard_segment_list):
+            segment_consumer_group_key = (self._get_segment_key(message_topic, shard_id), consumer_group)
+            if segment_consumer_group_key not in self._consumer_group_segment_key_set:
+                shard_segment.create_consumer_group(consumer_group, False)
+                self._consumer_group_segment_key_set.add(segment_consumer_group_key)
+        return shard_segment_list
+
+    def _get_shard_group_message_list(self, message_topic, consumer_group, consumer, max_consume_time,
+                                      message_count):
+        """
+        从下一个 Shard 开始 依次从各个 Shard 读取 直到凑满 message_count 条消息
+        :return: MQ Message 列表 与 None (消费组的读取不生成 Commit Log 记录)
+        """
+        shard_segment_list = self._get_consumer_group_shard_segment_list(message_topic, consumer_group)
+        begin_index = next(self._get_topic_counter(self._topic_consume_counter_dict, message_topic))
+        mq_message_list = list()
+        for index in range(len(shard_segment_list)):
+            if len(mq_message_list) >= message_count:
+                break
+            shard_segment = shard_segment_list[(begin_index + index) % len(shard_segment_list)]
+            mq_message_list.extend(shard_segment.get_group_message_list(
+                consumer_group, consumer, max_consume_time, message_count - len(mq_message_list)
+            ))
+        return mq_message_list, None
+
+    def _handle_commit_log(self):
+        """
+        重放 Commit Log 中 Checkpoint 之后的记录 使 Ext Segment 与 Common Segment 保持一致
+        """
+        self._handle_legacy_commit_log_file()
+
+        commit_log_list = self._commit_log.read_from_checkpoint()
+        if list_is_empty(commit_log_list):
+            return
+        self._sync_mq_message_data_from_common_segment(commit_log_list)
+        self._commit_log.persist_checkpoint()
+        PLog.gets().info(
+            "[SimpleSQLiteMQBroker] Handle %s un-commit log done, checkpoint offset %s" % (
+                len(commit_log_list), self._commit_log.get_checkpoint_offset())
+        )
+
+    def _handle_legacy_commit_log_file(self):
+        """
+        旧版本每次操作生成一个 Commit Log File 升级后仍需处理遗留的文件
+        """
+        if not os.path.isdir(self._legacy_commit_path):
+            return
+        file_domain_list = FileDomain(self._legacy_commit_path).get_children_file_domain()
         if list_is_empty(file_domain_list):
             return
 
@@ -153,59 +631,244 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
                 continue
             try:
                 mq_message_dict = json_to_python_object(file_domain.get_file_content())
-                mq_message = MQMessage.from_dict(mq_message_dict)
                 operation_index = get_int_value(file_domain.file_name.split("_")[0])
-                bisect.insort(commit_log_list, CommitLog(
-                    commit_log_id=operation_index,
-                    commit_log_file=file_domain.file_absolute_path,
-                    mq_message=mq_message))
+                # 批量操作的 Commit Log File 中存放的是消息列表
+                if type(mq_message_dict) is list:
+                    commit_log = CommitLog(
+                        commit_log_id=operation_index,
+                        commit_log_file=file_domain.file_absolute_path,
+                        mq_message_list=[MQMessage.from_dict(element) for element in mq_message_dict])
+                else:
+                    commit_log = CommitLog(
+                        commit_log_id=operation_index,
+                        commit_log_file=file_domain.file_absolute_path,
+                        mq_message=MQMessage.from_dict(mq_message_dict))
+                bisect.insort(commit_log_list, commit_log)
             except Exception as e:
                 PLog.gets().warning(
                     "[SimpleSQLiteMQBroker] Exception when read no committed log file! Exception '%s'" % str(e))
         self._sync_mq_message_data_from_common_segment(commit_log_list)
         PLog.gets().info(
-            "[SimpleSQLiteMQBroker] Handle un-commit log file done")
+            "[SimpleSQLiteMQBroker] Handle legacy un-commit log file done")
 
-    def _sync_mq_message_data_from_common_segment(self, commit_log_list):
+    def _sync_mq_message_data_from_common_segment(self, commit_log_list, commit_log=None):
+        """
+        :param commit_log: 记录所属的 Commit Log 为 None 时为本进程的 Commit Log
+        :type commit_log: SimpleSQLiteMQCommitLog
+        """
         if list_is_empty(commit_log_list):
             return
+        commit_log = self._commit_log if commit_log is None else commit_log
+
+        for commit_log_record in commit_log_list:  # type: CommitLog
+            # 一条记录中的消息全部同步完成后 再统一标记完成
+            for commit_log_mq_message in commit_log_record.get_mq_message_list():
+                self._sync_mq_message_from_common_segment(commit_log_mq_message)
+            if commit_log_record.commit_log_file is not None:
+                FileDomain(commit_log_record.commit_log_file).delete()
+            else:
+                commit_log.commit(commit_log_record.commit_log_id)
 
-        for commit_log in commit_log_list:  # type: CommitLog
-            message_topic = commit_log.mq_message.message_topic
-            message_uuid = commit_log.mq_message.message_uuid
-            mq_message = self.fetch_message_by_uuid(message_topic, message_uuid)
-            if mq_message is None:
-                if commit_log.mq_message.message_status != MESSAGE_STATUS_DELETE and commit_log.mq_message.message_status != MESSAGE_STATUS_DONE:
-                    PLog.gets().warning(
-                        "[SimpleSQLiteMQBroker] Try to commit '%s', '%s', but cannot fetch message." % (
-                            message_topic, message_uuid))
-                self._ext_segment.delete_message_by_mq_message(commit_log.mq_message, commit_log.commit_log_file)
+    def _sync_mq_message_from_common_segment(self, commit_log_mq_message):
+        """
+        :type commit_log_mq_message: MQMessage
+        """
+        message_topic = commit_log_mq_message.message_topic
+        message_uuid = commit_log_mq_message.message_uuid
+        # 直接读取 Common Segment 中存储的内容 消息体无需解码再编码
+        mq_message = self._get_message_segment(message_topic, message_uuid).fetch_message_by_uuid(message_uuid)
+        if mq_message is None:
+            if commit_log_mq_message.message_status == MESSAGE_STATUS_DEAD_LETTER:
+                # 消息已经转入死信队列 由死信队列保存 不归档
+                self._ext_segment.delete_message_by_uuid(message_topic, message_uuid)
+            elif commit_log_mq_message.message_status != MESSAGE_STATUS_DELETE and commit_log_mq_message.message_status != MESSAGE_STATUS_DONE:
+                # 多进程模式下 Leader 同步时消息已经被其他进程消费完成是正常的
+                log_function = PLog.gets().warning if self._process_coordinator is None else PLog.gets().debug
+                log_function(
+                    "[SimpleSQLiteMQBroker] Try to commit '%s', '%s', but cannot fetch message." % (
+                        message_topic, message_uuid))
+                # 消息已经被消费完成或删除 由之后的 完成 / 删除 记录负责归档
+                self._ext_segment.delete_message_by_uuid(message_topic, message_uuid)
+            elif self._archiver_segment.fetch_message_by_uuid(message_uuid) is not None:
+                # Checkpoint 之后的记录可能已经同步过 重放时不重复归档
+                self._ext_segment.delete_message_by_uuid(message_topic, message_uuid)
             else:
-                mq_message.message_text = str_to_base64(mq_message.message_text)
-                ext_mq_message = self._ext_segment.fetch_message_by_uuid(mq_message.message_uuid)
-                if ext_mq_message is None:
-                    self._ext_segment.add_message(mq_message, commit_log.commit_log_file)
-                else:
-                    self._ext_segment.update_message(mq_message, commit_log.commit_log_file)
+                self._ext_segment.delete_message_by_mq_message(commit_log_mq_message, None)
+        else:
+            ext_mq_message = self._ext_segment.fetch_message_by_uuid(mq_message.message_uuid)
+            if ext_mq_message is None:
+                self._ext_segment.add_message(mq_message, None)
+            else:
+                self._ext_segment.update_message(mq_message, None)
+
+    def _notify_message_arrival(self, message_topic_list):
+        with self._message_arrival_condition:
+            self._message_arrival_version += 1
+            for message_topic in message_topic_list:
+                self._topic_arrival_version_dict[message_topic] = self._message_arrival_version
+            self._message_arrival_condition.notify_all()
+
+    def _notify_segment_message_arrival(self, segment_key_list):
+        """
+        恢复器以 Segment Key 区分各个 Shard 通知时转换为 Topic
+        """
+        self._notify_message_arrival([self._get_segment_key_topic(segment_key) for segment_key in segment_key_list])
+
+    def _notify_message_delayed(self, message_topic, visible_time):
+        """
+        添加了延迟消息 记录最早的可见时间 并唤醒等待的消费者重新计算等待时间
+        """
+        with self._message_arrival_condition:
+            next_visible_time = self._topic_next_visible_time_dict.get(message_topic, None)
+            if next_visible_time is None or visible_time < next_visible_time:
+                self._topic_next_visible_time_dict[message_topic] = visible_time
+                self._message_arrival_condition.notify_all()
+
+    def _update_next_visible_time(self, message_topic, message_topic_segment):
+        """
+        从 Segment 中查询下一条延迟消息的可见时间 沿优先级复合索引 每个优先级只读取一行
+        :type message_topic_segment: AbstractMQBrokerCommonSegment
+        """
+        next_visible_time = message_topic_segment.get_next_visible_time(get_current_timestamp())
+        if next_visible_time is not None:
+            self._notify_message_delayed(message_topic, next_visible_time)
 
-    @type_check(None, str, str, [str, NoneType])
-    def add_message(self, message_topic, message_text, producer=None):
+    @staticmethod
+    def _get_visible_time(deliver_at, deliver_after):
+        """
+        :param deliver_at: 消息可以被消费的时间戳 (秒)
+        :param deliver_after: 消息在多少秒之后可以被消费
+        :return: 消息可以被消费的时间戳 不是延迟消息时返回 None
+        """
+        if deliver_at is not None and deliver_after is not None:
+            raise Exception("[SimpleSQLiteMQBroker] deliver_at and deliver_after cannot be both specified")
+        if deliver_at is not None:
+            # 向上取整 延迟消息不会早于指定的时间被消费
+            return int(math.ceil(deliver_at))
+        if deliver_after is not None:
+            if deliver_after < 0:
+                raise Exception("[SimpleSQLiteMQBroker] deliver_after should not be negative")
+            return int(math.ceil(time.time() + deliver_after))
+        return None
+
+    def _notify_message_added(self, message_topic, visible_time):
+        if visible_time > get_current_timestamp():
+            self._notify_message_delayed(message_topic, visible_time)
+        else:
+            self._notify_message_arrival([message_topic])
+
+    def get_message_arrival_version(self):
+        """
+        :return: 当前的消息到达版本号 配合 wait_message_arrival 使用
+        :rtype: int
+        """
+        with self._message_arrival_condition:
+            return self._message_arrival_version
+
+    @type_check(None, list, int, [int, float])
+    def wait_message_arrival(self, message_topic_list, arrival_version, wait_timeout):
+        """
+        等待 message_topic_list 中任意一个 Topic 在 arrival_version 之后有新消息到达
+        先获取版本号 再尝试获取消息 没有消息时再等待 这样不会错过两者之间到达的消息
+        延迟消息到达可见时间时 同样视为新消息到达
+        :param message_topic_list: 等待的 Topic 列表 每次被唤醒时重新检查 等待期间追加到列表中的 Topic 同样生效
+        :param arrival_version: get_message_arrival_version 返回的版本号
+        :param wait_timeout: 最多等待的秒数
+        :return: 是否有新消息到达
+        :rtype: bool
+        """
+        deadline = time.time() + wait_timeout
+        visible_message_topic = None
+        with self._message_arrival_condition:
+            while visible_message_topic is None:
+                for message_topic in message_topic_list:
+                    if self._topic_arrival_version_dict.get(message_topic, 0) > arrival_version:
+                        return True
+                current_time = time.time()
+                wait_seconds = deadline - current_time
+                for message_topic in message_topic_list:
+                    next_visible_time = self._topic_next_visible_time_dict.get(message_topic, None)
+                    if next_visible_time is None:
+                        continue
+                    if next_visible_time <= current_time:
+                        self._topic_next_visible_time_dict.pop(message_topic)
+                        visible_message_topic = message_topic
+                        break
+                    # 最多等待到最早一条延迟消息可见
+                    wait_seconds = min(wait_seconds, next_visible_time - current_time)
+                if visible_message_topic is None:
+                    if deadline - current_time <= 0:
+                        return False
+                    self._message_arrival_condition.wait(wait_seconds)
+
+        # 查询该 Topic 各个 Shard 的下一条延迟消息
+        for message_topic_segment in self._get_topic_shard_segment_list(visible_message_topic):
+            self._update_next_visible_time(visible_message_topic, message_topic_segment)
+        return True
+
+    def _wait_message(self, message_topic, wait_timeout, get_message_function, *args):
+        """
+        从 Segment 获取消息 没有消息时等待新消息到达后重试 直到超时
+        :return: get_message_function 的返回值
+        """
+        deadline = time.time() + (0 if wait_timeout is None else wait_timeout)
+        while True:
+            arrival_version = self.get_message_arrival_version()
+            mq_message, commit_log_offset = get_message_function(*args)
+            # 批量获取时返回的是 MQ Message 列表
+            message_exist_bool = list_not_empty(mq_message) if type(mq_message) is list else mq_message is not None
+            if message_exist_bool:
+                return mq_message, commit_log_offset
+            remaining_seconds = deadline - time.time()
+            if remaining_seconds <= 0:
+                return mq_message, commit_log_offset
+            # 多进程模式下 其他进程添加的消息不会通知本进程 定期重新查询
+            wait_seconds = remaining_seconds if self._process_coordinator is None \
+                else min(remaining_seconds, SQLITE_MQ_PROCESS_POLL_SECONDS)
+            if not self.wait_message_arrival([message_topic], arrival_version, wait_seconds) and \
+                    wait_seconds >= remaining_seconds:
+                return mq_message, commit_log_offset
+
+    @type_check(None, str, str, [str, NoneType], [int, float, NoneType], [int, float, NoneType], int,
+                [str, NoneType])
+    def add_message(self, message_topic, message_text, producer=None, deliver_at=None, deliver_after=None,
+                    priority=MESSAGE_PRIORITY_DEFAULT, idempotency_key=None):
+        """
+        :param deliver_at: 延迟消息 消息可以被消费的时间戳 (秒)
+        :param deliver_after: 延迟消息 消息在多少秒之后可以被消费 与 deliver_at 只能指定一个
+        :param priority: 消息的优先级 数值越大越先被消费 同一优先级内按可见时间先后消费
+        :param idempotency_key: 生产者幂等键 超时重试时使用相同的值 去重窗口内重复发布不会写入新消息 直接返回原消息
+        """
         if str_is_blank(message_topic):
             raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when add message")
-        message_topic_segment = self._get_topic_segment(message_topic)
+        message_topic_segment = self._get_producer_shard_segment(message_topic, idempotency_key)
 
         # Producer 使用 Broker IP 作为补缺
         if str_is_blank(producer):
             producer = get_local_host_ip()
 
-        # 消息体按照 Base64 进行存储 防止 SQLite 乱码 或 无法处理
-        new_message_text = str_to_base64(message_text)
+        # 消息体按照存储方式编码 Base64 文本 或 二进制 BLOB (可能压缩)
+        new_message_text, message_encoding = self._message_codec.encode(message_text)
+
+        mq_message, commit_log_offset = message_topic_segment.add_message(
+            new_message_text, producer, message_encoding, self._get_visible_time(deliver_at, deliver_after), priority,
+            idempotency_key
+        )
+        if commit_log_offset is None:
+            # 重复发布 没有写入消息 也没有 Commit Log 无需同步至 Ext Segment 返回原消息的消息体与当前状态
+            self.base64_message_text_to_str(mq_message)
+            PLog.gets().info(
+                "[SimpleSQLiteMQBroker] Duplicate message topic: %s, idempotency key: %s, return original uuid: %s" % (
+                    message_topic, idempotency_key, mq_message.message_uuid)
+            )
+            return mq_message
 
-        mq_message, log_file_name = message_topic_segment.add_message(new_message_text, producer)
         # 添加数据同步至 Ext Segment 任务
-        self._order_log_executor.submit(self._ext_segment.add_message, mq_message.copy(), log_file_name)
+        self._ext_synchronizer.submit(EXT_SYNC_OPERATION_ADD, mq_message.copy(), commit_log_offset)
+        self._notify_message_added(message_topic, mq_message.visible_time)
+        self._increase_metric(SQLITE_MQ_METRIC_ENQUEUE, message_topic, 1)
 
-        # 覆盖 Base64 的 Message Text
+        # 覆盖编码后的 Message Text
         mq_message.message_text = message_text
         if PLog.log_level_is_debug():
             PLog.gets().info(
@@ -219,20 +882,89 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
             )
         return mq_message
 
-    @type_check(None, str, [str, None], [int, NoneType])
-    def get_message(self, message_topic, consumer=None, max_consume_time=3600):
+    @type_check(None, str, list, [str, NoneType], [int, float, NoneType], [int, float, NoneType], int)
+    def add_messages(self, message_topic, message_text_list, producer=None, deliver_at=None, deliver_after=None,
+                     priority=MESSAGE_PRIORITY_DEFAULT):
+        """
+        批量添加消息 整批消息使用一个事务写入 Common Segment
+        同时只生成一个 Commit Log File 以及一个 Ext Segment 同步任务
+        :param message_topic: 消息主题
+        :param message_text_list: 消息内容列表
+        :param producer: 消息生产者
+        :param deliver_at: 延迟消息 整批消息可以被消费的时间戳 (秒)
+        :param deliver_after: 延迟消息 整批消息在多少秒之后可以被消费 与 deliver_at 只能指定一个
+        :param priority: 整批消息的优先级 数值越大越先被消费
+        :return: 与 message_text_list 顺序一致的 MQ Message 列表
+        """
+        if str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when add messages")
+        if list_is_empty(message_text_list):
+            return list()
+        for message_text in message_text_list:
+            if type(message_text) is not str and not object_type_is_unicode(message_text):
+                raise Exception(
+                    "[SimpleSQLiteMQBroker] message_text should be str instead of '%s' when add messages" % type(
+                        message_text)
+                )
+        # 整批消息写入同一个 Shard 仍然只使用一个事务
+        message_topic_segment = self._get_producer_shard_segment(message_topic)
+
+        # Producer 使用 Broker IP 作为补缺
+        if str_is_blank(producer):
+            producer = get_local_host_ip()
+
+        # 消息体按照存储方式编码 Base64 文本 或 二进制 BLOB (可能压缩)
+        new_message_text_list = list()
+        message_encoding_list = list()
+        for message_text in message_text_list:
+            new_message_text, message_encoding = self._message_codec.encode(message_text)
+            new_message_text_list.append(new_message_text)
+            message_encoding_list.append(message_encoding)
+
+        mq_message_list, commit_log_offset = message_topic_segment.add_message_list(
+            new_message_text_list, producer, message_encoding_list, self._get_visible_time(deliver_at, deliver_after),
+            priority
+        )
+        # 整批消息 只添加一个数据同步至 Ext Segment 任务
+        self._ext_synchronizer.submit(
+            EXT_SYNC_OPERATION_ADD, [mq_message.copy() for mq_message in mq_message_list], commit_log_offset
+        )
+        self._notify_message_added(message_topic, mq_message_list[0].visible_time)
+        self._increase_metric(SQLITE_MQ_METRIC_ENQUEUE, message_topic, len(mq_message_list))
+
+        # 覆盖编码后的 Message Text
+        for index, mq_message in enumerate(mq_message_list):
+            mq_message.message_text = message_text_list[index]
+        PLog.gets().info(
+            "[SimpleSQLiteMQBroker] Add %s messages topic: %s, uuid: %s ~ %s successfully" % (
+                len(mq_message_list), message_topic, mq_message_list[0].message_uuid,
+                mq_message_list[-1].message_uuid)
+        )
+        return mq_message_list
+
+    @type_check(None, str, [str, NoneType], [int, NoneType], [int, float, NoneType])
+    def get_message(self, message_topic, consumer=None, max_consume_time=3600, wait_timeout=0):
+        """
+        :param wait_timeout: 没有可消费的消息时 最多等待新消息到达的秒数 0 表示不等待
+        """
         if str_is_blank(message_topic):
             raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when get message")
+        self._check_topic_without_consumer_group(message_topic, "get message")
         if str_is_blank(consumer):
             consumer = ""
         max_consume_time = get_int_value(max_consume_time)
 
-        message_topic_segment = self._get_topic_segment(message_topic)
-        mq_message, log_file_name = message_topic_segment.get_message(consumer, max_consume_time)
+        mq_message, commit_log_offset = self._wait_message(
+            message_topic, wait_timeout, self._get_shard_message, message_topic, consumer, max_consume_time
+        )
 
         if mq_message is not None:
-            self._order_log_executor.submit(self._ext_segment.update_message, mq_message.copy(), log_file_name)
+            self._ext_synchronizer.submit(EXT_SYNC_OPERATION_UPDATE, mq_message.copy(), commit_log_offset)
+            self._message_recoverer.notify_expire_time(
+                self._get_message_segment_key(mq_message), mq_message.expire_time
+            )
             self.base64_message_text_to_str(mq_message)
+            self._increase_metric(SQLITE_MQ_METRIC_DEQUEUE, message_topic, 1)
             PLog.gets().info(
                 "[SimpleSQLiteMQBroker] Get message topic: %s, uuid: %s successfully" % (
                     message_topic, mq_message.message_uuid)
@@ -240,33 +972,129 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
 
         return mq_message
 
+    @type_check(None, str, int, [str, NoneType], [int, NoneType], [int, float, NoneType])
+    def get_messages(self, message_topic, message_count, consumer=None, max_consume_time=3600, wait_timeout=0):
+        """
+        批量获取消息 在一个事务中锁定至多 message_count 条消息 整批消息共享同一个过期时间
+        同时只生成一个 Commit Log 记录 以及一个 Ext Segment 同步操作
+        :param message_topic: 消息主题
+        :param message_count: 最多获取的消息数量
+        :param consumer: 消息对应的消费者
+        :param max_consume_time: 最大消费时间
+        :param wait_timeout: 没有可消费的消息时 最多等待新消息到达的秒数 0 表示不等待
+        :return: MQ Message 列表 没有消息时返回空列表
+        """
+        if str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when get messages")
+        if message_count <= 0:
+            raise Exception("[SimpleSQLiteMQBroker] message_count should be positive when get messages")
+        self._check_topic_without_consumer_group(message_topic, "get messages")
+        if str_is_blank(consumer):
+            consumer = ""
+        max_consume_time = get_int_value(max_consume_time)
+
+        mq_message_list, shard_message_list = self._wait_message(
+            message_topic, wait_timeout, self._get_shard_message_list, message_topic, consumer, max_consume_time,
+            message_count
+        )
+
+        if list_not_empty(mq_message_list):
+            # 每个 Shard 各自一个事务 各自一个 Commit Log 记录
+            for shard_mq_message_list, commit_log_offset in shard_message_list:
+                self._ext_synchronizer.submit(
+                    EXT_SYNC_OPERATION_UPDATE, [mq_message.copy() for mq_message in shard_mq_message_list],
+                    commit_log_offset
+                )
+                # 整批消息共享同一个过期时间
+                self._message_recoverer.notify_expire_time(
+                    self._get_message_segment_key(shard_mq_message_list[0]), shard_mq_message_list[0].expire_time
+                )
+            for mq_message in mq_message_list:
+                self.base64_message_text_to_str(mq_message)
+            self._increase_metric(SQLITE_MQ_METRIC_DEQUEUE, message_topic, len(mq_message_list))
+            PLog.gets().info(
+                "[SimpleSQLiteMQBroker] Get %s messages topic: %s, uuid: %s ~ %s successfully" % (
+                    len(mq_message_list), message_topic, mq_message_list[0].message_uuid,
+                    mq_message_list[-1].message_uuid)
+            )
+
+        return mq_message_list
+
     @type_check(None, str, str, [int, NoneType])
     def hold_message(self, message_topic, message_uuid, hold_consume_time=6000):
         if str_is_blank(message_topic):
             raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when hold message")
         hold_consume_time = 6000 if get_int_value(hold_consume_time) == 0 else hold_consume_time
 
-        message_topic_segment = self._get_topic_segment(message_topic)
-        mq_message, log_file_name = message_topic_segment.hold_message(message_uuid, hold_consume_time)
+        message_topic_segment = self._get_message_segment(message_topic, message_uuid)
+        mq_message, commit_log_offset = message_topic_segment.hold_message(message_uuid, hold_consume_time)
 
         if mq_message is not None:
-            self._order_log_executor.submit(self._ext_segment.update_message, mq_message, log_file_name)
+            self._ext_synchronizer.submit(EXT_SYNC_OPERATION_UPDATE, mq_message, commit_log_offset)
+            self._message_recoverer.notify_expire_time(
+                self._get_message_segment_key(mq_message), mq_message.expire_time
+            )
             self.base64_message_text_to_str(mq_message)
             PLog.gets().debug(
                 "[SimpleSQLiteMQBroker] Hold message topic: %s, uuid: %s successfully" % (message_topic, message_uuid)
             )
         return mq_message
 
+    @type_check(None, str, list, [int, NoneType])
+    def hold_messages(self, message_topic, message_uuid_list, hold_consume_time=6000):
+        """
+        批量保持消息 整批消息使用一个事务延长过期时间 同时只生成一个 Commit Log 记录 以及一个 Ext Segment 同步操作
+        已经不在消费中的消息会被跳过
+        :param message_topic: 消息主题
+        :param message_uuid_list: 消息的 UUID 列表
+        :param hold_consume_time: 在当前时间的基础上 延长的消费时间
+        :return: 成功 Hold 的 MQ Message 列表
+        """
+        if str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when hold messages")
+        hold_consume_time = 6000 if get_int_value(hold_consume_time) == 0 else hold_consume_time
+
+        # 按 UUID 中的 Shard 编号分组 每个 Shard 一个事务
+        shard_uuid_list_dict = dict()
+        for message_uuid in message_uuid_list:
+            shard_uuid_list_dict.setdefault(self._get_message_shard_id(message_uuid), list()).append(message_uuid)
+
+        mq_message_list = list()
+        for shard_id in sorted(shard_uuid_list_dict.keys()):
+            message_topic_segment = self._get_message_segment(message_topic, shard_uuid_list_dict[shard_id][0])
+            shard_mq_message_list, commit_log_offset = message_topic_segment.hold_message_list(
+                shard_uuid_list_dict[shard_id], hold_consume_time
+            )
+            if list_not_empty(shard_mq_message_list):
+                self._ext_synchronizer.submit(
+                    EXT_SYNC_OPERATION_UPDATE, [mq_message.copy() for mq_message in shard_mq_message_list],
+                    commit_log_offset
+                )
+                mq_message_list.extend(shard_mq_message_list)
+
+        if list_not_empty(mq_message_list):
+            for mq_message in mq_message_list:
+                self._message_recoverer.notify_expire_time(
+                    self._get_message_segment_key(mq_message), mq_message.expire_time
+                )
+                self.base64_message_text_to_str(mq_message)
+            PLog.gets().debug(
+                "[SimpleSQLiteMQBroker] Hold %s of %s messages topic: %s successfully" % (
+                    len(mq_message_list), len(message_uuid_list), message_topic)
+            )
+        return mq_message_list
+
     @type_check(None, str, str)
     def commit_message(self, message_topic, message_uuid):
         if str_is_blank(message_topic):
             raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when commit message")
+        self._check_topic_without_consumer_group(message_topic, "commit message")
 
-        message_topic_segment = self._get_topic_segment(message_topic)
-        mq_message, log_file_name = message_topic_segment.commit_message(message_uuid)
+        message_topic_segment = self._get_message_segment(message_topic, message_uuid)
+        mq_message, commit_log_offset = message_topic_segment.commit_message(message_uuid)
 
-        self._order_log_executor.submit(self._ext_segment.delete_message_by_mq_message, mq_message.copy(),
-                                        log_file_name)
+        self._ext_synchronizer.submit(EXT_SYNC_OPERATION_DELETE, mq_message.copy(), commit_log_offset)
+        self._increase_metric(SQLITE_MQ_METRIC_COMMIT, message_topic, 1)
 
         PLog.gets().info(
             "[SimpleSQLiteMQBroker] Commit message topic:%s, id:%s successfully" % (message_topic, message_uuid))
@@ -281,39 +1109,111 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
         if is_archiver_read:
             self._archiver_segment.delete_message_by_uuid(message_topic, message_uuid)
             return
+        self._check_topic_without_consumer_group(message_topic, "delete message")
 
-        message_topic_segment = self._get_topic_segment(message_topic)
-        mq_message, log_file_name = message_topic_segment.delete_message(message_uuid)
+        message_topic_segment = self._get_message_segment(message_topic, message_uuid)
+        mq_message, commit_log_offset = message_topic_segment.delete_message(message_uuid)
 
-        self._order_log_executor.submit(self._ext_segment.delete_message_by_mq_message, mq_message.copy(),
-                                        log_file_name)
+        self._ext_synchronizer.submit(EXT_SYNC_OPERATION_DELETE, mq_message.copy(), commit_log_offset)
 
         PLog.gets().info(
             "[SimpleSQLiteMQBroker] Delete message topic: %s, uuid: %s successfully" % (message_topic, message_uuid))
         self.base64_message_text_to_str(mq_message)
         return mq_message
 
-    @type_check(None, str, [int, NoneType], [int, NoneType], [NoneType, bool])
-    def scan_message(self, message_topic=None, every_page_quantity=10, page_number=1, is_archiver_read=False):
+    @staticmethod
+    def _encode_continuation_token(scan_source, continuation_key):
+        """
+        把下一页的位置编码为不透明的 Token 调用方只需要原样传回
+        :param scan_source: 检索来源 Ext Segment / Archiver / 死信队列
+        """
+        if continuation_key is None:
+            return None
+        return base64.urlsafe_b64encode("%s:%s:%s" % (
+            SCAN_CONTINUATION_TOKEN_VERSION, scan_source, ":".join([str(element) for element in continuation_key])))
+
+    @staticmethod
+    def _decode_continuation_token(scan_source, continuation_token):
+        """
+        :return: Ext Segment 与死信队列为 (update_time, rowid)
+            Archiver 为 (分区 end_time, 分区 start_time, update_time, rowid)
+        :rtype: tuple
+        """
+        try:
+            token_element_list = base64.urlsafe_b64decode(continuation_token).split(":")
+            token_version = int(token_element_list[0])
+            token_scan_source = int(token_element_list[1])
+            continuation_key = tuple([int(element) for element in token_element_list[2:]])
+        except Exception:
+            raise Exception("[SimpleSQLiteMQBroker] Invalid continuation token '%s'" % continuation_token)
+        if len(continuation_key) != (4 if token_scan_source == SCAN_SOURCE_ARCHIVER else 2):
+            raise Exception("[SimpleSQLiteMQBroker] Invalid continuation token '%s'" % continuation_token)
+        if token_version != SCAN_CONTINUATION_TOKEN_VERSION:
+            raise Exception("[SimpleSQLiteMQBroker] Unsupported continuation token version %s" % token_version)
+        # Ext Segment Archiver 与死信队列的 rowid 相互独立 Token 不能混用
+        if token_scan_source != scan_source:
+            raise Exception("[SimpleSQLiteMQBroker] Continuation token does not belong to %s" % {
+                SCAN_SOURCE_EXT: "ext segment", SCAN_SOURCE_ARCHIVER: "archiver",
+                SCAN_SOURCE_DEAD_LETTER: "dead letter queue"}[scan_source])
+        return continuation_key
+
+    @type_check(None, [str, NoneType], [int, NoneType], [int, NoneType], [NoneType, bool], [int, NoneType],
+                [int, NoneType], [int, NoneType], [str, NoneType], [NoneType, bool])
+    def scan_message(self, message_topic=None, every_page_quantity=10, page_number=1, is_archiver_read=False,
+                     message_status=None, begin_time=None, end_time=None, continuation_token=None,
+                     is_dead_letter_read=False):
+        """
+        按更新时间倒序检索消息 Topic / 消息状态 / 更新时间范围 可以任意组合筛选
+        翻页时传入上一页返回的 continuation_token 沿索引从上一页的末尾继续 耗时与页的深度无关
+        :param page_number: 从 1 开始的页码 需要跳过前面所有的消息 只适合较浅的页 翻页请使用 continuation_token
+        :param begin_time: 更新时间范围的起始 (包含)
+        :param end_time: 更新时间范围的结束 (不包含)
+        :param continuation_token: 上一页返回的 Token 筛选条件需要与上一页保持一致
+        :param is_dead_letter_read: 检索指定 Topic 的死信队列 需要指定 message_topic
+        :return: 消息列表 与 下一页的 continuation_token 已经没有更多消息时为 None
+        :rtype: (list, str)
+        """
         every_page_quantity = 10 if get_int_value(every_page_quantity) == 0 else every_page_quantity
         page_number = 1 if get_int_value(page_number) == 0 else page_number
         page_number = get_int_value(page_number) - 1
 
-        # 读取 Ext Segment 或者读取已经归档的数据
-        if is_archiver_read:
-            mq_message_list = self._archiver_segment.scan_message(message_topic, every_page_quantity, page_number)
+        if is_archiver_read and is_dead_letter_read:
+            raise Exception("[SimpleSQLiteMQBroker] is_archiver_read and is_dead_letter_read cannot be both True")
+        if is_dead_letter_read and str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when scan dead letter queue")
+        scan_source = SCAN_SOURCE_ARCHIVER if is_archiver_read else (
+            SCAN_SOURCE_DEAD_LETTER if is_dead_letter_read else SCAN_SOURCE_EXT)
+
+        continuation_key = None
+        if str_not_blank(continuation_token):
+            continuation_key = self._decode_continuation_token(scan_source, continuation_token)
+
+        # 读取 Ext Segment 死信队列 或者读取已经归档的数据
+        if is_dead_letter_read:
+            scan_segment = self._dead_letter_queue  # type: SimpleSQLiteMQDeadLetterQueue
+        elif is_archiver_read:
+            scan_segment = self._archiver_segment  # type: SimpleSQLiteMQArchiver
+            # 多进程模式下 分区由 Leader 创建与删除
+            if self._process_coordinator is not None:
+                self._archiver_segment.reload_partition()
         else:
-            mq_message_list = self._ext_segment.scan_message(message_topic, every_page_quantity, page_number)
+            scan_segment = self._ext_segment  # type: AbstractMQBrokerExtSegment
+        mq_message_list, next_continuation_key = scan_segment.scan_message(
+            message_topic, every_page_quantity, page_number, message_status, begin_time, end_time, continuation_key
+        )
 
         if list_not_empty(mq_message_list):
             for mq_message in mq_message_list:
                 self.base64_message_text_to_str(mq_message)
-        return mq_message_list
+        return mq_message_list, self._encode_continuation_token(scan_source, next_continuation_key)
 
     @type_check(None, str, str)
     def fetch_message_by_uuid(self, message_topic, message_uuid):
-        message_topic_segment = self._get_topic_segment(message_topic)
+        message_topic_segment = self._get_message_segment(message_topic, message_uuid)
         mq_message = message_topic_segment.fetch_message_by_uuid(message_uuid)
+        if mq_message is None:
+            # 达到消费失败次数上限的消息 已经转入死信队列
+            mq_message = self._dead_letter_queue.fetch_message_by_uuid(message_topic, message_uuid)
         self.base64_message_text_to_str(mq_message)
         return mq_message
 
@@ -321,21 +1221,39 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
     def consume_failed(self, message_topic, message_uuid, max_failed_times, retry_times_interval=300):
         if str_is_blank(message_topic):
             raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when dealing failed message")
+        self._check_topic_without_consumer_group(message_topic, "dealing failed message")
         if get_int_value(retry_times_interval) == 0:
             retry_times_interval = 300
 
-        message_topic_segment = self._get_topic_segment(message_topic)
-        mq_message, log_file_name = message_topic_segment.consume_failed(message_uuid, max_failed_times,
+        message_topic_segment = self._get_message_segment(message_topic, message_uuid)
+        mq_message, commit_log_offset = message_topic_segment.consume_failed(message_uuid, max_failed_times,
                                                                          retry_times_interval)
-        self._order_log_executor.submit(self._ext_segment.update_message, mq_message, log_file_name)
+        self._ext_synchronizer.submit(EXT_SYNC_OPERATION_UPDATE, mq_message.copy(), commit_log_offset)
+        self._increase_metric(SQLITE_MQ_METRIC_FAILED, message_topic, 1)
+        if mq_message.message_status == MESSAGE_STATUS_FAILED:
+            # 消费失败的消息 在过期时间到达后恢复重试
+            self._message_recoverer.notify_expire_time(
+                self._get_message_segment_key(mq_message), mq_message.expire_time
+            )
+        elif mq_message.message_status == MESSAGE_STATUS_PENDING and self._dead_letter_enabled:
+            # 挂起的消息转入死信队列 转移失败时由定期清理重试 不影响本次调用的结果
+            try:
+                if self._move_to_dead_letter(message_topic, message_topic_segment, [mq_message]) > 0:
+                    mq_message.message_status = MESSAGE_STATUS_DEAD_LETTER
+            except Exception as e:
+                PLog.gets().error(
+                    "[SimpleSQLiteMQBroker] Move message topic: %s, uuid: %s to dead letter queue failed, "
+                    "will retry later. Exception '%s'" % (message_topic, message_uuid, str(e))
+                )
 
         if mq_message.failed_times >= max_failed_times:
             PLog.gets().info(
                 "[SimpleSQLiteMQBroker] Failed to consume message topic: %s, uuid: %s, "
-                "maximum number of retry times: %s, pending message..." % (
+                "maximum number of retry times: %s, %s message..." % (
                     message_topic,
                     message_uuid,
-                    max_failed_times
+                    max_failed_times,
+                    "dead letter" if mq_message.message_status == MESSAGE_STATUS_DEAD_LETTER else "pending"
                 )
             )
         else:
@@ -350,34 +1268,370 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
         self.base64_message_text_to_str(mq_message)
         return mq_message
 
-    def _recover_message(self):
-        mq_message_list = self._ext_segment.get_recover_message()
-        if list_is_empty(mq_message_list):
-            return
+    def _move_to_dead_letter(self, message_topic, message_topic_segment, mq_message_list):
+        """
+        先写入死信队列 再从 Common Segment 删除 中途中断时消息仍然挂起在 Common Segment 中 由定期清理再次转移
+        再次写入死信队列时覆盖相同 UUID 的消息 不会重复
+        :param mq_message_list: 挂起的 MQ Message 列表 消息体为存储的原始内容
+        :type message_topic_segment: AbstractMQBrokerCommonSegment
+        :return: 转入死信队列的消息数量
+        :rtype: int
+        """
+        current_timestamp = get_current_timestamp()
+        dead_letter_message_list = list()
+        for mq_message in mq_message_list:
+            dead_letter_message = mq_message.copy()
+            dead_letter_message.message_status = MESSAGE_STATUS_DEAD_LETTER
+            dead_letter_message.update_time = current_timestamp
+            dead_letter_message_list.append(dead_letter_message)
+        self._dead_letter_queue.add_message_list(message_topic, dead_letter_message_list)
+
+        message_uuid_list = [mq_message.message_uuid for mq_message in mq_message_list]
+        deleted_message_list, commit_log_offset = message_topic_segment.delete_dead_letter_message_list(
+            message_uuid_list
+        )
+        if list_not_empty(deleted_message_list):
+            self._ext_synchronizer.submit(EXT_SYNC_OPERATION_DELETE, deleted_message_list, commit_log_offset)
+
+        # 写入死信队列之后 状态已经被修改的消息 (例如被重新锁定) 仍然留在 Common Segment 中 从死信队列撤回
+        deleted_uuid_set = set([mq_message.message_uuid for mq_message in deleted_message_list])
+        withdraw_uuid_list = [
+            message_uuid for message_uuid in message_uuid_list
+            if message_uuid not in deleted_uuid_set and message_topic_segment.fetch_message_by_uuid(
+                message_uuid) is not None
+        ]
+        self._dead_letter_queue.delete_message_list(message_topic, withdraw_uuid_list)
+
+        self._dead_letter_queue.record_dead_letter(len(deleted_message_list))
+        if list_not_empty(deleted_message_list):
+            PLog.gets().info("[SimpleSQLiteMQBroker] Move %s messages topic: %s to dead letter queue" % (
+                len(deleted_message_list), message_topic))
+        return len(deleted_message_list)
+
+    def sweep_dead_letter_messages(self, batch_size=SQLITE_MQ_DEAD_LETTER_BATCH_SIZE):
+        """
+        分批将所有 Common Segment 中挂起的消息转入死信队列 每批一个事务 批次之间释放 Segment 的锁
+        :return: 转入死信队列的消息数量
+        :rtype: int
+        """
+        total_dead_letter_count = 0
+        for segment_key in self._get_segment_file_key_list():
+            message_topic = self._get_segment_key_topic(segment_key)
+            message_topic_segment = self._get_segment_by_segment_key(segment_key)  # type: AbstractMQBrokerCommonSegment
+            try:
+                while True:
+                    pending_message_list = message_topic_segment.scan_pending_message_list(batch_size)
+                    if list_is_empty(pending_message_list):
+                        break
+                    dead_letter_count = self._move_to_dead_letter(
+                        message_topic, message_topic_segment, pending_message_list
+                    )
+                    total_dead_letter_count += dead_letter_count
+                    if len(pending_message_list) < batch_size or dead_letter_count == 0:
+                        break
+            except Exception as e:
+                PLog.gets().error(
+                    "[SimpleSQLiteMQBroker] Sweep dead letter messages of segment '%s' failed. Exception '%s'" % (
+                        segment_key, str(e))
+                )
+        return total_dead_letter_count
 
-        # 统计 都有哪些消息需要恢复
-        total_recover_message_uuid_list = list()
-        recover_message_dict = dict()
-        for mq_message in mq_message_list:  # type: MQMessage
-            message_topic = mq_message.message_topic
-            recover_message_uuid_list = recover_message_dict.get(message_topic, None)
-            if recover_message_uuid_list is None:
-                recover_message_uuid_list = list()
-                recover_message_dict[message_topic] = recover_message_uuid_list
-            recover_message_uuid_list.append(mq_message.message_uuid)
-            total_recover_message_uuid_list.append(mq_message.message_uuid)
-
-        # 用每个 Segment 每个进行恢复
-        recover_message_thread_list = list()
-        for message_topic, message_uuid_list in recover_message_dict.items():
-            message_topic_segment = self._get_topic_segment(message_topic)
-            recover_message_thread_list.append(async_execute(message_topic_segment.recover_message, message_uuid_list))
-
-        for task in recover_message_thread_list:
-            task.result()
-
-        # 最后恢复 Ext 状态
-        self._ext_segment.do_recover_message_status(total_recover_message_uuid_list)
+    @type_check(None, str, None, [int, NoneType], int)
+    def redrive(self, message_topic, message_filter=None, limit=None, batch_size=SQLITE_MQ_DEAD_LETTER_BATCH_SIZE):
+        """
+        将死信队列中的消息按进入死信队列的先后顺序移回 Common Segment 重新消费
+        每批消息写入各个 Shard 各自一个事务 再在一个事务中从死信队列删除
+        移回的消息保留原有的 UUID 立即可见 失败次数清零 中途中断后再次调用 已经移回的消息不会重复写入
+        :param message_filter: 接收 MQ Message (消息体已经还原) 返回是否移回的函数 为 None 时移回所有消息
+        :param limit: 最多移回的消息数量 为 None 时不限制
+        :param batch_size: 每个事务中移回的消息数量
+        :return: 移回的消息数量 检查的消息数量 批次数量 耗时 以及每秒移回的消息数量
+        :rtype: dict
+        """
+        if str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when redrive messages")
+        if batch_size <= 0:
+            raise Exception("[SimpleSQLiteMQBroker] batch_size should be positive when redrive messages")
+        if limit is not None and limit < 0:
+            raise Exception("[SimpleSQLiteMQBroker] limit should not be negative when redrive messages")
+
+        begin_time = time.time()
+        redrive_count = 0
+        scan_count = 0
+        batch_count = 0
+        last_rowid = 0
+        while limit is None or redrive_count < limit:
+            dead_letter_message_list, last_rowid = self._dead_letter_queue.scan_message_by_rowid(
+                message_topic, last_rowid, batch_size
+            )
+            if list_is_empty(dead_letter_message_list):
+                break
+            scan_count += len(dead_letter_message_list)
+
+            # 按 UUID 中的 Shard 编号分组 移回消息原来所在的 Shard
+            shard_message_list_dict = dict()
+            batch_redrive_count = 0
+            for dead_letter_message in dead_letter_message_list:
+                if limit is not None and redrive_count + batch_redrive_count >= limit:
+                    break
+                if message_filter is not None:
+                    filter_message = dead_letter_message.copy()
+                    self.base64_message_text_to_str(filter_message)
+                    if not message_filter(filter_message):
+                        continue
+                shard_message_list_dict.setdefault(
+                    self._get_message_shard_id(dead_letter_message.message_uuid), list()
+                ).append(dead_letter_message)
+                batch_redrive_count += 1
+            if batch_redrive_count == 0:
+                continue
+
+            redrive_uuid_list = list()
+            for shard_id in sorted(shard_message_list_dict.keys()):
+                shard_message_list = shard_message_list_dict[shard_id]
+                message_topic_segment = self._get_message_segment(message_topic, shard_message_list[0].message_uuid)
+                redrive_message_list, commit_log_offset = message_topic_segment.redrive_message_list(
+                    shard_message_list
+                )
+                if list_not_empty(redrive_message_list):
+                    self._ext_synchronizer.submit(
+                        EXT_SYNC_OPERATION_ADD, [mq_message.copy() for mq_message in redrive_message_list],
+                        commit_log_offset
+                    )
+                redrive_uuid_list.extend([mq_message.message_uuid for mq_message in shard_message_list])
+            self._dead_letter_queue.delete_message_list(message_topic, redrive_uuid_list)
+            self._notify_message_arrival([message_topic])
+            redrive_count += len(redrive_uuid_list)
+            batch_count += 1
+
+        redrive_seconds = time.time() - begin_time
+        self._dead_letter_queue.record_redrive(message_topic, redrive_count, batch_count, redrive_seconds)
+        PLog.gets().info(
+            "[SimpleSQLiteMQBroker] Redrive %s of %s dead letter messages topic: %s in %.3f seconds" % (
+                redrive_count, scan_count, message_topic, redrive_seconds)
+        )
+        return {
+            "redrive_count": redrive_count,
+            "scan_count": scan_count,
+            "batch_count": batch_count,
+            "redrive_seconds": redrive_seconds,
+            "redrive_rate": 0.0 if redrive_seconds <= 0 else redrive_count / redrive_seconds,
+        }
+
+    @type_check(None, str, str, bool)
+    def create_consumer_group(self, message_topic, consumer_group, start_from_latest=False):
+        """
+        为 Topic 创建消费组 每个消费组独立消费 Topic 中的每一条消息 消息只写入一次 由各个消费组各自记录 Offset 与租约
+        存在消费组的 Topic 只能通过消费组消费 消息在所有消费组提交后由保留策略删除并归档
+        :param consumer_group: 消费组名称
+        :param start_from_latest: 为 True 时只消费创建之后发布的消息 否则从 Topic 中现存最早的消息开始消费
+        :return: 是否新创建 消费组已经存在时保留原有的 Offset
+        :rtype: bool
+        """
+        if str_is_blank(message_topic) or str_is_blank(consumer_group):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic and consumer_group cannot be blank when create "
+                            "consumer group")
+        created_bool = False
+        for shard_id, shard_segment in enumerate(self._get_topic_shard_segment_list(message_topic)):
+            created_bool = shard_segment.create_consumer_group(consumer_group, start_from_latest) or created_bool
+            self._consumer_group_segment_key_set.add((self._get_segment_key(message_topic, shard_id), consumer_group))
+        self._get_topic_consumer_group_list(message_topic, reload=True)
+        PLog.gets().info("[SimpleSQLiteMQBroker] Create consumer group '%s' of topic: %s, start from %s" % (
+            consumer_group, message_topic, "latest" if start_from_latest else "earliest"))
+        return created_bool
+
+    @type_check(None, str, str)
+    def delete_consumer_group(self, message_topic, consumer_group):
+        """
+        删除消费组 以及消费组的所有租约 其他消费组不受影响
+        删除最后一个消费组后 Topic 恢复为普通的消费方式 该消费组已经提交的消息会被删除并归档 不会再次被消费
+        :return: 消费组是否存在
+        :rtype: bool
+        """
+        if str_is_blank(message_topic) or str_is_blank(consumer_group):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic and consumer_group cannot be blank when delete "
+                            "consumer group")
+        exist_bool = consumer_group in self._get_topic_consumer_group_list(message_topic, reload=True)
+        for shard_id, shard_segment in enumerate(self._get_topic_shard_segment_list(message_topic)):
+            mq_message_list, commit_log_offset = shard_segment.delete_consumer_group(consumer_group)
+            if list_not_empty(mq_message_list):
+                self._ext_synchronizer.submit(EXT_SYNC_OPERATION_DELETE, mq_message_list, commit_log_offset)
+            self._consumer_group_segment_key_set.discard(
+                (self._get_segment_key(message_topic, shard_id), consumer_group))
+        self._get_topic_consumer_group_list(message_topic, reload=True)
+        PLog.gets().info("[SimpleSQLiteMQBroker] Delete consumer group '%s' of topic: %s" % (
+            consumer_group, message_topic))
+        return exist_bool
+
+    @type_check(None, str)
+    def get_consumer_groups(self, message_topic):
+        """
+        :return: 消费组名称 -> 各个 Shard 合计的 lag (committed_offset 之后尚未提交也未挂起的消息数量)
+            以及各个状态的租约数量 init 为等待投递的延迟消息与移回的消息 pending 为达到失败次数上限的消息
+        :rtype: dict
+        """
+        if str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when get consumer groups")
+        consumer_group_stats_dict = dict()
+        for shard_segment in self._get_topic_shard_segment_list(message_topic):
+            self._merge_consumer_group_stats(consumer_group_stats_dict, shard_segment.get_consumer_group_stats())
+        return consumer_group_stats_dict
+
+    @staticmethod
+    def _merge_consumer_group_stats(consumer_group_stats_dict, shard_consumer_group_stats_dict):
+        for consumer_group, shard_consumer_group_stats in shard_consumer_group_stats_dict.items():
+            consumer_group_stats = consumer_group_stats_dict.setdefault(consumer_group, dict(
+                [("lag", 0)] + [(MESSAGE_STATUS_NAME_DICT[message_status], 0)
+                                for message_status in CONSUMER_GROUP_LEASE_STATUS_LIST]
+            ))
+            for stats_key, count in shard_consumer_group_stats.items():
+                consumer_group_stats[stats_key] = consumer_group_stats.get(stats_key, 0) + count
+
+    @type_check(None, str, str, [str, NoneType], [int, NoneType], [int, float, NoneType])
+    def get_group_message(self, message_topic, consumer_group, consumer=None, max_consume_time=3600, wait_timeout=0):
+        """
+        消费组获取一条消息 各个消费组互不影响 同一个消费组内的消费者共同分担消息
+        :param wait_timeout: 没有可消费的消息时 最多等待新消息到达的秒数 0 表示不等待
+        """
+        mq_message_list = self.get_group_messages(
+            message_topic, consumer_group, 1, consumer, max_consume_time, wait_timeout
+        )
+        return mq_message_list[0] if list_not_empty(mq_message_list) else None
+
+    @type_check(None, str, str, int, [str, NoneType], [int, NoneType], [int, float, NoneType])
+    def get_group_messages(self, message_topic, consumer_group, message_count, consumer=None, max_consume_time=3600,
+                           wait_timeout=0):
+        """
+        消费组批量获取消息 每个 Shard 一个事务 只写入消费组的租约 不修改消息本身 也不生成 Commit Log 记录
+        消费组按发布顺序消费 不使用优先级 延迟消息在可见时间到达后投递
+        :param consumer_group: 消费组名称
+        :param message_count: 最多获取的消息数量
+        :param max_consume_time: 最大消费时间 租约过期后 消息会再次投递给该消费组
+        :param wait_timeout: 没有可消费的消息时 最多等待新消息到达的秒数 0 表示不等待
+        :return: MQ Message 列表 没有消息时返回空列表
+        """
+        if message_count <= 0:
+            raise Exception("[SimpleSQLiteMQBroker] message_count should be positive when get group messages")
+        if str_is_blank(consumer):
+            consumer = ""
+        max_consume_time = get_int_value(max_consume_time)
+
+        mq_message_list, _ = self._wait_message(
+            message_topic, wait_timeout, self._get_shard_group_message_list, message_topic, consumer_group, consumer,
+            max_consume_time, message_count
+        )
+
+        if list_not_empty(mq_message_list):
+            for mq_message in mq_message_list:
+                self.base64_message_text_to_str(mq_message)
+            self._increase_metric(SQLITE_MQ_METRIC_DEQUEUE, message_topic, len(mq_message_list))
+            PLog.gets().info(
+                "[SimpleSQLiteMQBroker] Get %s messages topic: %s, consumer group: %s, uuid: %s ~ %s successfully" % (
+                    len(mq_message_list), message_topic, consumer_group, mq_message_list[0].message_uuid,
+                    mq_message_list[-1].message_uuid)
+            )
+        return mq_message_list
+
+    @type_check(None, str, str, str, [int, NoneType])
+    def hold_group_message(self, message_topic, consumer_group, message_uuid, hold_consume_time=6000):
+        hold_consume_time = 6000 if get_int_value(hold_consume_time) == 0 else hold_consume_time
+        self._get_consumer_group_shard_segment_list(message_topic, consumer_group)
+        mq_message = self._get_message_segment(message_topic, message_uuid).hold_group_message(
+            consumer_group, message_uuid, hold_consume_time
+        )
+        self.base64_message_text_to_str(mq_message)
+        PLog.gets().debug("[SimpleSQLiteMQBroker] Hold message topic: %s, consumer group: %s, uuid: %s successfully" % (
+            message_topic, consumer_group, message_uuid))
+        return mq_message
+
+    @type_check(None, str, str, str)
+    def commit_group_message(self, message_topic, consumer_group, message_uuid):
+        """
+        消费组提交消息 其他消费组仍然可以消费这条消息
+        """
+        self._get_consumer_group_shard_segment_list(message_topic, consumer_group)
+        mq_message = self._get_message_segment(message_topic, message_uuid).commit_group_message(
+            consumer_group, message_uuid
+        )
+        self._increase_metric(SQLITE_MQ_METRIC_COMMIT, message_topic, 1)
+        PLog.gets().info("[SimpleSQLiteMQBroker] Commit message topic: %s, consumer group: %s, uuid: %s successfully" % (
+            message_topic, consumer_group, message_uuid))
+        self.base64_message_text_to_str(mq_message)
+        return mq_message
+
+    @type_check(None, str, str, str, int, [int, NoneType])
+    def group_consume_failed(self, message_topic, consumer_group, message_uuid, max_failed_times,
+                             retry_times_interval=300):
+        """
+        消费组消费失败 未达到重试次数上限时 在 retry_times_interval 秒后再次投递给该消费组
+        达到上限后在该消费组中挂起 不再阻塞该消费组的 Offset 可以通过 redrive_consumer_group 重新投递
+        """
+        if get_int_value(retry_times_interval) == 0:
+            retry_times_interval = 300
+        self._get_consumer_group_shard_segment_list(message_topic, consumer_group)
+        mq_message = self._get_message_segment(message_topic, message_uuid).group_consume_failed(
+            consumer_group, message_uuid, max_failed_times, retry_times_interval
+        )
+        self._increase_metric(SQLITE_MQ_METRIC_FAILED, message_topic, 1)
+        if mq_message.message_status == MESSAGE_STATUS_FAILED:
+            # 到达重试时间时唤醒等待的消费者
+            self._notify_message_delayed(message_topic, mq_message.expire_time)
+            PLog.gets().info(
+                "[SimpleSQLiteMQBroker] Failed to consume message topic: %s, consumer group: %s, uuid: %s, "
+                "retry after %s seconds" % (message_topic, consumer_group, message_uuid, retry_times_interval)
+            )
+        else:
+            PLog.gets().info(
+                "[SimpleSQLiteMQBroker] Failed to consume message topic: %s, consumer group: %s, uuid: %s, "
+                "maximum number of retry times: %s, pending message..." % (
+                    message_topic, consumer_group, message_uuid, max_failed_times)
+            )
+        self.base64_message_text_to_str(mq_message)
+        return mq_message
+
+    @type_check(None, str, str)
+    def redrive_consumer_group(self, message_topic, consumer_group):
+        """
+        将消费组中挂起的消息重新投递给该消费组 立即可见 失败次数清零
+        :return: 重新投递的消息数量
+        :rtype: int
+        """
+        redrive_count = 0
+        for shard_segment in self._get_consumer_group_shard_segment_list(message_topic, consumer_group):
+            redrive_count += shard_segment.redrive_consumer_group(consumer_group)
+        if redrive_count > 0:
+            self._notify_message_arrival([message_topic])
+            PLog.gets().info("[SimpleSQLiteMQBroker] Redrive %s pending messages topic: %s, consumer group: %s" % (
+                redrive_count, message_topic, consumer_group))
+        return redrive_count
+
+    def trim_consumer_group_messages(self, batch_size=SQLITE_MQ_CONSUMER_GROUP_RETENTION_BATCH_SIZE):
+        """
+        分批删除所有消费组均已提交的消息 并同步至 Ext Segment 归档 每批一个事务 批次之间释放 Segment 的锁
+        :return: 删除的消息数量
+        :rtype: int
+        """
+        total_trim_count = 0
+        for segment_key in self._get_segment_file_key_list():
+            message_topic_segment = self._get_segment_by_segment_key(segment_key)  # type: AbstractMQBrokerCommonSegment
+            try:
+                while True:
+                    mq_message_list, commit_log_offset = message_topic_segment.trim_consumer_group_message_list(
+                        batch_size)
+                    if list_not_empty(mq_message_list):
+                        self._ext_synchronizer.submit(EXT_SYNC_OPERATION_DELETE, mq_message_list, commit_log_offset)
+                    total_trim_count += len(mq_message_list)
+                    if len(mq_message_list) < batch_size:
+                        break
+            except Exception as e:
+                PLog.gets().error(
+                    "[SimpleSQLiteMQBroker] Trim consumer group messages of segment '%s' failed. Exception '%s'" % (
+                        segment_key, str(e))
+                )
+        if total_trim_count > 0:
+            PLog.gets().info("[SimpleSQLiteMQBroker] Trim %s messages committed by all consumer groups" % (
+                total_trim_count))
+        return total_trim_count
 
     @type_check(None, str, str, [NoneType, int], [NoneType, int], [NoneType, str])
     def lock_message(self, message_topic, message_uuid, message_status, max_consume_time=None, consumer=None):
@@ -389,7 +1643,7 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
         message_status = get_int_value(message_status)
         max_consume_time = get_int_value(max_consume_time)
 
-        message_topic_segment = self._get_topic_segment(message_topic)
+        message_topic_segment = self._get_message_segment(message_topic, message_uuid)
         mq_message = message_topic_segment.fetch_message_by_uuid(message_uuid)
 
         if mq_message.message_status == MESSAGE_STATUS_LOCKED:
@@ -403,20 +1657,280 @@ class SimpleSQLiteMQBroker(AbstractSimpleSQLiteMQBroker):
         mq_message.consumer = consumer
         mq_message.expire_time = 0 if max_consume_time == 0 else update_time + max_consume_time
 
-        log_file_name = message_topic_segment.update_message(mq_message)
-        self._order_log_executor.submit(self._ext_segment.update_message, mq_message.copy(), log_file_name)
+        commit_log_offset = message_topic_segment.update_message(mq_message)
+        self._ext_synchronizer.submit(EXT_SYNC_OPERATION_UPDATE, mq_message.copy(), commit_log_offset)
+        if message_status == MESSAGE_STATUS_INIT:
+            self._notify_message_arrival([message_topic])
+        elif message_status == MESSAGE_STATUS_LOCKED or message_status == MESSAGE_STATUS_FAILED:
+            self._message_recoverer.notify_expire_time(
+                self._get_message_segment_key(mq_message), mq_message.expire_time
+            )
         return mq_message
 
     @type_check(None, [MQMessage, NoneType])
     def base64_message_text_to_str(self, mq_message):
+        """
+        将 Segment 中读取的消息体 按消息的存储编码还原 Base64 文本解码 压缩的消息体解压
+        """
         if mq_message is None:
             return
-        message_text = mq_message.message_text
-        if str_not_blank(message_text):
-            mq_message.message_text = base64_to_str(message_text)
+        mq_message.message_text = SimpleSQLiteMQMessageCodec.decode(
+            mq_message.message_text, mq_message.message_encoding
+        )
+
+    @type_check(None, [str, NoneType], int)
+    def migrate_message_storage(self, message_topic=None, batch_size=MESSAGE_STORAGE_MIGRATE_BATCH_SIZE):
+        """
+        将已有的 Base64 编码的消息 重写为当前的存储方式 (binary 以及可选的压缩)
+        每批消息一个事务 批次之间释放锁 迁移期间可以正常读写 中断后再次调用会继续迁移剩余的消息
+        :param message_topic: 只迁移指定 Topic 所有 Shard 的 Common Segment
+            为 None 时迁移所有 Topic 以及 Ext / Archiver Segment 与死信队列
+        :param batch_size: 每个事务中重写的消息数量
+        :return: 重写的消息数量
+        :rtype: int
+        """
+        if self._message_codec.get_message_storage_mode() == SQLITE_MQ_MESSAGE_STORAGE_BASE64:
+            raise Exception(
+                "[SimpleSQLiteMQBroker] Message storage mode is '%s', nothing to migrate" % (
+                    SQLITE_MQ_MESSAGE_STORAGE_BASE64)
+            )
+        if batch_size <= 0:
+            raise Exception("[SimpleSQLiteMQBroker] batch_size should be positive when migrate message storage")
+
+        segment_dict = dict()
+        if str_not_blank(message_topic):
+            for shard_id, shard_segment in enumerate(self._get_topic_shard_segment_list(message_topic)):
+                segment_dict[self._get_segment_key(message_topic, shard_id)] = shard_segment
+        else:
+            for segment_key in self._get_segment_file_key_list():
+                segment_dict[segment_key] = self._get_segment_by_segment_key(segment_key)
+            segment_dict[EXT_SQLITE_MQ_SEGMENT] = self._ext_segment
+            segment_dict[ARCHIVER_SQLITE_MQ_SEGMENT] = self._archiver_segment
+            segment_dict[SQLITE_MQ_DEAD_LETTER_DIR_NAME] = self._dead_letter_queue
+
+        total_migrate_count = 0
+        for segment_name, segment in segment_dict.items():
+            migrate_count = segment.migrate_message_storage(self._message_codec, batch_size)
+            total_migrate_count += migrate_count
+            PLog.gets().info(
+                "[SimpleSQLiteMQBroker] Migrate %s messages of '%s' to message storage mode '%s'" % (
+                    migrate_count, segment_name, self._message_codec.get_message_storage_mode())
+            )
+        return total_migrate_count
+
+    @type_check(None, str)
+    def get_priority_backlog(self, message_topic):
+        """
+        从 Ext Segment 统计指定 Topic 各个优先级尚未被消费的消息数量 包含尚未到达可见时间的延迟消息
+        Ext Segment 异步同步 需要精确结果时可以先调用 wait_ext_segment_synced
+        :return: 优先级 -> 消息数量
+        :rtype: dict
+        """
+        if str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when get priority backlog")
+        return self._ext_segment.get_priority_backlog(message_topic)
+
+    @type_check(None, str)
+    def get_topic_shard_count(self, message_topic):
+        """
+        :return: Topic 的 Shard 数量 包含配置减少后仍然存在文件的 Shard
+        :rtype: int
+        """
+        if str_is_blank(message_topic):
+            raise Exception("[SimpleSQLiteMQBroker] message_topic cannot be blank when get topic shard count")
+        return len(self._get_topic_shard_segment_list(message_topic))
+
+    def get_recover_metrics(self):
+        """
+        :return: 过期消息恢复的数量 恢复吞吐 下一次过期时间等统计数据
+        :rtype: dict
+        """
+        return self._message_recoverer.get_metrics()
+
+    def get_dead_letter_metrics(self):
+        """
+        :return: 转入死信队列的消息数量 移回的消息数量 移回吞吐 以及各个 Topic 死信队列中的消息数量
+        :rtype: dict
+        """
+        return self._dead_letter_queue.get_metrics()
+
+    def get_ext_sync_metrics(self):
+        """
+        :return: Ext Segment 同步队列长度 同步延迟 批次大小等统计数据 多进程模式下为是否 Leader 以及同步的记录数量等
+        :rtype: dict
+        """
+        return self._ext_synchronizer.get_metrics()
+
+    def stats(self):
+        """
+        运维指标快照 可以通过 stats_to_prometheus_text 转换为 Prometheus 文本格式
+        积压数量与最老租约按需查询各个 Common Segment 为所有进程共享的数据
+        出队 / 入队 / 提交 / 失败 计数 事务提交耗时 以及 fsync 次数只统计本进程
+        :return: topic 为 Topic -> 各个状态的积压数量 最老租约的秒数 各个消费组的 lag 与租约数量
+            各项计数及其自启动以来的平均速率
+            transaction_seconds 为 Topic -> 事务提交耗时直方图 ext_sync / recover / dead_letter 为各个组件的统计数据
+        :rtype: dict
+        """
+        current_time = time.time()
+        start_time = self._start_time if self._metrics_registry is None else self._metrics_registry.get_start_time()
+        uptime_seconds = current_time - start_time
+
+        topic_stats_dict = dict()
+
+        def get_topic_stats(message_topic):
+            topic_stats = topic_stats_dict.get(message_topic, None)
+            if topic_stats is None:
+                topic_stats = {
+                    "backlog": dict([
+                        (MESSAGE_STATUS_NAME_DICT[message_status], 0)
+                        for message_status in COMMON_SEGMENT_MESSAGE_STATUS_LIST
+                    ]),
+                    "oldest_lease_age_seconds": None,
+                    "consumer_group": dict(),
+                }
+                for counter_name in SQLITE_MQ_METRIC_COUNTER_LIST:
+                    topic_stats[counter_name + "_count"] = 0
+                    topic_stats[counter_name + "_rate"] = 0.0
+                topic_stats_dict[message_topic] = topic_stats
+            return topic_stats
+
+        for segment_key in self._get_segment_file_key_list():
+            message_topic_segment = self._get_segment_by_segment_key(segment_key)
+            topic_stats = get_topic_stats(self._get_segment_key_topic(segment_key))
+            for message_status, count in message_topic_segment.count_message_by_status().items():
+                status_name = MESSAGE_STATUS_NAME_DICT.get(message_status, str(message_status))
+                topic_stats["backlog"][status_name] = topic_stats["backlog"].get(status_name, 0) + count
+            self._merge_consumer_group_stats(
+                topic_stats["consumer_group"], message_topic_segment.get_consumer_group_stats())
+            oldest_lease_time = message_topic_segment.get_oldest_lease_time()
+            if oldest_lease_time is None:
+                continue
+            lease_age_seconds = max(0.0, current_time - oldest_lease_time)
+            if topic_stats["oldest_lease_age_seconds"] is None or lease_age_seconds > topic_stats[
+                    "oldest_lease_age_seconds"]:
+                topic_stats["oldest_lease_age_seconds"] = lease_age_seconds
+
+        transaction_seconds_dict = dict()
+        if self._metrics_registry is not None:
+            for counter_name, topic_count_dict in self._metrics_registry.get_counter_dict().items():
+                for message_topic, count in topic_count_dict.items():
+                    topic_stats = get_topic_stats(message_topic)
+                    topic_stats[counter_name + "_count"] = count
+                    topic_stats[counter_name + "_rate"] = 0.0 if uptime_seconds <= 0 else count / uptime_seconds
+            transaction_seconds_dict = self._metrics_registry.get_histogram_dict().get(
+                SQLITE_MQ_METRIC_TRANSACTION_SECONDS, dict())
+
+        return {
+            "time": current_time,
+            "uptime_seconds": uptime_seconds,
+            "metrics_enabled": self._metrics_registry is not None,
+            "topic": topic_stats_dict,
+            SQLITE_MQ_METRIC_TRANSACTION_SECONDS: transaction_seconds_dict,
+            "commit_log_fsync_count": self._commit_log.get_fsync_count(),
+            "ext_sync": self.get_ext_sync_metrics(),
+            "recover": self.get_recover_metrics(),
+            "dead_letter": self.get_dead_letter_metrics(),
+        }
+
+    def wait_ext_segment_synced(self, timeout=None):
+        """
+        等待调用前的所有变更同步至 Ext Segment
+        :param timeout: 最长等待秒数 None 表示一直等待
+        :return: 是否全部同步完成
+        :rtype: bool
+        """
+        return self._ext_synchronizer.wait_synced(timeout)
 
     def get_ext_segment_db_path(self):
         return self._ext_segment.get_db_path()
 
     def get_archiver_segment_db_path(self):
+        """
+        :return: 归档分区文件所在的目录
+        """
         return self._archiver_segment.get_db_path()
+
+    def get_dead_letter_db_path(self):
+        """
+        :return: 死信队列文件所在的目录
+        """
+        return self._dead_letter_queue.get_db_path()
+
+    def get_archive_partition_list(self):
+        """
+        :return: 所有归档分区的名称 时间范围 以及文件大小 从新到旧
+        :rtype: list
+        """
+        if self._process_coordinator is not None:
+            self._archiver_segment.reload_partition()
+        return self._archiver_segment.get_partition_list()
+
+    def enforce_archive_retention(self):
+        """
+        按保留策略删除过期的归档分区 启动时以及之后定期执行
+        :return: 删除的分区名称列表
+        :rtype: list
+        """
+        try:
+            return self._archiver_segment.enforce_retention()
+        except Exception as e:
+            PLog.gets().exception(e)
+            return list()
+
+    def prune_idempotency_keys(self, batch_size=SQLITE_MQ_IDEMPOTENCY_PRUNE_BATCH_SIZE):
+        """
+        分批删除所有 Common Segment 中超出去重窗口的幂等键 批次之间释放 Segment 的锁
+        :return: 删除的幂等键数量
+        :rtype: int
+        """
+        total_prune_count = 0
+        for segment_key in self._get_segment_file_key_list():
+            message_topic_segment = self._get_segment_by_segment_key(segment_key)  # type: AbstractMQBrokerCommonSegment
+            try:
+                while True:
+                    prune_count = message_topic_segment.prune_idempotency_key(batch_size)
+                    total_prune_count += prune_count
+                    if prune_count < batch_size:
+                        break
+            except Exception as e:
+                PLog.gets().error(
+                    "[SimpleSQLiteMQBroker] Prune idempotency key of segment '%s' failed. Exception '%s'" % (
+                        segment_key, str(e))
+                )
+        if total_prune_count > 0:
+            PLog.gets().info("[SimpleSQLiteMQBroker] Prune %s expired idempotency keys" % total_prune_count)
+        return total_prune_count
+
+    def vacuum_segments(self, free_page_ratio=SQLITE_MQ_VACUUM_FREE_PAGE_RATIO,
+                        max_vacuum_pages=SQLITE_MQ_INCREMENTAL_VACUUM_PAGES):
+        """
+        回收 Common / Ext Segment 中空闲页超过比例的文件 每批回收 max_vacuum_pages 页 批次之间释放 Segment 的锁
+        已有的文件第一次回收时需要执行一次完整的 VACUUM 之后均为增量回收
+        :param free_page_ratio: 空闲页占总页数的比例超过该值时才回收
+        :param max_vacuum_pages: 每批回收的页数
+        :return: Segment 名称 -> 回收的页数 只包含有回收的 Segment
+        :rtype: dict
+        """
+        segment_dict = dict()
+        for segment_key in self._get_segment_file_key_list():
+            segment_dict[segment_key] = self._get_segment_by_segment_key(segment_key)
+        segment_dict[EXT_SQLITE_MQ_SEGMENT] = self._ext_segment
+
+        vacuum_page_dict = dict()
+        for segment_name, segment in segment_dict.items():
+            try:
+                total_vacuum_pages = 0
+                while True:
+                    vacuum_pages = segment.vacuum_segment(free_page_ratio, max_vacuum_pages)
+                    if vacuum_pages <= 0:
+                        break
+                    total_vacuum_pages += vacuum_pages
+            except Exception as e:
+                PLog.gets().error("[SimpleSQLiteMQBroker] Vacuum segment '%s' failed. Exception '%s'" % (
+                    segment_name, str(e)))
+                continue
+            if total_vacuum_pages > 0:
+                vacuum_page_dict[segment_name] = total_vacuum_pages
+                PLog.gets().info("[SimpleSQLiteMQBroker] Vacuum %s free pages of segment '%s'" % (
+                    total_vacuum_pages, segment_name))
+        return vacuum_page_dict
@@ -0,0 +1,303 @@
+# coding=utf-8
+import socket
+from threading import Condition, Lock
+
+from pava.component.mq import *
+from pava.component.mq.core.simple_sqlite_mq_protocol import SimpleSQLiteMQFrameReader, SERVER_METHOD_LIST, \
+    SERVER_METHOD_OPCODE_DICT, decode_result, encode_frame
+from pava.component.mq.interface.abstract_simple_sqlite_mq_broker import AbstractSimpleSQLiteMQBroker
+from pava.component.p_log import PLog
+from pava.utils.async_utils import daemon_thread_execute
+
+"""
+简易的基于 SQLite 的消息队列 Client
+连接 SimpleSQLiteMQServer 接口与 SimpleSQLiteMQBroker 一致 可以直接交给 SimpleSQLiteMQConsumer 使用
+多个线程共用一个连接 请求连续发送 不必等待上一个请求的响应 由接收线程按请求编号分发响应
+"""
+
+
+class SimpleSQLiteMQResponse(object):
+    """
+    一个请求的响应 接收线程设置结果后唤醒等待的线程
+    """
+
+    def __init__(self, response_condition, result_type):
+        self._response_condition = response_condition
+        self.result_type = result_type
+        self.done = False
+        self.status = None
+        self.result = None
+
+    def set_result(self, status, result):
+        """
+        调用时需要持有 response_condition
+        """
+        self.status = status
+        self.result = result
+        self.done = True
+        self._response_condition.notify_all()
+
+    def get_result(self):
+        """
+        等待响应到达 请求失败时抛出异常
+        """
+        with self._response_condition:
+            while not self.done:
+                self._response_condition.wait()
+        if self.status != SQLITE_MQ_SERVER_STATUS_OK:
+            raise Exception("[SimpleSQLiteMQClient] Remote exception: %s" % self.result)
+        return decode_result(self.result_type, self.result)
+
+
+class SimpleSQLiteMQClient(AbstractSimpleSQLiteMQBroker):
+
+    def __init__(self, address=SQLITE_MQ_SERVER_DEFAULT_ADDRESS, connect_timeout=10):
+        """
+        :param address: Server 的地址 (host, port) 时连接 TCP 字符串时连接该路径的 Unix Socket
+        :param connect_timeout: 建立连接的最长秒数 连接建立后请求不会超时
+        """
+        self._address = address
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(connect_timeout)
+        self._socket.connect(address)
+        self._socket.settimeout(None)
+
+        # 保证一个请求的帧完整地写入 Socket
+        self._send_lock = Lock()
+        # 保护 请求编号 与 等待响应的请求
+        self._response_condition = Condition()
+        self._next_request_id = 0
+        self._pending_response_dict = dict()
+        # 连接断开的原因 断开后所有请求直接失败
+        self._closed_reason = None
+
+        # 接收线程在连接的整个生命周期内阻塞 不占用全局异步任务线程池
+        daemon_thread_execute(self._receive_loop)
+        PLog.gets().info("[SimpleSQLiteMQClient] Connect to %s successfully" % str(address))
+
+    def _receive_loop(self):
+        frame_reader = SimpleSQLiteMQFrameReader()
+        closed_reason = "connection closed by server"
+        try:
+            while True:
+                data = self._socket.recv(SQLITE_MQ_SERVER_RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                frame_list = frame_reader.feed(data)
+                with self._response_condition:
+                    for request_id, status, payload in frame_list:
+                        response = self._pending_response_dict.pop(request_id, None)
+                        if response is not None:
+                            response.set_result(status, payload)
+        except Exception as e:
+            closed_reason = str(e)
+        with self._response_condition:
+            if self._closed_reason is None:
+                self._closed_reason = closed_reason
+            for response in self._pending_response_dict.values():
+                response.set_result(SQLITE_MQ_SERVER_STATUS_ERROR, self._closed_reason)
+            self._pending_response_dict.clear()
+
+    def send_request_list(self, request_list):
+        """
+        连续发送多个请求 不等待响应
+        :param request_list: 元素为 (方法名, 位置参数元组, 关键字参数字典)
+        :return: 与请求顺序一致的响应列表
+        :rtype: list[SimpleSQLiteMQResponse]
+        """
+        frame_list = list()
+        response_list = list()
+        with self._response_condition:
+            if self._closed_reason is not None:
+                raise Exception("[SimpleSQLiteMQClient] Connection is closed: %s" % self._closed_reason)
+            for method_name, args, kwargs in request_list:
+                opcode = SERVER_METHOD_OPCODE_DICT.get(method_name, None)
+                if opcode is None:
+                    raise Exception("[SimpleSQLiteMQClient] Unsupported method '%s'" % method_name)
+                request_id = self._next_request_id
+                self._next_request_id = (self._next_request_id + 1) & 0xFFFFFFFF
+                response = SimpleSQLiteMQResponse(self._response_condition, SERVER_METHOD_LIST[opcode - 1][1])
+                self._pending_response_dict[request_id] = response
+                frame_list.append(encode_frame(request_id, opcode, (args, kwargs)))
+                response_list.append(response)
+        try:
+            with self._send_lock:
+                self._socket.sendall("".join(frame_list))
+        except socket.error as e:
+            # 发送失败的请求不会再有响应
+            with self._response_condition:
+                for response in response_list:
+                    if not response.done:
+                        response.set_result(SQLITE_MQ_SERVER_STATUS_ERROR, str(e))
+            raise e
+        return response_list
+
+    def _call(self, method_name, *args):
+        return self.send_request_list([(method_name, args, dict())])[0].get_result()
+
+    def pipeline(self):
+        """
+        :return: 收集多个调用 一次发送的 Pipeline
+        :rtype: SimpleSQLiteMQPipeline
+        """
+        return SimpleSQLiteMQPipeline(self)
+
+    def close(self):
+        with self._response_condition:
+            if self._closed_reason is None:
+                self._closed_reason = "connection closed by client"
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+
+    def add_message(self, message_topic, message_text, producer=None, deliver_at=None, deliver_after=None,
+                    priority=0, idempotency_key=None):
+        return self._call("add_message", message_topic, message_text, producer, deliver_at, deliver_after, priority,
+                          idempotency_key)
+
+    def add_messages(self, message_topic, message_text_list, producer=None, deliver_at=None, deliver_after=None,
+                     priority=0):
+        return self._call("add_messages", message_topic, message_text_list, producer, deliver_at, deliver_after,
+                          priority)
+
+    def get_message(self, message_topic, consumer=None, max_consume_time=3600, wait_timeout=0):
+        return self._call("get_message", message_topic, consumer, max_consume_time, wait_timeout)
+
+    def get_messages(self, message_topic, message_count, consumer=None, max_consume_time=3600, wait_timeout=0):
+        return self._call("get_messages", message_topic, message_count, consumer, max_consume_time, wait_timeout)
+
+    def get_message_arrival_version(self):
+        return self._call("get_message_arrival_version")
+
+    def wait_message_arrival(self, message_topic_list, arrival_version, wait_timeout):
+        return self._call("wait_message_arrival", message_topic_list, arrival_version, wait_timeout)
+
+    def commit_message(self, message_topic, message_uuid):
+        return self._call("commit_message", message_topic, message_uuid)
+
+    def hold_message(self, message_topic, message_uuid, hold_consume_time=6000):
+        return self._call("hold_message", message_topic, message_uuid, hold_consume_time)
+
+    def hold_messages(self, message_topic, message_uuid_list, hold_consume_time=6000):
+        return self._call("hold_messages", message_topic, message_uuid_list, hold_consume_time)
+
+    def consume_failed(self, message_topic, message_uuid, max_failed_times, retry_times_interval=300):
+        return self._call("consume_failed", message_topic, message_uuid, max_failed_times, retry_times_interval)
+
+    def delete_message(self, message_topic, message_uuid, is_archiver_read=False):
+        return self._call("delete_message", message_topic, message_uuid, is_archiver_read)
+
+    def scan_message(self, message_topic=None, every_page_quantity=10, page_number=1, is_archiver_read=False,
+                     message_status=None, begin_time=None, end_time=None, continuation_token=None,
+                     is_dead_letter_read=False):
+        return self._call("scan_message", message_topic, every_page_quantity, page_number, is_archiver_read,
+                          message_status, begin_time, end_time, continuation_token, is_dead_letter_read)
+
+    def fetch_message_by_uuid(self, message_topic, message_uuid):
+        return self._call("fetch_message_by_uuid", message_topic, message_uuid)
+
+    def get_priority_backlog(self, message_topic):
+        return self._call("get_priority_backlog", message_topic)
+
+    def get_topic_shard_count(self, message_topic):
+        return self._call("get_topic_shard_count", message_topic)
+
+    def redrive(self, message_topic, message_filter=None, limit=None, batch_size=SQLITE_MQ_DEAD_LETTER_BATCH_SIZE):
+        """
+        筛选函数无法发送至 Server 只能按先后顺序移回
+        """
+        if message_filter is not None:
+            raise Exception("[SimpleSQLiteMQClient] message_filter cannot be sent to server when redrive messages")
+        return self._call("redrive", message_topic, None, limit, batch_size)
+
+    def get_dead_letter_metrics(self):
+        return self._call("get_dead_letter_metrics")
+
+    def stats(self):
+        return self._call("stats")
+
+    def create_consumer_group(self, message_topic, consumer_group, start_from_latest=False):
+        return self._call("create_consumer_group", message_topic, consumer_group, start_from_latest)
+
+    def delete_consumer_group(self, message_topic, consumer_group):
+        return self._call("delete_consumer_group", message_topic, consumer_group)
+
+    def get_consumer_groups(self, message_topic):
+        return self._call("get_consumer_groups", message_topic)
+
+    def get_group_message(self, message_topic, consumer_group, consumer=None, max_consume_time=3600, wait_timeout=0):
+        return self._call("get_group_message", message_topic, consumer_group, consumer, max_consume_time,
+                          wait_timeout)
+
+    def get_group_messages(self, message_topic, consumer_group, message_count, consumer=None, max_consume_time=3600,
+                           wait_timeout=0):
+        return self._call("get_group_messages", message_topic, consumer_group, message_count, consumer,
+                          max_consume_time, wait_timeout)
+
+    def hold_group_message(self, message_topic, consumer_group, message_uuid, hold_consume_time=6000):
+        return self._call("hold_group_message", message_topic, consumer_group, message_uuid, hold_consume_time)
+
+    def commit_group_message(self, message_topic, consumer_group, message_uuid):
+        return self._call("commit_group_message", message_topic, consumer_group, message_uuid)
+
+    def group_consume_failed(self, message_topic, consumer_group, message_uuid, max_failed_times,
+                             retry_times_interval=300):
+        return self._call("group_consume_failed", message_topic, consumer_group, message_uuid, max_failed_times,
+                          retry_times_interval)
+
+    def redrive_consumer_group(self, message_topic, consumer_group):
+        return self._call("redrive_consumer_group", message_topic, consumer_group)
+
+
+class SimpleSQLiteMQPipeline(object):
+    """
+    收集多个调用 execute 时一次发送 再依次等待响应 适合批量 提交 / Hold / 消费失败 等互相独立的调用
+    例如 pipeline.commit_message(topic, uuid_1).commit_message(topic, uuid_2).execute()
+    """
+
+    def __init__(self, mq_client):
+        """
+        :type mq_client: SimpleSQLiteMQClient
+        """
+        self._mq_client = mq_client
+        self._request_list = list()
+
+    def __getattr__(self, method_name):
+        if method_name not in SERVER_METHOD_OPCODE_DICT:
+            raise AttributeError("[SimpleSQLiteMQPipeline] Unsupported method '%s'" % method_name)
+
+        def add_request(*args, **kwargs):
+            self._request_list.append((method_name, args, kwargs))
+            return self
+
+        return add_request
+
+    def __len__(self):
+        return len(self._request_list)
+
+    def execute(self, raise_on_error=True):
+        """
+        :param raise_on_error: 为 True 时 有调用失败则在所有响应到达后抛出第一个异常 否则异常作为对应位置的结果返回
+        :return: 与调用顺序一致的结果列表
+        :rtype: list
+        """
+        request_list, self._request_list = self._request_list, list()
+        if not request_list:
+            return list()
+        result_list = list()
+        first_exception = None
+        for response in self._mq_client.send_request_list(request_list):
+            try:
+                result_list.append(response.get_result())
+            except Exception as e:
+                first_exception = e if first_exception is None else first_exception
+                result_list.append(e)
+        if raise_on_error and first_exception is not None:
+            raise first_exception
+        return result_list
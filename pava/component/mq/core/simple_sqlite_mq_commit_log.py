@@ -0,0 +1,344 @@
+# coding=utf-8
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from threading import Condition, Lock
+
+from pava.component.mq.core.commit_log import CommitLog
+from pava.component.mq.core.mq_message import MQMessage
+from pava.component.mq.core.simple_sqlite_mq_message_codec import SimpleSQLiteMQMessageCodec
+from pava.component.p_log import PLog
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 内置的 Commit Log
+所有 Common Segment 的变更 在提交事务前 追加写入到 Commit Log 中 供 Ext Segment 顺序同步
+Commit Log 由多个 Log Segment 文件组成 每个文件以其第一条记录的全局 Offset 命名
+每条记录格式为: 4 字节长度 + 4 字节 CRC32 + JSON 内容
+二进制存储的消息体无法直接写入 JSON 写入 Commit Log 时转换为 Base64 读取时还原
+Checkpoint 文件中记录已经同步完成的 Offset 重启时从 Checkpoint 开始重放
+多进程模式下 每个进程只追加写入自己的 Commit Log (append_only) 由 Leader 进程只读地读取 (read_only) 并维护 Checkpoint
+"""
+
+# 记录头 长度 与 CRC32 均为无符号 4 字节 大端序
+COMMIT_LOG_RECORD_HEADER = struct.Struct(">II")
+# Log Segment 文件后缀
+COMMIT_LOG_SEGMENT_SUFFIX = ".log"
+# Checkpoint 文件名
+COMMIT_LOG_CHECKPOINT_FILE_NAME = "checkpoint"
+
+
+class SimpleSQLiteMQCommitLog(object):
+
+    def __init__(self, commit_log_path, fsync_enabled=True, segment_max_bytes=64 * 1024 * 1024,
+                 checkpoint_interval=1000, append_only=False, read_only=False):
+        """
+        :param commit_log_path: Commit Log 存放目录
+        :param fsync_enabled: 每次追加记录后是否 fsync 并发追加的多条记录共用一次 fsync
+        :param segment_max_bytes: 单个 Log Segment 文件的最大字节数 超过后滚动生成新的文件
+        :param checkpoint_interval: 每同步完成多少条记录 持久化一次 Checkpoint
+        :param append_only: 只追加记录 不跟踪同步进度 也不写入 Checkpoint 由其他进程读取并维护 Checkpoint
+        :param read_only: 只读取其他进程追加的记录 不截断 也不追加 同步完成后维护 Checkpoint
+        """
+        self._commit_log_path = commit_log_path
+        self._fsync_enabled = fsync_enabled
+        self._segment_max_bytes = segment_max_bytes
+        self._checkpoint_interval = checkpoint_interval
+        self._append_only = append_only
+        self._read_only = read_only
+        if not os.path.isdir(commit_log_path):
+            os.makedirs(commit_log_path)
+
+        self._lock = Lock()
+        # 已经追加 但还没有同步完成的 Offset 按追加顺序排列 值为是否已经同步完成
+        self._pending_offset_dict = OrderedDict()
+        # 距离上次持久化 Checkpoint 同步完成的记录数量
+        self._committed_count_since_checkpoint = 0
+        # 追加记录与持久化 Checkpoint 时 fsync 的次数
+        self._fsync_count = 0
+        # 组提交 追加记录后在锁外 fsync 一次 fsync 覆盖之前所有已经写入的记录
+        # 多个 Segment (例如同一个 Topic 的多个 Shard) 同时追加时 共用同一次 fsync 而不是在锁内依次 fsync
+        self._fsync_condition = Condition()
+        self._fsync_running = False
+        # 已经 fsync 完成的 Offset 之前的记录均已落盘
+        self._synced_offset = 0
+
+        self._checkpoint_offset = self._read_checkpoint_offset()
+        self._persisted_checkpoint_offset = self._checkpoint_offset
+
+        # 其他进程可能正在写入最后一个 Log Segment 只读时不能截断 读取到的记录之后即为末尾
+        self._segment_file = None
+        if read_only:
+            self._segment_base_offset = self._checkpoint_offset
+            self._end_offset = self._checkpoint_offset
+            return
+
+        # 打开最后一个 Log Segment 截断末尾写了一半的记录 后续在其末尾继续追加
+        segment_base_offset_list = self._get_segment_base_offset_list()
+        if list_is_empty(segment_base_offset_list):
+            segment_base_offset_list = [self._checkpoint_offset]
+        self._segment_base_offset = segment_base_offset_list[-1]
+        segment_file_path = self._get_segment_file_path(self._segment_base_offset)
+        valid_length = self._get_valid_segment_length(segment_file_path)
+        self._segment_file = open(segment_file_path, "ab")
+        if self._segment_file.tell() > valid_length:
+            PLog.gets().warning(
+                "[SimpleSQLiteMQCommitLog] Truncate broken tail of '%s' from %s to %s bytes" % (
+                    segment_file_path, self._segment_file.tell(), valid_length)
+            )
+            self._segment_file.truncate(valid_length)
+            self._segment_file.seek(valid_length)
+        self._end_offset = self._segment_base_offset + valid_length
+
+    def _get_segment_file_path(self, segment_base_offset):
+        return os.path.join(self._commit_log_path, "%020d%s" % (segment_base_offset, COMMIT_LOG_SEGMENT_SUFFIX))
+
+    def _get_checkpoint_file_path(self):
+        return os.path.join(self._commit_log_path, COMMIT_LOG_CHECKPOINT_FILE_NAME)
+
+    def _get_segment_base_offset_list(self):
+        segment_base_offset_list = list()
+        for file_name in os.listdir(self._commit_log_path):
+            if file_name.endswith(COMMIT_LOG_SEGMENT_SUFFIX):
+                segment_base_offset_list.append(get_int_value(file_name[:-len(COMMIT_LOG_SEGMENT_SUFFIX)]))
+        return sorted(segment_base_offset_list)
+
+    def _read_checkpoint_offset(self):
+        checkpoint_file_path = self._get_checkpoint_file_path()
+        if not os.path.isfile(checkpoint_file_path):
+            return 0
+        with open(checkpoint_file_path, "r") as checkpoint_file:
+            return get_int_value(checkpoint_file.read())
+
+    def _read_segment_record_list(self, segment_file_path, begin_position=0):
+        """
+        读取 Log Segment 中 begin_position 之后的完整记录 遇到不完整或 CRC 校验失败的记录时停止
+        :return: (记录位置, 记录内容) 列表 以及 有效数据的长度
+        """
+        record_list = list()
+        valid_length = 0
+        if not os.path.isfile(segment_file_path):
+            return record_list, valid_length
+        with open(segment_file_path, "rb") as segment_file:
+            # Checkpoint 总是位于记录的边界 直接从 begin_position 开始读取 无需解析之前的记录
+            segment_file.seek(begin_position)
+            valid_length = begin_position
+            while True:
+                record_position = segment_file.tell()
+                header = segment_file.read(COMMIT_LOG_RECORD_HEADER.size)
+                if len(header) < COMMIT_LOG_RECORD_HEADER.size:
+                    break
+                payload_length, payload_crc = COMMIT_LOG_RECORD_HEADER.unpack(header)
+                payload = segment_file.read(payload_length)
+                if len(payload) < payload_length or zlib.crc32(payload) & 0xffffffff != payload_crc:
+                    break
+                valid_length = segment_file.tell()
+                record_list.append((record_position, payload))
+        return record_list, valid_length
+
+    def _get_valid_segment_length(self, segment_file_path):
+        return self._read_segment_record_list(segment_file_path)[1]
+
+    def append(self, mq_message):
+        """
+        追加一条记录 批量操作时传入 MQ Message 列表 整批消息作为一条记录
+        :type mq_message: MQMessage or list
+        :return: 记录的 Offset
+        :rtype: int
+        """
+        if type(mq_message) is list:
+            payload = object_to_json([self._get_commit_log_dict(element) for element in mq_message])
+        else:
+            payload = object_to_json(self._get_commit_log_dict(mq_message))
+        record = COMMIT_LOG_RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+        if self._read_only:
+            raise Exception("[SimpleSQLiteMQCommitLog] Cannot append to read only commit log '%s'" % (
+                self._commit_log_path))
+        with self._lock:
+            if self._end_offset - self._segment_base_offset >= self._segment_max_bytes:
+                self._roll_segment()
+            commit_log_offset = self._end_offset
+            self._segment_file.write(record)
+            self._segment_file.flush()
+            self._end_offset += len(record)
+            record_end_offset = self._end_offset
+            if not self._append_only:
+                self._pending_offset_dict[commit_log_offset] = False
+        if self._fsync_enabled:
+            self._sync_to(record_end_offset)
+        return commit_log_offset
+
+    def _sync_to(self, sync_offset):
+        """
+        等待 sync_offset 之前的记录落盘 正在 fsync 时等待其完成 已经覆盖时直接返回 否则由当前线程执行下一次 fsync
+        """
+        with self._fsync_condition:
+            while self._fsync_running and self._synced_offset < sync_offset:
+                self._fsync_condition.wait()
+            if self._synced_offset >= sync_offset:
+                return
+            self._fsync_running = True
+
+        synced_offset = None
+        try:
+            with self._lock:
+                # 复制文件描述符 fsync 期间 Log Segment 可能滚动并关闭
+                end_offset = self._end_offset
+                file_descriptor = os.dup(self._segment_file.fileno())
+                self._fsync_count += 1
+            try:
+                os.fsync(file_descriptor)
+            finally:
+                os.close(file_descriptor)
+            synced_offset = end_offset
+        finally:
+            with self._fsync_condition:
+                self._fsync_running = False
+                if synced_offset is not None:
+                    self._synced_offset = max(self._synced_offset, synced_offset)
+                self._fsync_condition.notify_all()
+
+    @staticmethod
+    def _get_commit_log_dict(mq_message):
+        commit_log_dict = mq_message.to_dict()
+        commit_log_dict["message_text"] = SimpleSQLiteMQMessageCodec.to_json_safe(
+            mq_message.message_text, mq_message.message_encoding
+        )
+        return commit_log_dict
+
+    @staticmethod
+    def _get_commit_log_message(commit_log_dict):
+        mq_message = MQMessage.from_dict(commit_log_dict)
+        mq_message.message_text = SimpleSQLiteMQMessageCodec.from_json_safe(
+            mq_message.message_text, mq_message.message_encoding
+        )
+        return mq_message
+
+    def _roll_segment(self):
+        # 组提交的 fsync 只针对当前 Log Segment 滚动前先让其中的记录落盘
+        if self._fsync_enabled:
+            os.fsync(self._segment_file.fileno())
+            self._fsync_count += 1
+        self._segment_file.close()
+        self._segment_base_offset = self._end_offset
+        self._segment_file = open(self._get_segment_file_path(self._segment_base_offset), "ab")
+
+    def commit(self, commit_log_offset):
+        """
+        标记一条记录已经同步完成 Checkpoint 推进到最早一条尚未同步完成的记录
+        :type commit_log_offset: int
+        """
+        with self._lock:
+            if commit_log_offset not in self._pending_offset_dict:
+                return
+            self._pending_offset_dict[commit_log_offset] = True
+            while len(self._pending_offset_dict) > 0:
+                first_offset = next(iter(self._pending_offset_dict))
+                if not self._pending_offset_dict[first_offset]:
+                    break
+                self._pending_offset_dict.pop(first_offset)
+            self._checkpoint_offset = self._end_offset if len(self._pending_offset_dict) == 0 \
+                else next(iter(self._pending_offset_dict))
+            self._committed_count_since_checkpoint += 1
+            if self._committed_count_since_checkpoint >= self._checkpoint_interval:
+                self._persist_checkpoint()
+
+    def persist_checkpoint(self):
+        """
+        持久化 Checkpoint 并删除已经全部同步完成的 Log Segment
+        """
+        with self._lock:
+            self._persist_checkpoint()
+
+    def _persist_checkpoint(self):
+        self._committed_count_since_checkpoint = 0
+        # 只追加时 Checkpoint 由读取的进程维护
+        if self._append_only or self._checkpoint_offset == self._persisted_checkpoint_offset:
+            return
+        checkpoint_file_path = self._get_checkpoint_file_path()
+        temp_checkpoint_file_path = checkpoint_file_path + "_tmp"
+        with open(temp_checkpoint_file_path, "w") as checkpoint_file:
+            checkpoint_file.write(str(self._checkpoint_offset))
+            checkpoint_file.flush()
+            if self._fsync_enabled:
+                os.fsync(checkpoint_file.fileno())
+                self._fsync_count += 1
+        os.rename(temp_checkpoint_file_path, checkpoint_file_path)
+        self._persisted_checkpoint_offset = self._checkpoint_offset
+
+        # 下一个 Log Segment 的起始位置不晚于 Checkpoint 时 当前 Log Segment 已经没有用了
+        segment_base_offset_list = self._get_segment_base_offset_list()
+        for index, segment_base_offset in enumerate(segment_base_offset_list[:-1]):
+            if segment_base_offset_list[index + 1] > self._checkpoint_offset:
+                break
+            os.remove(self._get_segment_file_path(segment_base_offset))
+
+    def read_from_checkpoint(self):
+        """
+        读取 Checkpoint 之后的所有记录 重启时用于重放
+        读取到的记录会作为尚未同步完成的记录 同步完成后需要调用 commit
+        :return: 按 Offset 排列的 Commit Log 列表
+        """
+        commit_log_list = list()
+        with self._lock:
+            for segment_base_offset in self._get_segment_base_offset_list():
+                record_list, _ = self._read_segment_record_list(
+                    self._get_segment_file_path(segment_base_offset),
+                    max(0, self._checkpoint_offset - segment_base_offset)
+                )
+                for record_position, payload in record_list:
+                    commit_log_offset = segment_base_offset + record_position
+                    # 只读时 读取到的最后一条完整记录之后即为末尾
+                    self._end_offset = max(
+                        self._end_offset, commit_log_offset + COMMIT_LOG_RECORD_HEADER.size + len(payload)
+                    )
+                    if commit_log_offset in self._pending_offset_dict:
+                        continue
+                    try:
+                        commit_log_list.append(self._parse_commit_log(commit_log_offset, payload))
+                    except Exception as e:
+                        PLog.gets().warning(
+                            "[SimpleSQLiteMQCommitLog] Exception when read commit log offset %s! Exception '%s'" % (
+                                commit_log_offset, str(e))
+                        )
+                        continue
+                    self._pending_offset_dict[commit_log_offset] = False
+        commit_log_list.sort()
+        return commit_log_list
+
+    @staticmethod
+    def _parse_commit_log(commit_log_offset, payload):
+        mq_message_dict = json_to_python_object(payload)
+        # 批量操作的记录中存放的是消息列表
+        if type(mq_message_dict) is list:
+            return CommitLog(
+                commit_log_id=commit_log_offset,
+                mq_message_list=[
+                    SimpleSQLiteMQCommitLog._get_commit_log_message(element) for element in mq_message_dict
+                ]
+            )
+        return CommitLog(
+            commit_log_id=commit_log_offset,
+            mq_message=SimpleSQLiteMQCommitLog._get_commit_log_message(mq_message_dict)
+        )
+
+    def get_checkpoint_offset(self):
+        return self._checkpoint_offset
+
+    def get_persisted_checkpoint_offset(self):
+        """
+        :return: Checkpoint 文件中记录的 Offset 只追加时由读取的进程写入
+        :rtype: int
+        """
+        return self._read_checkpoint_offset()
+
+    def get_end_offset(self):
+        return self._end_offset
+
+    def get_fsync_count(self):
+        """
+        :return: 追加记录与持久化 Checkpoint 时 fsync 的次数 不包含 SQLite 自身的 fsync
+        :rtype: int
+        """
+        return self._fsync_count
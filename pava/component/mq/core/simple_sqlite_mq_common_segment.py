@@ -1,10 +1,12 @@
 # coding=utf-8
+import time
+
 from pava.component.mq.interface.abstract_mq_common_segment import AbstractMQBrokerCommonSegment
 from pava.utils.web_utils import get_local_host_ip
 
-from pava.entity.file_domain import FileDomain
-
 from pava.component.mq.core.mq_message import MQMessage
+from pava.component.mq.core.simple_sqlite_mq_commit_log import SimpleSQLiteMQCommitLog
+from pava.component.mq.core.simple_sqlite_mq_message_codec import SimpleSQLiteMQMessageCodec
 from pava.component.mq.core.sqlite_connection_pool import SQLiteConnectionPool
 
 from pava.component.p_log import PLog
@@ -22,7 +24,11 @@ from pava.decorator.decorator_impl.type_check_decorator import type_check
 """
 
 
-def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_path, mq_operation_lock_key):
+def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_log, mq_operation_lock_key,
+                                                 pragma_list=None,
+                                                 priority_aging_seconds=SQLITE_MQ_PRIORITY_AGING_SECONDS,
+                                                 idempotency_window_seconds=SQLITE_MQ_IDEMPOTENCY_WINDOW_SECONDS,
+                                                 shard_id=0, metrics_registry=None):
     class SimpleSQLiteBrokerCommonSegment(AbstractMQBrokerCommonSegment):
 
         def __init__(self):
@@ -30,10 +36,16 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             初始化一个 Common Segment
             """
             # 由上层 Synchronized 装饰器保证不会出现脏数据
-            self._connection_pool = SQLiteConnectionPool(db_path, capacity=4)
+            self._connection_pool = SQLiteConnectionPool(db_path, capacity=4, pragma_list=pragma_list)
             self._db_path = db_path
-            self._commit_path = commit_path
+            self._commit_log = commit_log  # type: SimpleSQLiteMQCommitLog
             self._message_topic = message_topic
+            # 消息每等待该秒数 出队时的有效优先级提升 1 为 0 时不老化
+            self._priority_aging_seconds = priority_aging_seconds
+            # 使用相同幂等键重复发布时 在该秒数内返回原消息 为 0 时不去重
+            self._idempotency_window_seconds = idempotency_window_seconds
+            # 所属 Topic 的 Shard 编号 非 0 号 Shard 的消息 UUID 以 Shard 编号结尾 供 Broker 路由
+            self._shard_id = shard_id
 
             # 创建数据表 以及对应的索引
             connection, cursor = self._get_connection_with_transaction()
@@ -41,34 +53,39 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             cursor.execute(CREATE_INDEX_UUID)
             connection.commit()
 
-            # 用于记录日志顺序
-            self._execute_log_count = -1
+            # 已有的 Segment 文件 自动升级到最新的表结构
+            before_version, after_version = self._connection_pool.upgrade_schema(COMMON_SEGMENT_SCHEMA_MIGRATION_LIST)
+            if before_version != after_version:
+                PLog.gets().info(
+                    "[SimpleSQLiteBrokerCommonSegment] Upgrade message queue '%s' schema version from %s to %s" % (
+                        self._message_topic, before_version, after_version)
+                )
+
             PLog.gets().info(
                 "[SimpleSQLiteBrokerCommonSegment] Initial message queue '%s' "
-                "storage successfully" % self._message_topic
+                "storage successfully, effective settings: %s" % (
+                    self._message_topic, self._connection_pool.get_effective_pragma_str())
             )
 
-        @synchronized(mq_operation_lock_key)
-        def _generate_log_count(self):
+        @type_check(None, None, [MQMessage, list])
+        def _commit_with_log(self, connection, mq_message):
             """
-            生成有序 int 使得 Commit Log File 是有序读取的 (Reboot时)
-            :return:
-            """
-            self._execute_log_count += 1
-            return self._execute_log_count
-
-        @type_check(None, MQMessage)
-        def _write_commit(self, mq_message):
-            """
-            根据 MQ Message 生成 Commit Log File 供 Ext 同步使用
-            :type mq_message: MQMessage
+            先将 MQ Message 追加写入 Commit Log 供 Ext 同步使用 随后提交事务 两者的总耗时记录为事务提交耗时
+            批量操作时传入 MQ Message 列表 整批消息作为一条 Commit Log 记录
+            :type mq_message: MQMessage or list
+            :return: Commit Log 记录的 Offset
             """
-            log_file_name = "%s_%s_%s" % (
-                self._generate_log_count(), mq_message.message_topic, mq_message.message_uuid
-            )
-            log_file_path = os.path.join(commit_path, log_file_name)
-            FileDomain(log_file_path).write(object_to_json(mq_message))
-            return log_file_path
+            begin_time = time.time()
+            commit_log_offset = self._commit_log.append(mq_message)
+            try:
+                connection.commit()
+            except Exception as e:
+                # 事务没有提交成功 这条 Commit Log 记录无需同步 直接标记完成 避免阻塞 Checkpoint
+                self._commit_log.commit(commit_log_offset)
+                raise e
+            if metrics_registry is not None:
+                metrics_registry.observe(SQLITE_MQ_METRIC_TRANSACTION_SECONDS, message_topic, time.time() - begin_time)
+            return commit_log_offset
 
         def _get_connection_with_transaction(self):
             """
@@ -79,42 +96,74 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             cursor.execute(BEGIN_TRANSACTION)
             return connection, cursor
 
-        @type_check(None, str)
-        def _execute_sql(self, sql_str):
+        @type_check(None, str, [tuple, list])
+        def _execute_sql(self, sql_str, sql_parameter=()):
             """
             直接执行 SQL
             :param sql_str: SQL 语句字符串
+            :param sql_parameter: SQL 语句中 ? 占位符对应的参数
             :return: 执行结果
             """
             connection = self._connection_pool.get_connection()
             cursor = connection.cursor()
-            execute_result = cursor.execute(sql_str)
+            execute_result = cursor.execute(sql_str, sql_parameter)
             connection.commit()
             return execute_result
 
+        def _generate_message_uuid(self):
+            """
+            :return: 新消息的 UUID 0 号 Shard 与未分片的 Topic 相同 其他 Shard 追加 Shard 编号
+            """
+            if self._shard_id == 0:
+                return get_uuid()
+            return "%s%s%s" % (get_uuid(), SQLITE_MQ_SHARD_UUID_SEPARATOR, self._shard_id)
+
         def _get_str_column(self, column_value):
             """
             将 Unicode 转化为 UTF-8 Str
             """
             return None if column_value is None else column_value.encode("utf8")
 
+        def _get_text_column(self, column_value):
+            """
+            消息体列 Base64 存储时为 TEXT 二进制存储时为 BLOB
+            """
+            return SimpleSQLiteMQMessageCodec.get_column_value(column_value)
+
         @synchronized(mq_operation_lock_key)
-        @type_check(None, str, str)
-        def add_message(self, message_text, producer):
+        @type_check(None, str, str, int, [int, NoneType], int, [str, NoneType])
+        def add_message(self, message_text, producer, message_encoding=MESSAGE_ENCODING_BASE64, visible_time=None,
+                        priority=MESSAGE_PRIORITY_DEFAULT, idempotency_key=None):
             """
             向 MQ 中添加消息
             :param producer: 消息生产者
-            :param message_text: 提交的消息
+            :param message_text: 提交的消息 已经按 message_encoding 编码
+            :param message_encoding: 消息体存储编码
+            :param visible_time: 消息可以被消费的时间戳 为 None 或早于当前时间时 立即可以被消费
+            :param priority: 消息的优先级 数值越大越先被消费
+            :param idempotency_key: 生产者幂等键 去重窗口内已经存在时 不写入消息 直接返回原消息
+            :return: MQ Message 与 Commit Log Offset 重复发布时 Commit Log Offset 为 None
             """
-            if str_is_blank(message_text):
+            # 二进制消息体中的空白字符同样是内容 只有 None 才视为空消息
+            if message_text is None:
                 message_text = ""
 
+            # 开启事务执行 多进程同时使用相同幂等键发布时 查询与写入幂等键在同一个写事务中
+            connection, cursor = self._get_connection_with_transaction()
+
             # 记录生成时间 与 UUID
             create_time = get_current_timestamp()
-            message_uuid = get_uuid()
+            if str_not_blank(idempotency_key) and self._idempotency_window_seconds > 0:
+                mq_message = self._get_idempotent_message(cursor, idempotency_key, create_time)
+                if mq_message is not None:
+                    connection.rollback()
+                    return mq_message, None
+            message_uuid = self._generate_message_uuid()
+            # 可见时间不早于添加时间 避免延迟消息插队到已经在排队的消息之前
+            visible_time = create_time if visible_time is None else max(create_time, visible_time)
 
             # 提前生成实体 一会记录日志要用
-            mq_message = MQMessage(
+            mq_message = MQMessage.from_trusted_fields(
                 message_topic=self._message_topic,
                 message_text=message_text,
                 message_status=MESSAGE_STATUS_INIT,
@@ -124,52 +173,193 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
                 failed_times=0,
                 producer=producer,
                 consumer='',
-                message_uuid=message_uuid
+                message_uuid=message_uuid,
+                message_encoding=message_encoding,
+                visible_time=visible_time,
+                priority=priority
             )
 
-            # 拼接插入 SQL
-            add_message_sql = ADD_MESSAGE_TO_COMMON_SEGMENT_TABLE_SQL % (
-                message_text, MESSAGE_STATUS_INIT, create_time, mq_message.update_time, mq_message.expire_time,
-                producer, mq_message.consumer, message_uuid
-            )
-
-            # 开启事务执行
-            connection, cursor = self._get_connection_with_transaction()
-            execute_result = cursor.execute(add_message_sql)
+            execute_result = cursor.execute(ADD_MESSAGE_TO_COMMON_SEGMENT_TABLE_SQL, (
+                SimpleSQLiteMQMessageCodec.get_bind_parameter(message_text, message_encoding), MESSAGE_STATUS_INIT,
+                create_time, mq_message.update_time, mq_message.expire_time, producer, mq_message.consumer,
+                message_uuid, message_encoding, visible_time, priority
+            ))
 
             # 获取 Message ID
             message_id = cursor.lastrowid
             mq_message.message_id = message_id
 
             if execute_result.rowcount == 0:
-                raise Exception("[SimpleSQLiteBrokerSegment] Try add message %s, but failed. SQL: %s", add_message_sql)
+                raise Exception("[SimpleSQLiteBrokerSegment] Try add message %s, but failed." % message_uuid)
+
+            # 幂等键与消息在同一个事务中写入
+            if str_not_blank(idempotency_key) and self._idempotency_window_seconds > 0:
+                cursor.execute(ADD_IDEMPOTENCY_KEY_SQL, (
+                    idempotency_key, message_id, message_uuid, producer, create_time, visible_time, priority,
+                    message_encoding, create_time + self._idempotency_window_seconds
+                ))
 
             # 生成 Commit Log
-            log_file_name = self._write_commit(mq_message)
-            connection.commit()
+            commit_log_offset = self._commit_with_log(connection, mq_message)
+
+            return mq_message, commit_log_offset
+
+        def _get_idempotent_message(self, cursor, idempotency_key, current_timestamp):
+            """
+            在添加消息的事务中 按幂等键查询去重窗口内已经发布的原消息
+            原消息仍在 Common Segment 中时 返回当前的消息 否则返回原消息离开 Common Segment 时记录的消息
+            :rtype: MQMessage
+            """
+            execute_result = cursor.execute(GET_IDEMPOTENCY_KEY_SQL, (idempotency_key, current_timestamp)).fetchone()
+            if execute_result is None:
+                return None
+            message_uuid = self._get_str_column(execute_result[1])
+            mq_message = self._fetch_message_by_uuid_with_cursor(cursor, message_uuid)
+            if mq_message is not None:
+                return mq_message
+
+            # 升级前记录的幂等键 原消息已经离开 Common Segment 时 没有记录最终的消息体与状态
+            message_status = execute_result[8]
+            return MQMessage.from_trusted_fields(
+                message_id=execute_result[0],
+                message_topic=self._message_topic,
+                message_text=self._get_text_column(execute_result[7]) if execute_result[7] is not None else "",
+                message_status=MESSAGE_STATUS_DONE if message_status is None else message_status,
+                create_time=execute_result[3],
+                update_time=execute_result[3] if execute_result[9] is None else execute_result[9],
+                expire_time=get_int_value(execute_result[10]),
+                failed_times=get_int_value(execute_result[12]),
+                producer=self._get_str_column(execute_result[2]),
+                consumer=self._get_str_column(execute_result[11]) or '',
+                message_uuid=message_uuid,
+                message_encoding=execute_result[6],
+                visible_time=execute_result[4],
+                priority=execute_result[5]
+            )
 
-            return mq_message, log_file_name
+        def _record_idempotent_message_list(self, cursor, mq_message_list):
+            """
+            在删除消息的事务中 为带有幂等键的消息记录最终的消息体与状态
+            :param mq_message_list: 离开 Common Segment 的消息 消息体为存储编码后的内容
+            """
+            if self._idempotency_window_seconds <= 0:
+                return
+            cursor.executemany(UPDATE_IDEMPOTENCY_KEY_FINAL_MESSAGE_SQL, [(
+                SimpleSQLiteMQMessageCodec.get_bind_parameter(mq_message.message_text, mq_message.message_encoding),
+                mq_message.message_status, mq_message.update_time, mq_message.expire_time, mq_message.consumer,
+                mq_message.failed_times, mq_message.message_uuid
+            ) for mq_message in mq_message_list])
+
+        @synchronized(mq_operation_lock_key)
+        def prune_idempotency_key(self, batch_size):
+            """
+            删除一批已经超出去重窗口的幂等键
+            :return: 删除的数量
+            :rtype: int
+            """
+            return self._execute_sql(PRUNE_IDEMPOTENCY_KEY_SQL, (get_current_timestamp(), batch_size)).rowcount
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, list, str, [list, NoneType], [int, NoneType], int)
+        def add_message_list(self, message_text_list, producer, message_encoding_list=None, visible_time=None,
+                             priority=MESSAGE_PRIORITY_DEFAULT):
+            """
+            向 MQ 中批量添加消息 整批消息在同一个事务中写入 并且只生成一个 Commit Log File
+            :param message_text_list: 提交的消息列表 已经按 message_encoding_list 编码
+            :param producer: 消息生产者
+            :param message_encoding_list: 与 message_text_list 一一对应的消息体存储编码 为 None 时均为 Base64
+            :param visible_time: 整批消息可以被消费的时间戳 为 None 或早于当前时间时 立即可以被消费
+            :param priority: 整批消息的优先级 数值越大越先被消费
+            """
+            create_time = get_current_timestamp()
+            visible_time = create_time if visible_time is None else max(create_time, visible_time)
+
+            # 开启事务执行 在事务内确定起始 Message ID 保证整批 ID 连续
+            connection, cursor = self._get_connection_with_transaction()
+            max_message_id = get_int_value(cursor.execute(GET_COMMON_SEGMENT_MAX_MESSAGE_ID_SQL).fetchone()[0])
+
+            mq_message_list = list()
+            insert_parameter_list = list()
+            for index, message_text in enumerate(message_text_list):
+                if message_text is None:
+                    message_text = ""
+                message_encoding = MESSAGE_ENCODING_BASE64 if message_encoding_list is None \
+                    else message_encoding_list[index]
+                mq_message = MQMessage.from_trusted_fields(
+                    message_id=max_message_id + index + 1,
+                    message_topic=self._message_topic,
+                    message_text=message_text,
+                    message_status=MESSAGE_STATUS_INIT,
+                    create_time=create_time,
+                    update_time=create_time,
+                    expire_time=0,
+                    failed_times=0,
+                    producer=producer,
+                    consumer='',
+                    message_uuid=self._generate_message_uuid(),
+                    message_encoding=message_encoding,
+                    visible_time=visible_time,
+                    priority=priority
+                )
+                mq_message_list.append(mq_message)
+                insert_parameter_list.append((
+                    mq_message.message_id, SimpleSQLiteMQMessageCodec.get_bind_parameter(message_text, message_encoding),
+                    MESSAGE_STATUS_INIT, create_time, create_time, mq_message.expire_time, producer,
+                    mq_message.consumer, mq_message.message_uuid, message_encoding, visible_time, priority
+                ))
+
+            execute_result = cursor.executemany(ADD_MESSAGE_LIST_TO_COMMON_SEGMENT_TABLE_SQL, insert_parameter_list)
+            if execute_result.rowcount != len(insert_parameter_list):
+                connection.rollback()
+                raise Exception(
+                    "[SimpleSQLiteBrokerSegment] Try add %s messages, but only %s added." % (
+                        len(insert_parameter_list), execute_result.rowcount
+                    )
+                )
+
+            # 整批消息只生成一个 Commit Log
+            commit_log_offset = self._commit_with_log(connection, mq_message_list)
+
+            return mq_message_list, commit_log_offset
+
+        def _check_without_consumer_group_with_cursor(self, connection, cursor, operation_name):
+            """
+            在普通消费方式的写事务中校验 Segment 中不存在消费组
+            Broker 的消费组列表存在缓存 其他进程刚刚创建的消费组 需要在事务中校验才能立即生效
+            """
+            if cursor.execute(EXISTS_CONSUMER_GROUP_SQL).fetchone() is not None:
+                connection.rollback()
+                raise Exception(
+                    "[SimpleSQLiteBrokerSegment] Cannot %s of topic '%s' which has consumer groups, "
+                    "use the consumer group methods instead" % (operation_name, self._message_topic)
+                )
 
         @synchronized(mq_operation_lock_key)
         def get_message(self, consumer, max_consume_time):
             """
-            获取 MQ 中指定 topic 的消息 返回最早入库且未被消费的
+            获取 MQ 中指定 topic 的消息 返回有效优先级最高的消息中 最早可见且未被消费的
             :param consumer: 消息对应的消费者
             :param max_consume_time: 最大消费时间 如果一段时间后没有通知消费完成 那么就会将这个消息置为初始状态
             """
-            # 首先查询是否有对应的 符合条件的消息
-            execute_result = self._execute_sql(GET_COMMON_SEGMENT_MESSAGE_SQL).fetchone()
+            # 首先查询是否有对应的 符合条件的消息 查询与锁定在同一个写事务中 多进程同时出队时不会锁定同一条消息
+            current_timestamp = get_current_timestamp()
+            connection, cursor = self._get_connection_with_transaction()
+            self._check_without_consumer_group_with_cursor(connection, cursor, "get message")
+            execute_result = cursor.execute(GET_COMMON_SEGMENT_MESSAGE_SQL, (
+                current_timestamp, current_timestamp, self._priority_aging_seconds
+            )).fetchone()
 
             if execute_result is None or len(execute_result) == 0:
+                connection.rollback()
                 return None, None
 
             max_consume_time = get_int_value(max_consume_time)
             update_time = get_current_timestamp()
 
-            mq_message = MQMessage(
+            mq_message = MQMessage.from_trusted_fields(
                 message_id=execute_result[0],
                 message_topic=self._message_topic,
-                message_text=self._get_str_column(execute_result[1]),
+                message_text=self._get_text_column(execute_result[1]),
                 message_status=MESSAGE_STATUS_LOCKED,
                 create_time=execute_result[2],
                 update_time=update_time,
@@ -177,37 +367,106 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
                 expire_time=0 if max_consume_time == 0 else update_time + max_consume_time,
                 failed_times=execute_result[3],
                 producer=self._get_str_column(execute_result[4]),
-                message_uuid=self._get_str_column(execute_result[5])
+                message_uuid=self._get_str_column(execute_result[5]),
+                message_encoding=execute_result[6],
+                visible_time=execute_result[7],
+                priority=execute_result[8]
             )
 
             # 尝试锁定这条消息
-            log_file_name = self.update_message(mq_message)
-            return mq_message, log_file_name
+            self._update_message_with_cursor(connection, cursor, mq_message)
+            commit_log_offset = self._commit_with_log(connection, mq_message)
+            return mq_message, commit_log_offset
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str, int, int)
+        def get_message_list(self, consumer, max_consume_time, message_count):
+            """
+            批量获取 MQ 中指定 topic 的消息 在同一个事务中 按有效优先级查询并锁定 至多 message_count 条消息
+            整批消息共享同一个过期时间 并且只生成一个 Commit Log File
+            :param consumer: 消息对应的消费者
+            :param max_consume_time: 最大消费时间 如果一段时间后没有通知消费完成 那么就会将这些消息置为初始状态
+            :param message_count: 最多获取的消息数量
+            """
+            if message_count <= 0:
+                return list(), None
+
+            current_timestamp = get_current_timestamp()
+            connection, cursor = self._get_connection_with_transaction()
+            self._check_without_consumer_group_with_cursor(connection, cursor, "get messages")
+            execute_result = cursor.execute(GET_COMMON_SEGMENT_MESSAGE_LIST_SQL, (
+                current_timestamp, message_count, current_timestamp, self._priority_aging_seconds, message_count
+            )).fetchall()
+            if list_is_empty(execute_result):
+                connection.rollback()
+                return list(), None
+
+            update_time = get_current_timestamp()
+            expire_time = 0 if max_consume_time == 0 else update_time + max_consume_time
+            consumer = consumer if str_not_blank(consumer) else get_local_host_ip()
+
+            mq_message_list = list()
+            lock_parameter_list = list()
+            for element in execute_result:
+                mq_message_list.append(MQMessage.from_trusted_fields(
+                    message_id=element[0],
+                    message_topic=self._message_topic,
+                    message_text=self._get_text_column(element[1]),
+                    message_status=MESSAGE_STATUS_LOCKED,
+                    create_time=element[2],
+                    update_time=update_time,
+                    consumer=consumer,
+                    expire_time=expire_time,
+                    failed_times=element[3],
+                    producer=self._get_str_column(element[4]),
+                    message_uuid=self._get_str_column(element[5]),
+                    message_encoding=element[6],
+                    visible_time=element[7],
+                    priority=element[8]
+                ))
+                lock_parameter_list.append((MESSAGE_STATUS_LOCKED, update_time, consumer, expire_time, element[0]))
+
+            # 锁定这一批消息
+            lock_result = cursor.executemany(LOCK_COMMON_SEGMENT_MESSAGE_LIST_SQL, lock_parameter_list)
+            if lock_result.rowcount != len(lock_parameter_list):
+                connection.rollback()
+                raise Exception(
+                    "[SimpleSQLiteBrokerSegment] Try locked %s messages, but only %s locked." % (
+                        len(lock_parameter_list), lock_result.rowcount
+                    )
+                )
+
+            commit_log_offset = self._commit_with_log(connection, mq_message_list)
+            return mq_message_list, commit_log_offset
 
         def update_message(self, mq_message):
             """
             :type mq_message: MQMessage
             """
-            update_message_sql = UPDATE_COMMON_SEGMENT_MESSAGE_SQL % (
+            connection, cursor = self._get_connection_with_transaction()
+            self._update_message_with_cursor(connection, cursor, mq_message)
+            commit_log_offset = self._commit_with_log(connection, mq_message)
+            return commit_log_offset
+
+        def _update_message_with_cursor(self, connection, cursor, mq_message):
+            """
+            在已经开始的事务中更新消息 失败时回滚事务
+            :type mq_message: MQMessage
+            """
+            execute_result = cursor.execute(UPDATE_COMMON_SEGMENT_MESSAGE_SQL, (
                 mq_message.message_status,
                 mq_message.update_time,
                 mq_message.consumer,
                 mq_message.expire_time,
                 mq_message.failed_times,
                 mq_message.message_uuid
-            )
-            connection, cursor = self._get_connection_with_transaction()
-            execute_result = cursor.execute(update_message_sql)
+            ))
 
             if execute_result.rowcount == 0:
+                connection.rollback()
                 raise Exception(
-                    "[SimpleSQLiteBrokerSegment] Try locked message uuid %s, but failed. SQL: %s" % (
-                        mq_message.message_uuid, update_message_sql
-                    )
+                    "[SimpleSQLiteBrokerSegment] Try locked message uuid %s, but failed." % mq_message.message_uuid
                 )
-            log_file_name = self._write_commit(mq_message)
-            connection.commit()
-            return log_file_name
 
         @synchronized(mq_operation_lock_key)
         def hold_message(self, message_uuid, hold_consume_time):
@@ -216,14 +475,18 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             :param message_uuid: 消息的 UUID
             :param hold_consume_time: 在当前时间的基础上 延长的消费时间
             """
-            mq_message = self.fetch_message_by_uuid(message_uuid)  # type: MQMessage
+            # 查询与更新在同一个写事务中 其他进程不会在两者之间恢复或提交这条消息
+            connection, cursor = self._get_connection_with_transaction()
+            mq_message = self._fetch_message_by_uuid_with_cursor(cursor, message_uuid)  # type: MQMessage
             if mq_message is None:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Can't get message uuid %s status when hold message." % (
                         message_uuid)
                 )
 
             if mq_message.message_status != MESSAGE_STATUS_LOCKED:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Invalid message status '%s' status when hold message, message uuid "
                     "'%s'." % (
@@ -236,22 +499,78 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             mq_message.expire_time = new_expire_time
 
             # 更新消息
-            log_file_name = self.update_message(mq_message)
-            return mq_message, log_file_name
+            self._update_message_with_cursor(connection, cursor, mq_message)
+            commit_log_offset = self._commit_with_log(connection, mq_message)
+            return mq_message, commit_log_offset
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, list, int)
+        def hold_message_list(self, message_uuid_list, hold_consume_time):
+            """
+            批量保持消息 在同一个事务中延长仍在消费中的消息的过期时间 并且只生成一个 Commit Log 记录
+            已经不在消费中的消息 (已提交 / 已被恢复) 直接跳过 不抛出异常
+            :param message_uuid_list: 消息的 UUID 列表
+            :param hold_consume_time: 在当前时间的基础上 延长的消费时间
+            :return: 成功 Hold 的 MQ Message 列表
+            """
+            if list_is_empty(message_uuid_list):
+                return list(), None
+
+            connection, cursor = self._get_connection_with_transaction()
+            # 逐条查询 语句文本固定 可以复用缓存的预编译语句 也不受 IN 列表长度的限制
+            execute_result = list()
+            for message_uuid in message_uuid_list:
+                execute_result.extend(
+                    cursor.execute(FETCH_COMMON_LOCKED_MESSAGE_BY_UUID_SQL, (message_uuid,)).fetchall()
+                )
+            if list_is_empty(execute_result):
+                connection.rollback()
+                return list(), None
+
+            update_time = get_current_timestamp()
+            mq_message_list = list()
+            hold_parameter_list = list()
+            for element in execute_result:
+                expire_time = element[3] if hold_consume_time == 0 else update_time + hold_consume_time
+                mq_message_list.append(MQMessage.from_trusted_fields(
+                    message_id=element[0],
+                    message_topic=self._message_topic,
+                    message_text=self._get_text_column(element[1]),
+                    message_status=MESSAGE_STATUS_LOCKED,
+                    create_time=element[2],
+                    update_time=update_time,
+                    expire_time=expire_time,
+                    consumer=self._get_str_column(element[4]),
+                    failed_times=element[5],
+                    producer=self._get_str_column(element[6]),
+                    message_uuid=self._get_str_column(element[7]),
+                    message_encoding=element[8],
+                    visible_time=element[9],
+                    priority=element[10]
+                ))
+                hold_parameter_list.append((update_time, expire_time, element[0]))
+
+            cursor.executemany(HOLD_COMMON_SEGMENT_MESSAGE_LIST_SQL, hold_parameter_list)
+            commit_log_offset = self._commit_with_log(connection, mq_message_list)
+            return mq_message_list, commit_log_offset
 
         @synchronized(mq_operation_lock_key)
         def commit_message(self, message_uuid):
             """
             消费成功后提交消息
             """
-            mq_message = self.fetch_message_by_uuid(message_uuid)
+            connection, cursor = self._get_connection_with_transaction()
+            self._check_without_consumer_group_with_cursor(connection, cursor, "commit message")
+            mq_message = self._fetch_message_by_uuid_with_cursor(cursor, message_uuid)
             if mq_message is None:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Can't get message uuid %s when commit message." % (
                         message_uuid)
                 )
 
             if mq_message.message_status != MESSAGE_STATUS_LOCKED:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Invalid message status '%s' status when commit message, message id "
                     "'%s'." % (
@@ -262,8 +581,8 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             mq_message.message_status = MESSAGE_STATUS_DONE
 
             # 更新消息
-            log_file_name = self._delete_message_get_log_file(mq_message)
-            return mq_message, log_file_name
+            commit_log_offset = self._delete_message_get_commit_log_offset(connection, cursor, mq_message)
+            return mq_message, commit_log_offset
 
         @synchronized(mq_operation_lock_key)
         def delete_message(self, message_uuid, expect_message_status=None):
@@ -272,14 +591,18 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             :param message_uuid: 消息的 UUID
             :param expect_message_status: 期望消息状态 如果存在值 且 状态为期望状态时 才进行删除
             """
-            mq_message = self.fetch_message_by_uuid(message_uuid)
+            connection, cursor = self._get_connection_with_transaction()
+            self._check_without_consumer_group_with_cursor(connection, cursor, "delete message")
+            mq_message = self._fetch_message_by_uuid_with_cursor(cursor, message_uuid)
             if mq_message is None:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Can't get message uuid %s when delete message." % (
                         message_uuid)
                 )
 
             if mq_message.message_status == MESSAGE_STATUS_LOCKED:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Invalid message status is LOCKED when commit message, message id "
                     "'%s'." % (
@@ -288,27 +611,27 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
 
             mq_message.message_status = MESSAGE_STATUS_DELETE
             mq_message.update_time = get_current_timestamp()
-            log_file_name = self._delete_message_get_log_file(mq_message)
+            commit_log_offset = self._delete_message_get_commit_log_offset(connection, cursor, mq_message)
 
-            return mq_message, log_file_name
+            return mq_message, commit_log_offset
 
-        @type_check(None, MQMessage)
-        def _delete_message_get_log_file(self, mq_message):
+        def _delete_message_get_commit_log_offset(self, connection, cursor, mq_message):
             """
+            在已经开始的事务中删除消息 并提交事务
             :type mq_message: MQMessage
             """
-            connection, cursor = self._get_connection_with_transaction()
-            execute_result = cursor.execute(DELETE_COMMON_SEGMENT_MESSAGE_SQL % mq_message.message_uuid)
+            execute_result = cursor.execute(DELETE_COMMON_SEGMENT_MESSAGE_SQL, (mq_message.message_uuid,))
 
             if execute_result.rowcount == 0:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Try _delete_message message uuid %s, but failed." % (
                         mq_message.message_uuid
                     )
                 )
-            log_file_name = self._write_commit(mq_message)
-            connection.commit()
-            return log_file_name
+            self._record_idempotent_message_list(cursor, [mq_message])
+            commit_log_offset = self._commit_with_log(connection, mq_message)
+            return commit_log_offset
 
         @synchronized(mq_operation_lock_key)
         def fetch_message_by_uuid(self, message_uuid):
@@ -316,15 +639,14 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
             :rtype: MQMessage
             """
 
-            fetch_message_sql = FETCH_COMMON_MESSAGE_BY_MESSAGE_UUID_SQL % message_uuid
-            execute_result = self._execute_sql(fetch_message_sql).fetchone()
+            execute_result = self._execute_sql(FETCH_COMMON_MESSAGE_BY_MESSAGE_UUID_SQL, (message_uuid,)).fetchone()
             if execute_result is None or len(execute_result) == 0:
                 return None
 
-            return MQMessage(
+            return MQMessage.from_trusted_fields(
                 message_topic=self._message_topic,
                 message_id=execute_result[0],
-                message_text=self._get_str_column(execute_result[1]),
+                message_text=self._get_text_column(execute_result[1]),
                 message_status=execute_result[2],
                 create_time=execute_result[3],
                 update_time=execute_result[4],
@@ -332,19 +654,26 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
                 consumer=self._get_str_column(execute_result[6]),
                 failed_times=execute_result[7],
                 producer=self._get_str_column(execute_result[8]),
-                message_uuid=message_uuid
+                message_uuid=message_uuid,
+                message_encoding=execute_result[9],
+                visible_time=execute_result[10],
+                priority=execute_result[11]
             )
 
         @synchronized(mq_operation_lock_key)
         def consume_failed(self, message_uuid, max_failed_times, retry_times_interval):
-            mq_message = self.fetch_message_by_uuid(message_uuid)
+            connection, cursor = self._get_connection_with_transaction()
+            self._check_without_consumer_group_with_cursor(connection, cursor, "dealing failed message")
+            mq_message = self._fetch_message_by_uuid_with_cursor(cursor, message_uuid)
             if mq_message is None:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Can't confirm message uuid %s status when dealing failed message" % (
                         message_uuid)
                 )
 
             if mq_message.message_status != MESSAGE_STATUS_LOCKED:
+                connection.rollback()
                 raise Exception(
                     "[SimpleSQLiteBrokerSegment] Message uuid %s status %s invalid when dealing failed message." % (
                         message_uuid, mq_message.message_status
@@ -359,40 +688,216 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
                 # 达到消费重试次数上限 挂起消息
                 mq_message.failed_times = next_retry_times
                 mq_message.message_status = MESSAGE_STATUS_PENDING
-                commit_log_file = self.update_message(mq_message)
-                return mq_message, commit_log_file
+                self._update_message_with_cursor(connection, cursor, mq_message)
+                commit_log_offset = self._commit_with_log(connection, mq_message)
+                return mq_message, commit_log_offset
             else:
                 # 未达到消费上限 一定时间后重试消息
                 mq_message.message_status = MESSAGE_STATUS_FAILED
                 mq_message.failed_times = next_retry_times
                 mq_message.expire_time = current_timestamp + retry_times_interval
 
-                commit_log_file = self.update_message(mq_message)
-                return mq_message, commit_log_file
+                self._update_message_with_cursor(connection, cursor, mq_message)
+                commit_log_offset = self._commit_with_log(connection, mq_message)
+                return mq_message, commit_log_offset
+
+        @type_check(None, int)
+        def scan_pending_message_list(self, batch_size):
+            """
+            :param batch_size: 最多获取的消息数量
+            :return: 挂起的 MQ Message 列表 消息体为存储的原始内容 供转入死信队列
+            :rtype: list
+            """
+            mq_message_list = list()
+            for element in self._execute_sql(SCAN_COMMON_SEGMENT_PENDING_MESSAGE_SQL, (batch_size,)).fetchall():
+                mq_message_list.append(MQMessage.from_trusted_fields(
+                    message_id=element[0],
+                    message_topic=self._message_topic,
+                    message_text=self._get_text_column(element[1]),
+                    message_status=element[2],
+                    create_time=element[3],
+                    update_time=element[4],
+                    expire_time=element[5],
+                    consumer=self._get_str_column(element[6]),
+                    failed_times=element[7],
+                    producer=self._get_str_column(element[8]),
+                    message_uuid=self._get_str_column(element[12]),
+                    message_encoding=element[9],
+                    visible_time=element[10],
+                    priority=element[11]
+                ))
+            return mq_message_list
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, list)
+        def delete_dead_letter_message_list(self, message_uuid_list):
+            """
+            在一个事务中删除已经写入死信队列的挂起消息 并且只生成一个 Commit Log 记录
+            状态已经不是挂起的消息 (例如已经被重新锁定) 会被跳过
+            :param message_uuid_list: 消息的 UUID 列表
+            :return: 删除的 MQ Message 列表 状态为已转入死信队列 以及 Commit Log 记录的 Offset
+            """
+            current_timestamp = get_current_timestamp()
+            connection, cursor = self._get_connection_with_transaction()
+            mq_message_list = list()
+            for message_uuid in message_uuid_list:
+                mq_message = self._fetch_message_by_uuid_with_cursor(cursor, message_uuid)
+                if mq_message is None or mq_message.message_status != MESSAGE_STATUS_PENDING:
+                    continue
+                cursor.execute(DELETE_COMMON_SEGMENT_MESSAGE_SQL, (message_uuid,))
+                mq_message.message_status = MESSAGE_STATUS_DEAD_LETTER
+                mq_message.update_time = current_timestamp
+                mq_message_list.append(mq_message)
+
+            if list_is_empty(mq_message_list):
+                connection.rollback()
+                return list(), None
+            self._record_idempotent_message_list(cursor, mq_message_list)
+            commit_log_offset = self._commit_with_log(connection, mq_message_list)
+            return mq_message_list, commit_log_offset
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, list)
+        def redrive_message_list(self, mq_message_list):
+            """
+            将死信队列中的消息重新写入 整批消息在同一个事务中写入 并且只生成一个 Commit Log 记录
+            消息保留原有的 UUID 创建时间 生产者与优先级 重新分配 Message ID 立即可见 失败次数清零
+            已经存在的 UUID 会被跳过 (移回后尚未从死信队列删除时中断 重新移回的情况)
+            :param mq_message_list: 死信队列中的 MQ Message 列表 消息体为存储的原始内容
+            :return: 写入的 MQ Message 列表 以及 Commit Log 记录的 Offset
+            """
+            current_timestamp = get_current_timestamp()
+            connection, cursor = self._get_connection_with_transaction()
+            max_message_id = get_int_value(cursor.execute(GET_COMMON_SEGMENT_MAX_MESSAGE_ID_SQL).fetchone()[0])
+
+            redrive_message_list = list()
+            insert_parameter_list = list()
+            for dead_letter_message in mq_message_list:
+                if self._fetch_message_by_uuid_with_cursor(cursor, dead_letter_message.message_uuid) is not None:
+                    continue
+                message_encoding = MESSAGE_ENCODING_BASE64 if dead_letter_message.message_encoding is None \
+                    else dead_letter_message.message_encoding
+                message_text = "" if dead_letter_message.message_text is None else dead_letter_message.message_text
+                priority = MESSAGE_PRIORITY_DEFAULT if dead_letter_message.priority is None \
+                    else dead_letter_message.priority
+                mq_message = MQMessage.from_trusted_fields(
+                    message_id=max_message_id + len(redrive_message_list) + 1,
+                    message_topic=self._message_topic,
+                    message_text=message_text,
+                    message_status=MESSAGE_STATUS_INIT,
+                    create_time=dead_letter_message.create_time,
+                    update_time=current_timestamp,
+                    expire_time=0,
+                    failed_times=0,
+                    producer=dead_letter_message.producer,
+                    consumer='',
+                    message_uuid=dead_letter_message.message_uuid,
+                    message_encoding=message_encoding,
+                    visible_time=current_timestamp,
+                    priority=priority
+                )
+                redrive_message_list.append(mq_message)
+                insert_parameter_list.append((
+                    mq_message.message_id, SimpleSQLiteMQMessageCodec.get_bind_parameter(message_text, message_encoding),
+                    MESSAGE_STATUS_INIT, mq_message.create_time, current_timestamp, 0, mq_message.producer, '',
+                    mq_message.message_uuid, message_encoding, current_timestamp, priority
+                ))
+
+            if list_is_empty(redrive_message_list):
+                connection.rollback()
+                return list(), None
+            cursor.executemany(ADD_MESSAGE_LIST_TO_COMMON_SEGMENT_TABLE_SQL, insert_parameter_list)
+            commit_log_offset = self._commit_with_log(connection, redrive_message_list)
+            return redrive_message_list, commit_log_offset
 
         @synchronized(mq_operation_lock_key)
-        def recover_message(self, recover_message_uuid_list):
-            message_uuid_list_str = ""
-            for message_uuid in recover_message_uuid_list:
-                message_uuid_list_str += "'%s', " % message_uuid
+        @type_check(None, int)
+        def recover_expired_message_list(self, batch_size):
+            """
+            恢复一页租约已经过期的 消费中 / 消费失败 的消息 查询与恢复在同一个事务中完成 并且只生成一个 Commit Log 记录
+            每页单独加锁 页与页之间不阻塞正常的读写
+            :param batch_size: 一页最多恢复的消息数量
+            :return: 恢复的 MQ Message 列表 只包含同步 Ext Segment 所需的字段 以及 Commit Log 记录的 Offset
+            """
             # 加入 Expire Time < CurrentTimeStamp 的目的是
             # 当一个消费者网络断线 而后又重新连接 实际消息还是在消费 刚刚提交 Hold Message
             # 这个时候 就要防止把这个消息恢复 导致其他消费者重复消费
-            recover_message_sql = SEGMENT_RECOVER_MESSAGE_SQL % (
-                message_uuid_list_str[:-2], get_current_timestamp()
-            )
-            self._execute_sql(recover_message_sql)
+            current_timestamp = get_current_timestamp()
+            connection, cursor = self._get_connection_with_transaction()
+            execute_result = cursor.execute(
+                SCAN_COMMON_SEGMENT_EXPIRE_MESSAGE_SQL, (current_timestamp, batch_size)
+            ).fetchall()
+            if list_is_empty(execute_result):
+                connection.rollback()
+                return list(), None
+
+            mq_message_list = list()
+            recover_parameter_list = list()
+            for element in execute_result:
+                mq_message_list.append(MQMessage.from_trusted_fields(
+                    message_id=element[0],
+                    message_topic=self._message_topic,
+                    message_status=MESSAGE_STATUS_INIT,
+                    update_time=current_timestamp,
+                    consumer=self._get_str_column(element[2]),
+                    expire_time=0,
+                    failed_times=element[3],
+                    message_uuid=self._get_str_column(element[1])
+                ))
+                recover_parameter_list.append((current_timestamp, element[0], current_timestamp))
+
+            recover_result = cursor.executemany(RECOVER_COMMON_SEGMENT_MESSAGE_LIST_SQL, recover_parameter_list)
+            if recover_result.rowcount != len(recover_parameter_list):
+                connection.rollback()
+                raise Exception(
+                    "[SimpleSQLiteBrokerSegment] Try recover %s messages, but only %s recovered." % (
+                        len(recover_parameter_list), recover_result.rowcount
+                    )
+                )
+
+            commit_log_offset = self._commit_with_log(connection, mq_message_list)
+            return mq_message_list, commit_log_offset
+
+        def get_next_expire_time(self):
+            """
+            :return: 消费中 与 消费失败 的消息中 最早的过期时间 没有会过期的消息时返回 None
+            :rtype: int
+            """
+            execute_result = self._execute_sql(GET_COMMON_SEGMENT_NEXT_EXPIRE_TIME_SQL).fetchone()
+            expire_time_list = [expire_time for expire_time in execute_result if expire_time is not None]
+            return min(expire_time_list) if list_not_empty(expire_time_list) else None
+
+        def count_message_by_status(self):
+            """
+            :return: 消息状态 -> 消息数量 只包含存在消息的状态
+            :rtype: dict
+            """
+            return dict(self._execute_sql(COUNT_COMMON_SEGMENT_MESSAGE_BY_STATUS_SQL).fetchall())
+
+        def get_oldest_lease_time(self):
+            """
+            :return: 消费中的消息里 最早被锁定 (或最后一次 Hold) 的时间戳 没有消费中的消息时返回 None
+            :rtype: int
+            """
+            return self._execute_sql(GET_COMMON_SEGMENT_OLDEST_LOCKED_UPDATE_TIME_SQL).fetchone()[0]
 
         @synchronized(mq_operation_lock_key)
         def fetch_message_by_uuid(self, message_uuid):
-            execute_result = self._execute_sql(FETCH_COMMON_MESSAGE_BY_MESSAGE_UUID_SQL % message_uuid).fetchone()
+            connection = self._connection_pool.get_connection()
+            return self._fetch_message_by_uuid_with_cursor(connection.cursor(), message_uuid)
+
+        def _fetch_message_by_uuid_with_cursor(self, cursor, message_uuid):
+            """
+            :rtype: MQMessage
+            """
+            execute_result = cursor.execute(FETCH_COMMON_MESSAGE_BY_MESSAGE_UUID_SQL, (message_uuid,)).fetchone()
             if list_is_empty(execute_result):
                 return None
 
-            return MQMessage(
+            return MQMessage.from_trusted_fields(
                 message_id=execute_result[0],
                 message_topic=self._message_topic,
-                message_text=self._get_str_column(execute_result[1]),
+                message_text=self._get_text_column(execute_result[1]),
                 message_status=execute_result[2],
                 create_time=execute_result[3],
                 update_time=execute_result[4],
@@ -400,8 +905,457 @@ def _get_simple_sqlite_mq_broker_common_segment(message_topic, db_path, commit_p
                 consumer=self._get_str_column(execute_result[6]),
                 failed_times=execute_result[7],
                 producer=self._get_str_column(execute_result[8]),
-                message_uuid=message_uuid
+                message_uuid=message_uuid,
+                message_encoding=execute_result[9],
+                visible_time=execute_result[10],
+                priority=execute_result[11]
+            )
+
+        @type_check(None, int)
+        def get_next_visible_time(self, current_timestamp):
+            """
+            :param current_timestamp: 当前时间戳
+            :return: 尚未可见的延迟消息中 最早的可见时间 没有延迟消息时返回 None
+            :rtype: int
+            """
+            return self._execute_sql(GET_COMMON_SEGMENT_NEXT_VISIBLE_TIME_SQL, (current_timestamp,)).fetchone()[0]
+
+        @type_check(None, SimpleSQLiteMQMessageCodec, int)
+        def migrate_message_storage(self, message_codec, batch_size):
+            """
+            将 Base64 编码的消息体 分批重写为 message_codec 的存储方式 每批一个事务 批次之间释放锁 不阻塞正常读写
+            :param message_codec: 目标存储方式的编解码器
+            :param batch_size: 每个事务中重写的消息数量
+            :return: 重写的消息数量
+            """
+            migrate_count = 0
+            last_rowid = 0
+            while True:
+                last_rowid, batch_count = self._migrate_message_storage_batch(message_codec, last_rowid, batch_size)
+                if batch_count == 0:
+                    return migrate_count
+                migrate_count += batch_count
+
+        @synchronized(mq_operation_lock_key)
+        def _migrate_message_storage_batch(self, message_codec, last_rowid, batch_size):
+            connection, cursor = self._get_connection_with_transaction()
+            execute_result = cursor.execute(SCAN_BASE64_ENCODING_MESSAGE_SQL, (last_rowid, batch_size)).fetchall()
+            if list_is_empty(execute_result):
+                connection.rollback()
+                return last_rowid, 0
+
+            update_parameter_list = list()
+            for element in execute_result:
+                message_text, message_encoding = message_codec.encode_base64_text(self._get_text_column(element[1]))
+                update_parameter_list.append((
+                    SimpleSQLiteMQMessageCodec.get_bind_parameter(message_text, message_encoding), message_encoding,
+                    element[0]
+                ))
+            cursor.executemany(UPDATE_MESSAGE_STORAGE_SQL, update_parameter_list)
+            connection.commit()
+            return execute_result[-1][0], len(execute_result)
+
+        @synchronized(mq_operation_lock_key)
+        def vacuum_segment(self, free_page_ratio, max_vacuum_pages):
+            """
+            :return: 回收的页数
+            :rtype: int
+            """
+            return self._connection_pool.vacuum_database(free_page_ratio, max_vacuum_pages)
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str, bool)
+        def create_consumer_group(self, consumer_group, start_from_latest):
+            """
+            创建消费组 已经存在时保留原有的 Offset
+            :param start_from_latest: 为 True 时只消费创建之后发布的消息 否则从 Segment 中最早的消息开始消费
+            :return: 是否新创建
+            :rtype: bool
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            start_offset = 0
+            if start_from_latest:
+                start_offset = get_int_value(cursor.execute(GET_COMMON_SEGMENT_MAX_MESSAGE_ID_SQL).fetchone()[0])
+            current_timestamp = get_current_timestamp()
+            execute_result = cursor.execute(ADD_CONSUMER_GROUP_SQL, (
+                consumer_group, start_offset, start_offset, current_timestamp, current_timestamp
+            ))
+            connection.commit()
+            return execute_result.rowcount > 0
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str)
+        def delete_consumer_group(self, consumer_group):
+            """
+            删除消费组 以及消费组的所有租约
+            删除的是最后一个消费组时 该消费组已经提交的消息全部删除并归档 Topic 恢复为普通的消费方式后不会再次消费这些消息
+            :return: 删除的 MQ Message 列表 以及 Commit Log 记录的 Offset
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            consumer_group_row = cursor.execute(GET_CONSUMER_GROUP_SQL, (consumer_group,)).fetchone()
+            if consumer_group_row is None:
+                connection.rollback()
+                return list(), None
+            cursor.execute(DELETE_CONSUMER_GROUP_SQL, (consumer_group,))
+            cursor.execute(DELETE_CONSUMER_GROUP_LEASE_SQL, (consumer_group,))
+            if cursor.execute(GET_MIN_CONSUMER_GROUP_COMMITTED_OFFSET_SQL).fetchone()[0] is not None:
+                connection.commit()
+                return list(), None
+
+            # 已经没有其他消费组 不必再保留最大 Message ID 的消息
+            mq_message_list = self._delete_retained_message_list(
+                cursor, consumer_group_row[0], consumer_group_row[0] + 1, -1
             )
+            if list_is_empty(mq_message_list):
+                connection.commit()
+                return list(), None
+            commit_log_offset = self._commit_with_log(connection, mq_message_list)
+            return mq_message_list, commit_log_offset
+
+        def get_consumer_group_list(self):
+            """
+            :return: Segment 中所有消费组的名称
+            :rtype: list
+            """
+            return [
+                self._get_str_column(element[0]) for element in self._execute_sql(LIST_CONSUMER_GROUP_SQL).fetchall()
+            ]
+
+        def _get_consumer_group_with_cursor(self, connection, cursor, consumer_group):
+            """
+            :return: 消费组的 (committed_offset, read_offset) 消费组不存在时回滚事务并抛出异常
+            :rtype: tuple
+            """
+            consumer_group_row = cursor.execute(GET_CONSUMER_GROUP_SQL, (consumer_group,)).fetchone()
+            if consumer_group_row is None:
+                connection.rollback()
+                raise Exception("[SimpleSQLiteBrokerSegment] Consumer group '%s' of topic '%s' does not exist." % (
+                    consumer_group, self._message_topic))
+            return consumer_group_row[0], consumer_group_row[1]
+
+        def _advance_consumer_group_offset(self, cursor, consumer_group, committed_offset, read_offset,
+                                           update_time):
+            """
+            在已经开始的事务中 将 committed_offset 推进到最早一条 未提交也未挂起的消息之前 并删除越过的已提交租约
+            """
+            min_unsettled_message_id = cursor.execute(
+                GET_CONSUMER_GROUP_MIN_UNSETTLED_MESSAGE_ID_SQL, (consumer_group, committed_offset)
+            ).fetchone()[0]
+            new_committed_offset = read_offset if min_unsettled_message_id is None \
+                else min(read_offset, min_unsettled_message_id - 1)
+            new_committed_offset = max(committed_offset, new_committed_offset)
+            cursor.execute(UPDATE_CONSUMER_GROUP_OFFSET_SQL, (
+                new_committed_offset, read_offset, update_time, consumer_group
+            ))
+            cursor.execute(DELETE_CONSUMER_GROUP_DONE_LEASE_SQL, (consumer_group, new_committed_offset))
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str, str, int, int)
+        def get_group_message_list(self, consumer_group, consumer, max_consume_time, message_count):
+            """
+            消费组批量获取消息 在同一个事务中锁定至多 message_count 条消息 只写入消费组租约 不修改消息本身
+            先获取到达投递时间的租约 (延迟消息可见 / 消费失败到达重试时间 / 租约过期) 再按 Message ID 顺序读取新消息
+            读取到尚未可见的延迟消息时 记录为初始化状态的租约 到达可见时间后投递 不阻塞之后的消息
+            消费组按发布顺序消费 不使用优先级
+            :param consumer_group: 消费组名称
+            :param consumer: 消息对应的消费者
+            :param max_consume_time: 最大消费时间 租约过期后 消息会再次投递给该消费组的消费者
+            :param message_count: 最多获取的消息数量
+            :return: MQ Message 列表
+            :rtype: list
+            """
+            if message_count <= 0:
+                return list()
+
+            current_timestamp = get_current_timestamp()
+            connection, cursor = self._get_connection_with_transaction()
+            committed_offset, read_offset = self._get_consumer_group_with_cursor(connection, cursor, consumer_group)
+            expire_time = 0 if max_consume_time == 0 else current_timestamp + max_consume_time
+            consumer = consumer if str_not_blank(consumer) else get_local_host_ip()
+
+            mq_message_list = list()
+            update_parameter_list = list()
+            orphan_lease_bool = False
+            for element in cursor.execute(SCAN_CONSUMER_GROUP_DUE_LEASE_SQL, (
+                    consumer_group, current_timestamp, message_count)).fetchall():
+                if element[5] is None:
+                    # 消息已经被直接删除 视为已经提交
+                    orphan_lease_bool = True
+                    update_parameter_list.append((
+                        MESSAGE_STATUS_DONE, '', 0, element[1], current_timestamp, consumer_group, element[0]
+                    ))
+                    continue
+                mq_message_list.append(self._get_group_mq_message(
+                    element[0], element[2], element[3], element[4], element[5], element[6], element[7], element[8],
+                    consumer, expire_time, element[1], current_timestamp
+                ))
+                update_parameter_list.append((
+                    MESSAGE_STATUS_LOCKED, consumer, expire_time, element[1], current_timestamp, consumer_group,
+                    element[0]
+                ))
+
+            lease_parameter_list = list()
+            new_read_offset = read_offset
+            while len(mq_message_list) < message_count:
+                execute_result = cursor.execute(SCAN_CONSUMER_GROUP_NEW_MESSAGE_SQL, (
+                    new_read_offset, message_count - len(mq_message_list)
+                )).fetchall()
+                if list_is_empty(execute_result):
+                    break
+                for element in execute_result:
+                    new_read_offset = element[0]
+                    if element[6] > current_timestamp:
+                        # 尚未可见的延迟消息 到达可见时间后作为到期的租约投递
+                        lease_parameter_list.append((
+                            consumer_group, element[0], MESSAGE_STATUS_INIT, '', element[6], 0, current_timestamp
+                        ))
+                        continue
+                    mq_message_list.append(self._get_group_mq_message(
+                        element[0], element[1], element[2], element[3], element[4], element[5], element[6],
+                        element[7], consumer, expire_time, 0, current_timestamp
+                    ))
+                    lease_parameter_list.append((
+                        consumer_group, element[0], MESSAGE_STATUS_LOCKED, consumer, expire_time, 0,
+                        current_timestamp
+                    ))
+
+            if list_is_empty(update_parameter_list) and list_is_empty(lease_parameter_list):
+                connection.rollback()
+                return list()
+
+            cursor.executemany(UPDATE_CONSUMER_GROUP_LEASE_SQL, update_parameter_list)
+            cursor.executemany(ADD_CONSUMER_GROUP_LEASE_SQL, lease_parameter_list)
+            if orphan_lease_bool:
+                self._advance_consumer_group_offset(
+                    cursor, consumer_group, committed_offset, new_read_offset, current_timestamp
+                )
+            elif new_read_offset != read_offset:
+                cursor.execute(UPDATE_CONSUMER_GROUP_OFFSET_SQL, (
+                    committed_offset, new_read_offset, current_timestamp, consumer_group
+                ))
+            connection.commit()
+            return mq_message_list
+
+        def _get_group_mq_message(self, message_id, message_text, create_time, producer, message_uuid,
+                                  message_encoding, visible_time, priority, consumer, expire_time, failed_times,
+                                  update_time):
+            """
+            :return: 消费组中被锁定的 MQ Message 状态 消费者 过期时间与失败次数为消费组租约中的值
+            :rtype: MQMessage
+            """
+            return MQMessage.from_trusted_fields(
+                message_id=message_id,
+                message_topic=self._message_topic,
+                message_text=self._get_text_column(message_text),
+                message_status=MESSAGE_STATUS_LOCKED,
+                create_time=create_time,
+                update_time=update_time,
+                consumer=consumer,
+                expire_time=expire_time,
+                failed_times=failed_times,
+                producer=self._get_str_column(producer),
+                message_uuid=self._get_str_column(message_uuid),
+                message_encoding=message_encoding,
+                visible_time=visible_time,
+                priority=priority
+            )
+
+        def _fetch_group_lease_with_cursor(self, connection, cursor, consumer_group, message_uuid, operation_name):
+            """
+            在已经开始的事务中 查询消费组中处于消费中的消息 不存在或不在消费中时回滚事务并抛出异常
+            :param operation_name: 异常信息中的操作名称
+            :rtype: MQMessage
+            """
+            element = cursor.execute(FETCH_CONSUMER_GROUP_LEASE_BY_UUID_SQL, (message_uuid, consumer_group)).fetchone()
+            if element is None:
+                connection.rollback()
+                raise Exception(
+                    "[SimpleSQLiteBrokerSegment] Can't get message uuid %s of consumer group '%s' when %s." % (
+                        message_uuid, consumer_group, operation_name)
+                )
+            if element[1] != MESSAGE_STATUS_LOCKED:
+                connection.rollback()
+                raise Exception(
+                    "[SimpleSQLiteBrokerSegment] Invalid message status '%s' of consumer group '%s' when %s, "
+                    "message uuid '%s'." % (element[1], consumer_group, operation_name, message_uuid)
+                )
+            return MQMessage.from_trusted_fields(
+                message_id=element[0],
+                message_topic=self._message_topic,
+                message_text=self._get_text_column(element[5]),
+                message_status=element[1],
+                create_time=element[6],
+                update_time=get_current_timestamp(),
+                consumer=self._get_str_column(element[2]),
+                expire_time=element[3],
+                failed_times=element[4],
+                producer=self._get_str_column(element[7]),
+                message_uuid=message_uuid,
+                message_encoding=element[8],
+                visible_time=element[9],
+                priority=element[10]
+            )
+
+        def _update_group_lease_with_cursor(self, cursor, consumer_group, mq_message):
+            """
+            :type mq_message: MQMessage
+            """
+            cursor.execute(UPDATE_CONSUMER_GROUP_LEASE_SQL, (
+                mq_message.message_status, mq_message.consumer, mq_message.expire_time, mq_message.failed_times,
+                mq_message.update_time, consumer_group, mq_message.message_id
+            ))
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str, str, int)
+        def hold_group_message(self, consumer_group, message_uuid, hold_consume_time):
+            """
+            延长消费组中仍在消费的消息的租约
+            :param hold_consume_time: 在当前时间的基础上 延长的消费时间
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            mq_message = self._fetch_group_lease_with_cursor(
+                connection, cursor, consumer_group, message_uuid, "hold message")
+            if hold_consume_time != 0:
+                mq_message.expire_time = mq_message.update_time + hold_consume_time
+            self._update_group_lease_with_cursor(cursor, consumer_group, mq_message)
+            connection.commit()
+            return mq_message
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str, str)
+        def commit_group_message(self, consumer_group, message_uuid):
+            """
+            消费组提交消息 只更新消费组的租约与 committed_offset 消息本身由保留策略在所有消费组提交后删除
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            committed_offset, read_offset = self._get_consumer_group_with_cursor(connection, cursor, consumer_group)
+            mq_message = self._fetch_group_lease_with_cursor(
+                connection, cursor, consumer_group, message_uuid, "commit message")
+            mq_message.message_status = MESSAGE_STATUS_DONE
+            self._update_group_lease_with_cursor(cursor, consumer_group, mq_message)
+            self._advance_consumer_group_offset(
+                cursor, consumer_group, committed_offset, read_offset, mq_message.update_time
+            )
+            connection.commit()
+            return mq_message
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str, str, int, int)
+        def group_consume_failed(self, consumer_group, message_uuid, max_failed_times, retry_times_interval):
+            """
+            消费组消费失败 未达到重试次数上限时 一定时间后再次投递给该消费组
+            达到上限后在该消费组中挂起 不再阻塞 committed_offset 消息保留至 redrive_consumer_group 重新投递
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            committed_offset, read_offset = self._get_consumer_group_with_cursor(connection, cursor, consumer_group)
+            mq_message = self._fetch_group_lease_with_cursor(
+                connection, cursor, consumer_group, message_uuid, "dealing failed message")
+            mq_message.failed_times += 1
+            if mq_message.failed_times >= max_failed_times:
+                mq_message.message_status = MESSAGE_STATUS_PENDING
+                self._update_group_lease_with_cursor(cursor, consumer_group, mq_message)
+                self._advance_consumer_group_offset(
+                    cursor, consumer_group, committed_offset, read_offset, mq_message.update_time
+                )
+            else:
+                mq_message.message_status = MESSAGE_STATUS_FAILED
+                mq_message.expire_time = mq_message.update_time + retry_times_interval
+                self._update_group_lease_with_cursor(cursor, consumer_group, mq_message)
+            connection.commit()
+            return mq_message
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, str)
+        def redrive_consumer_group(self, consumer_group):
+            """
+            将消费组中挂起的消息重新投递 立即可见 失败次数清零
+            :return: 重新投递的消息数量
+            :rtype: int
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            self._get_consumer_group_with_cursor(connection, cursor, consumer_group)
+            current_timestamp = get_current_timestamp()
+            execute_result = cursor.execute(REDRIVE_CONSUMER_GROUP_LEASE_SQL, (
+                current_timestamp, current_timestamp, consumer_group
+            ))
+            connection.commit()
+            return execute_result.rowcount
+
+        @synchronized(mq_operation_lock_key)
+        @type_check(None, int)
+        def trim_consumer_group_message_list(self, batch_size):
+            """
+            删除一批所有消费组的 committed_offset 均已越过的消息 并且只生成一个 Commit Log 记录 供 Ext 同步归档
+            始终保留最大 Message ID 的消息 表为空时 SQLite 会从 1 重新分配 Message ID 各个消费组的 Offset 将会失效
+            :return: 删除的 MQ Message 列表 状态为消费完成 以及 Commit Log 记录的 Offset
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            min_committed_offset = cursor.execute(GET_MIN_CONSUMER_GROUP_COMMITTED_OFFSET_SQL).fetchone()[0]
+            if min_committed_offset is None:
+                connection.rollback()
+                return list(), None
+            max_message_id = get_int_value(cursor.execute(GET_COMMON_SEGMENT_MAX_MESSAGE_ID_SQL).fetchone()[0])
+            mq_message_list = self._delete_retained_message_list(
+                cursor, min_committed_offset, max_message_id, batch_size
+            )
+            if list_is_empty(mq_message_list):
+                connection.rollback()
+                return list(), None
+            commit_log_offset = self._commit_with_log(connection, mq_message_list)
+            return mq_message_list, commit_log_offset
+
+        def _delete_retained_message_list(self, cursor, committed_offset, max_message_id, batch_size):
+            """
+            在已经开始的事务中 删除 committed_offset 及之前 且小于 max_message_id 的消息
+            :param batch_size: 最多删除的数量 为 -1 时不限制
+            :return: 删除的 MQ Message 列表 状态为消费完成
+            :rtype: list
+            """
+            update_time = get_current_timestamp()
+            mq_message_list = list()
+            for element in cursor.execute(SCAN_CONSUMER_GROUP_RETAINED_MESSAGE_SQL, (
+                    committed_offset, max_message_id, batch_size)).fetchall():
+                mq_message_list.append(MQMessage.from_trusted_fields(
+                    message_id=element[0],
+                    message_topic=self._message_topic,
+                    message_text=self._get_text_column(element[1]),
+                    message_status=MESSAGE_STATUS_DONE,
+                    create_time=element[3],
+                    update_time=update_time,
+                    expire_time=element[5],
+                    consumer=self._get_str_column(element[6]),
+                    failed_times=element[7],
+                    producer=self._get_str_column(element[8]),
+                    message_uuid=self._get_str_column(element[12]),
+                    message_encoding=element[9],
+                    visible_time=element[10],
+                    priority=element[11]
+                ))
+            cursor.executemany(DELETE_COMMON_SEGMENT_MESSAGE_SQL, [
+                (mq_message.message_uuid,) for mq_message in mq_message_list
+            ])
+            self._record_idempotent_message_list(cursor, mq_message_list)
+            return mq_message_list
+
+        def get_consumer_group_stats(self):
+            """
+            :return: 消费组名称 -> lag 为 committed_offset 之后尚未提交也未挂起的消息数量 以及各个状态的租约数量
+            :rtype: dict
+            """
+            consumer_group_stats_dict = dict()
+            for element in self._execute_sql(LIST_CONSUMER_GROUP_SQL).fetchall():
+                consumer_group = self._get_str_column(element[0])
+                committed_offset = element[1]
+                message_count = self._execute_sql(
+                    COUNT_COMMON_SEGMENT_MESSAGE_AFTER_ID_SQL, (committed_offset,)).fetchone()[0]
+                settled_count = self._execute_sql(
+                    COUNT_CONSUMER_GROUP_SETTLED_LEASE_AFTER_ID_SQL, (consumer_group, committed_offset)).fetchone()[0]
+                consumer_group_stats = {"lag": max(0, message_count - settled_count)}
+                for message_status, count in self._execute_sql(
+                        COUNT_CONSUMER_GROUP_LEASE_BY_STATUS_SQL, (consumer_group,)).fetchall():
+                    consumer_group_stats[MESSAGE_STATUS_NAME_DICT.get(message_status, str(message_status))] = count
+                consumer_group_stats_dict[consumer_group] = consumer_group_stats
+            return consumer_group_stats_dict
 
         def get_db_path(self):
             return self._db_path
@@ -2,7 +2,7 @@
 import threading
 from abc import ABCMeta, abstractmethod
 import time
-from threading import Lock
+from threading import Lock, Condition
 
 from pava.component.mq.core.mq_message import MQMessage
 from pava.component.mq.interface.abstract_simple_sqlite_mq_broker import AbstractSimpleSQLiteMQBroker
@@ -16,40 +16,65 @@ from pava.utils.object_utils import *
 class SimpleSQLiteMQConsumer(AbstractMQConsumer):
     __metaclass__ = ABCMeta
 
-    @type_check(None, None, [int, float])
-    def __init__(self, mq_instance, hold_message_heart_beat=30):
-        # 消费的主题合集 具有顺序性
+    @type_check(None, None, [int, float], int, [int, float], int)
+    def __init__(self, mq_instance, hold_message_heart_beat=30, consume_batch_size=1, max_idle_wait_seconds=10,
+                 worker_count=1):
+        # 消费的主题合集 各个主题之间轮询消费
         self._consume_topic_list = list()
         # 消费的主题 存储对应处理消息 Handler
         self._consume_topic_handler = dict()
+        # 每个主题同时消费的消息数量上限 None 表示不限制
+        self._consume_topic_max_concurrency = dict()
+        # 每个主题正在消费的消息数量
+        self._consume_topic_in_flight_count = dict()
+        # 下一次从哪个主题开始获取消息 用于在主题之间轮询
+        self._next_topic_index = 0
 
         # 消息队列实体 或 消息队列代理对象
         self._mq_instance = mq_instance  # type: AbstractSimpleSQLiteMQBroker
 
-        # 消费消息的线程
-        self._consumer_thread = None
-        # 消费消息时 维持消费关系的线程 专门用于发送 Hold Message 请求
-        self._hold_message_thread = None
+        # 同时消费消息的线程数量 所有线程共用同一份消费定义
+        self._worker_count = 1 if worker_count < 1 else worker_count
 
         # 消费消息时 多少秒发送一次 Hold Message 请求
         self._hold_message_heart_beat = hold_message_heart_beat
         # 消息操作同步锁 用于防止 Commit 消息后 仍然 Hold 消息的情况
         self._synchronize_message_lock = Lock()
-        # 正在消费的消息 用于 Hold Message
-        self._mq_message = None
-
-        # 初始时间 当没有消息时休眠的时间 动态变化
+        # 有消息消费完成时通知 用于唤醒因所有主题都达到并发上限而等待的线程
+        self._synchronize_message_condition = Condition(self._synchronize_message_lock)
+        # 所有线程正在消费的消息 UUID -> MQ Message 用于 Hold Message
+        self._in_flight_message_dict = dict()
+
+        # 每次从 MQ 批量租约的消息数量 大于 1 时 多出的消息暂存在预取列表中 依次消费
+        self._consume_batch_size = 1 if consume_batch_size < 1 else consume_batch_size
+        # 已经租约 但还没有开始消费的消息 同样需要 Hold Message
+        self._prefetch_message_list = list()
+
+        # 没有消息时 最多等待新消息到达的秒数 期间有新消息到达会立即被唤醒
+        self._max_idle_wait_seconds = max_idle_wait_seconds
+        # MQ 实例不支持消息到达通知时 没有消息时休眠的时间 动态变化
         self._sleep_seconds = 1
         PLog.gets().info("[ConsumerTemplate] Consumer initial successfully")
 
     def start(self):
         cycle_execute("%s_hold_message" % id(self), self._hold_message, self._hold_message_heart_beat)
-        async_execute(self._work)
+        for _ in range(self._worker_count):
+            async_execute(self._work)
 
-    @type_check(None, str, None)
-    def register_consume_message(self, message_topic, handler_function):
+    @type_check(None, str, None, [int, NoneType])
+    def register_consume_message(self, message_topic, handler_function, max_concurrency=None):
+        """
+        :param message_topic: 消费的主题
+        :param handler_function: 处理消息的函数
+        :param max_concurrency: 该主题同时消费的消息数量上限 None 表示不限制
+        """
+        if max_concurrency is not None and max_concurrency < 1:
+            raise Exception("[ConsumerTemplate] Topic: %s max concurrency should be positive instead of %s" % (
+                message_topic, max_concurrency))
         self._consume_topic_list.insert(0, message_topic)
         self._consume_topic_handler[message_topic] = handler_function
+        self._consume_topic_max_concurrency[message_topic] = max_concurrency
+        self._consume_topic_in_flight_count[message_topic] = 0
 
         # 过期机制校验
         heart_beat_time = self._hold_message_heart_beat
@@ -88,14 +113,73 @@ class SimpleSQLiteMQConsumer(AbstractMQConsumer):
             if topic_handler is None:
                 raise Exception("[ConsumerTemplate] Topic '%s' have not handler to consume it" % topic)
 
+    def _topic_is_saturated(self, message_topic):
+        """
+        调用时需要持有 _synchronize_message_lock
+        """
+        max_concurrency = self._consume_topic_max_concurrency.get(message_topic, None)
+        return max_concurrency is not None and self._consume_topic_in_flight_count[message_topic] >= max_concurrency
+
     def _get_message(self):
+        with self._synchronize_message_lock:
+            # 优先消费已经预取的消息 跳过已经达到并发上限的主题
+            for index, prefetch_mq_message in enumerate(self._prefetch_message_list):
+                if not self._topic_is_saturated(prefetch_mq_message.message_topic):
+                    self._prefetch_message_list.pop(index)
+                    self._start_consume(prefetch_mq_message)
+                    return prefetch_mq_message
+
+            # 从上次获取到消息的主题的下一个主题开始 轮询所有主题 避免排在后面的主题饥饿
+            topic_count = len(self._consume_topic_list)
+            topic_index_list = [(self._next_topic_index + offset) % topic_count for offset in range(topic_count)]
+
         # 获取 message 逻辑
-        for topic in self._consume_topic_list:
-            message = self._get_mq_message_by_topic(topic)
-            if message is not None:
-                return message
+        for topic_index in topic_index_list:
+            topic = self._consume_topic_list[topic_index]
+            # 获取消息前先占用一个并发名额 避免多个线程同时超过并发上限
+            # 获取到消息时 该名额即为第一条消息的名额 直到消费完成才归还
+            with self._synchronize_message_lock:
+                if self._topic_is_saturated(topic):
+                    continue
+                self._consume_topic_in_flight_count[topic] += 1
+
+            mq_message_list = list()
+            try:
+                if self._consume_batch_size == 1:
+                    message = self._get_mq_message_by_topic(topic)
+                    if message is not None:
+                        mq_message_list.append(message)
+                else:
+                    mq_message_list = self._get_mq_message_list_by_topic(topic)
+            finally:
+                # 没有获取到消息 或获取消息时发生异常 归还占用的并发名额
+                if list_is_empty(mq_message_list):
+                    with self._synchronize_message_lock:
+                        self._consume_topic_in_flight_count[topic] -= 1
+                        self._synchronize_message_condition.notify_all()
+
+            if list_not_empty(mq_message_list):
+                with self._synchronize_message_lock:
+                    self._next_topic_index = (topic_index + 1) % len(self._consume_topic_list)
+                    self._prefetch_message_list.extend(mq_message_list[1:])
+                    self._in_flight_message_dict[mq_message_list[0].message_uuid] = mq_message_list[0]
+                return mq_message_list[0]
         return None
 
+    def _start_consume(self, mq_message):
+        """
+        调用时需要持有 _synchronize_message_lock
+        """
+        self._in_flight_message_dict[mq_message.message_uuid] = mq_message
+        self._consume_topic_in_flight_count[mq_message.message_topic] += 1
+
+    def _finish_consume(self, mq_message):
+        with self._synchronize_message_lock:
+            if self._in_flight_message_dict.pop(mq_message.message_uuid, None) is None:
+                return
+            self._consume_topic_in_flight_count[mq_message.message_topic] -= 1
+            self._synchronize_message_condition.notify_all()
+
     def _get_mq_message_by_topic(self, message_topic):
         return self._mq_instance.get_message(
             message_topic=message_topic,
@@ -103,13 +187,43 @@ class SimpleSQLiteMQConsumer(AbstractMQConsumer):
             max_consume_time=get_int_value(self._get_consume_expire_time(message_topic))
         )
 
+    def _get_mq_message_list_by_topic(self, message_topic):
+        return self._mq_instance.get_messages(
+            message_topic=message_topic,
+            message_count=self._consume_batch_size,
+            consumer=self._get_consumer(message_topic),
+            max_consume_time=get_int_value(self._get_consume_expire_time(message_topic))
+        )
+
     def _consume_or_sleep(self):
+        # 先获取消息到达版本号 再获取消息 这样不会错过两者之间到达的消息
+        arrival_version = self._mq_instance.get_message_arrival_version()
         message = self._get_message()
 
         # 消费逻辑
         if message is None:
-            # 如果没有消息 休眠时间逐渐增加
-            if self._sleep_seconds < 10:
+            with self._synchronize_message_lock:
+                available_topic_list = [
+                    topic for topic in self._consume_topic_list if not self._topic_is_saturated(topic)
+                ]
+                # 所有主题都达到并发上限 等待其他线程消费完成
+                if list_is_empty(available_topic_list):
+                    self._synchronize_message_condition.wait(self._max_idle_wait_seconds)
+                    return
+
+            if arrival_version is not None:
+                PLog.gets().debug(
+                    "[ConsumerTemplate] No message can be consumed, consumer thread will wait at most %s seconds "
+                    "for new message ..." % self._max_idle_wait_seconds
+                )
+                # 等待新消息到达 或等待超时后 继续尝试获取消息
+                self._mq_instance.wait_message_arrival(
+                    available_topic_list, arrival_version, self._max_idle_wait_seconds
+                )
+                return
+
+            # MQ 实例不支持消息到达通知 如果没有消息 休眠时间逐渐增加
+            if self._sleep_seconds < self._max_idle_wait_seconds:
                 self._sleep_seconds += 1
 
             PLog.gets().debug(
@@ -120,25 +234,17 @@ class SimpleSQLiteMQConsumer(AbstractMQConsumer):
             time_sleep(self._sleep_seconds)
             return
 
-        # 存在消息 则消费消息
+        # 存在消息 则消费消息 有消息时不再休眠 直接消费下一条
         self._handle_message(message)
-
-        # 如果有消息存在 则消费间隔变为 0.1
-        self._sleep_seconds = 0.1
-
-        # 消费间隔
-        time_sleep(self._sleep_seconds)
+        self._sleep_seconds = 0
 
     def _handle_message(self, mq_message):
         message_topic = mq_message.message_topic  # type: str
         message_uuid = mq_message.message_uuid  # type: str
         PLog.gets().info("[ConsumerTemplate] Receive message: %s from %s, handle it..." % (message_uuid, message_topic))
         try:
-            with self._synchronize_message_lock:
-                self._mq_message = mq_message
             self._do_consume(mq_message)
-            with self._synchronize_message_lock:
-                self._mq_message = None
+            self._finish_consume(mq_message)
             self._mq_instance.commit_message(message_topic, message_uuid)
         except Exception as e:
             self._do_exception(mq_message, e)
@@ -151,8 +257,7 @@ class SimpleSQLiteMQConsumer(AbstractMQConsumer):
         :type mq_message: MQMessage
         :param exception_object:
         """
-        with self._synchronize_message_lock:
-            self._mq_message = None
+        self._finish_consume(mq_message)
 
         message_topic = mq_message.message_topic
         message_uuid = mq_message.message_uuid
@@ -191,30 +296,40 @@ class SimpleSQLiteMQConsumer(AbstractMQConsumer):
 
     def _hold_message(self):
         with self._synchronize_message_lock:
-            mq_message = self._mq_message
-            if mq_message is None:
-                return
-            self._do_hold(mq_message)
-
-    def _do_hold(self, mq_message):
+            # 所有线程正在消费的消息 以及预取的消息 按主题分组 每个主题只发送一次批量 Hold Message 请求
+            hold_message_uuid_dict = dict()
+            for mq_message in list(self._in_flight_message_dict.values()) + self._prefetch_message_list:
+                hold_message_uuid_dict.setdefault(mq_message.message_topic, list()).append(mq_message.message_uuid)
+        # Hold Message 请求可能等待 SQLite 的锁 或者经过网络 不能持有同步锁 否则会阻塞所有消费线程
+        for message_topic, message_uuid_list in hold_message_uuid_dict.items():
+            self._do_hold(message_topic, message_uuid_list)
+
+    def _do_hold(self, message_topic, message_uuid_list):
         """
-        :type mq_message: MQMessage
+        :type message_topic: str
+        :type message_uuid_list: list
         """
-        message_topic = mq_message.message_topic
         try:
             consume_expire_time = self._get_consume_expire_time(message_topic)
 
             if PLog.log_level_is_debug():
-                PLog.gets().debug("[ConsumerTemplate] hold message id: %s ..." % mq_message.message_uuid)
+                PLog.gets().debug("[ConsumerTemplate] hold %s messages topic: %s ..." % (
+                    len(message_uuid_list), message_topic))
 
-            self._mq_instance.hold_message(
-                message_topic=mq_message.message_topic,
-                message_uuid=mq_message.message_uuid,
+            hold_mq_message_list = self._mq_instance.hold_messages(
+                message_topic=message_topic,
+                message_uuid_list=message_uuid_list,
                 hold_consume_time=consume_expire_time)
+            if hold_mq_message_list is not None and len(hold_mq_message_list) != len(message_uuid_list):
+                PLog.gets().warning(
+                    "[SimpleSQLiteMQConsumer] Only hold %s of %s messages topic: %s, "
+                    "others may have been recovered" % (
+                        len(hold_mq_message_list), len(message_uuid_list), message_topic)
+                )
         except Exception as e:
             PLog.gets().exception(
                 Exception(
-                    "[SimpleSQLiteMQConsumer] Occurred exception when hold message topic: %s, message_uuid: %s" % (
-                        message_topic, mq_message.message_uuid
+                    "[SimpleSQLiteMQConsumer] Occurred exception when hold messages topic: %s, message_uuid: %s" % (
+                        message_topic, ", ".join(message_uuid_list)
                     ), e)
             )
@@ -0,0 +1,182 @@
+# coding=utf-8
+import os
+import time
+from threading import Lock
+
+from pava.component.mq.core.mq_message import MQMessage
+from pava.component.mq.interface.abstract_mq_ext_segment import AbstractMQBrokerExtSegment
+from pava.entity.file_domain import FileDomain
+from pava.component.mq import *
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 死信队列
+达到消费失败次数上限的消息 从 Common Segment 移入所属 Topic 的死信队列文件 不再参与 Common Segment 的出队与状态扫描
+每个 Topic 的死信队列文件是一个独立的 Ext Segment 可以按 Ext Segment 的方式检索 也可以分批移回 Common Segment 重新消费
+"""
+
+# 死信队列文件名后缀 文件名为 Topic + 后缀
+DEAD_LETTER_FILE_SUFFIX = ".sqlite"
+
+
+class SimpleSQLiteMQDeadLetterQueue(object):
+
+    def __init__(self, dead_letter_path, generate_segment_function):
+        """
+        :param dead_letter_path: 死信队列文件所在的目录
+        :param generate_segment_function: 根据文件路径生成死信队列使用的 Ext Segment
+        """
+        self._dead_letter_path = dead_letter_path
+        self._generate_segment_function = generate_segment_function
+
+        # 避免重复打开同一个 Topic 的死信队列文件
+        self._segment_lock = Lock()
+        # Topic -> 死信队列的 Ext Segment
+        self._segment_dict = dict()
+
+        # 统计数据
+        self._metrics_lock = Lock()
+        self._dead_letter_count = 0
+        self._redrive_count = 0
+        self._redrive_batch_count = 0
+        self._redrive_seconds = 0.0
+        self._last_redrive_topic = None
+        self._last_redrive_time = None
+        self._last_redrive_count = 0
+        self._last_redrive_seconds = 0.0
+        self._last_redrive_rate = 0.0
+        self._peak_redrive_rate = 0.0
+
+        FileDomain(dead_letter_path).create_dir()
+
+    def _get_segment(self, message_topic, create_bool=True):
+        """
+        :param create_bool: 文件不存在时是否创建 为 False 时返回 None
+        :rtype: AbstractMQBrokerExtSegment
+        """
+        segment = self._segment_dict.get(message_topic, None)
+        if segment is not None:
+            return segment
+        with self._segment_lock:
+            segment = self._segment_dict.get(message_topic, None)
+            if segment is not None:
+                return segment
+            db_path = os.path.join(self._dead_letter_path, message_topic + DEAD_LETTER_FILE_SUFFIX)
+            # 多进程模式下 文件可能由其他进程创建
+            if not create_bool and not os.path.exists(db_path):
+                return None
+            segment = self._generate_segment_function(db_path)
+            self._segment_dict[message_topic] = segment
+            return segment
+
+    def get_topic_list(self):
+        """
+        :return: 存在死信队列文件的 Topic 列表
+        :rtype: list
+        """
+        return sorted([
+            file_name[:-len(DEAD_LETTER_FILE_SUFFIX)] for file_name in os.listdir(self._dead_letter_path)
+            if file_name.endswith(DEAD_LETTER_FILE_SUFFIX)
+        ])
+
+    def add_message_list(self, message_topic, mq_message_list):
+        """
+        整批消息在同一个事务中写入 已经存在的相同 UUID 的消息会被覆盖
+        :type mq_message_list: list
+        """
+        self._get_segment(message_topic).replace_message_list(mq_message_list)
+
+    def record_dead_letter(self, dead_letter_count):
+        with self._metrics_lock:
+            self._dead_letter_count += dead_letter_count
+
+    def scan_message_by_rowid(self, message_topic, last_rowid, batch_size):
+        """
+        :return: 按进入死信队列的先后顺序 返回 MQ Message 列表 以及最后一条消息的 rowid
+        :rtype: (list, int)
+        """
+        segment = self._get_segment(message_topic, create_bool=False)
+        if segment is None:
+            return list(), last_rowid
+        return segment.scan_message_by_rowid(last_rowid, batch_size)
+
+    def delete_message_list(self, message_topic, message_uuid_list):
+        segment = self._get_segment(message_topic, create_bool=False)
+        if segment is not None and list_not_empty(message_uuid_list):
+            segment.delete_message_list_by_uuid(message_topic, message_uuid_list)
+
+    def record_redrive(self, message_topic, redrive_count, batch_count, redrive_seconds):
+        redrive_rate = 0.0 if redrive_seconds <= 0 else redrive_count / redrive_seconds
+        with self._metrics_lock:
+            self._redrive_count += redrive_count
+            self._redrive_batch_count += batch_count
+            self._redrive_seconds += redrive_seconds
+            self._last_redrive_topic = message_topic
+            self._last_redrive_time = time.time()
+            self._last_redrive_count = redrive_count
+            self._last_redrive_seconds = redrive_seconds
+            self._last_redrive_rate = redrive_rate
+            self._peak_redrive_rate = max(self._peak_redrive_rate, redrive_rate)
+
+    def scan_message(self, message_topic, every_page_quantity, page_number, message_status=None,
+                     begin_time=None, end_time=None, continuation_key=None):
+        """
+        与 Ext Segment 相同 按 (update_time, rowid) 倒序检索指定 Topic 的死信队列
+        :rtype: (list, tuple)
+        """
+        segment = self._get_segment(message_topic, create_bool=False)
+        if segment is None:
+            return list(), None
+        return segment.scan_message(message_topic, every_page_quantity, page_number, message_status, begin_time,
+                                    end_time, continuation_key)
+
+    def fetch_message_by_uuid(self, message_topic, message_uuid):
+        """
+        :rtype: MQMessage
+        """
+        segment = self._get_segment(message_topic, create_bool=False)
+        if segment is None:
+            return None
+        return segment.fetch_message_by_uuid(message_uuid)
+
+    def get_topic_depth(self):
+        """
+        :return: Topic -> 死信队列中的消息数量
+        :rtype: dict
+        """
+        topic_depth_dict = dict()
+        for message_topic in self.get_topic_list():
+            topic_depth_dict[message_topic] = self._get_segment(message_topic).count_message()
+        return topic_depth_dict
+
+    def get_metrics(self):
+        """
+        :return: 转入死信队列的消息数量 移回的消息数量 移回吞吐 以及各个 Topic 死信队列中的消息数量
+        :rtype: dict
+        """
+        topic_depth_dict = self.get_topic_depth()
+        with self._metrics_lock:
+            return {
+                "dead_letter_count": self._dead_letter_count,
+                "redrive_count": self._redrive_count,
+                "redrive_batch_count": self._redrive_batch_count,
+                "redrive_seconds": self._redrive_seconds,
+                "average_redrive_rate": 0.0 if self._redrive_seconds == 0 else (
+                    self._redrive_count / self._redrive_seconds),
+                "last_redrive_topic": self._last_redrive_topic,
+                "last_redrive_time": self._last_redrive_time,
+                "last_redrive_count": self._last_redrive_count,
+                "last_redrive_seconds": self._last_redrive_seconds,
+                "last_redrive_rate": self._last_redrive_rate,
+                "peak_redrive_rate": self._peak_redrive_rate,
+                "topic_depth": topic_depth_dict,
+            }
+
+    def migrate_message_storage(self, message_codec, batch_size):
+        migrate_count = 0
+        for message_topic in self.get_topic_list():
+            migrate_count += self._get_segment(message_topic).migrate_message_storage(message_codec, batch_size)
+        return migrate_count
+
+    def get_db_path(self):
+        return self._dead_letter_path
@@ -1,14 +1,16 @@
 # coding=utf-8
 
-from pava.entity.file_domain import FileDomain
-
 from pava.component.mq.core.mq_message import MQMessage
+from pava.component.mq.core.simple_sqlite_mq_archiver import SimpleSQLiteMQArchiver
+from pava.component.mq.core.simple_sqlite_mq_commit_log import SimpleSQLiteMQCommitLog
+from pava.component.mq.core.simple_sqlite_mq_message_codec import SimpleSQLiteMQMessageCodec
 from pava.component.mq.core.sqlite_connection_pool import SQLiteConnectionPool
 from pava.component.mq.interface.abstract_mq_ext_segment import AbstractMQBrokerExtSegment
 
 from pava.component.p_log import PLog
 
 from pava.decorator.decorator_impl.synchronized_decorator import synchronized
+from pava.decorator.decorator_impl.type_check_decorator import type_check
 from pava.component.mq import *
 from pava.utils.time_utils import *
 
@@ -19,26 +21,38 @@ from pava.utils.time_utils import *
 """
 
 
-def _get_simple_sqlite_mq_broker_ext_segment(db_path, mq_operation_lock_key):
+def _get_simple_sqlite_mq_broker_ext_segment(db_path, mq_operation_lock_key, pragma_list=None):
     class SimpleSQLiteBrokerExtSegment(AbstractMQBrokerExtSegment):
 
         def __init__(self):
-            self._connection_pool = SQLiteConnectionPool(db_path, capacity=8)
+            self._connection_pool = SQLiteConnectionPool(db_path, capacity=8, pragma_list=pragma_list)
             self._db_path = db_path
 
             # 如果当前对象为 Ext 对象 则 由 Broker 注入 Archiver
-            self.archiver_segment_ = None  # type: SimpleSQLiteBrokerExtSegment
+            self.archiver_segment_ = None  # type: SimpleSQLiteMQArchiver
+            # 如果当前对象为 Ext 对象 则 由 Broker 注入 Commit Log 同步完成后标记对应的记录
+            self.commit_log_ = None  # type: SimpleSQLiteMQCommitLog
 
             # 创建 Ext 管理表 以及对应的索引
             connection, cursor = self._get_connection_with_transaction()
             cursor.execute(CREATE_SIMPLE_SQLITE_MQ_EXT_SEGMENT_TABLE_SQL)
             cursor.execute(CREATE_INDEX_UUID)
-            cursor.execute(CREATE_INDEX_MESSAGE_TOPIC)
             cursor.execute(CREATE_INDEX_EXPIRE_TIME)
             cursor.execute(CREATE_INDEX_UPDATE_TIME)
             connection.commit()
 
-            PLog.gets().info("[SimpleSQLiteBrokerExtSegment] Initial message queue storage successfully")
+            # 已有的 Segment 文件 自动升级到最新的表结构
+            before_version, after_version = self._connection_pool.upgrade_schema(EXT_SEGMENT_SCHEMA_MIGRATION_LIST)
+            if before_version != after_version:
+                PLog.gets().info(
+                    "[SimpleSQLiteBrokerExtSegment] Upgrade message queue storage '%s' schema version from %s to %s" % (
+                        self._db_path, before_version, after_version)
+                )
+
+            PLog.gets().info(
+                "[SimpleSQLiteBrokerExtSegment] Initial message queue storage '%s' successfully, "
+                "effective settings: %s" % (self._db_path, self._connection_pool.get_effective_pragma_str())
+            )
 
         def _get_connection_with_transaction(self):
             connection = self._connection_pool.get_connection()
@@ -46,34 +60,36 @@ def _get_simple_sqlite_mq_broker_ext_segment(db_path, mq_operation_lock_key):
             cursor.execute(BEGIN_TRANSACTION)
             return connection, cursor
 
-        def _execute_sql(self, sql_str):
+        def _execute_sql(self, sql_str, sql_parameter=()):
             connection = self._connection_pool.get_connection()
             cursor = connection.cursor()
-            execute_result = cursor.execute(sql_str)
+            execute_result = cursor.execute(sql_str, sql_parameter)
             connection.commit()
             return execute_result
 
-        def _delete_commit_log_file(self, commit_log_file):
-            # 执行成功后 删除 Commit Log File
-            FileDomain(commit_log_file).delete()
+        def _mark_commit_log_synced(self, commit_log_offset):
+            # 执行成功后 标记 Commit Log 记录同步完成 重放时由调用方统一标记
+            if commit_log_offset is not None and self.commit_log_ is not None:
+                self.commit_log_.commit(commit_log_offset)
 
         def _get_str_column(self, column_value):
             return None if column_value is None else column_value.encode("utf8")
 
-        @synchronized(mq_operation_lock_key)
-        def add_message(self, mq_message, commit_log_file):
+        def _get_text_column(self, column_value):
+            return SimpleSQLiteMQMessageCodec.get_column_value(column_value)
+
+        @staticmethod
+        def _get_insert_parameter(mq_message):
             """
             :type mq_message: MQMessage
-            :type commit_log_file: str
             """
-            if str_is_blank(mq_message.message_text):
-                mq_message.message_text = ""
-
-            # 拼接插入 SQL
-            add_message_sql = ADD_MESSAGE_TO_EXT_SEGMENT_TABLE_SQL % (
+            message_encoding = MESSAGE_ENCODING_BASE64 if mq_message.message_encoding is None \
+                else mq_message.message_encoding
+            return (
                 mq_message.message_id,
                 mq_message.message_topic,
-                mq_message.message_text,
+                "" if mq_message.message_text is None else SimpleSQLiteMQMessageCodec.get_bind_parameter(
+                    mq_message.message_text, message_encoding),
                 mq_message.message_status,
                 mq_message.create_time,
                 mq_message.update_time,
@@ -81,24 +97,19 @@ def _get_simple_sqlite_mq_broker_ext_segment(db_path, mq_operation_lock_key):
                 mq_message.failed_times,
                 mq_message.producer,
                 mq_message.consumer,
-                mq_message.message_uuid
+                mq_message.message_uuid,
+                message_encoding,
+                # 旧版本 Commit Log 中的消息没有可见时间 视为添加时立即可见
+                mq_message.create_time if mq_message.visible_time is None else mq_message.visible_time,
+                MESSAGE_PRIORITY_DEFAULT if mq_message.priority is None else mq_message.priority
             )
 
-            connection, cursor = self._get_connection_with_transaction()
-            cursor.execute(add_message_sql)
-            connection.commit()
-
-            # Archiver 归档时 不需要 Commit Log File
-            if str_not_blank(commit_log_file):
-                self._delete_commit_log_file(commit_log_file)
-
-        @synchronized(mq_operation_lock_key)
-        def update_message(self, mq_message, commit_log_file):
+        @staticmethod
+        def _get_update_parameter(mq_message):
             """
             :type mq_message: MQMessage
-            :type commit_log_file: str
             """
-            update_message_sql = UPDATE_EXT_SEGMENT_MESSAGE_SQL % (
+            return (
                 mq_message.message_status,
                 mq_message.update_time,
                 mq_message.consumer,
@@ -106,59 +117,168 @@ def _get_simple_sqlite_mq_broker_ext_segment(db_path, mq_operation_lock_key):
                 mq_message.failed_times,
                 mq_message.message_uuid
             )
-            self._execute_sql(update_message_sql)
-            self._delete_commit_log_file(commit_log_file)
 
         @synchronized(mq_operation_lock_key)
-        def delete_message_by_mq_message(self, mq_message, commit_log_file):
+        def add_message(self, mq_message, commit_log_offset):
             """
             :type mq_message: MQMessage
-            :type commit_log_file: str
+            :type commit_log_offset: int
             """
-            delete_message_sql = DELETE_EXT_SEGMENT_MESSAGE_SQL % (
-                mq_message.message_topic,
-                mq_message.message_uuid
-            )
+            connection, cursor = self._get_connection_with_transaction()
+            cursor.execute(ADD_MESSAGE_TO_EXT_SEGMENT_TABLE_SQL, self._get_insert_parameter(mq_message))
+            connection.commit()
+
+            # Archiver 归档时 不需要 Commit Log
+            self._mark_commit_log_synced(commit_log_offset)
+
+        @synchronized(mq_operation_lock_key)
+        def add_message_list(self, mq_message_list, commit_log_offset):
+            """
+            批量添加消息 整批消息在同一个事务中写入
+            :type mq_message_list: list
+            :type commit_log_offset: int
+            """
+            insert_parameter_list = [self._get_insert_parameter(mq_message) for mq_message in mq_message_list]
+
+            connection, cursor = self._get_connection_with_transaction()
+            cursor.executemany(ADD_MESSAGE_TO_EXT_SEGMENT_TABLE_SQL, insert_parameter_list)
+            connection.commit()
+
+            self._mark_commit_log_synced(commit_log_offset)
+
+        @synchronized(mq_operation_lock_key)
+        def update_message(self, mq_message, commit_log_offset):
+            """
+            :type mq_message: MQMessage
+            :type commit_log_offset: int
+            """
+            self._execute_sql(UPDATE_EXT_SEGMENT_MESSAGE_SQL, self._get_update_parameter(mq_message))
+            self._mark_commit_log_synced(commit_log_offset)
+
+        @synchronized(mq_operation_lock_key)
+        def update_message_list(self, mq_message_list, commit_log_offset):
+            """
+            批量更新消息 整批消息在同一个事务中更新
+            :type mq_message_list: list
+            :type commit_log_offset: int
+            """
+            update_parameter_list = [self._get_update_parameter(mq_message) for mq_message in mq_message_list]
 
             connection, cursor = self._get_connection_with_transaction()
-            cursor.execute(delete_message_sql)
+            cursor.executemany(UPDATE_EXT_SEGMENT_MESSAGE_SQL, update_parameter_list)
+            connection.commit()
+
+            self._mark_commit_log_synced(commit_log_offset)
+
+        @synchronized(mq_operation_lock_key)
+        def delete_message_by_mq_message(self, mq_message, commit_log_offset):
+            """
+            :type mq_message: MQMessage
+            :type commit_log_offset: int
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            cursor.execute(DELETE_EXT_SEGMENT_MESSAGE_SQL, (mq_message.message_topic, mq_message.message_uuid))
 
-            if self.archiver_segment_ is not None:
+            # 转入死信队列的消息 由死信队列保存 不归档
+            if self.archiver_segment_ is not None and mq_message.message_status != MESSAGE_STATUS_DEAD_LETTER:
                 self.archiver_segment_.add_message(mq_message, None)
-            self._delete_commit_log_file(commit_log_file)
             connection.commit()
+            self._mark_commit_log_synced(commit_log_offset)
+
+        @synchronized(mq_operation_lock_key)
+        def sync_message_list(self, sync_operation_list):
+            """
+            按顺序执行一批同步操作 整批操作在同一个事务中完成 删除的消息在同一批次中一次性写入 Archiver
+            连续的同类操作合并为一次 executemany
+            :param sync_operation_list: 元素为 (同步操作类型, MQ Message)
+            :type sync_operation_list: list
+            """
+            archive_message_list = list()
+            connection, cursor = self._get_connection_with_transaction()
+            try:
+                index = 0
+                while index < len(sync_operation_list):
+                    sync_operation = sync_operation_list[index][0]
+                    end_index = index
+                    while end_index < len(sync_operation_list) and sync_operation_list[end_index][0] == sync_operation:
+                        end_index += 1
+                    mq_message_list = [element[1] for element in sync_operation_list[index:end_index]]
+                    if sync_operation == EXT_SYNC_OPERATION_ADD:
+                        cursor.executemany(ADD_MESSAGE_TO_EXT_SEGMENT_TABLE_SQL,
+                                           [self._get_insert_parameter(mq_message) for mq_message in mq_message_list])
+                    elif sync_operation == EXT_SYNC_OPERATION_UPDATE:
+                        cursor.executemany(UPDATE_EXT_SEGMENT_MESSAGE_SQL,
+                                           [self._get_update_parameter(mq_message) for mq_message in mq_message_list])
+                    elif sync_operation == EXT_SYNC_OPERATION_DELETE:
+                        cursor.executemany(DELETE_EXT_SEGMENT_MESSAGE_SQL, [
+                            (mq_message.message_topic, mq_message.message_uuid) for mq_message in mq_message_list
+                        ])
+                        archive_message_list.extend([
+                            mq_message for mq_message in mq_message_list
+                            if mq_message.message_status != MESSAGE_STATUS_DEAD_LETTER
+                        ])
+                    else:
+                        raise Exception(
+                            "[SimpleSQLiteBrokerExtSegment] Unknown sync operation '%s'" % sync_operation)
+                    index = end_index
+
+                if self.archiver_segment_ is not None and list_not_empty(archive_message_list):
+                    self.archiver_segment_.add_message_list(archive_message_list, None)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
 
         def delete_message_by_uuid(self, message_topic, message_uuid):
-            delete_message_sql = DELETE_EXT_SEGMENT_MESSAGE_SQL % (
-                message_topic,
-                message_uuid
-            )
-            self._execute_sql(delete_message_sql)
+            self._execute_sql(DELETE_EXT_SEGMENT_MESSAGE_SQL, (message_topic, message_uuid))
 
-        def scan_message(self, message_topic, every_page_quantity, page_number, message_status=None):
-            every_page_quantity = get_int_value(every_page_quantity)
-            page_number = get_int_value(page_number)
-            scan_message_sql = SCAN_EXT_SEGMENT_MESSAGE_SQL % ("%s",
-                                                               page_number * every_page_quantity,
-                                                               every_page_quantity)
+        @synchronized(mq_operation_lock_key)
+        def replace_message_list(self, mq_message_list):
+            """
+            整批消息在同一个事务中 先删除相同 UUID 的消息再写入 重复写入同一批消息的结果不变
+            死信队列使用 转入死信队列中途中断后 再次转入时不会产生重复的消息
+            :type mq_message_list: list
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            try:
+                cursor.executemany(DELETE_EXT_SEGMENT_MESSAGE_SQL, [
+                    (mq_message.message_topic, mq_message.message_uuid) for mq_message in mq_message_list
+                ])
+                cursor.executemany(ADD_MESSAGE_TO_EXT_SEGMENT_TABLE_SQL,
+                                   [self._get_insert_parameter(mq_message) for mq_message in mq_message_list])
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
 
-            if str_not_blank(message_topic):
-                scan_message_sql = scan_message_sql % (WHERE_MESSAGE_TOPIC_STR % message_topic)
-            elif message_status is not None:
-                scan_message_sql = scan_message_sql % (WHERE_MESSAGE_STATUS_STR % get_int_value(message_status))
-            else:
-                scan_message_sql = scan_message_sql % ""
+        @synchronized(mq_operation_lock_key)
+        def delete_message_list_by_uuid(self, message_topic, message_uuid_list):
+            """
+            整批消息在同一个事务中删除
+            :type message_uuid_list: list
+            """
+            connection, cursor = self._get_connection_with_transaction()
+            cursor.executemany(DELETE_EXT_SEGMENT_MESSAGE_SQL, [
+                (message_topic, message_uuid) for message_uuid in message_uuid_list
+            ])
+            connection.commit()
 
+        def scan_message_by_rowid(self, last_rowid, batch_size):
+            """
+            按 rowid 顺序读取消息 即写入的先后顺序
+            :param last_rowid: 上一批最后一条消息的 rowid 从 0 开始
+            :param batch_size: 最多读取的消息数量
+            :return: MQ Message 列表 消息体为存储的原始内容 以及最后一条消息的 rowid
+            :rtype: (list, int)
+            """
             result = list()
-            execute_result = self._execute_sql(scan_message_sql).fetchall()
-            if execute_result is None or len(execute_result) == 0:
-                return result
+            execute_result = self._execute_sql(SCAN_EXT_SEGMENT_MESSAGE_BY_ROWID_SQL, (last_rowid, batch_size)).fetchall()
             for element in execute_result:
                 result.append(
-                    MQMessage(
+                    MQMessage.from_trusted_fields(
                         message_id=element[0],
                         message_topic=self._get_str_column(element[1]),
-                        message_text=self._get_str_column(element[2]),
+                        message_text=self._get_text_column(element[2]),
                         message_status=element[3],
                         create_time=element[4],
                         update_time=element[5],
@@ -166,51 +286,103 @@ def _get_simple_sqlite_mq_broker_ext_segment(db_path, mq_operation_lock_key):
                         expire_time=element[7],
                         failed_times=element[8],
                         producer=self._get_str_column(element[9]),
-                        message_uuid=self._get_str_column(element[10])
+                        message_uuid=self._get_str_column(element[10]),
+                        message_encoding=element[11],
+                        visible_time=element[12],
+                        priority=element[13]
                     )
                 )
-            return result
+            return result, last_rowid if list_is_empty(execute_result) else execute_result[-1][14]
 
-        def get_recover_message(self):
-            current_timestamp = get_current_timestamp()
-            execute_result = self._execute_sql(SCAN_EXT_SEGMENT_EXPIRE_MESSAGE_SQL % (
-                current_timestamp, MESSAGE_STATUS_LOCKED, MESSAGE_STATUS_FAILED)).fetchall()
-            if list_is_empty(execute_result):
-                return execute_result
+        def count_message(self):
+            """
+            :return: 消息数量
+            :rtype: int
+            """
+            return self._execute_sql(COUNT_EXT_SEGMENT_MESSAGE_SQL).fetchone()[0]
 
-            mq_message_list = list()
-            for element in execute_result:
-                mq_message_list.append(MQMessage(
-                    message_topic=self._get_str_column(element[0]),
-                    message_uuid=self._get_str_column(element[1])
-                ))
+        def scan_message(self, message_topic, every_page_quantity, page_number, message_status=None,
+                         begin_time=None, end_time=None, continuation_key=None):
+            """
+            按 (update_time, rowid) 倒序检索消息 筛选条件可以任意组合
+            :param page_number: 从 0 开始的页码 指定 continuation_key 时表示在其之后再跳过的页数
+            :param begin_time: 更新时间范围的起始 (包含)
+            :param end_time: 更新时间范围的结束 (不包含)
+            :param continuation_key: 上一页返回的 (update_time, rowid) 从该位置之后继续检索
+            :return: 消息列表 与 下一页的 continuation_key 已经没有更多消息时为 None
+            :rtype: (list, tuple)
+            """
+            every_page_quantity = get_int_value(every_page_quantity)
+            page_number = get_int_value(page_number)
+            # 只有筛选条件是拼接的 语句文本只有有限的几种组合 可以复用缓存的预编译语句
+            scan_condition_list = list()
+            scan_message_parameter = tuple()
+            if str_not_blank(message_topic):
+                scan_condition_list.append(SCAN_CONDITION_MESSAGE_TOPIC_STR)
+                scan_message_parameter += (message_topic,)
+            if message_status is not None:
+                scan_condition_list.append(SCAN_CONDITION_MESSAGE_STATUS_STR)
+                scan_message_parameter += (get_int_value(message_status),)
+            if begin_time is not None:
+                scan_condition_list.append(SCAN_CONDITION_BEGIN_TIME_STR)
+                scan_message_parameter += (get_int_value(begin_time),)
+            if end_time is not None:
+                scan_condition_list.append(SCAN_CONDITION_END_TIME_STR)
+                scan_message_parameter += (get_int_value(end_time),)
+            if continuation_key is not None:
+                last_update_time, last_rowid = continuation_key
+                scan_condition_list.append(SCAN_CONDITION_CONTINUATION_STR)
+                scan_message_parameter += (last_update_time, last_update_time, last_rowid)
+
+            scan_condition_str = ""
+            if list_not_empty(scan_condition_list):
+                scan_condition_str = "WHERE " + SCAN_CONDITION_SEPARATOR_STR.join(scan_condition_list)
+            scan_message_sql = SCAN_EXT_SEGMENT_MESSAGE_SQL % scan_condition_str
 
-            return mq_message_list
+            result = list()
+            execute_result = self._execute_sql(
+                scan_message_sql, scan_message_parameter + (page_number * every_page_quantity, every_page_quantity)
+            ).fetchall()
+            if execute_result is None or len(execute_result) == 0:
+                return result, None
+            for element in execute_result:
+                result.append(
+                    MQMessage.from_trusted_fields(
+                        message_id=element[0],
+                        message_topic=self._get_str_column(element[1]),
+                        message_text=self._get_text_column(element[2]),
+                        message_status=element[3],
+                        create_time=element[4],
+                        update_time=element[5],
+                        consumer=self._get_str_column(element[6]),
+                        expire_time=element[7],
+                        failed_times=element[8],
+                        producer=self._get_str_column(element[9]),
+                        message_uuid=self._get_str_column(element[10]),
+                        message_encoding=element[11],
+                        visible_time=element[12],
+                        priority=element[13]
+                    )
+                )
 
-        @synchronized(mq_operation_lock_key)
-        def do_recover_message_status(self, recover_message_uuid_list):
-            # 虽然在 Common Segment 中加入了判断条件
-            # 但是 Hold 与 Commit 都会让消息的状态最终一致
-            message_uuid_list_str = ""
-            for message_uuid in recover_message_uuid_list:
-                message_uuid_list_str += "'%s', " % message_uuid
-            recover_message_sql = SEGMENT_RECOVER_MESSAGE_SQL % (
-                message_uuid_list_str[:-2], get_current_timestamp()
-            )
-            self._execute_sql(recover_message_sql)
+            # 不足一页时 说明已经没有更多消息
+            next_continuation_key = None
+            if len(execute_result) == every_page_quantity:
+                next_continuation_key = (execute_result[-1][5], execute_result[-1][14])
+            return result, next_continuation_key
 
         def fetch_message_by_uuid(self, message_uuid):
             """
             :rtype: MQMessage
             """
-            execute_result = self._execute_sql(FETCH_EXT_MESSAGE_BY_MESSAGE_UUID_SQL % message_uuid).fetchone()
+            execute_result = self._execute_sql(FETCH_EXT_MESSAGE_BY_MESSAGE_UUID_SQL, (message_uuid,)).fetchone()
             if execute_result is None or len(execute_result) == 0:
                 return None
 
-            return MQMessage(
+            return MQMessage.from_trusted_fields(
                 message_id=execute_result[0],
                 message_topic=self._get_str_column(execute_result[1]),
-                message_text=self._get_str_column(execute_result[2]),
+                message_text=self._get_text_column(execute_result[2]),
                 message_status=execute_result[3],
                 create_time=execute_result[4],
                 update_time=execute_result[5],
@@ -218,9 +390,75 @@ def _get_simple_sqlite_mq_broker_ext_segment(db_path, mq_operation_lock_key):
                 consumer=self._get_str_column(execute_result[7]),
                 failed_times=execute_result[8],
                 producer=self._get_str_column(execute_result[9]),
-                message_uuid=message_uuid
+                message_uuid=message_uuid,
+                message_encoding=execute_result[10],
+                visible_time=execute_result[11],
+                priority=execute_result[12]
             )
 
+        @type_check(None, str)
+        def get_priority_backlog(self, message_topic):
+            """
+            统计指定 Topic 各个优先级尚未被消费的消息数量 (包含尚未到达可见时间的延迟消息)
+            Ext Segment 异步同步 统计结果可能略微落后于 Common Segment
+            :return: 优先级 -> 消息数量
+            :rtype: dict
+            """
+            result = dict()
+            for element in self._execute_sql(COUNT_EXT_SEGMENT_PRIORITY_BACKLOG_SQL, (message_topic,)).fetchall():
+                result[element[0]] = element[1]
+            return result
+
+        @type_check(None, SimpleSQLiteMQMessageCodec, int)
+        def migrate_message_storage(self, message_codec, batch_size):
+            """
+            将 Base64 编码的消息体 分批重写为 message_codec 的存储方式 每批一个事务 批次之间释放锁 不阻塞同步
+            :param message_codec: 目标存储方式的编解码器
+            :param batch_size: 每个事务中重写的消息数量
+            :return: 重写的消息数量
+            """
+            migrate_count = 0
+            last_rowid = 0
+            while True:
+                last_rowid, batch_count = self._migrate_message_storage_batch(message_codec, last_rowid, batch_size)
+                if batch_count == 0:
+                    return migrate_count
+                migrate_count += batch_count
+
+        @synchronized(mq_operation_lock_key)
+        def _migrate_message_storage_batch(self, message_codec, last_rowid, batch_size):
+            connection, cursor = self._get_connection_with_transaction()
+            execute_result = cursor.execute(SCAN_BASE64_ENCODING_MESSAGE_SQL, (last_rowid, batch_size)).fetchall()
+            if list_is_empty(execute_result):
+                connection.rollback()
+                return last_rowid, 0
+
+            update_parameter_list = list()
+            for element in execute_result:
+                message_text, message_encoding = message_codec.encode_base64_text(self._get_text_column(element[1]))
+                update_parameter_list.append((
+                    SimpleSQLiteMQMessageCodec.get_bind_parameter(message_text, message_encoding), message_encoding,
+                    element[0]
+                ))
+            cursor.executemany(UPDATE_MESSAGE_STORAGE_SQL, update_parameter_list)
+            connection.commit()
+            return execute_result[-1][0], len(execute_result)
+
+        @synchronized(mq_operation_lock_key)
+        def vacuum_segment(self, free_page_ratio, max_vacuum_pages):
+            """
+            :return: 回收的页数
+            :rtype: int
+            """
+            return self._connection_pool.vacuum_database(free_page_ratio, max_vacuum_pages)
+
+        @synchronized(mq_operation_lock_key)
+        def close(self):
+            """
+            关闭所有的连接 之后不能再使用该 Segment Archiver 删除分区文件前调用
+            """
+            self._connection_pool.close_all_connection()
+
         def get_db_path(self):
             return self._db_path
 
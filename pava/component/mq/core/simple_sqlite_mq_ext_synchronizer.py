@@ -0,0 +1,204 @@
+# coding=utf-8
+import time
+from threading import Condition
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+from pava.component.mq.core.simple_sqlite_mq_commit_log import SimpleSQLiteMQCommitLog
+from pava.component.mq.interface.abstract_mq_ext_segment import AbstractMQBrokerExtSegment
+from pava.component.p_log import PLog
+from pava.component.mq import *
+from pava.utils.async_utils import async_execute
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 Ext Segment 同步器
+Broker 的每次操作只把同步操作放入有界队列 由一个同步线程按顺序批量取出
+一批操作在 Ext Segment 中使用一个事务执行 (删除的消息同一批次写入 Archiver) 之后统一标记 Commit Log
+队列满时写入方阻塞等待 避免 Ext Segment 落后时内存无限增长
+"""
+
+
+class SimpleSQLiteMQExtSynchronizer(object):
+
+    def __init__(self, ext_segment, commit_log, max_queue_size=EXT_SYNC_MAX_QUEUE_SIZE,
+                 max_batch_size=EXT_SYNC_MAX_BATCH_SIZE):
+        """
+        :param ext_segment: 需要同步的 Ext Segment 已经注入了 Archiver
+        :param commit_log: 同步完成后标记的 Commit Log
+        :param max_queue_size: 同步队列的最大长度
+        :param max_batch_size: 一个事务中最多处理的同步操作数量
+        """
+        self._ext_segment = ext_segment  # type: AbstractMQBrokerExtSegment
+        self._commit_log = commit_log  # type: SimpleSQLiteMQCommitLog
+        self._max_queue_size = max_queue_size
+        self._max_batch_size = max_batch_size
+
+        # 元素为 (同步操作类型, MQ Message 或 MQ Message 列表, Commit Log Offset, 入队时间)
+        self._sync_queue = Queue(maxsize=max_queue_size)
+
+        # 用于等待同步完成 以及保护统计数据
+        self._sync_condition = Condition()
+        self._submitted_count = 0
+        self._applied_count = 0
+        # 正在同步的批次中 最早入队的时间
+        self._applying_enqueue_time = None
+
+        # 统计数据
+        self._batch_count = 0
+        self._last_batch_size = 0
+        self._peak_batch_size = 0
+        self._last_batch_seconds = 0.0
+        self._last_batch_lag_seconds = 0.0
+        self._peak_lag_seconds = 0.0
+        self._backpressure_count = 0
+        self._backpressure_seconds = 0.0
+        self._failed_count = 0
+
+        async_execute(self._sync_loop)
+
+    def submit(self, sync_operation, mq_message, commit_log_offset):
+        """
+        提交一次同步操作 队列满时阻塞等待
+        :param sync_operation: 同步操作类型 add / update / delete
+        :param mq_message: MQ Message 批量操作时为 MQ Message 列表
+        :type commit_log_offset: int
+        """
+        with self._sync_condition:
+            self._submitted_count += 1
+        sync_task = (sync_operation, mq_message, commit_log_offset, time.time())
+        try:
+            self._sync_queue.put_nowait(sync_task)
+        except Full:
+            wait_begin_time = time.time()
+            self._sync_queue.put(sync_task)
+            with self._sync_condition:
+                self._backpressure_count += 1
+                self._backpressure_seconds += time.time() - wait_begin_time
+
+    def _sync_loop(self):
+        while True:
+            # 阻塞等待第一个操作 然后取出队列中已有的操作 组成一批
+            sync_task_list = [self._sync_queue.get()]
+            while len(sync_task_list) < self._max_batch_size and not self._sync_queue.empty():
+                sync_task_list.append(self._sync_queue.get_nowait())
+
+            with self._sync_condition:
+                self._applying_enqueue_time = sync_task_list[0][3]
+            begin_time = time.time()
+            try:
+                self._apply_sync_task_list(sync_task_list)
+            except Exception as e:
+                PLog.gets().exception(e)
+            end_time = time.time()
+
+            with self._sync_condition:
+                self._applied_count += len(sync_task_list)
+                self._applying_enqueue_time = None
+                self._batch_count += 1
+                self._last_batch_size = len(sync_task_list)
+                self._peak_batch_size = max(self._peak_batch_size, len(sync_task_list))
+                self._last_batch_seconds = end_time - begin_time
+                self._last_batch_lag_seconds = end_time - sync_task_list[0][3]
+                self._peak_lag_seconds = max(self._peak_lag_seconds, self._last_batch_lag_seconds)
+                self._sync_condition.notify_all()
+
+    def _apply_sync_task_list(self, sync_task_list):
+        sync_operation_list = list()
+        for sync_operation, mq_message, _, _ in sync_task_list:
+            if type(mq_message) is list:
+                sync_operation_list.extend([(sync_operation, element) for element in mq_message])
+            else:
+                sync_operation_list.append((sync_operation, mq_message))
+
+        try:
+            self._ext_segment.sync_message_list(sync_operation_list)
+        except Exception as e:
+            # 整批失败时 逐个操作重新执行 避免一个异常的操作导致整批都无法同步
+            PLog.gets().warning(
+                "[SimpleSQLiteMQExtSynchronizer] Sync %s operations failed, retry one by one. Exception '%s'" % (
+                    len(sync_operation_list), str(e))
+            )
+            self._apply_sync_task_list_one_by_one(sync_task_list)
+            return
+
+        for _, _, commit_log_offset, _ in sync_task_list:
+            self._mark_commit_log_synced(commit_log_offset)
+
+    def _apply_sync_task_list_one_by_one(self, sync_task_list):
+        for sync_operation, mq_message, commit_log_offset, _ in sync_task_list:
+            mq_message_list = mq_message if type(mq_message) is list else [mq_message]
+            try:
+                self._ext_segment.sync_message_list([(sync_operation, element) for element in mq_message_list])
+            except Exception as e:
+                # 不标记 Commit Log 重启时会从 Checkpoint 重放这条记录
+                with self._sync_condition:
+                    self._failed_count += 1
+                PLog.gets().error(
+                    "[SimpleSQLiteMQExtSynchronizer] Sync operation '%s' of commit log offset %s failed. "
+                    "Exception '%s'" % (sync_operation, commit_log_offset, str(e))
+                )
+                continue
+            self._mark_commit_log_synced(commit_log_offset)
+
+    def _mark_commit_log_synced(self, commit_log_offset):
+        if commit_log_offset is not None:
+            self._commit_log.commit(commit_log_offset)
+
+    def wait_synced(self, timeout=None):
+        """
+        等待调用前提交的同步操作全部执行完成
+        :param timeout: 最长等待秒数 None 表示一直等待
+        :return: 是否全部执行完成
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._sync_condition:
+            target_count = self._submitted_count
+            while self._applied_count < target_count:
+                if deadline is None:
+                    # 不带超时的 wait 在 Python 2 中无法响应中断 这里分段等待
+                    self._sync_condition.wait(1)
+                    continue
+                remaining_seconds = deadline - time.time()
+                if remaining_seconds <= 0:
+                    return False
+                self._sync_condition.wait(remaining_seconds)
+            return True
+
+    def get_metrics(self):
+        """
+        :return: 同步队列长度 同步延迟 批次大小等统计数据
+        :rtype: dict
+        """
+        current_time = time.time()
+        # 当前最早一个尚未同步的操作 在正在同步的批次中 或在队列头部
+        oldest_enqueue_time = None
+        with self._sync_queue.mutex:
+            if len(self._sync_queue.queue) > 0:
+                oldest_enqueue_time = self._sync_queue.queue[0][3]
+        with self._sync_condition:
+            if self._applying_enqueue_time is not None:
+                oldest_enqueue_time = self._applying_enqueue_time
+            return {
+                "queue_size": self._sync_queue.qsize(),
+                "max_queue_size": self._max_queue_size,
+                "submitted_count": self._submitted_count,
+                "applied_count": self._applied_count,
+                "lag_seconds": 0.0 if oldest_enqueue_time is None else current_time - oldest_enqueue_time,
+                "last_batch_lag_seconds": self._last_batch_lag_seconds,
+                "peak_lag_seconds": self._peak_lag_seconds,
+                "batch_count": self._batch_count,
+                "last_batch_size": self._last_batch_size,
+                "peak_batch_size": self._peak_batch_size,
+                "average_batch_size": 0.0 if self._batch_count == 0 else float(
+                    self._applied_count) / self._batch_count,
+                "last_batch_seconds": self._last_batch_seconds,
+                "backpressure_count": self._backpressure_count,
+                "backpressure_seconds": self._backpressure_seconds,
+                "failed_count": self._failed_count,
+                "commit_log_lag_bytes": self._commit_log.get_end_offset() - self._commit_log.get_checkpoint_offset(),
+            }
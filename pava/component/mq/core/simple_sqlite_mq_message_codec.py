@@ -0,0 +1,146 @@
+# coding=utf-8
+import base64
+import sqlite3
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from pava.component.mq import *
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 消息体编解码
+Base64 存储方式下 消息体以 Base64 文本存入 TEXT 与旧版本写入的 Segment 保持一致
+二进制存储方式下 消息体以原始字节绑定为 BLOB 超过阈值时尝试压缩 每条消息记录自己的存储编码
+读取时根据消息的存储编码解码 同一个 Segment 中可以同时存在不同编码的消息
+"""
+
+
+class SimpleSQLiteMQMessageCodec(object):
+
+    def __init__(self, message_storage_mode=SQLITE_MQ_MESSAGE_STORAGE_BASE64, compress_algorithm=None,
+                 compress_threshold=SQLITE_MQ_COMPRESS_THRESHOLD):
+        """
+        :param message_storage_mode: 消息体存储方式 base64 / binary
+        :param compress_algorithm: 压缩算法 zlib / lzma 为 None 时不压缩 仅在二进制存储方式下可用
+        :param compress_threshold: 消息体超过该字节数时才尝试压缩
+        """
+        if message_storage_mode not in (SQLITE_MQ_MESSAGE_STORAGE_BASE64, SQLITE_MQ_MESSAGE_STORAGE_BINARY):
+            raise Exception(
+                "[SimpleSQLiteMQMessageCodec] Unknown message storage mode '%s'" % message_storage_mode
+            )
+        if compress_algorithm is not None:
+            if message_storage_mode != SQLITE_MQ_MESSAGE_STORAGE_BINARY:
+                raise Exception(
+                    "[SimpleSQLiteMQMessageCodec] Compress algorithm '%s' requires message storage mode '%s'" % (
+                        compress_algorithm, SQLITE_MQ_MESSAGE_STORAGE_BINARY)
+                )
+            if compress_algorithm not in (SQLITE_MQ_COMPRESS_ALGORITHM_ZLIB, SQLITE_MQ_COMPRESS_ALGORITHM_LZMA):
+                raise Exception(
+                    "[SimpleSQLiteMQMessageCodec] Unknown compress algorithm '%s'" % compress_algorithm
+                )
+            if compress_algorithm == SQLITE_MQ_COMPRESS_ALGORITHM_LZMA and lzma is None:
+                raise Exception(
+                    "[SimpleSQLiteMQMessageCodec] Compress algorithm 'lzma' is not available in current runtime"
+                )
+        self._message_storage_mode = message_storage_mode
+        self._compress_algorithm = compress_algorithm
+        self._compress_threshold = compress_threshold
+
+    def get_message_storage_mode(self):
+        return self._message_storage_mode
+
+    def encode(self, message_text):
+        """
+        将消息体编码为存入 Segment 的内容
+        :param message_text: 消息体 unicode 按 UTF-8 编码
+        :return: (存入 Segment 的内容, 存储编码)
+        """
+        if self._message_storage_mode == SQLITE_MQ_MESSAGE_STORAGE_BASE64:
+            return str_to_base64(message_text), MESSAGE_ENCODING_BASE64
+
+        if message_text is None:
+            message_text = ""
+        elif object_type_is_unicode(message_text):
+            message_text = message_text.encode("utf8")
+        if self._compress_algorithm is None or len(message_text) <= self._compress_threshold:
+            return message_text, MESSAGE_ENCODING_BINARY
+
+        if self._compress_algorithm == SQLITE_MQ_COMPRESS_ALGORITHM_ZLIB:
+            compressed_text, message_encoding = zlib.compress(message_text), MESSAGE_ENCODING_ZLIB
+        else:
+            compressed_text, message_encoding = lzma.compress(message_text), MESSAGE_ENCODING_LZMA
+        # 压缩后没有变小 (例如已经压缩过的数据) 按原文存储 读取时也无需解压
+        if len(compressed_text) >= len(message_text):
+            return message_text, MESSAGE_ENCODING_BINARY
+        return compressed_text, message_encoding
+
+    def encode_base64_text(self, base64_text):
+        """
+        存储方式迁移时 将 Base64 文本重新编码为当前的存储方式
+        :return: (存入 Segment 的内容, 存储编码)
+        """
+        return self.encode(self.decode(base64_text, MESSAGE_ENCODING_BASE64))
+
+    @staticmethod
+    def decode(stored_text, message_encoding):
+        """
+        将 Segment 中读取的内容 根据存储编码解码为消息体
+        :param message_encoding: 存储编码 为 None 时视为 Base64
+        """
+        if message_encoding is None or message_encoding == MESSAGE_ENCODING_BASE64:
+            if str_not_blank(stored_text):
+                return base64_to_str(stored_text)
+            return stored_text
+        if stored_text is None or message_encoding == MESSAGE_ENCODING_BINARY:
+            return stored_text
+        if message_encoding == MESSAGE_ENCODING_ZLIB:
+            return zlib.decompress(stored_text)
+        if message_encoding == MESSAGE_ENCODING_LZMA:
+            if lzma is None:
+                raise Exception(
+                    "[SimpleSQLiteMQMessageCodec] Message is compressed by 'lzma' which is not available in "
+                    "current runtime"
+                )
+            return lzma.decompress(stored_text)
+        raise Exception("[SimpleSQLiteMQMessageCodec] Unknown message encoding '%s'" % message_encoding)
+
+    @staticmethod
+    def get_bind_parameter(stored_text, message_encoding):
+        """
+        :return: 写入 SQLite 时的绑定参数 非 Base64 编码的内容绑定为 BLOB
+        """
+        if message_encoding is None or message_encoding == MESSAGE_ENCODING_BASE64:
+            return stored_text
+        return sqlite3.Binary(stored_text)
+
+    @staticmethod
+    def get_column_value(column_value):
+        """
+        :return: 从 SQLite 读取的消息体列 TEXT 读取为 str BLOB 读取为字节
+        """
+        if column_value is None:
+            return None
+        if object_type_is_unicode(column_value):
+            return column_value.encode("utf8")
+        if type(column_value) is str:
+            return column_value
+        return bytes(column_value)
+
+    @staticmethod
+    def to_json_safe(stored_text, message_encoding):
+        """
+        写入 Commit Log 等 JSON 内容时 非 Base64 编码的字节转换为 Base64 文本
+        """
+        if stored_text is None or message_encoding is None or message_encoding == MESSAGE_ENCODING_BASE64:
+            return stored_text
+        return base64.b64encode(stored_text)
+
+    @staticmethod
+    def from_json_safe(json_text, message_encoding):
+        if json_text is None or message_encoding is None or message_encoding == MESSAGE_ENCODING_BASE64:
+            return json_text
+        return base64.b64decode(json_text)
@@ -0,0 +1,209 @@
+# coding=utf-8
+import time
+from threading import Condition
+
+from pava.component.mq.core.simple_sqlite_mq_ext_synchronizer import SimpleSQLiteMQExtSynchronizer
+from pava.component.mq.interface.abstract_mq_common_segment import AbstractMQBrokerCommonSegment
+from pava.component.p_log import PLog
+from pava.component.mq import *
+from pava.utils.async_utils import async_execute
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 过期消息恢复器
+每个 Common Segment 各自沿 (message_status, expire_time) 索引 分页恢复租约已经过期的消息 直到没有过期的消息
+每个 Topic 记录最早一条租约的过期时间 恢复线程在该时间到达时立即唤醒 无需等待固定的轮询间隔
+另外每隔一个心跳周期 对所有 Segment 文件做一次全量检查 作为兜底
+多进程模式下 只有 Leader 进程恢复过期消息 其他进程的恢复线程等待成为 Leader
+"""
+
+
+class SimpleSQLiteMQMessageRecoverer(object):
+
+    def __init__(self, get_topic_segment_function, get_topic_list_function, ext_synchronizer,
+                 message_arrival_function, full_sweep_seconds, batch_size=RECOVER_MESSAGE_BATCH_SIZE,
+                 recover_enabled_function=None):
+        """
+        :param get_topic_segment_function: 根据 Topic 获取 Common Segment 分片的 Topic 每个 Shard 使用各自的 Segment Key
+        :param get_topic_list_function: 获取所有已经存在 Common Segment 文件的 Topic 列表 全量检查时使用
+        :param ext_synchronizer: 恢复的消息通过同步器同步至 Ext Segment
+        :param message_arrival_function: 恢复了消息后 通知等待该 Topic 的消费者
+        :param full_sweep_seconds: 全量检查的间隔秒数
+        :param batch_size: 每个事务中恢复的消息数量
+        :param recover_enabled_function: 返回当前是否需要恢复过期消息 为 None 时总是恢复
+        """
+        self._get_topic_segment_function = get_topic_segment_function
+        self._get_topic_list_function = get_topic_list_function
+        self._ext_synchronizer = ext_synchronizer  # type: SimpleSQLiteMQExtSynchronizer
+        self._message_arrival_function = message_arrival_function
+        self._full_sweep_seconds = full_sweep_seconds
+        self._batch_size = batch_size
+        self._recover_enabled_function = recover_enabled_function
+
+        # 用于唤醒恢复线程 以及保护过期时间提示与统计数据
+        self._recover_condition = Condition()
+        # 每个 Topic 最早一条租约的过期时间 到达该时间后恢复该 Topic
+        self._topic_next_expire_time_dict = dict()
+
+        # 统计数据
+        self._sweep_count = 0
+        self._full_sweep_count = 0
+        self._page_count = 0
+        self._recovered_count = 0
+        self._recover_seconds = 0.0
+        self._last_sweep_topic = None
+        self._last_sweep_time = None
+        self._last_sweep_recovered_count = 0
+        self._last_sweep_seconds = 0.0
+        self._last_sweep_rate = 0.0
+        self._peak_sweep_rate = 0.0
+        self._failed_count = 0
+
+        async_execute(self._recover_loop)
+
+    def notify_expire_time(self, message_topic, expire_time):
+        """
+        有消息的租约被设置或延长时调用 过期时间早于当前记录的时间时 提前唤醒恢复线程
+        提示可以比实际更早 到期后恢复线程会从索引重新读取准确的时间
+        :param expire_time: 租约过期的时间戳 不大于 1 时表示不会过期
+        """
+        if expire_time is None or expire_time <= 1:
+            return
+        with self._recover_condition:
+            next_expire_time = self._topic_next_expire_time_dict.get(message_topic, None)
+            if next_expire_time is None or expire_time < next_expire_time:
+                self._topic_next_expire_time_dict[message_topic] = expire_time
+                self._recover_condition.notify_all()
+
+    def _recover_loop(self):
+        # 启动后立即做一次全量检查 恢复上次运行时遗留的过期消息
+        next_full_sweep_time = 0
+        while True:
+            if self._recover_enabled_function is not None and not self._recover_enabled_function():
+                # 成为 Leader 后立即做一次全量检查 恢复之前由其他进程负责的过期消息
+                next_full_sweep_time = 0
+                with self._recover_condition:
+                    self._recover_condition.wait(SQLITE_MQ_LEADER_ELECTION_INTERVAL_SECONDS)
+                continue
+            message_topic_list = self._wait_recover_topic_list(next_full_sweep_time)
+            if message_topic_list is None:
+                next_full_sweep_time = time.time() + self._full_sweep_seconds
+                with self._recover_condition:
+                    self._full_sweep_count += 1
+                try:
+                    message_topic_list = self._get_topic_list_function()
+                except Exception as e:
+                    PLog.gets().exception(e)
+                    continue
+
+            for message_topic in message_topic_list:
+                try:
+                    self.recover_topic_message(message_topic)
+                except Exception as e:
+                    # 该 Topic 的过期时间提示已经移除 由下一次全量检查兜底
+                    with self._recover_condition:
+                        self._failed_count += 1
+                    PLog.gets().error(
+                        "[SimpleSQLiteMQMessageRecoverer] Recover message topic '%s' failed. Exception '%s'" % (
+                            message_topic, str(e))
+                    )
+
+    def _wait_recover_topic_list(self, next_full_sweep_time):
+        """
+        等待到有 Topic 的租约过期 或者到达全量检查的时间
+        :return: 需要恢复的 Topic 列表 需要全量检查时返回 None
+        """
+        with self._recover_condition:
+            while True:
+                current_time = time.time()
+                if current_time >= next_full_sweep_time:
+                    return None
+
+                # 过期时间为整秒 恢复条件为 expire_time < 当前时间戳 所以在下一秒才能恢复
+                message_topic_list = [
+                    message_topic for message_topic, expire_time in self._topic_next_expire_time_dict.items()
+                    if expire_time + 1 <= current_time
+                ]
+                if list_not_empty(message_topic_list):
+                    return message_topic_list
+
+                wait_seconds = next_full_sweep_time - current_time
+                if len(self._topic_next_expire_time_dict) > 0:
+                    wait_seconds = min(wait_seconds, min(self._topic_next_expire_time_dict.values()) + 1 - current_time)
+                self._recover_condition.wait(wait_seconds)
+
+    def recover_topic_message(self, message_topic):
+        """
+        分页恢复指定 Topic 中所有租约已经过期的消息 直到没有过期的消息 之后重新读取下一次过期的时间
+        :return: 恢复的消息数量
+        :rtype: int
+        """
+        message_topic_segment = self._get_topic_segment_function(message_topic)  # type: AbstractMQBrokerCommonSegment
+        with self._recover_condition:
+            self._topic_next_expire_time_dict.pop(message_topic, None)
+
+        begin_time = time.time()
+        page_count = 0
+        recovered_count = 0
+        while True:
+            mq_message_list, commit_log_offset = message_topic_segment.recover_expired_message_list(self._batch_size)
+            if list_is_empty(mq_message_list):
+                break
+            page_count += 1
+            recovered_count += len(mq_message_list)
+            self._ext_synchronizer.submit(EXT_SYNC_OPERATION_UPDATE, mq_message_list, commit_log_offset)
+            # 每恢复一页就通知消费者 不必等待整个 Topic 恢复完成
+            self._message_arrival_function([message_topic])
+            if len(mq_message_list) < self._batch_size:
+                break
+        end_time = time.time()
+
+        self.notify_expire_time(message_topic, message_topic_segment.get_next_expire_time())
+
+        sweep_seconds = end_time - begin_time
+        sweep_rate = recovered_count / sweep_seconds if sweep_seconds > 0 else 0.0
+        with self._recover_condition:
+            self._sweep_count += 1
+            self._page_count += page_count
+            self._recovered_count += recovered_count
+            self._recover_seconds += sweep_seconds
+            self._last_sweep_topic = message_topic
+            self._last_sweep_time = end_time
+            self._last_sweep_recovered_count = recovered_count
+            self._last_sweep_seconds = sweep_seconds
+            self._last_sweep_rate = sweep_rate
+            self._peak_sweep_rate = max(self._peak_sweep_rate, sweep_rate)
+
+        if recovered_count > 0:
+            PLog.gets().info(
+                "[SimpleSQLiteMQMessageRecoverer] Recover %s messages of topic '%s' in %s pages, %.3f seconds" % (
+                    recovered_count, message_topic, page_count, sweep_seconds)
+            )
+        return recovered_count
+
+    def get_metrics(self):
+        """
+        :return: 恢复的消息数量 恢复吞吐 下一次过期时间等统计数据
+        :rtype: dict
+        """
+        with self._recover_condition:
+            next_expire_time = None
+            if len(self._topic_next_expire_time_dict) > 0:
+                next_expire_time = min(self._topic_next_expire_time_dict.values())
+            return {
+                "sweep_count": self._sweep_count,
+                "full_sweep_count": self._full_sweep_count,
+                "page_count": self._page_count,
+                "recovered_count": self._recovered_count,
+                "recover_seconds": self._recover_seconds,
+                "average_rate": 0.0 if self._recover_seconds == 0 else self._recovered_count / self._recover_seconds,
+                "last_sweep_topic": self._last_sweep_topic,
+                "last_sweep_time": self._last_sweep_time,
+                "last_sweep_recovered_count": self._last_sweep_recovered_count,
+                "last_sweep_seconds": self._last_sweep_seconds,
+                "last_sweep_rate": self._last_sweep_rate,
+                "peak_sweep_rate": self._peak_sweep_rate,
+                "pending_topic_count": len(self._topic_next_expire_time_dict),
+                "next_expire_time": next_expire_time,
+                "failed_count": self._failed_count,
+            }
@@ -0,0 +1,217 @@
+# coding=utf-8
+import bisect
+import time
+from threading import Lock
+
+from pava.component.mq import *
+
+"""
+简易的基于 SQLite 的消息队列 运维指标
+计数器与直方图按 (指标名称, Topic) 统计 位于出入队的热路径上 每次记录只有一次加锁与字典操作
+Broker 的 stats() 将计数器 直方图 与各个组件的统计数据合并为一份快照 快照可以转换为 Prometheus 文本格式
+"""
+
+
+class SimpleSQLiteMQMetricsRegistry(object):
+
+    def __init__(self, latency_bucket_list=SQLITE_MQ_METRICS_LATENCY_BUCKET_LIST):
+        """
+        :param latency_bucket_list: 直方图各个桶的上限秒数 升序排列 最后隐含一个 +Inf 桶
+        """
+        self._latency_bucket_list = list(latency_bucket_list)
+        self._start_time = time.time()
+
+        self._lock = Lock()
+        # (指标名称, Topic) -> 累计值
+        self._counter_dict = dict()
+        # (指标名称, Topic) -> [各个桶的数量 (非累计), 总和, 最大值]
+        self._histogram_dict = dict()
+
+    def get_start_time(self):
+        return self._start_time
+
+    def increase(self, metric_name, message_topic, value=1):
+        counter_key = (metric_name, message_topic)
+        with self._lock:
+            self._counter_dict[counter_key] = self._counter_dict.get(counter_key, 0) + value
+
+    def observe(self, metric_name, message_topic, seconds):
+        histogram_key = (metric_name, message_topic)
+        bucket_index = bisect.bisect_left(self._latency_bucket_list, seconds)
+        with self._lock:
+            histogram = self._histogram_dict.get(histogram_key, None)
+            if histogram is None:
+                histogram = [[0] * (len(self._latency_bucket_list) + 1), 0.0, 0.0]
+                self._histogram_dict[histogram_key] = histogram
+            histogram[0][bucket_index] += 1
+            histogram[1] += seconds
+            if seconds > histogram[2]:
+                histogram[2] = seconds
+
+    def get_counter_dict(self):
+        """
+        :return: 指标名称 -> Topic -> 累计值
+        :rtype: dict
+        """
+        counter_dict = dict()
+        with self._lock:
+            for (metric_name, message_topic), value in self._counter_dict.items():
+                counter_dict.setdefault(metric_name, dict())[message_topic] = value
+        return counter_dict
+
+    def get_histogram_dict(self):
+        """
+        :return: 指标名称 -> Topic -> 直方图快照
+            bucket_list 为 Prometheus 格式的累计桶 [(上限秒数, 不超过该上限的数量)] 最后一个上限为 None 表示 +Inf
+            p50 / p99 / p999 为所在桶的上限 落在 +Inf 桶时为观测到的最大值
+        :rtype: dict
+        """
+        with self._lock:
+            histogram_item_list = [
+                (histogram_key, list(histogram[0]), histogram[1], histogram[2])
+                for histogram_key, histogram in self._histogram_dict.items()
+            ]
+        histogram_dict = dict()
+        for (metric_name, message_topic), bucket_count_list, total_seconds, max_seconds in histogram_item_list:
+            count = sum(bucket_count_list)
+            bucket_list = list()
+            cumulative_count = 0
+            for index, bucket_count in enumerate(bucket_count_list):
+                cumulative_count += bucket_count
+                upper_bound = self._latency_bucket_list[index] if index < len(self._latency_bucket_list) else None
+                bucket_list.append((upper_bound, cumulative_count))
+            histogram_dict.setdefault(metric_name, dict())[message_topic] = {
+                "count": count,
+                "sum": total_seconds,
+                "max": max_seconds,
+                "bucket_list": bucket_list,
+                "p50": self._estimate_percentile(bucket_list, count, max_seconds, 0.5),
+                "p99": self._estimate_percentile(bucket_list, count, max_seconds, 0.99),
+                "p999": self._estimate_percentile(bucket_list, count, max_seconds, 0.999),
+            }
+        return histogram_dict
+
+    @staticmethod
+    def _estimate_percentile(bucket_list, count, max_seconds, ratio):
+        if count == 0:
+            return 0.0
+        rank = ratio * count
+        for upper_bound, cumulative_count in bucket_list:
+            if cumulative_count >= rank:
+                return max_seconds if upper_bound is None else min(upper_bound, max_seconds)
+        return max_seconds
+
+
+def _escape_label_value(label_value):
+    return str(label_value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_sample(metric_name, label_list, value):
+    """
+    :param label_list: [(标签名, 标签值)]
+    """
+    if type(value) is bool:
+        value = 1 if value else 0
+    label_str = ""
+    if len(label_list) > 0:
+        label_str = "{%s}" % ",".join(
+            ["%s=\"%s\"" % (label_name, _escape_label_value(label_value)) for label_name, label_value in label_list]
+        )
+    return "%s%s%s %s" % (SQLITE_MQ_METRICS_PROMETHEUS_PREFIX, metric_name, label_str, repr(float(value)))
+
+
+def _append_metric(line_list, metric_name, metric_type, help_str, sample_list):
+    """
+    :param sample_list: [(标签列表, 值)] 为空时不输出该指标
+    """
+    if len(sample_list) == 0:
+        return
+    line_list.append("# HELP %s%s %s" % (SQLITE_MQ_METRICS_PROMETHEUS_PREFIX, metric_name, help_str))
+    line_list.append("# TYPE %s%s %s" % (SQLITE_MQ_METRICS_PROMETHEUS_PREFIX, metric_name, metric_type))
+    for label_list, value in sample_list:
+        line_list.append(_format_sample(metric_name, label_list, value))
+
+
+def _append_component_metrics(line_list, component_name, component_metrics_dict):
+    """
+    组件统计数据中的数值 各自作为一个 Gauge 输出 其他类型 (Topic 名称 时间为 None 等) 跳过
+    """
+    for metric_key in sorted(component_metrics_dict.keys()):
+        value = component_metrics_dict[metric_key]
+        if type(value) not in (int, long, float, bool):
+            continue
+        _append_metric(line_list, "%s_%s" % (component_name, metric_key), "gauge",
+                       "%s metrics '%s'" % (component_name, metric_key), [([], value)])
+
+
+def stats_to_prometheus_text(stats_dict):
+    """
+    将 Broker stats() 返回的快照转换为 Prometheus 文本格式 (0.0.4)
+    :type stats_dict: dict
+    :rtype: str
+    """
+    line_list = list()
+    topic_stats_dict = stats_dict["topic"]
+    topic_list = sorted(topic_stats_dict.keys())
+
+    _append_metric(line_list, "uptime_seconds", "gauge", "Seconds since the metrics registry was created",
+                   [([], stats_dict["uptime_seconds"])])
+    _append_metric(line_list, "backlog", "gauge", "Messages in the common segments by status", [
+        ([("topic", message_topic), ("status", status_name)], count)
+        for message_topic in topic_list
+        for status_name, count in sorted(topic_stats_dict[message_topic]["backlog"].items())
+    ])
+    _append_metric(line_list, "oldest_lease_age_seconds", "gauge", "Age of the oldest lease held by a consumer", [
+        ([("topic", message_topic)], topic_stats_dict[message_topic]["oldest_lease_age_seconds"])
+        for message_topic in topic_list if topic_stats_dict[message_topic]["oldest_lease_age_seconds"] is not None
+    ])
+    consumer_group_item_list = [
+        (message_topic, consumer_group, consumer_group_stats)
+        for message_topic in topic_list
+        for consumer_group, consumer_group_stats in sorted(topic_stats_dict[message_topic]["consumer_group"].items())
+    ]
+    _append_metric(line_list, "consumer_group_lag", "gauge", "Messages not yet committed by the consumer group", [
+        ([("topic", message_topic), ("group", consumer_group)], consumer_group_stats["lag"])
+        for message_topic, consumer_group, consumer_group_stats in consumer_group_item_list
+    ])
+    _append_metric(line_list, "consumer_group_leases", "gauge", "Consumer group leases by status", [
+        ([("topic", message_topic), ("group", consumer_group), ("status", status_name)], count)
+        for message_topic, consumer_group, consumer_group_stats in consumer_group_item_list
+        for status_name, count in sorted(consumer_group_stats.items()) if status_name != "lag"
+    ])
+    for counter_name in SQLITE_MQ_METRIC_COUNTER_LIST:
+        _append_metric(line_list, counter_name + "_total", "counter", "Messages %s by this process" % counter_name, [
+            ([("topic", message_topic)], topic_stats_dict[message_topic][counter_name + "_count"])
+            for message_topic in topic_list
+        ])
+
+    histogram_line_list = list()
+    for message_topic, histogram in sorted(stats_dict[SQLITE_MQ_METRIC_TRANSACTION_SECONDS].items()):
+        for upper_bound, cumulative_count in histogram["bucket_list"]:
+            histogram_line_list.append(_format_sample(
+                SQLITE_MQ_METRIC_TRANSACTION_SECONDS + "_bucket",
+                [("topic", message_topic), ("le", "+Inf" if upper_bound is None else repr(upper_bound))],
+                cumulative_count
+            ))
+        histogram_line_list.append(_format_sample(
+            SQLITE_MQ_METRIC_TRANSACTION_SECONDS + "_sum", [("topic", message_topic)], histogram["sum"]))
+        histogram_line_list.append(_format_sample(
+            SQLITE_MQ_METRIC_TRANSACTION_SECONDS + "_count", [("topic", message_topic)], histogram["count"]))
+    if len(histogram_line_list) > 0:
+        line_list.append("# HELP %s%s Common segment transaction commit latency, including commit log fsync" % (
+            SQLITE_MQ_METRICS_PROMETHEUS_PREFIX, SQLITE_MQ_METRIC_TRANSACTION_SECONDS))
+        line_list.append("# TYPE %s%s histogram" % (
+            SQLITE_MQ_METRICS_PROMETHEUS_PREFIX, SQLITE_MQ_METRIC_TRANSACTION_SECONDS))
+        line_list.extend(histogram_line_list)
+
+    _append_metric(line_list, "commit_log_fsync_total", "counter", "Commit log fsync calls of this process",
+                   [([], stats_dict["commit_log_fsync_count"])])
+    _append_component_metrics(line_list, "ext_sync", stats_dict["ext_sync"])
+    _append_component_metrics(line_list, "recover", stats_dict["recover"])
+    dead_letter_dict = dict(stats_dict["dead_letter"])
+    topic_depth_dict = dead_letter_dict.pop("topic_depth", dict())
+    _append_metric(line_list, "dead_letter_depth", "gauge", "Messages in the dead letter queue", [
+        ([("topic", message_topic)], depth) for message_topic, depth in sorted(topic_depth_dict.items())
+    ])
+    _append_component_metrics(line_list, "dead_letter", dead_letter_dict)
+    return "\n".join(line_list) + "\n"
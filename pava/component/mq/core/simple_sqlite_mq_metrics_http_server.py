@@ -0,0 +1,82 @@
+# coding=utf-8
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from pava.component.mq import *
+from pava.component.mq.core.simple_sqlite_mq_metrics import stats_to_prometheus_text
+from pava.component.p_log import PLog
+from pava.utils.async_utils import async_execute
+
+"""
+简易的基于 SQLite 的消息队列 运维指标 HTTP 接口
+GET /metrics 时调用 MQ 实例的 stats() 并以 Prometheus 文本格式返回 MQ 实例可以是 Broker 也可以是连接 Server 的 Client
+每次请求都会查询各个 Common Segment 的积压数量 抓取间隔不宜过短
+"""
+
+
+class SimpleSQLiteMQMetricsHTTPServer(object):
+
+    def __init__(self, mq_instance, address=SQLITE_MQ_METRICS_HTTP_DEFAULT_ADDRESS):
+        """
+        :param mq_instance: 提供 stats() 的 MQ 实例
+        :param address: 监听的 (host, port) 端口为 0 时自动分配
+        """
+        self._mq_instance = mq_instance
+        self._address = address
+        self._http_server = None  # type: HTTPServer
+
+    def start(self):
+        """
+        监听地址 并在后台线程中处理请求
+        """
+        mq_instance = self._mq_instance
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != SQLITE_MQ_METRICS_HTTP_PATH:
+                    self._send_response(404, "text/plain", "Not Found\n")
+                    return
+                try:
+                    response_text = stats_to_prometheus_text(mq_instance.stats())
+                except Exception as e:
+                    PLog.gets().exception(e)
+                    self._send_response(500, "text/plain", "%s\n" % str(e))
+                    return
+                self._send_response(200, SQLITE_MQ_METRICS_PROMETHEUS_CONTENT_TYPE, response_text)
+
+            def _send_response(self, status_code, content_type, response_text):
+                response_body = response_text if isinstance(response_text, bytes) else response_text.encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(response_body)))
+                self.end_headers()
+                self.wfile.write(response_body)
+
+            def log_message(self, format_str, *args):
+                PLog.gets().debug("[SimpleSQLiteMQMetricsHTTPServer] %s - %s" % (
+                    self.address_string(), format_str % args))
+
+        self._http_server = HTTPServer(self._address, MetricsRequestHandler)
+        async_execute(self._http_server.serve_forever)
+        PLog.gets().info("[SimpleSQLiteMQMetricsHTTPServer] Start listening on %s" % str(self.get_address()))
+
+    def get_address(self):
+        """
+        :return: 实际监听的地址 端口为 0 时为自动分配的端口
+        """
+        if self._http_server is None:
+            return self._address
+        return self._http_server.server_address
+
+    def stop(self):
+        """
+        停止处理请求 并关闭监听的 Socket
+        """
+        if self._http_server is None:
+            return
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        self._http_server = None
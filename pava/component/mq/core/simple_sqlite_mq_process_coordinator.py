@@ -0,0 +1,236 @@
+# coding=utf-8
+import fcntl
+import os
+import shutil
+import time
+from threading import Condition
+
+from pava.component.mq.core.simple_sqlite_mq_commit_log import SimpleSQLiteMQCommitLog
+from pava.component.p_log import PLog
+from pava.component.mq import *
+from pava.entity.file_domain import FileDomain
+from pava.utils.async_utils import async_execute
+from pava.utils.object_utils import *
+
+"""
+简易的基于 SQLite 的消息队列 多进程协调器
+多个进程可以同时使用同一个 MQ 目录 Common Segment 的并发由 SQLite 自身的锁保证 (BEGIN IMMEDIATE)
+每个进程只追加写入自己的 Commit Log 并在进程存活期间持有对应的文件锁
+所有进程通过文件锁竞选一个 Leader 只有 Leader 读取所有进程的 Commit Log 按 Common Segment 当前的状态同步 Ext Segment
+Leader 退出后 文件锁自动释放 其他进程在下一次竞选时接替 从各个 Commit Log 的 Checkpoint 继续同步
+进程退出后 Leader 同步完其 Commit Log 中剩余的记录 再删除该进程的 Commit Log 目录
+"""
+
+
+class SimpleSQLiteMQProcessCoordinator(object):
+
+    def __init__(self, mq_path, sync_commit_log_function, leader_elected_function=None, fsync_enabled=True):
+        """
+        :param mq_path: MQ 存储路径
+        :param sync_commit_log_function: Leader 同步读取到的记录 参数为 Commit Log 列表 以及记录所属的只读 Commit Log
+            同步完成后需要调用只读 Commit Log 的 commit
+        :param leader_elected_function: 当选 Leader 后 开始同步之前调用
+        :param fsync_enabled: 本进程的 Commit Log 每次追加记录后是否 fsync
+        """
+        self._sync_commit_log_function = sync_commit_log_function
+        self._leader_elected_function = leader_elected_function
+        self._fsync_enabled = fsync_enabled
+
+        self._process_commit_log_path = os.path.join(mq_path, SQLITE_MQ_PROCESS_COMMIT_LOG_DIR_NAME)
+        FileDomain(self._process_commit_log_path).create_dir()
+        # 单进程模式使用的 Commit Log 切换为多进程模式之前遗留的记录 同样由 Leader 同步
+        self._legacy_commit_log_path = os.path.join(mq_path, "commit_log")
+        self._leader_lock_file_path = os.path.join(mq_path, SQLITE_MQ_LEADER_LOCK_FILE_NAME)
+
+        # 先锁定进程的锁文件 再创建 Commit Log 目录 Leader 看到目录时 锁一定已经被持有
+        self._process_name = "%s_%s" % (os.getpid(), int(time.time() * 1000000))
+        self._process_lock_file = self._try_lock_file(self._get_process_lock_file_path(self._process_name))
+        if self._process_lock_file is None:
+            raise Exception("[SimpleSQLiteMQProcessCoordinator] Cannot lock process '%s'" % self._process_name)
+        self._commit_log = SimpleSQLiteMQCommitLog(
+            os.path.join(self._process_commit_log_path, self._process_name), fsync_enabled=fsync_enabled,
+            append_only=True
+        )
+
+        # 成为 Leader 后持有的文件锁
+        self._leader_lock_file = None
+        # Commit Log 目录 -> 只读 Commit Log 仅 Leader 使用
+        self._reader_commit_log_dict = dict()
+
+        # 保护 Leader 状态 以及统计数据
+        self._coordinator_condition = Condition()
+        self._leader_elected_time = None
+        self._sync_pass_count = 0
+        self._synced_record_count = 0
+        self._removed_process_count = 0
+        self._failed_count = 0
+
+    def start(self):
+        """
+        竞选 Leader 并开始同步线程 所有依赖的 Segment 准备好之后调用
+        """
+        self.elect_leader()
+        async_execute(self._sync_loop)
+
+    @staticmethod
+    def _try_lock_file(lock_file_path):
+        """
+        :return: 成功锁定时返回打开的文件 持有期间锁一直有效 已经被其他进程锁定时返回 None
+        """
+        lock_file = open(lock_file_path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _get_process_lock_file_path(self, process_name):
+        return os.path.join(self._process_commit_log_path, process_name + ".lock")
+
+    def get_commit_log(self):
+        """
+        :return: 本进程只追加写入的 Commit Log
+        :rtype: SimpleSQLiteMQCommitLog
+        """
+        return self._commit_log
+
+    def is_leader(self):
+        return self._leader_lock_file is not None
+
+    def elect_leader(self):
+        """
+        尝试成为 Leader 已经是 Leader 时直接返回
+        :return: 当前进程是否为 Leader
+        :rtype: bool
+        """
+        with self._coordinator_condition:
+            if self._leader_lock_file is not None:
+                return True
+            leader_lock_file = self._try_lock_file(self._leader_lock_file_path)
+            if leader_lock_file is None:
+                return False
+
+        PLog.gets().info("[SimpleSQLiteMQProcessCoordinator] Process '%s' is elected as leader" % self._process_name)
+        if self._leader_elected_function is not None:
+            self._leader_elected_function()
+        with self._coordinator_condition:
+            self._leader_lock_file = leader_lock_file
+            self._leader_elected_time = time.time()
+        return True
+
+    def _sync_loop(self):
+        # 在同步线程中竞选 Leader 而不是使用 cycle_execute
+        # 调度线程在导入时启动 fork 出的子进程中不存在 Leader 退出后其他进程将无法接替
+        last_election_time = time.time()
+        while True:
+            time.sleep(SQLITE_MQ_PROCESS_SYNC_INTERVAL_SECONDS)
+            if not self.is_leader():
+                if time.time() - last_election_time < SQLITE_MQ_LEADER_ELECTION_INTERVAL_SECONDS:
+                    continue
+                last_election_time = time.time()
+                if not self.elect_leader():
+                    continue
+            try:
+                self.sync_commit_log()
+            except Exception as e:
+                with self._coordinator_condition:
+                    self._failed_count += 1
+                PLog.gets().exception(e)
+
+    def _get_commit_log_path_list(self):
+        commit_log_path_list = list()
+        if os.path.isdir(self._legacy_commit_log_path):
+            commit_log_path_list.append(self._legacy_commit_log_path)
+        for file_name in sorted(os.listdir(self._process_commit_log_path)):
+            commit_log_path = os.path.join(self._process_commit_log_path, file_name)
+            if os.path.isdir(commit_log_path):
+                commit_log_path_list.append(commit_log_path)
+        return commit_log_path_list
+
+    def sync_commit_log(self):
+        """
+        Leader 读取所有进程 Commit Log 中 Checkpoint 之后的记录并同步 已经退出的进程同步完成后删除其 Commit Log 目录
+        :return: 同步的记录数量
+        :rtype: int
+        """
+        synced_record_count = 0
+        for commit_log_path in self._get_commit_log_path_list():
+            # 先确认进程已经退出 再读取剩余的记录 之后该进程不会再追加记录
+            exited_process_lock_file = None
+            if commit_log_path != self._legacy_commit_log_path:
+                exited_process_lock_file = self._try_lock_file(
+                    self._get_process_lock_file_path(os.path.basename(commit_log_path))
+                )
+            try:
+                reader_commit_log = self._reader_commit_log_dict.get(commit_log_path, None)
+                if reader_commit_log is None:
+                    reader_commit_log = SimpleSQLiteMQCommitLog(
+                        commit_log_path, fsync_enabled=self._fsync_enabled, read_only=True
+                    )
+                    self._reader_commit_log_dict[commit_log_path] = reader_commit_log
+
+                commit_log_list = reader_commit_log.read_from_checkpoint()
+                if list_not_empty(commit_log_list):
+                    self._sync_commit_log_function(commit_log_list, reader_commit_log)
+                    synced_record_count += len(commit_log_list)
+                reader_commit_log.persist_checkpoint()
+
+                if exited_process_lock_file is not None and \
+                        reader_commit_log.get_checkpoint_offset() >= reader_commit_log.get_end_offset():
+                    self._remove_process_commit_log(commit_log_path)
+            finally:
+                if exited_process_lock_file is not None:
+                    exited_process_lock_file.close()
+
+        with self._coordinator_condition:
+            self._sync_pass_count += 1
+            self._synced_record_count += synced_record_count
+        return synced_record_count
+
+    def _remove_process_commit_log(self, commit_log_path):
+        self._reader_commit_log_dict.pop(commit_log_path, None)
+        shutil.rmtree(commit_log_path)
+        os.remove(self._get_process_lock_file_path(os.path.basename(commit_log_path)))
+        with self._coordinator_condition:
+            self._removed_process_count += 1
+        PLog.gets().info(
+            "[SimpleSQLiteMQProcessCoordinator] Remove commit log of exited process '%s'" % commit_log_path)
+
+    def submit(self, sync_operation, mq_message, commit_log_offset):
+        """
+        与 Ext Segment 同步器接口一致 多进程模式下 Ext Segment 由 Leader 按 Commit Log 同步 无需处理
+        """
+        pass
+
+    def wait_synced(self, timeout=None):
+        """
+        等待本进程调用前追加的所有记录被 Leader 同步至 Ext Segment
+        :param timeout: 最长等待秒数 None 表示一直等待
+        :return: 是否全部同步完成
+        :rtype: bool
+        """
+        end_offset = self._commit_log.get_end_offset()
+        deadline = None if timeout is None else time.time() + timeout
+        while self._commit_log.get_persisted_checkpoint_offset() < end_offset:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(SQLITE_MQ_PROCESS_SYNC_INTERVAL_SECONDS)
+        return True
+
+    def get_metrics(self):
+        """
+        :return: 是否为 Leader 同步的记录数量 以及本进程尚未同步的字节数等统计数据
+        :rtype: dict
+        """
+        with self._coordinator_condition:
+            return {
+                "process_name": self._process_name,
+                "is_leader": self._leader_lock_file is not None,
+                "leader_elected_time": self._leader_elected_time,
+                "sync_pass_count": self._sync_pass_count,
+                "synced_record_count": self._synced_record_count,
+                "removed_process_count": self._removed_process_count,
+                "unsynced_bytes": self._commit_log.get_end_offset() - self._commit_log.get_persisted_checkpoint_offset(),
+                "failed_count": self._failed_count,
+            }
@@ -0,0 +1,153 @@
+# coding=utf-8
+import marshal
+import struct
+
+from pava.component.mq import *
+from pava.component.mq.core.mq_message import MQMessage
+
+"""
+简易的基于 SQLite 的消息队列 Server 与 Client 之间的二进制协议
+每一帧为固定长度的帧头 (负载长度, 请求编号, 操作码 / 状态码) 加上 marshal 编码的负载
+请求的负载为 (位置参数, 关键字参数) 响应的负载为返回值 MQ Message 编码为字段元组
+同一个连接上可以连续发送多个请求 无需等待响应 (Pipelining) 响应按请求编号对应
+marshal 只能编码基本类型 解码时不会执行代码 但 Server 仍然只应该暴露给受信任的 Client
+"""
+
+SQLITE_MQ_SERVER_FRAME_HEADER_SIZE = struct.calcsize(SQLITE_MQ_SERVER_FRAME_HEADER_FORMAT)
+
+# 返回值的编码方式
+RESULT_TYPE_VALUE = 0
+RESULT_TYPE_MESSAGE = 1
+RESULT_TYPE_MESSAGE_LIST = 2
+# scan_message 返回 (消息列表, continuation_token)
+RESULT_TYPE_SCAN = 3
+
+# Server 支持的方法 (方法名, 返回值的编码方式, wait_timeout 参数的位置) 操作码为下标 + 1
+# wait_timeout 大于 0 时请求可能长时间阻塞 Server 在单独的线程中执行 不阻塞同一个连接上的其他请求
+SERVER_METHOD_LIST = [
+    ("add_message", RESULT_TYPE_MESSAGE, None),
+    ("add_messages", RESULT_TYPE_MESSAGE_LIST, None),
+    ("get_message", RESULT_TYPE_MESSAGE, 3),
+    ("get_messages", RESULT_TYPE_MESSAGE_LIST, 4),
+    ("get_message_arrival_version", RESULT_TYPE_VALUE, None),
+    ("wait_message_arrival", RESULT_TYPE_VALUE, 2),
+    ("commit_message", RESULT_TYPE_MESSAGE, None),
+    ("hold_message", RESULT_TYPE_MESSAGE, None),
+    ("hold_messages", RESULT_TYPE_MESSAGE_LIST, None),
+    ("consume_failed", RESULT_TYPE_MESSAGE, None),
+    ("delete_message", RESULT_TYPE_MESSAGE, None),
+    ("scan_message", RESULT_TYPE_SCAN, None),
+    ("fetch_message_by_uuid", RESULT_TYPE_MESSAGE, None),
+    ("get_priority_backlog", RESULT_TYPE_VALUE, None),
+    ("get_topic_shard_count", RESULT_TYPE_VALUE, None),
+    ("redrive", RESULT_TYPE_VALUE, None),
+    ("get_dead_letter_metrics", RESULT_TYPE_VALUE, None),
+    ("stats", RESULT_TYPE_VALUE, None),
+    ("create_consumer_group", RESULT_TYPE_VALUE, None),
+    ("delete_consumer_group", RESULT_TYPE_VALUE, None),
+    ("get_consumer_groups", RESULT_TYPE_VALUE, None),
+    ("get_group_message", RESULT_TYPE_MESSAGE, 4),
+    ("get_group_messages", RESULT_TYPE_MESSAGE_LIST, 5),
+    ("hold_group_message", RESULT_TYPE_MESSAGE, None),
+    ("commit_group_message", RESULT_TYPE_MESSAGE, None),
+    ("group_consume_failed", RESULT_TYPE_MESSAGE, None),
+    ("redrive_consumer_group", RESULT_TYPE_VALUE, None),
+]
+SERVER_METHOD_OPCODE_DICT = dict([
+    (method_name, opcode + 1) for opcode, (method_name, _, _) in enumerate(SERVER_METHOD_LIST)
+])
+
+
+def get_server_method(opcode):
+    """
+    :return: (方法名, 返回值的编码方式, wait_timeout 参数的位置) 未知的操作码返回 None
+    :rtype: tuple
+    """
+    if opcode < 1 or opcode > len(SERVER_METHOD_LIST):
+        return None
+    return SERVER_METHOD_LIST[opcode - 1]
+
+
+def encode_frame(request_id, code, value):
+    """
+    :param request_id: 请求编号 响应使用与请求相同的编号
+    :param code: 请求的操作码 或 响应的状态码
+    :param value: 负载 只能包含 marshal 支持的基本类型
+    :rtype: str
+    """
+    payload = marshal.dumps(value, SQLITE_MQ_SERVER_MARSHAL_VERSION)
+    return struct.pack(SQLITE_MQ_SERVER_FRAME_HEADER_FORMAT, len(payload), request_id, code) + payload
+
+
+def encode_mq_message(mq_message):
+    """
+    :type mq_message: MQMessage
+    """
+    if mq_message is None:
+        return None
+    return mq_message.to_field_tuple()
+
+
+def decode_mq_message(message_field_tuple):
+    """
+    :rtype: MQMessage
+    """
+    if message_field_tuple is None:
+        return None
+    return MQMessage.from_trusted_fields(*message_field_tuple)
+
+
+def encode_result(result_type, result):
+    if result_type == RESULT_TYPE_MESSAGE:
+        return encode_mq_message(result)
+    if result_type == RESULT_TYPE_MESSAGE_LIST:
+        return None if result is None else [encode_mq_message(mq_message) for mq_message in result]
+    if result_type == RESULT_TYPE_SCAN:
+        mq_message_list, continuation_token = result
+        return [encode_mq_message(mq_message) for mq_message in mq_message_list], continuation_token
+    return result
+
+
+def decode_result(result_type, result):
+    if result_type == RESULT_TYPE_MESSAGE:
+        return decode_mq_message(result)
+    if result_type == RESULT_TYPE_MESSAGE_LIST:
+        return None if result is None else [decode_mq_message(message_field_tuple) for message_field_tuple in result]
+    if result_type == RESULT_TYPE_SCAN:
+        message_field_tuple_list, continuation_token = result
+        return [decode_mq_message(message_field_tuple) for message_field_tuple in message_field_tuple_list], \
+            continuation_token
+    return result
+
+
+class SimpleSQLiteMQFrameReader(object):
+    """
+    从 Socket 读取到的字节流中 切分出完整的帧 不完整的部分留到下一次读取
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, data):
+        """
+        :param data: 新读取到的字节
+        :return: 已经完整的帧列表 元素为 (请求编号, 操作码 / 状态码, 负载)
+        :rtype: list
+        """
+        buffer_data = self._buffer + data if self._buffer else data
+        frame_list = list()
+        offset = 0
+        while len(buffer_data) - offset >= SQLITE_MQ_SERVER_FRAME_HEADER_SIZE:
+            payload_size, request_id, code = struct.unpack_from(
+                SQLITE_MQ_SERVER_FRAME_HEADER_FORMAT, buffer_data, offset
+            )
+            if payload_size > SQLITE_MQ_SERVER_MAX_FRAME_SIZE:
+                raise Exception("[SimpleSQLiteMQFrameReader] Frame size %s exceeds limit %s" % (
+                    payload_size, SQLITE_MQ_SERVER_MAX_FRAME_SIZE))
+            payload_begin = offset + SQLITE_MQ_SERVER_FRAME_HEADER_SIZE
+            if len(buffer_data) < payload_begin + payload_size:
+                break
+            frame_list.append((request_id, code, marshal.loads(buffer_data[payload_begin:payload_begin + payload_size])))
+            offset = payload_begin + payload_size
+        self._buffer = buffer_data[offset:]
+        return frame_list
@@ -0,0 +1,203 @@
+# coding=utf-8
+import os
+import socket
+from threading import Lock
+
+from pava.component.mq import *
+from pava.component.mq.core.simple_sqlite_mq_protocol import SimpleSQLiteMQFrameReader, encode_frame, \
+    encode_result, get_server_method
+from pava.component.mq.interface.abstract_simple_sqlite_mq_broker import AbstractSimpleSQLiteMQBroker
+from pava.component.p_log import PLog
+from pava.utils.async_utils import daemon_thread_execute
+
+"""
+简易的基于 SQLite 的消息队列 Server
+通过 TCP 或 Unix Socket 对外提供 MQ 实例 多个进程中的 Client 共享同一个 MQ
+每个连接一个线程 一次读取到的多个请求依次执行 响应合并为一次发送
+可能长时间阻塞的请求 (等待新消息到达) 在单独的线程中执行 不阻塞同一个连接上之后的请求
+连接与阻塞请求都使用单独的守护线程 不占用全局异步任务线程池 大量空闲连接不会影响 Broker 的后台任务
+"""
+
+
+class SimpleSQLiteMQServer(object):
+
+    def __init__(self, mq_instance, address=SQLITE_MQ_SERVER_DEFAULT_ADDRESS):
+        """
+        :param mq_instance: 对外提供服务的 MQ 实例
+        :type mq_instance: AbstractSimpleSQLiteMQBroker
+        :param address: (host, port) 时监听 TCP 端口为 0 时自动分配 字符串时监听该路径的 Unix Socket
+        """
+        self._mq_instance = mq_instance
+        self._address = address
+        self._server_socket = None  # type: socket.socket
+        self._running = False
+
+        # 保护 连接集合 与 统计数据
+        self._server_lock = Lock()
+        self._connection_socket_set = set()
+        self._accepted_count = 0
+        self._request_count = 0
+        self._failed_count = 0
+
+    def start(self):
+        """
+        监听地址 并开始接受连接
+        """
+        if isinstance(self._address, str):
+            self._remove_stale_unix_socket(self._address)
+            server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind(self._address)
+        server_socket.listen(SQLITE_MQ_SERVER_LISTEN_BACKLOG)
+        self._server_socket = server_socket
+        self._running = True
+        daemon_thread_execute(self._accept_loop)
+        PLog.gets().info("[SimpleSQLiteMQServer] Start listening on %s" % str(self.get_address()))
+
+    @staticmethod
+    def _remove_stale_unix_socket(socket_path):
+        """
+        上一次进程退出时遗留的 Socket 文件会导致监听失败 仍然有进程在监听时不删除
+        """
+        if not os.path.exists(socket_path):
+            return
+        probe_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe_socket.connect(socket_path)
+        except socket.error:
+            os.remove(socket_path)
+            return
+        finally:
+            probe_socket.close()
+        raise Exception("[SimpleSQLiteMQServer] Unix socket '%s' is in use by another server" % socket_path)
+
+    def get_address(self):
+        """
+        :return: 实际监听的地址 TCP 端口为 0 时为自动分配的端口
+        """
+        if self._server_socket is None:
+            return self._address
+        return self._server_socket.getsockname()
+
+    def stop(self):
+        """
+        停止接受新的连接 并关闭所有已经建立的连接
+        """
+        self._running = False
+        if self._server_socket is not None:
+            self._server_socket.close()
+            if isinstance(self._address, str) and os.path.exists(self._address):
+                os.remove(self._address)
+        with self._server_lock:
+            connection_socket_list = list(self._connection_socket_set)
+        for connection_socket in connection_socket_list:
+            self._close_connection(connection_socket)
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                connection_socket, _ = self._server_socket.accept()
+            except socket.error as e:
+                if self._running:
+                    PLog.gets().exception(e)
+                continue
+            if connection_socket.family == socket.AF_INET:
+                connection_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._server_lock:
+                self._connection_socket_set.add(connection_socket)
+                self._accepted_count += 1
+            daemon_thread_execute(self._handle_connection, connection_socket)
+
+    def _close_connection(self, connection_socket):
+        with self._server_lock:
+            self._connection_socket_set.discard(connection_socket)
+        try:
+            connection_socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        connection_socket.close()
+
+    def _handle_connection(self, connection_socket):
+        frame_reader = SimpleSQLiteMQFrameReader()
+        # 阻塞请求在其他线程中完成后 与本线程同时发送响应
+        send_lock = Lock()
+        try:
+            while self._running:
+                data = connection_socket.recv(SQLITE_MQ_SERVER_RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                response_list = list()
+                for request_id, opcode, payload in frame_reader.feed(data):
+                    if self._is_blocking_request(opcode, payload):
+                        daemon_thread_execute(self._handle_blocking_request, connection_socket, send_lock,
+                                              request_id, opcode, payload)
+                        continue
+                    response_list.append(self._execute_request(request_id, opcode, payload))
+                if response_list:
+                    with send_lock:
+                        connection_socket.sendall("".join(response_list))
+        except Exception as e:
+            if self._running:
+                PLog.gets().warning("[SimpleSQLiteMQServer] Close connection because of exception '%s'" % str(e))
+        finally:
+            self._close_connection(connection_socket)
+
+    @staticmethod
+    def _is_blocking_request(opcode, payload):
+        server_method = get_server_method(opcode)
+        if server_method is None or server_method[2] is None:
+            return False
+        args, kwargs = payload
+        wait_timeout_index = server_method[2]
+        if len(args) > wait_timeout_index:
+            wait_timeout = args[wait_timeout_index]
+        else:
+            wait_timeout = kwargs.get("wait_timeout", 0)
+        return wait_timeout is not None and wait_timeout > 0
+
+    def _handle_blocking_request(self, connection_socket, send_lock, request_id, opcode, payload):
+        response = self._execute_request(request_id, opcode, payload)
+        try:
+            with send_lock:
+                connection_socket.sendall(response)
+        except socket.error as e:
+            PLog.gets().warning("[SimpleSQLiteMQServer] Cannot send response of request %s, exception '%s'" % (
+                request_id, str(e)))
+
+    def _execute_request(self, request_id, opcode, payload):
+        """
+        :return: 编码后的响应帧
+        :rtype: str
+        """
+        server_method = get_server_method(opcode)
+        try:
+            if server_method is None:
+                raise Exception("[SimpleSQLiteMQServer] Unknown opcode %s" % opcode)
+            method_name, result_type, _ = server_method
+            args, kwargs = payload
+            result = getattr(self._mq_instance, method_name)(*args, **kwargs)
+            response = encode_frame(request_id, SQLITE_MQ_SERVER_STATUS_OK, encode_result(result_type, result))
+            failed = False
+        except Exception as e:
+            response = encode_frame(request_id, SQLITE_MQ_SERVER_STATUS_ERROR, str(e))
+            failed = True
+        with self._server_lock:
+            self._request_count += 1
+            if failed:
+                self._failed_count += 1
+        return response
+
+    def get_metrics(self):
+        """
+        :return: 当前连接数 累计接受的连接数 处理的请求数 以及失败的请求数
+        :rtype: dict
+        """
+        with self._server_lock:
+            return {
+                "connection_count": len(self._connection_socket_set),
+                "accepted_count": self._accepted_count,
+                "request_count": self._request_count,
+                "failed_count": self._failed_count,
+            }
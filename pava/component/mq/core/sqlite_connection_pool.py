@@ -1,25 +1,49 @@
 # coding=utf-8
 import sqlite3
 
+from pava.component.mq import BEGIN_TRANSACTION, COMMIT_TRANSACTION, ROLLBACK_TRANSACTION, GET_SCHEMA_VERSION_SQL, SET_SCHEMA_VERSION_SQL, SET_PRAGMA_SQL, \
+    GET_PRAGMA_SQL, SQLITE_STATEMENT_CACHE_SIZE, INCREMENTAL_VACUUM_SQL, VACUUM_SQL, SQLITE_AUTO_VACUUM_INCREMENTAL
 from pava.dependency.cuttlepool import CuttlePool
 
 
+class SQLiteConnection(sqlite3.Connection):
+    """
+    原生 sqlite3.Connection 无法记录额外属性
+    这里记录连接是否已经设置过 PRAGMA 避免每次从连接池取出时重复设置
+    """
+    pragma_applied_ = False
+
+
+def _connect_sqlite(database):
+    # 连接池中的连接会被多个线程轮流使用 并发安全由上层 Synchronized 装饰器保证
+    # 连接按 SQL 文本缓存预编译语句 参数化的语句无需重复解析
+    return sqlite3.connect(database, factory=SQLiteConnection, check_same_thread=False,
+                           cached_statements=SQLITE_STATEMENT_CACHE_SIZE)
+
+
 class SQLiteConnectionPool(CuttlePool):
-    def __init__(self, db_path, capacity=4):
+    def __init__(self, db_path, capacity=4, pragma_list=None):
         """
         复制自 CuttlePool 官方 Demo
         :param db_path:
         :param capacity:
+        :param pragma_list: 连接创建后需要设置的 PRAGMA 列表 元素为 (PRAGMA 名称, 值) 按顺序执行
         """
+        self._pragma_list = list() if pragma_list is None else pragma_list
         CuttlePool.__init__(
             self,
-            factory=sqlite3.connect,
+            factory=_connect_sqlite,
             database=db_path,
             capacity=capacity
         )
 
     def normalize_resource(self, resource):
         resource.row_factory = None
+        # 每个连接只需要设置一次 PRAGMA
+        if not resource.pragma_applied_:
+            for pragma_name, pragma_value in self._pragma_list:
+                resource.execute(SET_PRAGMA_SQL % (pragma_name, pragma_value)).fetchall()
+            resource.pragma_applied_ = True
 
     def ping(self, resource):
         try:
@@ -33,3 +57,83 @@ class SQLiteConnectionPool(CuttlePool):
             self,
             resource_wrapper=None
         )
+
+    def get_effective_pragma_str(self):
+        """
+        读取连接实际生效的 PRAGMA 设置 用于启动时输出
+        :rtype: str
+        """
+        connection = self.get_connection()
+        effective_pragma_list = list()
+        for pragma_name, _ in self._pragma_list:
+            effective_pragma_list.append(
+                "%s=%s" % (pragma_name, connection.execute(GET_PRAGMA_SQL % pragma_name).fetchone()[0])
+            )
+        return ", ".join(effective_pragma_list)
+
+    def upgrade_schema(self, schema_migration_list):
+        """
+        根据数据库文件中记录的表结构版本 (PRAGMA user_version) 在一个事务中执行尚未执行过的表结构升级
+        :param schema_migration_list: 第 N 个元素为升级到版本 N + 1 所需执行的 SQL 列表
+        :return: 升级前的版本 与 升级后的版本
+        """
+        connection = self.get_connection()
+        # Python 2 的 sqlite3 在执行 PRAGMA 与 DDL 之前会自动提交当前事务 升级期间改为手动管理事务
+        # 多个进程同时打开同一个文件时 只有第一个获得写锁的进程执行升级
+        connection.isolation_level = None
+        cursor = connection.cursor()
+        try:
+            cursor.execute(BEGIN_TRANSACTION)
+            current_version = cursor.execute(GET_SCHEMA_VERSION_SQL).fetchone()[0]
+            target_version = len(schema_migration_list)
+            if current_version >= target_version:
+                cursor.execute(ROLLBACK_TRANSACTION)
+                return current_version, current_version
+
+            try:
+                for migration_sql_list in schema_migration_list[current_version:]:
+                    for migration_sql in migration_sql_list:
+                        cursor.execute(migration_sql)
+                cursor.execute(SET_SCHEMA_VERSION_SQL % target_version)
+            except Exception as e:
+                cursor.execute(ROLLBACK_TRANSACTION)
+                raise e
+            cursor.execute(COMMIT_TRANSACTION)
+            return current_version, target_version
+        finally:
+            connection.isolation_level = ""
+
+    def vacuum_database(self, free_page_ratio, max_vacuum_pages):
+        """
+        空闲页占总页数的比例超过 free_page_ratio 时 回收空闲页
+        auto_vacuum 已经为 INCREMENTAL 时 最多回收 max_vacuum_pages 页 否则执行一次 VACUUM 重建文件 之后改为增量回收
+        并发安全由上层 Synchronized 装饰器保证
+        :return: 回收的页数
+        :rtype: int
+        """
+        connection = self.get_connection()
+        page_count = connection.execute(GET_PRAGMA_SQL % "page_count").fetchone()[0]
+        freelist_count = connection.execute(GET_PRAGMA_SQL % "freelist_count").fetchone()[0]
+        if freelist_count == 0 or freelist_count < page_count * free_page_ratio:
+            return 0
+
+        if connection.execute(GET_PRAGMA_SQL % "auto_vacuum").fetchone()[0] == SQLITE_AUTO_VACUUM_INCREMENTAL:
+            connection.execute(INCREMENTAL_VACUUM_SQL % max_vacuum_pages).fetchall()
+            connection.commit()
+        else:
+            connection.execute(SET_PRAGMA_SQL % ("auto_vacuum", "INCREMENTAL")).fetchall()
+            connection.execute(VACUUM_SQL)
+        return freelist_count - connection.execute(GET_PRAGMA_SQL % "freelist_count").fetchone()[0]
+
+    def close_all_connection(self):
+        """
+        关闭连接池中所有的连接 之后不能再使用该连接池 删除数据库文件前调用
+        并发安全由上层 Synchronized 装饰器保证
+        """
+        with self._lock:
+            for index, resource_tracker in enumerate(self._reference_queue):
+                if resource_tracker is not None:
+                    resource_tracker.resource.close()
+                    self._reference_queue[index] = None
+            self._resource_start = self._resource_end = 0
+            self._size = self._available = 0
@@ -10,10 +10,27 @@ class AbstractMQBrokerCommonSegment(object):
     __metaclass__ = ABCMeta
 
     @abstractmethod
-    def add_message(self, message_text, producer):
+    def add_message(self, message_text, producer, message_encoding=0, visible_time=None, priority=0,
+                    idempotency_key=None):
         """
         :type message_text: str
         :type producer: str
+        :type message_encoding: int
+        :type visible_time: int
+        :type priority: int
+        :type idempotency_key: str
+        """
+        pass
+
+    @abstractmethod
+    def add_message_list(self, message_text_list, producer, message_encoding_list=None, visible_time=None,
+                         priority=0):
+        """
+        :type message_text_list: list
+        :type producer: str
+        :type message_encoding_list: list
+        :type visible_time: int
+        :type priority: int
         """
         pass
 
@@ -21,6 +38,10 @@ class AbstractMQBrokerCommonSegment(object):
     def get_message(self, consumer, max_consume_time):
         pass
 
+    @abstractmethod
+    def get_message_list(self, consumer, max_consume_time, message_count):
+        pass
+
     @abstractmethod
     def update_message(self, mq_message):
         pass
@@ -29,6 +50,10 @@ class AbstractMQBrokerCommonSegment(object):
     def hold_message(self, message_uuid, hold_consume_time):
         pass
 
+    @abstractmethod
+    def hold_message_list(self, message_uuid_list, hold_consume_time):
+        pass
+
     @abstractmethod
     def commit_message(self, message_uuid):
         pass
@@ -45,10 +70,90 @@ class AbstractMQBrokerCommonSegment(object):
     def consume_failed(self, message_id, max_failed_times, retry_times_interval):
         pass
 
+    @abstractmethod
+    def scan_pending_message_list(self, batch_size):
+        pass
+
+    @abstractmethod
+    def delete_dead_letter_message_list(self, message_uuid_list):
+        pass
+
+    @abstractmethod
+    def redrive_message_list(self, mq_message_list):
+        pass
+
     @abstractmethod
     def get_db_path(self):
         pass
 
     @abstractmethod
-    def recover_message(self, recover_message_uuid_list):
+    def recover_expired_message_list(self, batch_size):
+        pass
+
+    @abstractmethod
+    def get_next_expire_time(self):
+        pass
+
+    @abstractmethod
+    def count_message_by_status(self):
+        pass
+
+    @abstractmethod
+    def get_oldest_lease_time(self):
+        pass
+
+    @abstractmethod
+    def get_next_visible_time(self, current_timestamp):
+        pass
+
+    @abstractmethod
+    def migrate_message_storage(self, message_codec, batch_size):
+        pass
+
+    @abstractmethod
+    def vacuum_segment(self, free_page_ratio, max_vacuum_pages):
+        pass
+
+    @abstractmethod
+    def prune_idempotency_key(self, batch_size):
+        pass
+
+    @abstractmethod
+    def create_consumer_group(self, consumer_group, start_from_latest):
+        pass
+
+    @abstractmethod
+    def delete_consumer_group(self, consumer_group):
+        pass
+
+    @abstractmethod
+    def get_consumer_group_list(self):
+        pass
+
+    @abstractmethod
+    def get_group_message_list(self, consumer_group, consumer, max_consume_time, message_count):
+        pass
+
+    @abstractmethod
+    def hold_group_message(self, consumer_group, message_uuid, hold_consume_time):
+        pass
+
+    @abstractmethod
+    def commit_group_message(self, consumer_group, message_uuid):
+        pass
+
+    @abstractmethod
+    def group_consume_failed(self, consumer_group, message_uuid, max_failed_times, retry_times_interval):
+        pass
+
+    @abstractmethod
+    def redrive_consumer_group(self, consumer_group):
+        pass
+
+    @abstractmethod
+    def trim_consumer_group_message_list(self, batch_size):
+        pass
+
+    @abstractmethod
+    def get_consumer_group_stats(self):
         pass
@@ -10,11 +10,19 @@ class AbstractMQBrokerExtSegment(object):
     __metaclass__ = ABCMeta
 
     @abstractmethod
-    def add_message(self, mq_message, commit_log_file):
+    def add_message(self, mq_message, commit_log_offset):
         pass
 
     @abstractmethod
-    def delete_message_by_mq_message(self, mq_message, commit_log_file):
+    def add_message_list(self, mq_message_list, commit_log_offset):
+        pass
+
+    @abstractmethod
+    def delete_message_by_mq_message(self, mq_message, commit_log_offset):
+        pass
+
+    @abstractmethod
+    def sync_message_list(self, sync_operation_list):
         pass
 
     @abstractmethod
@@ -22,25 +30,54 @@ class AbstractMQBrokerExtSegment(object):
         pass
 
     @abstractmethod
-    def update_message(self, mq_message, commit_log_file):
+    def replace_message_list(self, mq_message_list):
+        pass
+
+    @abstractmethod
+    def delete_message_list_by_uuid(self, message_topic, message_uuid_list):
         pass
 
     @abstractmethod
-    def scan_message(self, message_topic, every_page_quantity, page_number, message_status=None):
+    def scan_message_by_rowid(self, last_rowid, batch_size):
         pass
 
     @abstractmethod
-    def get_recover_message(self):
+    def count_message(self):
         pass
 
     @abstractmethod
-    def do_recover_message_status(self, recover_message_uuid_list):
+    def update_message(self, mq_message, commit_log_offset):
+        pass
+
+    @abstractmethod
+    def update_message_list(self, mq_message_list, commit_log_offset):
+        pass
+
+    @abstractmethod
+    def scan_message(self, message_topic, every_page_quantity, page_number, message_status=None,
+                     begin_time=None, end_time=None, continuation_key=None):
         pass
 
     @abstractmethod
     def fetch_message_by_uuid(self, message_uuid):
         pass
 
+    @abstractmethod
+    def get_priority_backlog(self, message_topic):
+        pass
+
+    @abstractmethod
+    def migrate_message_storage(self, message_codec, batch_size):
+        pass
+
     @abstractmethod
     def get_db_path(self):
         pass
+
+    @abstractmethod
+    def vacuum_segment(self, free_page_ratio, max_vacuum_pages):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
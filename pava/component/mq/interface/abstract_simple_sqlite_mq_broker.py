@@ -7,10 +7,24 @@ from pava.component.mq.interface.abstract_mq_broker import AbstractMQBroker
 class AbstractSimpleSQLiteMQBroker(AbstractMQBroker):
     __metaclass__ = ABCMeta
 
-    def add_message(self, message_topic, message_text, producer=None):
+    def add_message(self, message_topic, message_text, producer=None, deliver_at=None, deliver_after=None,
+                    priority=0, idempotency_key=None):
         pass
 
-    def get_message(self, message_topic, consumer=None, max_consume_time=3600):
+    def add_messages(self, message_topic, message_text_list, producer=None, deliver_at=None, deliver_after=None,
+                     priority=0):
+        pass
+
+    def get_message(self, message_topic, consumer=None, max_consume_time=3600, wait_timeout=0):
+        pass
+
+    def get_messages(self, message_topic, message_count, consumer=None, max_consume_time=3600, wait_timeout=0):
+        pass
+
+    def get_message_arrival_version(self):
+        pass
+
+    def wait_message_arrival(self, message_topic_list, arrival_version, wait_timeout):
         pass
 
     def commit_message(self, message_topic, message_id):
@@ -19,14 +33,66 @@ class AbstractSimpleSQLiteMQBroker(AbstractMQBroker):
     def hold_message(self, message_topic, message_uuid, hold_consume_time=6000):
         pass
 
+    def hold_messages(self, message_topic, message_uuid_list, hold_consume_time=6000):
+        """
+        默认逐条调用 hold_message 只实现了 hold_message 的子类仍然可以被消费者批量保持消息
+        :return: 成功 Hold 的 MQ Message 列表
+        """
+        mq_message_list = list()
+        for message_uuid in message_uuid_list:
+            mq_message = self.hold_message(message_topic, message_uuid, hold_consume_time)
+            if mq_message is not None:
+                mq_message_list.append(mq_message)
+        return mq_message_list
+
     def consume_failed(self, message_topic, message_uuid, max_failed_times, retry_times_interval=300):
         pass
 
     def delete_message(self, message_topic, message_id):
         pass
 
-    def scan_message(self, message_topic=None, every_page_quantity=10, page_number=1):
+    def scan_message(self, message_topic=None, every_page_quantity=10, page_number=1, is_archiver_read=False,
+                     message_status=None, begin_time=None, end_time=None, continuation_token=None,
+                     is_dead_letter_read=False):
         pass
 
     def fetch_message_by_uuid(self, message_id):
         pass
+
+    def get_priority_backlog(self, message_topic):
+        pass
+
+    def redrive(self, message_topic, message_filter=None, limit=None, batch_size=1000):
+        pass
+
+    def stats(self):
+        pass
+
+    def create_consumer_group(self, message_topic, consumer_group, start_from_latest=False):
+        pass
+
+    def delete_consumer_group(self, message_topic, consumer_group):
+        pass
+
+    def get_consumer_groups(self, message_topic):
+        pass
+
+    def get_group_message(self, message_topic, consumer_group, consumer=None, max_consume_time=3600, wait_timeout=0):
+        pass
+
+    def get_group_messages(self, message_topic, consumer_group, message_count, consumer=None, max_consume_time=3600,
+                           wait_timeout=0):
+        pass
+
+    def hold_group_message(self, message_topic, consumer_group, message_uuid, hold_consume_time=6000):
+        pass
+
+    def commit_group_message(self, message_topic, consumer_group, message_uuid):
+        pass
+
+    def group_consume_failed(self, message_topic, consumer_group, message_uuid, max_failed_times,
+                             retry_times_interval=300):
+        pass
+
+    def redrive_consumer_group(self, message_topic, consumer_group):
+        pass
@@ -55,6 +55,13 @@ class ThreadPoolExecutorWrapper(object):
         # Task.result() 是可以被重复运行的 这里依然返回 Task 方便业务代码获取执行结果
         return submitted_task
 
+    def shutdown(self, wait=True):
+        """
+        关闭线程池 之后不能再提交任务
+        :param wait: 是否等待已经提交的任务执行完成
+        """
+        self._thread_pool.shutdown(wait=wait)
+
 
 if __name__ == '__main__':
     def print_it(a, b=5):
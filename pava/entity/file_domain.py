@@ -195,7 +195,12 @@ class FileDomain(object):
 
     def create_dir(self):
         if self.get_exist_status() is False:
-            os.makedirs(self.file_absolute_path)
+            try:
+                os.makedirs(self.file_absolute_path)
+            except OSError:
+                # 其他进程可能同时创建了这个目录
+                if not os.path.isdir(self.file_absolute_path):
+                    raise
 
     def get_file_content(self):
         if self.get_exist_status() is False:
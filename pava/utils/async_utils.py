@@ -26,6 +26,21 @@ def async_execute(execute_function, *args, **kwargs):
     return __DEFAULT_ASYNC_THREAD_POOL_EXECUTOR.submit(execute_function, *args, **kwargs)
 
 
+def daemon_thread_execute(execute_function, *args, **kwargs):
+    """
+    在单独的守护线程中运行某个函数 不占用全局异步任务处理线程池
+    适用于长时间阻塞的任务 (例如一个连接的读循环) 避免大量阻塞任务耗尽线程池 导致其他异步任务无法执行
+    :return: 运行该函数的线程
+    :rtype: threading.Thread
+    """
+    if execute_function is None:
+        raise Exception("[daemon_thread_execute] Execute function is None!")
+    thread = threading.Thread(target=execute_function, args=args, kwargs=kwargs)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
 @type_check(str, None, [int, float, long, str])
 def cycle_execute(task_name, execute_function, cycle_run_seconds):
     """
@@ -0,0 +1,97 @@
+# coding=utf-8
+import json
+import sys
+import time
+
+from pava.component.mq.core.mq_message import MQMessage, MQ_MESSAGE_FIELD_NAME_TUPLE
+from pava.decorator.decorator_impl.type_check_decorator import type_check
+
+"""
+对比 MQ Message 各个操作的耗时 以及单个实例占用的内存
+legacy 为使用 __dict__ 存储字段 构造时检查类型 复制时重新构造的实现 (即引入 __slots__ 之前的 MQMessage)
+用法: python test/mq_message_benchmark.py [重复次数]
+"""
+
+REPEAT_COUNT = 100000
+
+FIELD_TUPLE = (
+    1, "benchmark_topic", "message_text", 0, 1700000000, 1700000000, "consumer", 1700003600, 0, "producer",
+    "8c7d2a3e-4b5f-4c1d-9e0a-1b2c3d4e5f60", 1, 1700000000, 0
+)
+
+
+class LegacyMQMessage(object):
+
+    @type_check(None, int, str, str, int, int, int, str, int, int, str, str, int, int, int)
+    def __init__(self, message_id=None, message_topic=None, message_text=None, message_status=None,
+                 create_time=None, update_time=None, consumer=None, expire_time=None, failed_times=None, producer=None,
+                 message_uuid=None, message_encoding=None, visible_time=None, priority=None):
+        self.message_id = message_id
+        self.message_topic = message_topic
+        self.message_text = message_text
+        self.message_status = message_status
+        self.create_time = create_time
+        self.update_time = update_time
+        self.consumer = consumer
+        self.expire_time = expire_time
+        self.failed_times = failed_times
+        self.producer = producer
+        self.message_uuid = message_uuid
+        self.message_encoding = message_encoding
+        self.visible_time = visible_time
+        self.priority = priority
+
+    def copy(self):
+        another_mq_message = LegacyMQMessage()
+        another_mq_message.message_id = self.message_id
+        another_mq_message.message_topic = self.message_topic
+        another_mq_message.message_text = self.message_text
+        another_mq_message.message_status = self.message_status
+        another_mq_message.create_time = self.create_time
+        another_mq_message.update_time = self.update_time
+        another_mq_message.consumer = self.consumer
+        another_mq_message.expire_time = self.expire_time
+        another_mq_message.failed_times = self.failed_times
+        another_mq_message.producer = self.producer
+        another_mq_message.message_uuid = self.message_uuid
+        another_mq_message.message_encoding = self.message_encoding
+        another_mq_message.visible_time = self.visible_time
+        another_mq_message.priority = self.priority
+        return another_mq_message
+
+
+def benchmark(function, repeat_count):
+    """
+    :return: 每次操作的微秒数
+    """
+    begin_time = time.time()
+    for _ in range(repeat_count):
+        function()
+    return (time.time() - begin_time) * 1000000 / repeat_count
+
+
+if __name__ == '__main__':
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT_COUNT
+
+    field_dict = dict(zip(MQ_MESSAGE_FIELD_NAME_TUPLE, FIELD_TUPLE))
+    legacy_mq_message = LegacyMQMessage(**field_dict)
+    mq_message = MQMessage.from_trusted_fields(*FIELD_TUPLE)
+
+    result_list = [
+        ("construct (legacy, type checked)", benchmark(lambda: LegacyMQMessage(**field_dict), repeat_count)),
+        ("construct (type checked)", benchmark(lambda: MQMessage(**field_dict), repeat_count)),
+        ("construct (trusted fields)", benchmark(lambda: MQMessage.from_trusted_fields(**field_dict), repeat_count)),
+        ("construct (trusted field tuple)", benchmark(lambda: MQMessage.from_trusted_fields(*FIELD_TUPLE),
+                                                      repeat_count)),
+        ("copy (legacy)", benchmark(legacy_mq_message.copy, repeat_count)),
+        ("copy", benchmark(mq_message.copy, repeat_count)),
+        ("to_dict + json.dumps", benchmark(lambda: json.dumps(mq_message.to_dict()), repeat_count)),
+        ("to_field_tuple + json.dumps", benchmark(lambda: json.dumps(mq_message.to_field_tuple()), repeat_count)),
+        ("from_dict", benchmark(lambda: MQMessage.from_dict(field_dict), repeat_count)),
+    ]
+    for operation_name, cost in result_list:
+        print("%-34s: %8.3f us/op" % (operation_name, cost))
+
+    print("%-34s: %8s bytes" % ("instance size (legacy)",
+                                sys.getsizeof(legacy_mq_message) + sys.getsizeof(legacy_mq_message.__dict__)))
+    print("%-34s: %8s bytes" % ("instance size", sys.getsizeof(mq_message)))
@@ -0,0 +1,54 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+对比 add_message 逐条写入 与 add_messages 批量写入 的吞吐
+用法: python test/simple_sqlite_mq_add_messages_benchmark.py [消息数量] [批量大小]
+"""
+
+MESSAGE_COUNT = 2000
+BATCH_SIZE = 500
+MESSAGE_TEXT = "benchmark_message_text_" * 8
+
+
+def benchmark_add_message(mq, message_count):
+    begin_time = time.time()
+    for _ in range(message_count):
+        mq.add_message("benchmark_single", MESSAGE_TEXT)
+    mq.wait_ext_segment_synced()
+    return time.time() - begin_time
+
+
+def benchmark_add_messages(mq, message_count, batch_size):
+    begin_time = time.time()
+    for begin_index in range(0, message_count, batch_size):
+        mq.add_messages("benchmark_batch", [MESSAGE_TEXT] * min(batch_size, message_count - begin_index))
+    mq.wait_ext_segment_synced()
+    return time.time() - begin_time
+
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_SIZE
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+
+    single_cost = benchmark_add_message(mq, message_count)
+    batch_cost = benchmark_add_messages(mq, message_count, batch_size)
+
+    print("add_message  : %s messages, %.3f s, %.1f msg/s" % (message_count, single_cost, message_count / single_cost))
+    print("add_messages : %s messages, batch %s, %.3f s, %.1f msg/s" % (
+        message_count, batch_size, batch_cost, message_count / batch_cost))
+    print("speed up     : %.1fx" % (single_cost / batch_cost))
+    os._exit(0)
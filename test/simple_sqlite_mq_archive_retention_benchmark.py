@@ -0,0 +1,115 @@
+# coding=utf-8
+import base64
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import MESSAGE_STATUS_DONE, MESSAGE_ENCODING_BASE64, MESSAGE_PRIORITY_DEFAULT, \
+    SQLITE_MQ_ARCHIVE_PARTITION_DAY, VACUUM_SQL
+from pava.component.mq.core.mq_message import MQMessage
+from pava.component.mq.core.simple_sqlite_mq_archiver import SimpleSQLiteMQArchiver
+from pava.component.mq.core.simple_sqlite_mq_ext_segment import _get_simple_sqlite_mq_broker_ext_segment
+
+"""
+归档若干天的消息 之后删除最旧一天的归档
+对比 按天分区时直接删除分区文件 与 单个归档文件中 DELETE 最旧一天的消息再 VACUUM 回收空间 的耗时
+用法: python test/simple_sqlite_mq_archive_retention_benchmark.py [天数 至少为 3] [每天的消息数量]
+"""
+
+DAY_COUNT = 7
+DAY_MESSAGE_COUNT = 50000
+BATCH_SIZE = 10000
+MESSAGE_TOPIC = "benchmark_archive_retention"
+MESSAGE_TEXT = base64.b64encode("message" * 20)
+
+SEGMENT_LOCK_KEY_COUNT = [0]
+
+
+def generate_segment(db_path):
+    SEGMENT_LOCK_KEY_COUNT[0] += 1
+    return _get_simple_sqlite_mq_broker_ext_segment(
+        db_path=db_path,
+        mq_operation_lock_key="archive_retention_benchmark_%s" % SEGMENT_LOCK_KEY_COUNT[0],
+        pragma_list=[("journal_mode", "WAL"), ("synchronous", "NORMAL")]
+    )
+
+
+def get_message_list(begin_index, message_count, update_time):
+    return [
+        MQMessage(message_id=begin_index + index, message_topic=MESSAGE_TOPIC, message_text=MESSAGE_TEXT,
+                  message_status=MESSAGE_STATUS_DONE, create_time=update_time, update_time=update_time,
+                  consumer="consumer", expire_time=0, failed_times=0, producer="producer",
+                  message_uuid="uuid_%s" % (begin_index + index), message_encoding=MESSAGE_ENCODING_BASE64,
+                  visible_time=update_time, priority=MESSAGE_PRIORITY_DEFAULT)
+        for index in range(message_count)
+    ]
+
+
+def archive_messages(add_message_list_function, day_count, day_message_count, current_time):
+    message_index = 0
+    for day in range(day_count - 1, -1, -1):
+        added_count = 0
+        while added_count < day_message_count:
+            batch_size = min(BATCH_SIZE, day_message_count - added_count)
+            add_message_list_function(get_message_list(message_index, batch_size, current_time - day * 86400), None)
+            added_count += batch_size
+            message_index += batch_size
+
+
+def get_file_size(db_path):
+    return sum([os.path.getsize(db_path + suffix) for suffix in ("", "-wal") if os.path.exists(db_path + suffix)])
+
+
+if __name__ == '__main__':
+    day_count = int(sys.argv[1]) if len(sys.argv) > 1 else DAY_COUNT
+    day_message_count = int(sys.argv[2]) if len(sys.argv) > 2 else DAY_MESSAGE_COUNT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    current_time = int(time.time())
+    # 分区的结束时间早于 retention 时才删除 只有最旧一天的分区完全在 retention 之外
+    retention_seconds = (day_count - 2) * 86400
+
+    # 按天分区 保留策略直接删除最旧的分区文件
+    archiver = SimpleSQLiteMQArchiver(
+        os.path.join(mq_path, "archive"), os.path.join(mq_path, "legacy.sqlite"), generate_segment,
+        partition_period=SQLITE_MQ_ARCHIVE_PARTITION_DAY, retention_seconds=retention_seconds
+    )
+    archive_messages(archiver.add_message_list, day_count, day_message_count, current_time)
+    partition_size_before = sum([partition["file_size"] for partition in archiver.get_partition_list()])
+    begin_time = time.time()
+    dropped_partition_name_list = archiver.enforce_retention()
+    partition_cost = time.time() - begin_time
+    partition_size_after = sum([partition["file_size"] for partition in archiver.get_partition_list()])
+
+    # 单个归档文件 DELETE 最旧一天的消息 再 VACUUM 才能把空间还给文件系统
+    single_db_path = os.path.join(mq_path, "single_archive.sqlite")
+    single_segment = generate_segment(single_db_path)
+    archive_messages(single_segment.add_message_list, day_count, day_message_count, current_time)
+    single_segment.close()
+    single_size_before = get_file_size(single_db_path)
+    connection = sqlite3.connect(single_db_path)
+    begin_time = time.time()
+    partition_start_time = archiver.get_partition_list()[-1]["start_time"]
+    delete_count = connection.execute("DELETE FROM simple_sqlite_mq WHERE update_time < ?",
+                                      (partition_start_time,)).rowcount
+    connection.commit()
+    delete_cost = time.time() - begin_time
+    connection.execute(VACUUM_SQL)
+    vacuum_cost = time.time() - begin_time - delete_cost
+    connection.close()
+    single_size_after = get_file_size(single_db_path)
+
+    print("archived messages    : %s days x %s messages" % (day_count, day_message_count))
+    print("partition drop       : %s partitions, %.3f s, %.1f MB -> %.1f MB" % (
+        len(dropped_partition_name_list), partition_cost, partition_size_before / 1048576.0,
+        partition_size_after / 1048576.0))
+    print("single file delete   : %s messages, delete %.3f s + vacuum %.3f s, %.1f MB -> %.1f MB" % (
+        delete_count, delete_cost, vacuum_cost, single_size_before / 1048576.0, single_size_after / 1048576.0))
+    os._exit(0)
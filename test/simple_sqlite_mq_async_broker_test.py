@@ -0,0 +1,179 @@
+# coding=utf-8
+import logging
+import os
+import tempfile
+import time
+import traceback
+from threading import Event, Lock
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import SQLITE_MQ_ASYNC_ARRIVAL_WAIT_SECONDS
+from pava.component.mq.core.simple_sqlite_mq_async_broker import AsyncSimpleSQLiteMQBroker
+from pava.component.mq.core.simple_sqlite_mq_async_consumer import AsyncSQLiteMQConsumer
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+校验异步接口等待消息到达 以及异步消费者释放并发名额的时机
+已经有等待正在进行时 新注册的等待请求在其 Topic 发布消息后立即被唤醒 不必等到正在进行的等待超时
+关闭后正在等待新消息的获取请求立即返回没有消息 不再重复获取 合并写入的 add_message 中一个非法请求不影响其他请求
+异步消费者在提交请求完成之后才释放并发名额 提交期间不会获取超过 max_in_flight 的消息
+用法: python test/simple_sqlite_mq_async_broker_test.py
+"""
+
+WAKE_TIMEOUT_SECONDS = 10
+# 唤醒耗时的上限 远小于一次等待到达的间隔
+MAX_WAKE_SECONDS = SQLITE_MQ_ASYNC_ARRIVAL_WAIT_SECONDS / 4.0
+COMMIT_GATE_SECONDS = 0.5
+
+
+class GatedCommitAsyncBroker(AsyncSimpleSQLiteMQBroker):
+    """
+    commit_message 在 commit_gate 打开之后才执行
+    """
+
+    def __init__(self, mq_instance):
+        AsyncSimpleSQLiteMQBroker.__init__(self, mq_instance)
+        self.commit_gate = Event()
+
+    def _gated_commit_message(self, message_topic, message_uuid):
+        self.commit_gate.wait(WAKE_TIMEOUT_SECONDS)
+        return self._mq_instance.commit_message(message_topic, message_uuid)
+
+    def commit_message(self, message_topic, message_uuid):
+        return self._submit(self._gated_commit_message, message_topic, message_uuid)
+
+
+class RecordConsumer(AsyncSQLiteMQConsumer):
+
+    def __init__(self, async_mq_instance, message_topic):
+        AsyncSQLiteMQConsumer.__init__(self, async_mq_instance, max_in_flight=1, consume_batch_size=1,
+                                       max_idle_wait_seconds=1)
+        self._record_lock = Lock()
+        self.consumed_text_list = list()
+        self.register_consume_message(message_topic, self._consume)
+
+    def _consume(self, mq_message):
+        with self._record_lock:
+            self.consumed_text_list.append(mq_message.message_text)
+
+    def get_in_flight_count(self):
+        with self._synchronize_message_lock:
+            return len(self._in_flight_message_dict)
+
+    def _get_consumer(self, message_topic):
+        return "record_consumer"
+
+    def _get_consume_expire_time(self, message_topic):
+        return 60
+
+    def _get_max_failed_times(self, message_topic):
+        return 3
+
+    def _get_retry_interval(self, message_topic):
+        return 1
+
+
+def check_late_waiter(mq, async_mq):
+    """
+    第一个请求的等待进行期间 注册等待另一个 Topic 的请求
+    """
+    first_future = async_mq.wait_message_arrival(["late_waiter_first"], mq.get_message_arrival_version(), 30)
+    time.sleep(0.2)
+    late_future = async_mq.wait_message_arrival(["late_waiter_second"], mq.get_message_arrival_version(), 30)
+    time.sleep(0.2)
+    begin_time = time.time()
+    mq.add_message("late_waiter_second", "late_waiter_message")
+    assert late_future.result(WAKE_TIMEOUT_SECONDS) is True
+    wake_seconds = time.time() - begin_time
+    assert wake_seconds < MAX_WAKE_SECONDS, wake_seconds
+
+    # 注册之前已经到达的消息
+    arrival_version = mq.get_message_arrival_version()
+    mq.add_message("late_waiter_third", "arrived_message")
+    time.sleep(0.2)
+    begin_time = time.time()
+    arrived_future = async_mq.wait_message_arrival(["late_waiter_third"], arrival_version, 30)
+    assert arrived_future.result(WAKE_TIMEOUT_SECONDS) is True
+    wake_seconds = time.time() - begin_time
+    assert wake_seconds < MAX_WAKE_SECONDS, wake_seconds
+    mq.add_message("late_waiter_first", "first_message")
+    first_future.result(WAKE_TIMEOUT_SECONDS)
+
+
+def check_close_pending_wait(mq):
+    """
+    关闭时正在等待新消息的获取请求 立即返回没有消息 之后不再调用 MQ 获取消息
+    """
+    async_mq = AsyncSimpleSQLiteMQBroker(mq)
+    get_message_future = async_mq.get_message("close_pending_wait", wait_timeout=30)
+    get_messages_future = async_mq.get_messages("close_pending_wait", 3, wait_timeout=30)
+    time.sleep(0.2)
+    async_mq.close()
+    assert get_message_future.result(WAKE_TIMEOUT_SECONDS) is None
+    assert get_messages_future.result(WAKE_TIMEOUT_SECONDS) == []
+
+
+def check_add_message_isolation(mq):
+    """
+    消息体非法的请求只有自己失败 与其合并写入的其他请求正常写入
+    """
+    async_mq = AsyncSimpleSQLiteMQBroker(mq)
+    message_topic = "add_message_isolation"
+    future_list = [async_mq.add_message(message_topic, "isolation_%s" % index) for index in range(3)]
+    invalid_future = async_mq.add_message(message_topic, None)
+    future_list.append(async_mq.add_message(message_topic, "isolation_3"))
+    assert [future.result(WAKE_TIMEOUT_SECONDS).message_text for future in future_list] == [
+        "isolation_%s" % index for index in range(4)]
+    assert invalid_future.exception(WAKE_TIMEOUT_SECONDS) is not None
+    async_mq.close()
+
+
+def check_commit_release(mq):
+    """
+    提交请求完成之前 消息仍然占用并发名额
+    """
+    message_topic = "commit_release"
+    async_mq = GatedCommitAsyncBroker(mq)
+    mq.add_messages(message_topic, ["commit_release_0", "commit_release_1"])
+    consumer = RecordConsumer(async_mq, message_topic)
+    consumer.start()
+
+    time.sleep(COMMIT_GATE_SECONDS)
+    assert consumer.consumed_text_list == ["commit_release_0"], consumer.consumed_text_list
+    assert consumer.get_in_flight_count() == 1
+
+    async_mq.commit_gate.set()
+    begin_time = time.time()
+    while len(consumer.consumed_text_list) < 2:
+        assert time.time() - begin_time < WAKE_TIMEOUT_SECONDS, consumer.consumed_text_list
+        time.sleep(0.05)
+    while consumer.get_in_flight_count() > 0:
+        assert time.time() - begin_time < WAKE_TIMEOUT_SECONDS, consumer.get_in_flight_count()
+        time.sleep(0.05)
+    consumer.stop()
+    async_mq.close()
+
+
+if __name__ == '__main__':
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_test_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "test.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+    async_mq = AsyncSimpleSQLiteMQBroker(mq)
+
+    try:
+        check_late_waiter(mq, async_mq)
+        print("late waiter ok")
+        check_close_pending_wait(mq)
+        print("close pending wait ok")
+        check_add_message_isolation(mq)
+        print("add message isolation ok")
+        check_commit_release(mq)
+        print("commit release ok")
+    except Exception:
+        # 消费者的线程不是守护线程 校验失败 或等待结果超时时 直接退出进程
+        traceback.print_exc()
+        os._exit(1)
+    async_mq.close()
+    os._exit(0)
@@ -0,0 +1,166 @@
+# coding=utf-8
+import heapq
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from threading import Condition, Lock
+
+from pava.component.p_log import PLog
+
+from pava.component.mq.core.simple_sqlite_mq_async_broker import AsyncSimpleSQLiteMQBroker
+from pava.component.mq.core.simple_sqlite_mq_async_consumer import AsyncSQLiteMQConsumer
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+from pava.component.mq.core.simple_sqlite_mq_consumer import SimpleSQLiteMQConsumer
+from pava.utils.async_utils import async_execute
+
+"""
+模拟每条消息的处理需要等待一段 IO 时间 对比 多线程消费者 与 异步消费者 的消费吞吐
+多线程消费者的吞吐受线程数量限制 异步消费者只用一个线程获取消息 同时处理的消息数量由 max_in_flight 限制
+同时对比 逐条同步 add_message 与 通过异步接口并发 add_message (自动合并为批量写入) 的吞吐
+用法: python test/simple_sqlite_mq_async_consumer_benchmark.py [消息数量] [每条消息的 IO 毫秒数] [线程数量] [max_in_flight]
+"""
+
+MESSAGE_COUNT = 2000
+IO_MILLISECONDS = 50
+THREAD_COUNT = 8
+MAX_IN_FLIGHT = 200
+
+
+class SimulatedIO(object):
+    """
+    用一个线程模拟非阻塞 IO 到达完成时间后完成对应的 Future
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._timer_heap = list()
+        async_execute(self._loop)
+
+    def submit(self, io_seconds):
+        future = Future()
+        with self._condition:
+            heapq.heappush(self._timer_heap, (time.time() + io_seconds, id(future), future))
+            self._condition.notify_all()
+        return future
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._timer_heap or self._timer_heap[0][0] > time.time():
+                    self._condition.wait(None if not self._timer_heap else self._timer_heap[0][0] - time.time())
+                _, _, future = heapq.heappop(self._timer_heap)
+            future.set_result(None)
+
+
+class ConsumeCounter(object):
+
+    def __init__(self, message_count):
+        self._lock = Lock()
+        self._message_count = message_count
+        self._consumed_count = 0
+        self.finish_time = None
+
+    def increase(self):
+        with self._lock:
+            self._consumed_count += 1
+            if self._consumed_count == self._message_count:
+                self.finish_time = time.time()
+
+
+class BenchmarkConsumerMixin(object):
+
+    def _get_consumer(self, message_topic):
+        return "benchmark_consumer"
+
+    def _get_consume_expire_time(self, message_topic):
+        return 600
+
+    def _get_retry_interval(self, message_topic):
+        return 1
+
+    def _get_max_failed_times(self, message_topic):
+        return 3
+
+
+class ThreadBenchmarkConsumer(BenchmarkConsumerMixin, SimpleSQLiteMQConsumer):
+
+    def __init__(self, mq_instance, message_topic, counter, io_seconds, thread_count):
+        SimpleSQLiteMQConsumer.__init__(self, mq_instance, worker_count=thread_count)
+
+        def handle(mq_message):
+            time.sleep(io_seconds)
+            counter.increase()
+
+        self.register_consume_message(message_topic, handle)
+
+
+class AsyncBenchmarkConsumer(BenchmarkConsumerMixin, AsyncSQLiteMQConsumer):
+
+    def __init__(self, async_mq_instance, message_topic, counter, io_seconds, max_in_flight, simulated_io):
+        AsyncSQLiteMQConsumer.__init__(self, async_mq_instance, max_in_flight=max_in_flight, consume_batch_size=50)
+
+        def handle(mq_message):
+            future = simulated_io.submit(io_seconds)
+            future.add_done_callback(lambda _: counter.increase())
+            return future
+
+        self.register_consume_message(message_topic, handle)
+
+
+def benchmark_consumer(mq, message_topic, message_count, create_consumer_function):
+    """
+    :return: 每秒消费的消息数量
+    """
+    mq.add_messages(message_topic, ["message"] * message_count)
+    counter = ConsumeCounter(message_count)
+    begin_time = time.time()
+    create_consumer_function(counter).start()
+    while counter.finish_time is None:
+        time.sleep(0.01)
+    return message_count / (counter.finish_time - begin_time)
+
+
+def benchmark_add_message(mq, async_mq, message_count):
+    """
+    :return: (逐条同步写入 每秒消息数, 异步并发写入 每秒消息数)
+    """
+    begin_time = time.time()
+    for _ in range(message_count):
+        mq.add_message("benchmark_add_sync", "message")
+    sync_rate = message_count / (time.time() - begin_time)
+
+    begin_time = time.time()
+    future_list = [async_mq.add_message("benchmark_add_async", "message") for _ in range(message_count)]
+    for future in future_list:
+        future.result()
+    return sync_rate, message_count / (time.time() - begin_time)
+
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    io_seconds = (int(sys.argv[2]) if len(sys.argv) > 2 else IO_MILLISECONDS) / 1000.0
+    thread_count = int(sys.argv[3]) if len(sys.argv) > 3 else THREAD_COUNT
+    max_in_flight = int(sys.argv[4]) if len(sys.argv) > 4 else MAX_IN_FLIGHT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+    async_mq = AsyncSimpleSQLiteMQBroker(mq)
+    simulated_io = SimulatedIO()
+
+    sync_add_rate, async_add_rate = benchmark_add_message(mq, async_mq, message_count)
+    print("add_message sync           : %.1f msg/s" % sync_add_rate)
+    print("add_message async batched  : %.1f msg/s" % async_add_rate)
+
+    thread_rate = benchmark_consumer(mq, "benchmark_thread", message_count, lambda counter: ThreadBenchmarkConsumer(
+        mq, "benchmark_thread", counter, io_seconds, thread_count))
+    print("thread consumer (%3s thr)  : %.1f msg/s" % (thread_count, thread_rate))
+
+    async_rate = benchmark_consumer(mq, "benchmark_async", message_count, lambda counter: AsyncBenchmarkConsumer(
+        async_mq, "benchmark_async", counter, io_seconds, max_in_flight, simulated_io))
+    print("async consumer (%3s flight): %.1f msg/s" % (max_in_flight, async_rate))
+    os._exit(0)
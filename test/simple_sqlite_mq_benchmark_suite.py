@@ -0,0 +1,349 @@
+# coding=utf-8
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from threading import Lock
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import MESSAGE_STATUS_DEAD_LETTER, MESSAGE_STATUS_PENDING
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+from pava.utils.async_utils import async_execute
+
+"""
+MQ 吞吐与延迟的基准测试集 每个负载在临时目录中新建一个 SimpleSQLiteMQBroker
+负载参数: 生产者数量 消费者数量 消息大小 Topic 数量 批大小 消费失败的比例 消息数量
+统计 生产 / 消费 吞吐 (msg/s) 以及每条消息从写入到提交的延迟 p50 / p99 / p999
+结果以 JSON 输出 (摘要输出到 stderr) 指定基准文件时逐个负载对比 吞吐下降或 p99 延迟上升超过容忍比例时返回 1
+默认的基准文件 simple_sqlite_mq_benchmark_baseline.json 记录了生成时的运行环境 在其他环境中对比前应当重新生成
+消费失败由每个消费者各自的固定种子的随机数决定 相同参数的两次运行 失败的消息序列相同
+用法: python test/simple_sqlite_mq_benchmark_suite.py [--workload 名称 ...] [--messages 数量] [--producers 数量]
+      [--consumers 数量] [--message-size 字节] [--topics 数量] [--batch-size 数量] [--failure-rate 比例]
+      [--seed 种子] [--output 文件] [--baseline 文件] [--save-baseline] [--tolerance 比例]
+"""
+
+# 预置的负载 命令行中指定的参数覆盖所有选中负载的对应参数
+WORKLOAD_DICT = {
+    "single": {
+        "producer_count": 1, "consumer_count": 1, "message_size": 256, "topic_count": 1, "batch_size": 1,
+        "failure_rate": 0.0, "message_count": 2000,
+    },
+    "batch": {
+        "producer_count": 1, "consumer_count": 1, "message_size": 256, "topic_count": 1, "batch_size": 100,
+        "failure_rate": 0.0, "message_count": 20000,
+    },
+    "concurrent": {
+        "producer_count": 4, "consumer_count": 4, "message_size": 256, "topic_count": 1, "batch_size": 10,
+        "failure_rate": 0.0, "message_count": 10000,
+    },
+    "multi_topic": {
+        "producer_count": 4, "consumer_count": 4, "message_size": 256, "topic_count": 4, "batch_size": 10,
+        "failure_rate": 0.0, "message_count": 10000,
+    },
+    "large_message": {
+        "producer_count": 2, "consumer_count": 2, "message_size": 64 * 1024, "topic_count": 1, "batch_size": 10,
+        "failure_rate": 0.0, "message_count": 2000,
+    },
+    "failure": {
+        "producer_count": 2, "consumer_count": 2, "message_size": 256, "topic_count": 1, "batch_size": 10,
+        "failure_rate": 0.1, "message_count": 5000,
+    },
+}
+WORKLOAD_NAME_LIST = ["single", "batch", "concurrent", "multi_topic", "large_message", "failure"]
+WORKLOAD_PARAMETER_NAME_LIST = [
+    "producer_count", "consumer_count", "message_size", "topic_count", "batch_size", "failure_rate", "message_count"
+]
+
+DEFAULT_SEED = 20231
+DEFAULT_TOLERANCE = 0.1
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     "simple_sqlite_mq_benchmark_baseline.json")
+MAX_FAILED_TIMES = 3
+RETRY_INTERVAL_SECONDS = 1
+MAX_CONSUME_SECONDS = 600
+ARRIVAL_WAIT_SECONDS = 0.1
+TOPIC_PREFIX = "benchmark_topic_"
+# 消息体 = 写入时间 + 分隔符 + 填充 写入时间用于计算写入到提交的延迟
+MESSAGE_TIME_SEPARATOR = "|"
+
+
+def build_message_text(enqueue_time, message_size):
+    message_text = "%.6f%s" % (enqueue_time, MESSAGE_TIME_SEPARATOR)
+    return message_text + "x" * max(0, message_size - len(message_text))
+
+
+def parse_enqueue_time(message_text):
+    return float(message_text[:message_text.index(MESSAGE_TIME_SEPARATOR)])
+
+
+def percentile(sorted_value_list, ratio):
+    """
+    最近秩法 取第 ceil(ratio * n) 小的值
+    """
+    if len(sorted_value_list) == 0:
+        return 0.0
+    index = int(math.ceil(ratio * len(sorted_value_list))) - 1
+    return sorted_value_list[min(len(sorted_value_list) - 1, max(0, index))]
+
+
+class WorkloadState(object):
+    """
+    一个负载运行期间 生产者与消费者共享的统计数据
+    """
+
+    def __init__(self, message_count):
+        self._lock = Lock()
+        self.message_count = message_count
+        self.finished_count = 0
+        self.failed_count = 0
+        self.dead_letter_count = 0
+        self.latency_list = list()
+        self.produce_finish_time = None
+        self.consume_finish_time = None
+
+    def record_commit(self, latency_list):
+        with self._lock:
+            self.latency_list.extend(latency_list)
+            self._finish(len(latency_list))
+
+    def record_failed(self, dead_letter_bool):
+        with self._lock:
+            self.failed_count += 1
+            if dead_letter_bool:
+                self.dead_letter_count += 1
+                self._finish(1)
+
+    def _finish(self, finished_count):
+        self.finished_count += finished_count
+        if self.finished_count >= self.message_count and self.consume_finish_time is None:
+            self.consume_finish_time = time.time()
+
+    def is_finished(self):
+        with self._lock:
+            return self.finished_count >= self.message_count
+
+
+def produce(mq, producer_index, message_count, parameter_dict):
+    topic_count = parameter_dict["topic_count"]
+    batch_size = parameter_dict["batch_size"]
+    message_size = parameter_dict["message_size"]
+    producer = "benchmark_producer_%s" % producer_index
+    produced_count = 0
+    batch_index = producer_index
+    while produced_count < message_count:
+        message_topic = TOPIC_PREFIX + str(batch_index % topic_count)
+        batch_index += 1
+        current_batch_size = min(batch_size, message_count - produced_count)
+        message_text = build_message_text(time.time(), message_size)
+        if current_batch_size == 1:
+            mq.add_message(message_topic, message_text, producer=producer)
+        else:
+            mq.add_messages(message_topic, [message_text] * current_batch_size, producer=producer)
+        produced_count += current_batch_size
+
+
+def consume(mq, consumer_index, parameter_dict, seed, workload_state):
+    message_topic_list = [TOPIC_PREFIX + str(index) for index in range(parameter_dict["topic_count"])]
+    batch_size = parameter_dict["batch_size"]
+    failure_rate = parameter_dict["failure_rate"]
+    failure_random = random.Random(seed * 1000 + consumer_index)
+    consumer = "benchmark_consumer_%s" % consumer_index
+    topic_index = consumer_index
+    while not workload_state.is_finished():
+        arrival_version = mq.get_message_arrival_version()
+        mq_message_list = list()
+        # 从上次的下一个 Topic 开始轮询 避免所有消费者总是先消费同一个 Topic
+        for _ in range(len(message_topic_list)):
+            message_topic = message_topic_list[topic_index % len(message_topic_list)]
+            topic_index += 1
+            if batch_size == 1:
+                mq_message = mq.get_message(message_topic, consumer, MAX_CONSUME_SECONDS)
+                mq_message_list = [] if mq_message is None else [mq_message]
+            else:
+                mq_message_list = mq.get_messages(message_topic, batch_size, consumer, MAX_CONSUME_SECONDS)
+            if len(mq_message_list) > 0:
+                break
+        if len(mq_message_list) == 0:
+            # 失败的消息在重试时间到达后恢复 不一定触发到达通知 所以只等待一小段时间
+            mq.wait_message_arrival(message_topic_list, arrival_version, ARRIVAL_WAIT_SECONDS)
+            continue
+
+        latency_list = list()
+        for mq_message in mq_message_list:
+            if failure_rate > 0 and failure_random.random() < failure_rate:
+                failed_message = mq.consume_failed(mq_message.message_topic, mq_message.message_uuid,
+                                                   MAX_FAILED_TIMES, RETRY_INTERVAL_SECONDS)
+                workload_state.record_failed(
+                    failed_message.message_status in (MESSAGE_STATUS_DEAD_LETTER, MESSAGE_STATUS_PENDING)
+                )
+                continue
+            mq.commit_message(mq_message.message_topic, mq_message.message_uuid)
+            latency_list.append(time.time() - parse_enqueue_time(mq_message.message_text))
+        workload_state.record_commit(latency_list)
+
+
+def run_workload(mq_path, workload_name, parameter_dict, seed):
+    """
+    :return: 负载的运行结果
+    :rtype: dict
+    """
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, workload_name))
+    message_count = parameter_dict["message_count"]
+    producer_count = parameter_dict["producer_count"]
+    workload_state = WorkloadState(message_count)
+
+    begin_time = time.time()
+    consumer_future_list = [
+        async_execute(consume, mq, consumer_index, parameter_dict, seed, workload_state)
+        for consumer_index in range(parameter_dict["consumer_count"])
+    ]
+    # 消息数量不能整除时 前面的生产者多生产一条
+    producer_future_list = [
+        async_execute(produce, mq, producer_index,
+                      message_count // producer_count + (1 if producer_index < message_count % producer_count else 0),
+                      parameter_dict)
+        for producer_index in range(producer_count)
+    ]
+    for future in producer_future_list:
+        future.result()
+    produce_seconds = time.time() - begin_time
+    for future in consumer_future_list:
+        future.result()
+    consume_seconds = workload_state.consume_finish_time - begin_time
+
+    latency_list = sorted(workload_state.latency_list)
+    committed_count = len(latency_list)
+    return {
+        "workload": workload_name,
+        "parameters": parameter_dict,
+        "seed": seed,
+        "produce_seconds": produce_seconds,
+        "consume_seconds": consume_seconds,
+        "produce_rate": message_count / produce_seconds,
+        "throughput": committed_count / consume_seconds,
+        "committed_count": committed_count,
+        "failed_count": workload_state.failed_count,
+        "dead_letter_count": workload_state.dead_letter_count,
+        "latency_ms": {
+            "p50": percentile(latency_list, 0.5) * 1000,
+            "p99": percentile(latency_list, 0.99) * 1000,
+            "p999": percentile(latency_list, 0.999) * 1000,
+            "max": (latency_list[-1] if committed_count > 0 else 0.0) * 1000,
+        },
+    }
+
+
+def compare_with_baseline(result_list, baseline_result_list, tolerance):
+    """
+    相同名称并且参数相同的负载才进行对比
+    :return: 对比结果列表 以及是否存在性能退化
+    :rtype: (list, bool)
+    """
+    baseline_result_dict = dict([(result["workload"], result) for result in baseline_result_list])
+    comparison_list = list()
+    regression_bool = False
+    for result in result_list:
+        baseline_result = baseline_result_dict.get(result["workload"], None)
+        if baseline_result is None or baseline_result["parameters"] != result["parameters"]:
+            continue
+        throughput_ratio = result["throughput"] / baseline_result["throughput"]
+        baseline_p99 = baseline_result["latency_ms"]["p99"]
+        p99_ratio = 1.0 if baseline_p99 == 0 else result["latency_ms"]["p99"] / baseline_p99
+        workload_regression_bool = throughput_ratio < 1 - tolerance or p99_ratio > 1 + tolerance
+        regression_bool = regression_bool or workload_regression_bool
+        comparison_list.append({
+            "workload": result["workload"],
+            "throughput_ratio": throughput_ratio,
+            "p99_ratio": p99_ratio,
+            "regression": workload_regression_bool,
+        })
+    return comparison_list, regression_bool
+
+
+def get_environment():
+    return {
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "cpu_count": multiprocessing.cpu_count(),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SimpleSQLiteMQBroker throughput / latency benchmark suite")
+    parser.add_argument("--workload", action="append", choices=WORKLOAD_NAME_LIST,
+                        help="workload to run, repeatable, default all")
+    parser.add_argument("--messages", dest="message_count", type=int)
+    parser.add_argument("--producers", dest="producer_count", type=int)
+    parser.add_argument("--consumers", dest="consumer_count", type=int)
+    parser.add_argument("--message-size", dest="message_size", type=int)
+    parser.add_argument("--topics", dest="topic_count", type=int)
+    parser.add_argument("--batch-size", dest="batch_size", type=int)
+    parser.add_argument("--failure-rate", dest="failure_rate", type=float)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", help="write result json to this file, default stdout")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline result json to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed throughput drop / p99 latency rise ratio")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    result_list = list()
+    for workload_name in args.workload or WORKLOAD_NAME_LIST:
+        parameter_dict = dict(WORKLOAD_DICT[workload_name])
+        for parameter_name in WORKLOAD_PARAMETER_NAME_LIST:
+            if getattr(args, parameter_name) is not None:
+                parameter_dict[parameter_name] = getattr(args, parameter_name)
+        result = run_workload(mq_path, workload_name, parameter_dict, args.seed)
+        result_list.append(result)
+        sys.stderr.write("%-14s: %9.1f msg/s produce, %9.1f msg/s consume, p50 %8.2f ms, p99 %8.2f ms, "
+                         "p999 %8.2f ms, failed %s, dead letter %s\n" % (
+                             workload_name, result["produce_rate"], result["throughput"], result["latency_ms"]["p50"],
+                             result["latency_ms"]["p99"], result["latency_ms"]["p999"], result["failed_count"],
+                             result["dead_letter_count"]))
+
+    report = {"environment": get_environment(), "results": result_list}
+    regression_bool = False
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline_report = json.load(baseline_file)
+        comparison_list, regression_bool = compare_with_baseline(
+            result_list, baseline_report["results"], args.tolerance
+        )
+        report["baseline"] = {"path": args.baseline, "tolerance": args.tolerance, "comparison": comparison_list}
+        for comparison in comparison_list:
+            sys.stderr.write("%-14s: throughput x%.3f, p99 x%.3f%s\n" % (
+                comparison["workload"], comparison["throughput_ratio"], comparison["p99_ratio"],
+                ", REGRESSION" if comparison["regression"] else ""))
+    elif not args.save_baseline:
+        sys.stderr.write("no baseline found at %s, skip comparison (run with --save-baseline to create one)\n" %
+                         args.baseline)
+
+    report_json = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(report_json)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(report_json + "\n")
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            baseline_file.write(report_json + "\n")
+        sys.stderr.write("baseline saved to %s\n" % args.baseline)
+    os._exit(1 if regression_bool else 0)
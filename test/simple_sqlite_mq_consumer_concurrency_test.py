@@ -0,0 +1,136 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+import traceback
+from threading import Condition, Lock
+
+from pava.component.p_log import PLog
+
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+from pava.component.mq.core.simple_sqlite_mq_consumer import SimpleSQLiteMQConsumer
+
+"""
+线程数量多于主题的 max_concurrency 处理函数较慢 校验任意时刻正在处理的消息数量 以及消费者记录的正在消费数量 都不超过并发上限
+消费者的同步锁每次释放后都会让出一小段时间 放大两次加锁之间的间隙 使并发名额被提前归还的问题可以稳定复现
+逐条获取 与 批量预取 两种方式各运行一次 同时校验所有消息都被消费且只被消费一次
+用法: python test/simple_sqlite_mq_consumer_concurrency_test.py [消息数量] [线程数量] [max_concurrency]
+"""
+
+MESSAGE_COUNT = 200
+WORKER_COUNT = 8
+MAX_CONCURRENCY = 2
+HANDLE_SECONDS = 0.02
+# 每次释放消费者的同步锁后 让出的秒数
+YIELD_SECONDS = 0.005
+CONSUME_TIMEOUT_SECONDS = 120
+
+
+class YieldingLock(object):
+    """
+    释放后休眠一段时间的锁 让其他线程有机会在两次加锁之间运行
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+
+    def acquire(self, blocking=True):
+        return self._lock.acquire(blocking)
+
+    def release(self):
+        self._lock.release()
+        time.sleep(YIELD_SECONDS)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ConcurrencyCheckConsumer(SimpleSQLiteMQConsumer):
+
+    def __init__(self, mq_instance, message_topic, worker_count, max_concurrency, consume_batch_size):
+        SimpleSQLiteMQConsumer.__init__(self, mq_instance, consume_batch_size=consume_batch_size,
+                                        max_idle_wait_seconds=1, worker_count=worker_count)
+        self._synchronize_message_lock = YieldingLock()
+        self._synchronize_message_condition = Condition(self._synchronize_message_lock)
+        self._message_topic = message_topic
+        self._max_concurrency = max_concurrency
+        self._check_lock = Lock()
+        self.handling_count = 0
+        self.max_handling_count = 0
+        self.max_in_flight_count = 0
+        self.consumed_text_list = list()
+        self.register_consume_message(message_topic, self._consume, max_concurrency)
+
+    def _consume(self, mq_message):
+        with self._check_lock:
+            self.handling_count += 1
+            self.max_handling_count = max(self.max_handling_count, self.handling_count)
+        with self._synchronize_message_lock:
+            self.max_in_flight_count = max(
+                self.max_in_flight_count, self._consume_topic_in_flight_count[self._message_topic])
+        time.sleep(HANDLE_SECONDS)
+        with self._check_lock:
+            self.handling_count -= 1
+            self.consumed_text_list.append(mq_message.message_text)
+
+    def _get_consumer(self, message_topic):
+        return "concurrency_check_consumer"
+
+    def _get_consume_expire_time(self, message_topic):
+        return 60
+
+    def _get_max_failed_times(self, message_topic):
+        return 3
+
+    def _get_retry_interval(self, message_topic):
+        return 1
+
+
+def run_check(mq, message_topic, message_count, worker_count, max_concurrency, consume_batch_size):
+    """
+    :return: (处理函数中观察到的最大并发数量, 消费者记录的最大正在消费数量)
+    """
+    mq.add_messages(message_topic, ["message_%s" % index for index in range(message_count)])
+    consumer = ConcurrencyCheckConsumer(mq, message_topic, worker_count, max_concurrency, consume_batch_size)
+    consumer.start()
+
+    begin_time = time.time()
+    while len(consumer.consumed_text_list) < message_count:
+        assert time.time() - begin_time < CONSUME_TIMEOUT_SECONDS, "consume timeout, %s of %s consumed" % (
+            len(consumer.consumed_text_list), message_count)
+        time.sleep(0.05)
+    assert sorted(consumer.consumed_text_list) == sorted("message_%s" % index for index in range(message_count))
+    assert consumer.max_handling_count <= max_concurrency, consumer.max_handling_count
+    assert consumer.max_in_flight_count <= max_concurrency, consumer.max_in_flight_count
+    return consumer.max_handling_count, consumer.max_in_flight_count
+
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    worker_count = int(sys.argv[2]) if len(sys.argv) > 2 else WORKER_COUNT
+    max_concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else MAX_CONCURRENCY
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_test_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "test.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+
+    print("messages: %s, workers: %s, max concurrency: %s" % (message_count, worker_count, max_concurrency))
+    try:
+        for consume_batch_size in (1, 4):
+            message_topic = "concurrency_batch_%s" % consume_batch_size
+            max_handling_count, max_in_flight_count = run_check(
+                mq, message_topic, message_count, worker_count, max_concurrency, consume_batch_size)
+            print("batch size %s: max handling %s, max in flight %s, ok" % (
+                consume_batch_size, max_handling_count, max_in_flight_count))
+    except AssertionError:
+        # 消费线程不是守护线程 校验失败时直接退出进程
+        traceback.print_exc()
+        os._exit(1)
+    os._exit(0)
@@ -0,0 +1,123 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import SQLITE_MQ_DURABILITY_PROFILE_FAST
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+将同一批消息分发给 N 个订阅者 对比 每个订阅者一个 Topic (发布 N 次) 与 一个 Topic 加 N 个消费组 (发布 1 次) 两种方式下
+发布的耗时 Common Segment 文件的大小 以及各个订阅者 出队 + 提交 的吞吐 最后统计保留策略删除并归档的耗时
+用法: python test/simple_sqlite_mq_consumer_group_benchmark.py [消息数量] [订阅者数量]
+"""
+
+MESSAGE_COUNT = 10000
+SUBSCRIBER_COUNT = 4
+BATCH_SIZE = 500
+MESSAGE_SIZE = 512
+MESSAGE_TOPIC = "benchmark_fan_out"
+CONSUMER = "benchmark_consumer"
+
+
+def get_segment_size(mq_path, message_topic_list):
+    """
+    :return: Topic 的 Common Segment 文件 (包含 WAL) 的总字节数
+    """
+    total_size = 0
+    for message_topic in message_topic_list:
+        for suffix in ("", "-wal"):
+            file_path = os.path.join(mq_path, "segment", message_topic + "_segment.sqlite" + suffix)
+            if os.path.exists(file_path):
+                total_size += os.path.getsize(file_path)
+    return total_size
+
+
+def publish(publish_function, message_text_list):
+    """
+    :return: 发布的秒数
+    """
+    begin_time = time.time()
+    for index in range(0, len(message_text_list), BATCH_SIZE):
+        publish_function(message_text_list[index:index + BATCH_SIZE])
+    return time.time() - begin_time
+
+
+def consume(get_messages_function, commit_function, message_count):
+    """
+    :return: 每秒 出队 + 提交 的消息数量
+    """
+    begin_time = time.time()
+    consumed_count = 0
+    while True:
+        mq_message_list = get_messages_function()
+        if len(mq_message_list) == 0:
+            break
+        for mq_message in mq_message_list:
+            commit_function(mq_message.message_uuid)
+        consumed_count += len(mq_message_list)
+    assert consumed_count == message_count, consumed_count
+    return message_count / (time.time() - begin_time)
+
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    subscriber_count = int(sys.argv[2]) if len(sys.argv) > 2 else SUBSCRIBER_COUNT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    message_text_list = ["%s_%s" % (index, "x" * MESSAGE_SIZE) for index in range(message_count)]
+    print("messages: %s, subscribers: %s, message size: %s bytes" % (message_count, subscriber_count, MESSAGE_SIZE))
+
+    # 每个订阅者一个 Topic 同一条消息发布 N 次
+    topic_mq_path = os.path.join(mq_path, "topic_mq")
+    topic_mq = SimpleSQLiteMQBroker(topic_mq_path, durability_profile=SQLITE_MQ_DURABILITY_PROFILE_FAST)
+    topic_list = ["%s_%s" % (MESSAGE_TOPIC, index) for index in range(subscriber_count)]
+    topic_publish_seconds = publish(
+        lambda text_list: [topic_mq.add_messages(message_topic, text_list) for message_topic in topic_list],
+        message_text_list
+    )
+    topic_segment_size = get_segment_size(topic_mq_path, topic_list)
+    topic_consume_rate_list = [
+        consume(lambda: topic_mq.get_messages(message_topic, BATCH_SIZE, CONSUMER),
+                lambda message_uuid: topic_mq.commit_message(message_topic, message_uuid), message_count)
+        for message_topic in topic_list
+    ]
+
+    # 一个 Topic 加 N 个消费组 同一条消息只发布一次
+    group_mq_path = os.path.join(mq_path, "group_mq")
+    group_mq = SimpleSQLiteMQBroker(group_mq_path, durability_profile=SQLITE_MQ_DURABILITY_PROFILE_FAST)
+    group_list = ["group_%s" % index for index in range(subscriber_count)]
+    for consumer_group in group_list:
+        group_mq.create_consumer_group(MESSAGE_TOPIC, consumer_group)
+    group_publish_seconds = publish(lambda text_list: group_mq.add_messages(MESSAGE_TOPIC, text_list),
+                                    message_text_list)
+    group_segment_size = get_segment_size(group_mq_path, [MESSAGE_TOPIC])
+    group_consume_rate_list = [
+        consume(lambda: group_mq.get_group_messages(MESSAGE_TOPIC, consumer_group, BATCH_SIZE, CONSUMER),
+                lambda message_uuid: group_mq.commit_group_message(MESSAGE_TOPIC, consumer_group, message_uuid),
+                message_count)
+        for consumer_group in group_list
+    ]
+    begin_time = time.time()
+    trim_count = group_mq.trim_consumer_group_messages()
+    trim_seconds = time.time() - begin_time
+    # 最大 Message ID 的消息始终保留
+    assert trim_count == message_count - 1, trim_count
+
+    print("%-22s %14s %14s %20s" % ("", "publish (s)", "segment (KB)", "consume (msg/s)"))
+    print("%-22s %14.3f %14.1f %20.1f" % (
+        "%s topics" % subscriber_count, topic_publish_seconds, topic_segment_size / 1024.0,
+        sum(topic_consume_rate_list) / len(topic_consume_rate_list)))
+    print("%-22s %14.3f %14.1f %20.1f" % (
+        "1 topic + %s groups" % subscriber_count, group_publish_seconds, group_segment_size / 1024.0,
+        sum(group_consume_rate_list) / len(group_consume_rate_list)))
+    print("publish speedup: %.2fx, trim %s messages committed by all groups: %.3f s" % (
+        topic_publish_seconds / group_publish_seconds, trim_count, trim_seconds))
+    os._exit(0)
@@ -0,0 +1,106 @@
+# coding=utf-8
+import logging
+import multiprocessing
+import os
+import tempfile
+import traceback
+
+from pava.component.p_log import PLog
+
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+两个进程共享同一个 MQ 目录 主进程已经缓存了 Topic 没有消费组
+另一个进程创建消费组后 主进程普通的 获取 / 提交 / 失败 / 删除 立即被拒绝 不必等待缓存过期
+另一个进程删除最后一个消费组后 Topic 恢复为普通的消费方式
+用法: python test/simple_sqlite_mq_consumer_group_test.py
+"""
+
+MESSAGE_TOPIC = "consumer_group_topic"
+CONSUMER_GROUP = "consumer_group"
+CONSUMER = "consumer_group_consumer"
+EVENT_TIMEOUT_SECONDS = 60
+
+
+def consumer_group_process(mq_path, create_event, created_event, delete_event, deleted_event):
+    """
+    在另一个进程中 依次创建 删除消费组
+    """
+    PLog.add_file_handler(os.path.join(os.path.dirname(mq_path), "log", "consumer_group_process.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(mq_path, multi_process=True)
+    create_event.wait(EVENT_TIMEOUT_SECONDS)
+    mq.create_consumer_group(MESSAGE_TOPIC, CONSUMER_GROUP)
+    created_event.set()
+    delete_event.wait(EVENT_TIMEOUT_SECONDS)
+    mq.delete_consumer_group(MESSAGE_TOPIC, CONSUMER_GROUP)
+    deleted_event.set()
+    # Broker 的后台线程不是守护线程
+    os._exit(0)
+
+
+def assert_rejected(operation_name, operation_function, *args):
+    """
+    校验普通的消费方式因为存在消费组被拒绝
+    """
+    try:
+        operation_function(*args)
+    except Exception as e:
+        assert "consumer groups" in str(e), str(e)
+        return
+    raise AssertionError("%s is not rejected" % operation_name)
+
+
+def check_classic_rejected(mq, create_event, created_event):
+    """
+    :return: 消费组创建前 以普通方式锁定的消息
+    """
+    mq.add_messages(MESSAGE_TOPIC, ["message_%s" % index for index in range(3)])
+    locked_mq_message = mq.get_message(MESSAGE_TOPIC, CONSUMER)
+    locked_mq_message_list = mq.get_messages(MESSAGE_TOPIC, 1, CONSUMER)
+    assert len(locked_mq_message_list) == 1
+
+    # 主进程缓存的消费组列表仍然为空
+    create_event.set()
+    assert created_event.wait(EVENT_TIMEOUT_SECONDS)
+    assert_rejected("get message", mq.get_message, MESSAGE_TOPIC, CONSUMER)
+    assert_rejected("get messages", mq.get_messages, MESSAGE_TOPIC, 1, CONSUMER)
+    assert_rejected("commit message", mq.commit_message, MESSAGE_TOPIC, locked_mq_message.message_uuid)
+    assert_rejected("consume failed", mq.consume_failed, MESSAGE_TOPIC, locked_mq_message_list[0].message_uuid, 3, 1)
+    assert_rejected("delete message", mq.delete_message, MESSAGE_TOPIC, locked_mq_message.message_uuid)
+    return locked_mq_message
+
+
+def check_classic_restored(mq, locked_mq_message, delete_event, deleted_event):
+    delete_event.set()
+    assert deleted_event.wait(EVENT_TIMEOUT_SECONDS)
+    # 被拒绝的操作没有改变消息状态 锁定的消息仍然可以提交 未被锁定的消息可以继续获取
+    mq.commit_message(MESSAGE_TOPIC, locked_mq_message.message_uuid)
+    mq_message = mq.get_message(MESSAGE_TOPIC, CONSUMER)
+    assert mq_message is not None and mq_message.message_text == "message_2", mq_message
+    mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+
+
+if __name__ == '__main__':
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_test_")
+    broker_path = os.path.join(mq_path, "mq")
+    event_list = [multiprocessing.Event() for _ in range(4)]
+    # 在主进程创建 Broker 之前启动子进程
+    process = multiprocessing.Process(target=consumer_group_process, args=[broker_path] + event_list)
+    process.start()
+
+    PLog.add_file_handler(os.path.join(mq_path, "log", "test.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(broker_path, multi_process=True)
+    create_event, created_event, delete_event, deleted_event = event_list
+
+    try:
+        locked_mq_message = check_classic_rejected(mq, create_event, created_event)
+        print("classic consumption rejected ok")
+        check_classic_restored(mq, locked_mq_message, delete_event, deleted_event)
+        print("classic consumption restored ok")
+    except AssertionError:
+        traceback.print_exc()
+        os._exit(1)
+    process.join()
+    os._exit(0)
@@ -0,0 +1,114 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import MESSAGE_STATUS_DEAD_LETTER, MESSAGE_STATUS_PENDING
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+将大量消息消费失败直至达到失败次数上限 对比 挂起的消息留在 Common Segment 与 转入死信队列 两种方式下
+之后正常消息 出队 + 提交 的耗时 以及按不同批大小将死信队列中的消息移回 Common Segment 的吞吐
+用法: python test/simple_sqlite_mq_dead_letter_benchmark.py [失败消息数量] [正常消息数量]
+"""
+
+FAILED_MESSAGE_COUNT = 20000
+LIVE_MESSAGE_COUNT = 5000
+BATCH_SIZE = 1000
+REDRIVE_BATCH_SIZE_LIST = [100, 1000, 5000]
+MESSAGE_TOPIC = "benchmark_dead_letter"
+CONSUMER = "benchmark_consumer"
+
+
+def fail_messages(mq, message_count, expect_message_status):
+    """
+    :return: 每秒处理的失败消息数量
+    """
+    mq.add_messages(MESSAGE_TOPIC, ["failed_message_%s" % index for index in range(message_count)])
+    begin_time = time.time()
+    failed_count = 0
+    while failed_count < message_count:
+        mq_message_list = mq.get_messages(MESSAGE_TOPIC, BATCH_SIZE, CONSUMER)
+        for mq_message in mq_message_list:
+            mq_message = mq.consume_failed(MESSAGE_TOPIC, mq_message.message_uuid, 1)
+            assert mq_message.message_status == expect_message_status
+        failed_count += len(mq_message_list)
+    return message_count / (time.time() - begin_time)
+
+
+def consume_live_messages(mq, message_count):
+    """
+    :return: 每秒 出队 + 提交 的消息数量
+    """
+    mq.add_messages(MESSAGE_TOPIC, ["live_message_%s" % index for index in range(message_count)])
+    begin_time = time.time()
+    consumed_count = 0
+    while True:
+        mq_message = mq.get_message(MESSAGE_TOPIC, CONSUMER)
+        if mq_message is None:
+            break
+        mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+        consumed_count += 1
+    assert consumed_count == message_count
+    return message_count / (time.time() - begin_time)
+
+
+def scan_dead_letter(mq, page_size=200):
+    """
+    :return: (死信队列中的消息数量, 逐页检索完整个 Topic 的秒数)
+    """
+    begin_time = time.time()
+    scanned_count = 0
+    continuation_token = None
+    while True:
+        mq_message_list, continuation_token = mq.scan_message(
+            MESSAGE_TOPIC, page_size, continuation_token=continuation_token, is_dead_letter_read=True
+        )
+        scanned_count += len(mq_message_list)
+        if continuation_token is None:
+            break
+    return scanned_count, time.time() - begin_time
+
+
+if __name__ == '__main__':
+    failed_message_count = int(sys.argv[1]) if len(sys.argv) > 1 else FAILED_MESSAGE_COUNT
+    live_message_count = int(sys.argv[2]) if len(sys.argv) > 2 else LIVE_MESSAGE_COUNT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    pending_mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "pending_mq"), dead_letter_enabled=False)
+    dead_letter_mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "dead_letter_mq"))
+
+    pending_fail_rate = fail_messages(pending_mq, failed_message_count, MESSAGE_STATUS_PENDING)
+    dead_letter_fail_rate = fail_messages(dead_letter_mq, failed_message_count, MESSAGE_STATUS_DEAD_LETTER)
+    print("consume_failed pending in common segment : %.1f msg/s" % pending_fail_rate)
+    print("consume_failed routed to dead letter     : %.1f msg/s" % dead_letter_fail_rate)
+
+    print("get + commit with %s pending messages  : %.1f msg/s" % (
+        failed_message_count, consume_live_messages(pending_mq, live_message_count)))
+    print("get + commit with dead letter queue      : %.1f msg/s" % consume_live_messages(
+        dead_letter_mq, live_message_count))
+
+    scanned_count, scan_seconds = scan_dead_letter(dead_letter_mq)
+    assert scanned_count == failed_message_count
+    print("scan dead letter queue                   : %s messages, %.3f s" % (scanned_count, scan_seconds))
+
+    # 死信队列中的消息平均分给各个批大小 依次移回
+    redrive_limit = failed_message_count // len(REDRIVE_BATCH_SIZE_LIST)
+    for redrive_batch_size in REDRIVE_BATCH_SIZE_LIST:
+        redrive_result = dead_letter_mq.redrive(MESSAGE_TOPIC, limit=redrive_limit, batch_size=redrive_batch_size)
+        assert redrive_result["redrive_count"] == redrive_limit
+        print("redrive batch size %5s                 : %.1f msg/s, %s batches" % (
+            redrive_batch_size, redrive_result["redrive_rate"], redrive_result["batch_count"]))
+
+    dead_letter_metrics = dead_letter_mq.get_dead_letter_metrics()
+    print("dead letter metrics                      : %s dead letter, %s redrive, peak %.1f msg/s, depth %s" % (
+        dead_letter_metrics["dead_letter_count"], dead_letter_metrics["redrive_count"],
+        dead_letter_metrics["peak_redrive_rate"], dead_letter_metrics["topic_depth"]))
+    os._exit(0)
@@ -0,0 +1,107 @@
+# coding=utf-8
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import CREATE_INDEX_MESSAGE_STATUS_MESSAGE_ID, GET_COMMON_SEGMENT_MESSAGE_SQL
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+在一个 Topic 中写入大量未到期的延迟消息 之后测量普通消息 get / commit 的耗时
+出队语句沿 (message_status, priority, visible_time, message_id) 索引直接定位到已经可见的消息 耗时与延迟消息的数量无关
+作为对比 输出按 (message_status, message_id) 索引出队 逐条跳过未到期延迟消息时的耗时
+用法: python test/simple_sqlite_mq_delayed_delivery_benchmark.py [延迟消息数量] [普通消息数量]
+"""
+
+DELAYED_MESSAGE_COUNT = 1000000
+MESSAGE_COUNT = 1000
+BATCH_SIZE = 10000
+MESSAGE_TOPIC = "benchmark_delayed_delivery"
+
+# 按 Message ID 顺序出队 只能逐条检查可见时间
+GET_MESSAGE_BY_MESSAGE_ID_ORDER_SQL = """
+    SELECT
+        message_id
+    FROM
+        simple_sqlite_mq INDEXED BY idx_message_status_message_id
+    WHERE
+        message_status = 0
+    AND
+        visible_time <= ?
+    ORDER BY
+        message_id
+    LIMIT 1
+"""
+
+
+def add_delayed_messages(mq, delayed_message_count):
+    begin_time = time.time()
+    added_count = 0
+    while added_count < delayed_message_count:
+        batch_size = min(BATCH_SIZE, delayed_message_count - added_count)
+        mq.add_messages(MESSAGE_TOPIC, ["delayed_%s" % (added_count + index) for index in range(batch_size)],
+                        deliver_after=24 * 3600)
+        added_count += batch_size
+    mq.wait_ext_segment_synced()
+    return time.time() - begin_time
+
+
+def benchmark_broker(mq, message_count):
+    begin_time = time.time()
+    for index in range(message_count):
+        mq.add_message(MESSAGE_TOPIC, "message_%s" % index)
+        mq_message = mq.get_message(MESSAGE_TOPIC)
+        assert mq_message.message_text == "message_%s" % index
+        mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+    mq.wait_ext_segment_synced()
+    return time.time() - begin_time
+
+
+def benchmark_dequeue_statement(db_path, sql_str, sql_parameter, repeat_count):
+    connection = sqlite3.connect(db_path)
+    begin_time = time.time()
+    for _ in range(repeat_count):
+        connection.execute(sql_str, sql_parameter).fetchall()
+    cost = time.time() - begin_time
+    connection.close()
+    return cost
+
+
+if __name__ == '__main__':
+    delayed_message_count = int(sys.argv[1]) if len(sys.argv) > 1 else DELAYED_MESSAGE_COUNT
+    message_count = int(sys.argv[2]) if len(sys.argv) > 2 else MESSAGE_COUNT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+    add_cost = add_delayed_messages(mq, delayed_message_count)
+    print("add delayed messages       : %s messages, %.3f s, %.1f msg/s" % (
+        delayed_message_count, add_cost, delayed_message_count / add_cost))
+
+    broker_cost = benchmark_broker(mq, message_count)
+    print("broker add/get/commit      : %s messages, %.3f s, %.3f ms/message" % (
+        message_count, broker_cost, broker_cost * 1000 / message_count))
+
+    db_path = os.path.join(mq_path, "mq", "segment", MESSAGE_TOPIC + "_segment.sqlite")
+    repeat_count = 100
+    current_timestamp = int(time.time())
+    visible_time_index_cost = benchmark_dequeue_statement(
+        db_path, GET_COMMON_SEGMENT_MESSAGE_SQL, (current_timestamp, current_timestamp, 60), repeat_count
+    )
+    connection = sqlite3.connect(db_path)
+    connection.execute(CREATE_INDEX_MESSAGE_STATUS_MESSAGE_ID)
+    connection.commit()
+    connection.close()
+    message_id_index_cost = benchmark_dequeue_statement(
+        db_path, GET_MESSAGE_BY_MESSAGE_ID_ORDER_SQL, (current_timestamp,), repeat_count
+    )
+    print("dequeue by visible_time idx: %.3f ms/query" % (visible_time_index_cost * 1000 / repeat_count))
+    print("dequeue by message_id idx  : %.3f ms/query" % (message_id_index_cost * 1000 / repeat_count))
+    os._exit(0)
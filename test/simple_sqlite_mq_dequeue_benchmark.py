@@ -0,0 +1,83 @@
+# coding=utf-8
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import GET_COMMON_SEGMENT_MESSAGE_SQL, MESSAGE_STATUS_LOCKED, MESSAGE_STATUS_FAILED
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+验证 Common Segment 中堆积大量 消费中 / 消费失败 的消息时 出队延迟保持平稳
+用法: python test/simple_sqlite_mq_dequeue_benchmark.py [逗号分隔的表规模 例如 10000,100000,1000000,10000000]
+"""
+
+TABLE_SIZE_LIST = [10000, 100000, 1000000]
+DEQUEUE_COUNT = 200
+FILL_BATCH_SIZE = 100000
+MESSAGE_TOPIC = "benchmark_dequeue"
+
+FILL_SQL = """
+    INSERT INTO simple_sqlite_mq (
+        message_text, message_status, create_time, update_time, expire_time, failed_times, producer, consumer, uuid
+    ) VALUES (?, ?, ?, ?, ?, 0, 'benchmark', 'benchmark', ?)
+"""
+
+
+def fill_segment(db_path, fill_count, begin_index):
+    # 直接写入 Segment 文件 模拟大量 消费中 与 消费失败 的消息 远期过期 不会被恢复
+    connection = sqlite3.connect(db_path)
+    current_timestamp = int(time.time())
+    expire_time = current_timestamp + 30 * 24 * 3600
+    filled_count = 0
+    while filled_count < fill_count:
+        batch_count = min(FILL_BATCH_SIZE, fill_count - filled_count)
+        connection.executemany(FILL_SQL, [(
+            "", MESSAGE_STATUS_LOCKED if index % 2 == 0 else MESSAGE_STATUS_FAILED,
+            current_timestamp, current_timestamp, expire_time, "fill_%s" % index
+        ) for index in range(begin_index + filled_count, begin_index + filled_count + batch_count)])
+        connection.commit()
+        filled_count += batch_count
+    connection.close()
+
+
+def benchmark_dequeue(mq):
+    mq.add_messages(MESSAGE_TOPIC, ["dequeue_message"] * DEQUEUE_COUNT)
+    latency_list = list()
+    for _ in range(DEQUEUE_COUNT):
+        begin_time = time.time()
+        mq_message = mq.get_message(MESSAGE_TOPIC)
+        latency_list.append(time.time() - begin_time)
+        mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+    latency_list.sort()
+    return latency_list[len(latency_list) // 2], latency_list[int(len(latency_list) * 0.99)]
+
+
+if __name__ == '__main__':
+    table_size_list = TABLE_SIZE_LIST
+    if len(sys.argv) > 1:
+        table_size_list = [int(table_size) for table_size in sys.argv[1].split(",")]
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+    segment_db_path = mq._get_topic_segment(MESSAGE_TOPIC).get_db_path()
+
+    current_timestamp = int(time.time())
+    query_plan = sqlite3.connect(segment_db_path).execute(
+        "EXPLAIN QUERY PLAN " + GET_COMMON_SEGMENT_MESSAGE_SQL, (current_timestamp, current_timestamp, 60)
+    )
+    print("query plan: %s" % " | ".join([str(element[-1]) for element in query_plan.fetchall()]))
+
+    current_size = 0
+    for table_size in sorted(table_size_list):
+        fill_segment(segment_db_path, table_size - current_size, current_size)
+        current_size = table_size
+        p50, p99 = benchmark_dequeue(mq)
+        print("rows: %10s, get_message p50: %.3f ms, p99: %.3f ms" % (table_size, p50 * 1000, p99 * 1000))
+    os._exit(0)
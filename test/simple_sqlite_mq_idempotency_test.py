@@ -0,0 +1,133 @@
+# coding=utf-8
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import traceback
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import MESSAGE_STATUS_INIT, MESSAGE_STATUS_LOCKED, MESSAGE_STATUS_FAILED, \
+    MESSAGE_STATUS_DONE, MESSAGE_STATUS_DELETE, MESSAGE_STATUS_DEAD_LETTER
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+校验生产者幂等键的去重行为
+去重窗口内使用相同幂等键重复发布 (消息体不同) 时 不写入新消息 返回原消息的消息体 以及原消息当前的状态
+原消息 被锁定 / 消费失败 / 消费完成 / 删除 / 转入死信队列 之后重复发布 分别校验返回的状态
+去重窗口过期后重新写入消息 过期的幂等键被分批清理 开启 Shard 时相同幂等键总是写入同一个 Shard
+用法: python test/simple_sqlite_mq_idempotency_test.py
+"""
+
+MESSAGE_TOPIC = "idempotency_topic"
+SHARD_MESSAGE_TOPIC = "idempotency_shard_topic"
+IDEMPOTENCY_WINDOW_SECONDS = 8
+CONSUMER = "idempotency_consumer"
+
+
+def add_duplicate(mq, message_topic, idempotency_key, original_mq_message):
+    """
+    使用相同的幂等键 与不同的消息体 重复发布
+    :return: 重复发布返回的 MQ Message
+    """
+    duplicate_mq_message = mq.add_message(message_topic, "retry_body", idempotency_key=idempotency_key)
+    assert duplicate_mq_message.message_uuid == original_mq_message.message_uuid, duplicate_mq_message.message_uuid
+    assert duplicate_mq_message.message_id == original_mq_message.message_id, duplicate_mq_message.message_id
+    assert duplicate_mq_message.message_text == original_mq_message.message_text, duplicate_mq_message.message_text
+    return duplicate_mq_message
+
+
+def check_duplicate_status(mq):
+    """
+    校验原消息处于各个状态时 重复发布返回的消息
+    """
+    # 原消息尚未被消费
+    original_mq_message = mq.add_message(MESSAGE_TOPIC, "original_body", idempotency_key="key_init", priority=3)
+    duplicate_mq_message = add_duplicate(mq, MESSAGE_TOPIC, "key_init", original_mq_message)
+    assert duplicate_mq_message.message_status == MESSAGE_STATUS_INIT and duplicate_mq_message.priority == 3
+
+    # 原消息被锁定 消费失败 再次被锁定后消费完成
+    locked_mq_message = mq.get_message(MESSAGE_TOPIC, CONSUMER)
+    assert locked_mq_message.message_uuid == original_mq_message.message_uuid
+    duplicate_mq_message = add_duplicate(mq, MESSAGE_TOPIC, "key_init", original_mq_message)
+    assert duplicate_mq_message.message_status == MESSAGE_STATUS_LOCKED and duplicate_mq_message.consumer == CONSUMER
+
+    mq.consume_failed(MESSAGE_TOPIC, original_mq_message.message_uuid, 3, 1)
+    duplicate_mq_message = add_duplicate(mq, MESSAGE_TOPIC, "key_init", original_mq_message)
+    assert duplicate_mq_message.message_status == MESSAGE_STATUS_FAILED and duplicate_mq_message.failed_times == 1
+
+    # 等待消费失败的消息在重试间隔后恢复
+    locked_mq_message = mq.get_message(MESSAGE_TOPIC, CONSUMER, 3600, 5)
+    assert locked_mq_message.message_uuid == original_mq_message.message_uuid
+    mq.commit_message(MESSAGE_TOPIC, original_mq_message.message_uuid)
+    duplicate_mq_message = add_duplicate(mq, MESSAGE_TOPIC, "key_init", original_mq_message)
+    assert duplicate_mq_message.message_status == MESSAGE_STATUS_DONE and duplicate_mq_message.failed_times == 1
+    assert duplicate_mq_message.consumer == CONSUMER
+
+    # 原消息被删除
+    original_mq_message = mq.add_message(MESSAGE_TOPIC, "deleted_body", idempotency_key="key_delete")
+    mq.delete_message(MESSAGE_TOPIC, original_mq_message.message_uuid)
+    duplicate_mq_message = add_duplicate(mq, MESSAGE_TOPIC, "key_delete", original_mq_message)
+    assert duplicate_mq_message.message_status == MESSAGE_STATUS_DELETE
+
+    # 原消息达到消费失败次数上限 转入死信队列
+    original_mq_message = mq.add_message(MESSAGE_TOPIC, "dead_letter_body", idempotency_key="key_dead_letter")
+    mq.get_message(MESSAGE_TOPIC, CONSUMER)
+    mq.consume_failed(MESSAGE_TOPIC, original_mq_message.message_uuid, 1, 1)
+    duplicate_mq_message = add_duplicate(mq, MESSAGE_TOPIC, "key_dead_letter", original_mq_message)
+    assert duplicate_mq_message.message_status == MESSAGE_STATUS_DEAD_LETTER, duplicate_mq_message.message_status
+
+    # 所有重复发布都没有写入新消息
+    assert mq.get_message(MESSAGE_TOPIC, CONSUMER) is None
+
+
+def check_window_expire_and_prune(mq, mq_path):
+    """
+    去重窗口过期后 相同幂等键写入新消息 过期的幂等键被分批清理
+    """
+    original_mq_message = mq.add_message(MESSAGE_TOPIC, "window_body", idempotency_key="key_window")
+    time.sleep(IDEMPOTENCY_WINDOW_SECONDS + 1.2)
+    new_mq_message = mq.add_message(MESSAGE_TOPIC, "window_body", idempotency_key="key_window")
+    assert new_mq_message.message_uuid != original_mq_message.message_uuid
+
+    # 除 key_window 刚刚重新写入外 其余 3 个幂等键均已过期
+    assert mq.prune_idempotency_keys(2) == 3
+    segment_connection = sqlite3.connect(os.path.join(mq_path, "segment", MESSAGE_TOPIC + "_segment.sqlite"))
+    key_list = segment_connection.execute("SELECT idempotency_key FROM simple_sqlite_mq_idempotency_key").fetchall()
+    assert [element[0] for element in key_list] == [u"key_window"], key_list
+    segment_connection.close()
+
+
+def check_shard(mq):
+    """
+    开启 Shard 时 相同幂等键的重复发布路由到原消息所在的 Shard
+    """
+    original_mq_message_list = [
+        mq.add_message(SHARD_MESSAGE_TOPIC, "shard_body_%s" % index, idempotency_key="shard_key_%s" % index)
+        for index in range(20)
+    ]
+    for index, original_mq_message in enumerate(original_mq_message_list):
+        add_duplicate(mq, SHARD_MESSAGE_TOPIC, "shard_key_%s" % index, original_mq_message)
+    assert len(mq.get_messages(SHARD_MESSAGE_TOPIC, 100, CONSUMER)) == len(original_mq_message_list)
+
+
+if __name__ == '__main__':
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_test_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "test.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    broker_path = os.path.join(mq_path, "mq")
+    mq = SimpleSQLiteMQBroker(broker_path, idempotency_window_seconds=IDEMPOTENCY_WINDOW_SECONDS,
+                              topic_shard_count_dict={SHARD_MESSAGE_TOPIC: 4})
+
+    try:
+        check_duplicate_status(mq)
+        print("duplicate status ok")
+        check_window_expire_and_prune(mq, broker_path)
+        print("window expire and prune ok")
+        check_shard(mq)
+        print("shard ok")
+    except AssertionError:
+        traceback.print_exc()
+        os._exit(1)
+    os._exit(0)
@@ -0,0 +1,83 @@
+# coding=utf-8
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import SQLITE_MQ_MESSAGE_STORAGE_BASE64, SQLITE_MQ_MESSAGE_STORAGE_BINARY, \
+    SQLITE_MQ_COMPRESS_ALGORITHM_ZLIB
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+对比 Base64 存储 / 二进制存储 / 二进制 + zlib 压缩 三种消息体存储方式
+输出 add / get / commit 的吞吐 以及 Common Segment 与 Ext Segment 文件占用的磁盘大小
+用法: python test/simple_sqlite_mq_message_storage_benchmark.py [消息数量] [消息体字节数]
+"""
+
+MESSAGE_COUNT = 2000
+MESSAGE_SIZE = 8192
+MESSAGE_TOPIC = "benchmark_message_storage"
+
+
+def _get_message_text(message_size):
+    # 半随机的 JSON 风格文本 接近业务消息的可压缩程度
+    field_list = list()
+    while sum(len(field) for field in field_list) < message_size:
+        field_list.append('"field_%s": "%s"' % (random.randint(0, 100), "%x" % random.getrandbits(64)))
+    return ("{%s}" % ", ".join(field_list))[:message_size]
+
+
+def _get_segment_size(mq_path):
+    segment_size = 0
+    for file_name in os.listdir(os.path.join(mq_path, "segment")):
+        if file_name.startswith(MESSAGE_TOPIC) or file_name.startswith("ext_sqlite_mq_segment"):
+            segment_size += os.path.getsize(os.path.join(mq_path, "segment", file_name))
+    return segment_size
+
+
+def benchmark(mq_path, message_text, message_count, **broker_kwargs):
+    mq = SimpleSQLiteMQBroker(mq_path, **broker_kwargs)
+
+    begin_time = time.time()
+    for _ in range(message_count):
+        mq.add_message(MESSAGE_TOPIC, message_text)
+    mq.wait_ext_segment_synced()
+    add_cost = time.time() - begin_time
+    segment_size = _get_segment_size(mq_path)
+
+    begin_time = time.time()
+    for _ in range(message_count):
+        mq_message = mq.get_message(MESSAGE_TOPIC)
+        assert mq_message.message_text == message_text
+        mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+    mq.wait_ext_segment_synced()
+    consume_cost = time.time() - begin_time
+    return add_cost, consume_cost, segment_size
+
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    message_size = int(sys.argv[2]) if len(sys.argv) > 2 else MESSAGE_SIZE
+
+    benchmark_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(benchmark_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    message_text = _get_message_text(message_size)
+    for storage_name, broker_kwargs in [
+        ("base64", {"message_storage_mode": SQLITE_MQ_MESSAGE_STORAGE_BASE64}),
+        ("binary", {"message_storage_mode": SQLITE_MQ_MESSAGE_STORAGE_BINARY}),
+        ("binary + zlib", {"message_storage_mode": SQLITE_MQ_MESSAGE_STORAGE_BINARY,
+                           "compress_algorithm": SQLITE_MQ_COMPRESS_ALGORITHM_ZLIB}),
+    ]:
+        add_cost, consume_cost, segment_size = benchmark(
+            os.path.join(benchmark_path, storage_name.replace(" ", "")), message_text, message_count, **broker_kwargs
+        )
+        print("%-14s: %s x %s bytes, add %.1f msg/s, get/commit %.1f msg/s, segment size %.1f MB" % (
+            storage_name, message_count, message_size, message_count / add_cost, message_count / consume_cost,
+            segment_size / 1024.0 / 1024.0))
+    os._exit(0)
@@ -0,0 +1,107 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import SQLITE_MQ_DURABILITY_PROFILE_FAST, SQLITE_MQ_METRIC_ENQUEUE, \
+    SQLITE_MQ_METRIC_TRANSACTION_SECONDS
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+from pava.component.mq.core.simple_sqlite_mq_metrics import SimpleSQLiteMQMetricsRegistry, stats_to_prometheus_text
+
+"""
+对比 开启 与 关闭 运维指标时 逐条 add_message + get_message + commit_message 的耗时 得出指标在热路径上的额外开销
+使用 fast 持久化配置 没有 fsync 时单次操作的耗时最短 指标开销的占比最大
+两个 Broker 交替运行多轮 取每轮耗时比值的中位数 减少磁盘与调度抖动的影响
+同时输出 单次计数 / 直方图记录 以及 stats() 与转换为 Prometheus 文本的耗时
+用法: python test/simple_sqlite_mq_metrics_overhead_benchmark.py [每轮消息数量] [轮数]
+"""
+
+ROUND_MESSAGE_COUNT = 500
+ROUND_COUNT = 20
+MICRO_REPEAT_COUNT = 100000
+MESSAGE_TOPIC = "benchmark_metrics"
+# 开启指标后 热路径耗时增加的上限
+MAX_OVERHEAD_RATIO = 0.02
+
+
+def run_round(mq, message_count):
+    """
+    :return: 本轮耗时秒数
+    """
+    begin_time = time.time()
+    for index in range(message_count):
+        mq.add_message(MESSAGE_TOPIC, "message_%s" % index)
+        mq_message = mq.get_message(MESSAGE_TOPIC, "benchmark_consumer")
+        mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+    return time.time() - begin_time
+
+
+def benchmark_micro(function, repeat_count):
+    """
+    :return: 每次操作的微秒数
+    """
+    begin_time = time.time()
+    for _ in range(repeat_count):
+        function()
+    return (time.time() - begin_time) * 1000000 / repeat_count
+
+
+if __name__ == '__main__':
+    round_message_count = int(sys.argv[1]) if len(sys.argv) > 1 else ROUND_MESSAGE_COUNT
+    round_count = int(sys.argv[2]) if len(sys.argv) > 2 else ROUND_COUNT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    disabled_mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "disabled_mq"),
+                                       durability_profile=SQLITE_MQ_DURABILITY_PROFILE_FAST, metrics_enabled=False)
+    enabled_mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "enabled_mq"),
+                                      durability_profile=SQLITE_MQ_DURABILITY_PROFILE_FAST)
+    # 预热 生成 Segment 文件与连接
+    run_round(disabled_mq, 100)
+    run_round(enabled_mq, 100)
+
+    # 每轮两个 Broker 各运行一次 交替先后顺序 取每轮耗时比值的中位数
+    disabled_cost_list = list()
+    enabled_cost_list = list()
+    ratio_list = list()
+    for round_index in range(round_count):
+        if round_index % 2 == 0:
+            disabled_cost_list.append(run_round(disabled_mq, round_message_count))
+            enabled_cost_list.append(run_round(enabled_mq, round_message_count))
+        else:
+            enabled_cost_list.append(run_round(enabled_mq, round_message_count))
+            disabled_cost_list.append(run_round(disabled_mq, round_message_count))
+        ratio_list.append(enabled_cost_list[-1] / disabled_cost_list[-1])
+    disabled_cost = sorted(disabled_cost_list)[round_count // 2]
+    enabled_cost = sorted(enabled_cost_list)[round_count // 2]
+    overhead_ratio = sorted(ratio_list)[round_count // 2] - 1
+
+    print("metrics disabled : %.1f us/message (add + get + commit)" % (disabled_cost * 1000000 / round_message_count))
+    print("metrics enabled  : %.1f us/message (add + get + commit)" % (enabled_cost * 1000000 / round_message_count))
+    print("overhead         : %.2f %% (limit %.0f %%), %s" % (
+        overhead_ratio * 100, MAX_OVERHEAD_RATIO * 100, "ok" if overhead_ratio < MAX_OVERHEAD_RATIO else "EXCEEDED"))
+
+    # 两轮之间的抖动可能大于指标本身的开销 再按每条消息的 3 次计数 + 3 次直方图记录 估算开销的占比
+    registry = SimpleSQLiteMQMetricsRegistry()
+    increase_cost = benchmark_micro(
+        lambda: registry.increase(SQLITE_MQ_METRIC_ENQUEUE, MESSAGE_TOPIC, 1), MICRO_REPEAT_COUNT)
+    observe_cost = benchmark_micro(
+        lambda: registry.observe(SQLITE_MQ_METRIC_TRANSACTION_SECONDS, MESSAGE_TOPIC, 0.003), MICRO_REPEAT_COUNT)
+    estimated_ratio = (3 * increase_cost + 3 * observe_cost) / (disabled_cost * 1000000 / round_message_count)
+    print("registry increase: %.3f us/op, observe: %.3f us/op" % (increase_cost, observe_cost))
+    print("estimated        : %.2f %% of a message (3 increase + 3 observe)" % (estimated_ratio * 100))
+
+    begin_time = time.time()
+    stats_dict = enabled_mq.stats()
+    stats_seconds = time.time() - begin_time
+    begin_time = time.time()
+    stats_to_prometheus_text(stats_dict)
+    print("stats()          : %.3f ms, prometheus text: %.3f ms" % (
+        stats_seconds * 1000, (time.time() - begin_time) * 1000))
+    os._exit(0)
@@ -0,0 +1,136 @@
+# coding=utf-8
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import MESSAGE_STATUS_DONE, SQLITE_MQ_DURABILITY_PROFILE_BALANCED
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+多个进程同时使用同一个 MQ 目录 每个进程一边生产消息 一边消费所有进程生产的消息
+检查每条消息只被消费一次 所有消息都被消费 并且 Ext Segment 最终与 Common Segment 保持一致
+用法: python test/simple_sqlite_mq_multi_process_stress_test.py [进程数量] [每个进程的消息数量]
+"""
+
+PROCESS_COUNT = 4
+PROCESS_MESSAGE_COUNT = 500
+MESSAGE_TOPIC = "stress_multi_process"
+TOPIC_SHARD_COUNT_DICT = {MESSAGE_TOPIC: 2}
+
+
+def get_broker(mq_path):
+    return SimpleSQLiteMQBroker(
+        mq_path, durability_profile=SQLITE_MQ_DURABILITY_PROFILE_BALANCED,
+        topic_shard_count_dict=TOPIC_SHARD_COUNT_DICT, multi_process=True
+    )
+
+
+def consume_process(mq_path, process_index, process_message_count, total_message_count, produced_count):
+    mq = get_broker(mq_path)
+
+    consumed_uuid_list = list()
+    for index in range(process_message_count):
+        mq.add_message(MESSAGE_TOPIC, "process_%s_message_%s" % (process_index, index))
+        with produced_count.get_lock():
+            produced_count.value += 1
+        # 生产的同时消费 其他进程的消息也会被本进程消费
+        mq_message = mq.get_message(MESSAGE_TOPIC, "consumer_%s" % process_index)
+        if mq_message is not None:
+            mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+            consumed_uuid_list.append(mq_message.message_uuid)
+
+    # 所有进程都生产完成后 继续消费剩余的消息
+    while True:
+        mq_message = mq.get_message(MESSAGE_TOPIC, "consumer_%s" % process_index, wait_timeout=1)
+        if mq_message is not None:
+            mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+            consumed_uuid_list.append(mq_message.message_uuid)
+        elif produced_count.value >= total_message_count:
+            break
+
+    return consumed_uuid_list, mq.wait_ext_segment_synced(timeout=60)
+
+
+def run_process(mq_path, process_index, process_message_count, total_message_count, produced_count, consumed_queue):
+    PLog.add_file_handler(os.path.join(mq_path, "log", "process_%s.log" % process_index))
+    PLog.set_print_logger_level(logging.WARNING)
+    try:
+        consumed_uuid_list, synced = consume_process(
+            mq_path, process_index, process_message_count, total_message_count, produced_count
+        )
+        consumed_queue.put((process_index, consumed_uuid_list, synced))
+    except Exception as e:
+        PLog.gets().exception(e)
+        consumed_queue.put((process_index, None, False))
+    # 等待队列的后台线程发送完成 再退出进程
+    consumed_queue.close()
+    consumed_queue.join_thread()
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    process_count = int(sys.argv[1]) if len(sys.argv) > 1 else PROCESS_COUNT
+    process_message_count = int(sys.argv[2]) if len(sys.argv) > 2 else PROCESS_MESSAGE_COUNT
+    total_message_count = process_count * process_message_count
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_stress_")
+    produced_count = multiprocessing.Value("i", 0)
+    consumed_queue = multiprocessing.Queue()
+    process_list = [
+        multiprocessing.Process(
+            target=run_process, args=(mq_path, index, process_message_count, total_message_count, produced_count,
+                                        consumed_queue)
+        ) for index in range(process_count)
+    ]
+    begin_time = time.time()
+    for process in process_list:
+        process.start()
+
+    consumed_uuid_list = list()
+    try:
+        for _ in range(process_count):
+            process_index, process_consumed_uuid_list, synced = consumed_queue.get()
+            assert process_consumed_uuid_list is not None, "process %s failed" % process_index
+            assert synced, "process %s ext segment not synced" % process_index
+            print("process %s consumed %s messages" % (process_index, len(process_consumed_uuid_list)))
+            consumed_uuid_list.extend(process_consumed_uuid_list)
+    finally:
+        # 某个进程失败时 其他进程会一直等待剩余的消息
+        for process in process_list:
+            if process.is_alive() and len(consumed_uuid_list) < total_message_count:
+                process.terminate()
+    for process in process_list:
+        process.join()
+    cost_seconds = time.time() - begin_time
+
+    PLog.add_file_handler(os.path.join(mq_path, "log", "main.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    assert len(consumed_uuid_list) == len(set(consumed_uuid_list)), "message consumed more than once"
+    assert len(consumed_uuid_list) == total_message_count, \
+        "consumed %s messages, expected %s" % (len(consumed_uuid_list), total_message_count)
+
+    # 所有进程都已退出 完成的消息都已经从 Ext Segment 移入归档
+    mq = get_broker(mq_path)
+    ext_mq_message_list, _ = mq.scan_message(MESSAGE_TOPIC, 10)
+    assert len(ext_mq_message_list) == 0, "ext segment still has %s messages" % len(ext_mq_message_list)
+    done_uuid_set = set()
+    continuation_token = None
+    while True:
+        mq_message_list, continuation_token = mq.scan_message(
+            MESSAGE_TOPIC, 200, is_archiver_read=True, message_status=MESSAGE_STATUS_DONE,
+            continuation_token=continuation_token
+        )
+        done_uuid_set.update([mq_message.message_uuid for mq_message in mq_message_list])
+        if continuation_token is None:
+            break
+    assert done_uuid_set == set(consumed_uuid_list), \
+        "archived %s done messages, expected %s" % (len(done_uuid_set), total_message_count)
+
+    print("%s processes, %s messages, %.2f s, %.1f msg/s, ok" % (
+        process_count, total_message_count, cost_seconds, total_message_count / cost_seconds))
+    os._exit(0)
@@ -0,0 +1,60 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+模拟消费者崩溃 大量消息的租约同时过期 测量从租约过期到全部消息恢复为可消费状态的耗时 以及恢复吞吐
+用法: python test/simple_sqlite_mq_recovery_benchmark.py [租约过期的消息数量]
+"""
+
+MESSAGE_COUNT = 100000
+BATCH_SIZE = 1000
+LEASE_SECONDS = 2
+MESSAGE_TOPIC = "benchmark_recovery"
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+
+    added_count = 0
+    while added_count < message_count:
+        batch_size = min(BATCH_SIZE, message_count - added_count)
+        mq.add_messages(MESSAGE_TOPIC, ["message_%s" % (added_count + index) for index in range(batch_size)])
+        added_count += batch_size
+
+    # 消费者取走所有消息后崩溃 不再提交 也不再 Hold
+    leased_count = 0
+    expire_time = None
+    while leased_count < message_count:
+        mq_message_list = mq.get_messages(MESSAGE_TOPIC, BATCH_SIZE, max_consume_time=LEASE_SECONDS)
+        expire_time = mq_message_list[-1].expire_time
+        leased_count += len(mq_message_list)
+    mq.wait_ext_segment_synced()
+
+    # 最后一批租约在 expire_time 之后的下一秒可以恢复
+    while mq.get_recover_metrics()["recovered_count"] < message_count:
+        time.sleep(0.01)
+    recover_done_time = time.time()
+    mq.wait_ext_segment_synced()
+    ext_synced_time = time.time()
+
+    recover_metrics = mq.get_recover_metrics()
+    print("leased messages      : %s, lease %s s" % (message_count, LEASE_SECONDS))
+    print("recovered after lease: %.3f s (last lease recoverable at %s.0)" % (
+        recover_done_time - (expire_time + 1), expire_time + 1))
+    print("ext segment synced   : %.3f s after lease" % (ext_synced_time - (expire_time + 1)))
+    print("recover throughput   : average %.1f msg/s, peak sweep %.1f msg/s, %s pages in %s sweeps" % (
+        recover_metrics["average_rate"], recover_metrics["peak_sweep_rate"], recover_metrics["page_count"],
+        recover_metrics["sweep_count"]))
+    os._exit(0)
@@ -0,0 +1,92 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+在 Ext Segment 中写入大量消息 之后逐页检索完整个 Topic
+对比 按页码 (LIMIT offset) 翻页 与 按 continuation_token (update_time, rowid) 翻页 时 浅页与深页的耗时
+按页码翻页需要跳过前面所有的消息 耗时随页的深度线性增长 按 Token 翻页沿索引直接定位 耗时与页的深度无关
+用法: python test/simple_sqlite_mq_scan_benchmark.py [消息数量] [每页消息数量]
+"""
+
+MESSAGE_COUNT = 200000
+PAGE_SIZE = 100
+BATCH_SIZE = 10000
+MESSAGE_TOPIC = "benchmark_scan"
+NOISE_MESSAGE_TOPIC = "benchmark_scan_noise"
+
+
+def add_messages(mq, message_topic, message_count):
+    added_count = 0
+    while added_count < message_count:
+        batch_size = min(BATCH_SIZE, message_count - added_count)
+        mq.add_messages(message_topic, ["message_%s" % (added_count + index) for index in range(batch_size)])
+        added_count += batch_size
+
+
+def benchmark_page_number_scan(mq, page_count, page_size):
+    page_cost_list = list()
+    for page_number in range(1, page_count + 1):
+        begin_time = time.time()
+        mq_message_list, _ = mq.scan_message(MESSAGE_TOPIC, page_size, page_number)
+        page_cost_list.append(time.time() - begin_time)
+        assert len(mq_message_list) > 0
+    return page_cost_list
+
+
+def benchmark_continuation_token_scan(mq, page_size):
+    page_cost_list = list()
+    scanned_count = 0
+    continuation_token = None
+    while True:
+        begin_time = time.time()
+        mq_message_list, continuation_token = mq.scan_message(
+            MESSAGE_TOPIC, page_size, continuation_token=continuation_token
+        )
+        page_cost_list.append(time.time() - begin_time)
+        scanned_count += len(mq_message_list)
+        if continuation_token is None:
+            break
+    return page_cost_list, scanned_count
+
+
+def _average_ms(cost_list):
+    return sum(cost_list) * 1000 / len(cost_list)
+
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else PAGE_SIZE
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+    # 其他 Topic 的消息同样写入 Ext Segment 检验按 Topic 筛选时同样沿索引定位
+    add_messages(mq, MESSAGE_TOPIC, message_count)
+    add_messages(mq, NOISE_MESSAGE_TOPIC, message_count)
+    mq.wait_ext_segment_synced()
+
+    token_cost_list, scanned_count = benchmark_continuation_token_scan(mq, page_size)
+    assert scanned_count == message_count
+    # 消息数量正好是整页时 按 Token 翻页最后会多读一个空页
+    page_count = (message_count + page_size - 1) // page_size
+    page_number_cost_list = benchmark_page_number_scan(mq, page_count, page_size)
+
+    sample_count = max(1, min(10, page_count // 10))
+    print("messages / page size : %s / %s, %s pages" % (message_count, page_size, page_count))
+    print("page number  first %s pages: %.3f ms/page, last %s pages: %.3f ms/page, total %.3f s" % (
+        sample_count, _average_ms(page_number_cost_list[:sample_count]), sample_count,
+        _average_ms(page_number_cost_list[-sample_count:]), sum(page_number_cost_list)))
+    print("continuation first %s pages: %.3f ms/page, last %s pages: %.3f ms/page, total %.3f s" % (
+        sample_count, _average_ms(token_cost_list[:sample_count]), sample_count,
+        _average_ms(token_cost_list[-sample_count:]), sum(token_cost_list)))
+    os._exit(0)
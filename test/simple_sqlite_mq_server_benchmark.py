@@ -0,0 +1,101 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import SQLITE_MQ_DURABILITY_PROFILE_BALANCED
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+from pava.component.mq.core.simple_sqlite_mq_client import SimpleSQLiteMQClient
+from pava.component.mq.core.simple_sqlite_mq_server import SimpleSQLiteMQServer
+
+"""
+通过本机回环的 TCP 与 Unix Socket 访问 MQ Server 对比 直接调用 MQ 实例 逐个请求 Pipeline 批量接口 的吞吐
+空请求 (获取消息到达版本号) 只包含协议与网络的开销 添加消息包含 SQLite 写入的开销
+用法: python test/simple_sqlite_mq_server_benchmark.py [请求数量] [Pipeline 与批量接口每批的请求数量]
+"""
+
+REQUEST_COUNT = 5000
+BATCH_SIZE = 100
+MESSAGE_TOPIC = "benchmark_server"
+
+
+def benchmark(function, request_count, batch_size):
+    """
+    :return: 每秒完成的请求数
+    """
+    begin_time = time.time()
+    for _ in range(request_count // batch_size):
+        function(batch_size)
+    return request_count // batch_size * batch_size / (time.time() - begin_time)
+
+
+def run_single(function):
+    def execute(batch_size):
+        for _ in range(batch_size):
+            function()
+
+    return execute
+
+
+def run_pipeline(mq_client, method_name, *args):
+    def execute(batch_size):
+        pipeline = mq_client.pipeline()
+        for _ in range(batch_size):
+            getattr(pipeline, method_name)(*args)
+        pipeline.execute()
+
+    return execute
+
+
+def benchmark_mq(mq, mq_client, request_count, batch_size):
+    """
+    :return: [(场景名称, 每秒请求数)]
+    """
+    result_list = list()
+    if mq_client is None:
+        result_list.append(("noop", benchmark(run_single(mq.get_message_arrival_version), request_count, 1)))
+        result_list.append(("add_message", benchmark(
+            run_single(lambda: mq.add_message(MESSAGE_TOPIC, "message")), request_count, 1)))
+    else:
+        result_list.append(("noop", benchmark(
+            run_single(mq_client.get_message_arrival_version), request_count, 1)))
+        result_list.append(("noop pipeline", benchmark(
+            run_pipeline(mq_client, "get_message_arrival_version"), request_count, batch_size)))
+        result_list.append(("add_message", benchmark(
+            run_single(lambda: mq_client.add_message(MESSAGE_TOPIC, "message")), request_count, 1)))
+        result_list.append(("add_message pipeline", benchmark(
+            run_pipeline(mq_client, "add_message", MESSAGE_TOPIC, "message"), request_count, batch_size)))
+    result_list.append(("add_messages batch", benchmark(
+        lambda batch_size: (mq_client or mq).add_messages(MESSAGE_TOPIC, ["message"] * batch_size),
+        request_count, batch_size)))
+    return result_list
+
+
+if __name__ == '__main__':
+    request_count = int(sys.argv[1]) if len(sys.argv) > 1 else REQUEST_COUNT
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_SIZE
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+    mq = SimpleSQLiteMQBroker(mq_path, durability_profile=SQLITE_MQ_DURABILITY_PROFILE_BALANCED)
+
+    print("%-10s | %-20s | %12s" % ("transport", "workload", "requests/s"))
+    for transport_name, address in [("embedded", None), ("tcp", ("127.0.0.1", 0)),
+                                    ("unix", os.path.join(mq_path, "mq.sock"))]:
+        mq_server = None
+        mq_client = None
+        if address is not None:
+            mq_server = SimpleSQLiteMQServer(mq, address)
+            mq_server.start()
+            mq_client = SimpleSQLiteMQClient(mq_server.get_address())
+        for workload_name, request_rate in benchmark_mq(mq, mq_client, request_count, batch_size):
+            print("%-10s | %-20s | %12.1f" % (transport_name, workload_name, request_rate))
+        if mq_server is not None:
+            mq_client.close()
+            mq_server.stop()
+    os._exit(0)
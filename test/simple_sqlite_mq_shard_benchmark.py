@@ -0,0 +1,83 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import SQLITE_MQ_DURABILITY_PROFILE_SAFE
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+
+"""
+多个生产者线程同时向一个 Topic 写入消息 对比 Topic 只有一个 Shard 与 每个生产者一个 Shard 时的写入吞吐
+以及每条消息平均的 Commit Log fsync 次数
+每个 Shard 为独立的 SQLite 文件与锁 各个 Shard 的写事务与 fsync 可以同时进行 所有 Shard 共用的 Commit Log 使用组提交
+同时追加的记录共用一次 fsync 只有一个 Shard 时 Segment 的锁使每次 fsync 只覆盖一条记录
+写入耗时中 fsync 等待的占比越高 Shard 带来的提升越大 默认使用 safe 持久化配置
+balanced / fast 配置下 Commit Log 不 fsync 写入主要消耗 CPU 受 GIL 限制 多个 Shard 几乎没有提升
+用法: python test/simple_sqlite_mq_shard_benchmark.py [逗号分隔的 Shard 数量 例如 1,2,4,8] [每个生产者的消息数量] [持久化配置]
+"""
+
+SHARD_COUNT_LIST = [1, 2, 4, 8]
+PRODUCER_MESSAGE_COUNT = 2000
+MESSAGE_TOPIC = "benchmark_shard"
+
+
+def produce(mq, message_count):
+    for index in range(message_count):
+        mq.add_message(MESSAGE_TOPIC, "message_%s" % index)
+
+
+def benchmark_produce(mq_path, producer_count, shard_count, producer_message_count, durability_profile):
+    """
+    :return: (每秒写入的消息数量, 每条消息的 Commit Log fsync 次数)
+    """
+    mq = SimpleSQLiteMQBroker(
+        tempfile.mkdtemp(prefix="mq_%s_producer_%s_shard_" % (producer_count, shard_count), dir=mq_path),
+        durability_profile=durability_profile,
+        topic_shard_count_dict={MESSAGE_TOPIC: shard_count}
+    )
+    # 提前生成各个 Shard 的 Segment 不计入写入耗时
+    mq.get_topic_shard_count(MESSAGE_TOPIC)
+    begin_fsync_count = mq.stats()["commit_log_fsync_count"]
+    producer_thread_list = [
+        threading.Thread(target=produce, args=(mq, producer_message_count)) for _ in range(producer_count)
+    ]
+    begin_time = time.time()
+    for producer_thread in producer_thread_list:
+        producer_thread.start()
+    for producer_thread in producer_thread_list:
+        producer_thread.join()
+    cost_seconds = time.time() - begin_time
+    fsync_count = mq.stats()["commit_log_fsync_count"] - begin_fsync_count
+    mq.wait_ext_segment_synced()
+    message_count = producer_count * producer_message_count
+    return message_count / cost_seconds, float(fsync_count) / message_count
+
+
+if __name__ == '__main__':
+    shard_count_list = SHARD_COUNT_LIST
+    if len(sys.argv) > 1:
+        shard_count_list = [int(shard_count) for shard_count in sys.argv[1].split(",")]
+    producer_message_count = int(sys.argv[2]) if len(sys.argv) > 2 else PRODUCER_MESSAGE_COUNT
+    durability_profile = sys.argv[3] if len(sys.argv) > 3 else SQLITE_MQ_DURABILITY_PROFILE_SAFE
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    print("durability profile: %s" % durability_profile)
+    print("producers | 1 shard msg/s | N shards msg/s | speedup | fsync/msg 1 shard | fsync/msg N shards")
+    for shard_count in sorted(shard_count_list):
+        # 生产者数量与 Shard 数量相同
+        single_shard_rate, single_shard_fsync = benchmark_produce(
+            mq_path, shard_count, 1, producer_message_count, durability_profile)
+        shard_rate, shard_fsync = benchmark_produce(
+            mq_path, shard_count, shard_count, producer_message_count, durability_profile)
+        print("%9s | %13.1f | %14.1f | %6.2fx | %17.2f | %18.2f" % (
+            shard_count, single_shard_rate, shard_rate, shard_rate / single_shard_rate, single_shard_fsync,
+            shard_fsync))
+    os._exit(0)
@@ -0,0 +1,103 @@
+# coding=utf-8
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pava.component.p_log import PLog
+
+from pava.component.mq import CREATE_SIMPLE_SQLITE_MQ_COMMON_SEGMENT_TABLE_SQL, CREATE_INDEX_UUID, \
+    CREATE_INDEX_MESSAGE_STATUS_MESSAGE_ID, ADD_MESSAGE_TO_COMMON_SEGMENT_TABLE_SQL, \
+    UPDATE_COMMON_SEGMENT_MESSAGE_SQL, DELETE_COMMON_SEGMENT_MESSAGE_SQL, BEGIN_TRANSACTION, \
+    MESSAGE_STATUS_INIT, MESSAGE_STATUS_LOCKED, ADD_COLUMN_MESSAGE_ENCODING, MESSAGE_ENCODING_BASE64, \
+    ADD_COLUMN_VISIBLE_TIME, ADD_COLUMN_PRIORITY, MESSAGE_PRIORITY_DEFAULT
+from pava.component.mq.core.simple_sqlite_mq_broker import SimpleSQLiteMQBroker
+from pava.component.mq.core.sqlite_connection_pool import _connect_sqlite
+
+"""
+对比 Common Segment 热点语句 (添加 / 锁定 / 删除) 使用 % 拼接 与 使用 ? 参数化 的耗时
+拼接的语句每次文本都不同 无法命中语句缓存 每次都需要重新解析
+同时输出 Broker 上 add / get / commit 完整路径的吞吐
+用法: python test/simple_sqlite_mq_statement_cache_benchmark.py [消息数量]
+"""
+
+MESSAGE_COUNT = 5000
+MESSAGE_TOPIC = "benchmark_statement_cache"
+
+
+def _interpolate(sql_str, sql_parameter):
+    # 按旧的方式 把参数直接拼接进 SQL 文本
+    for parameter in sql_parameter:
+        literal = str(parameter) if type(parameter) in (int, long) else "'%s'" % parameter
+        sql_str = sql_str.replace("?", literal, 1)
+    return sql_str
+
+
+def benchmark_segment_statement(db_path, message_count, interpolate_bool):
+    connection = _connect_sqlite(db_path)
+    connection.execute(CREATE_SIMPLE_SQLITE_MQ_COMMON_SEGMENT_TABLE_SQL)
+    connection.execute(CREATE_INDEX_UUID)
+    connection.execute(CREATE_INDEX_MESSAGE_STATUS_MESSAGE_ID)
+    connection.execute(ADD_COLUMN_MESSAGE_ENCODING)
+    connection.execute(ADD_COLUMN_VISIBLE_TIME)
+    connection.execute(ADD_COLUMN_PRIORITY)
+    connection.commit()
+
+    def execute(sql_str, sql_parameter):
+        cursor = connection.cursor()
+        cursor.execute(BEGIN_TRANSACTION)
+        if interpolate_bool:
+            cursor.execute(_interpolate(sql_str, sql_parameter))
+        else:
+            cursor.execute(sql_str, sql_parameter)
+        connection.commit()
+
+    current_timestamp = int(time.time())
+    begin_time = time.time()
+    for index in range(message_count):
+        message_uuid = "uuid_%s" % index
+        execute(ADD_MESSAGE_TO_COMMON_SEGMENT_TABLE_SQL, (
+            "bWVzc2FnZQ==", MESSAGE_STATUS_INIT, current_timestamp, current_timestamp, 0, "producer", "", message_uuid,
+            MESSAGE_ENCODING_BASE64, current_timestamp, MESSAGE_PRIORITY_DEFAULT
+        ))
+        execute(UPDATE_COMMON_SEGMENT_MESSAGE_SQL, (
+            MESSAGE_STATUS_LOCKED, current_timestamp, "consumer", current_timestamp + 3600, 0, message_uuid
+        ))
+        execute(DELETE_COMMON_SEGMENT_MESSAGE_SQL, (message_uuid,))
+    cost = time.time() - begin_time
+    connection.close()
+    return cost
+
+
+def benchmark_broker(mq, message_count):
+    begin_time = time.time()
+    for _ in range(message_count):
+        mq.add_message(MESSAGE_TOPIC, "message")
+        mq_message = mq.get_message(MESSAGE_TOPIC)
+        mq.commit_message(MESSAGE_TOPIC, mq_message.message_uuid)
+    mq.wait_ext_segment_synced()
+    return time.time() - begin_time
+
+
+if __name__ == '__main__':
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+
+    mq_path = tempfile.mkdtemp(prefix="simple_sqlite_mq_benchmark_")
+    PLog.add_file_handler(os.path.join(mq_path, "log", "benchmark.log"))
+    PLog.set_print_logger_level(logging.WARNING)
+
+    # 使用内存数据库 排除磁盘同步的影响 只比较语句解析的开销
+    interpolate_cost = benchmark_segment_statement(":memory:", message_count, True)
+    parameterize_cost = benchmark_segment_statement(":memory:", message_count, False)
+    print("segment statements interpolated  : %s x add/lock/delete, %.3f s, %.1f us/statement" % (
+        message_count, interpolate_cost, interpolate_cost * 1000000 / (message_count * 3)))
+    print("segment statements parameterized : %s x add/lock/delete, %.3f s, %.1f us/statement" % (
+        message_count, parameterize_cost, parameterize_cost * 1000000 / (message_count * 3)))
+    print("speed up                         : %.2fx" % (interpolate_cost / parameterize_cost))
+
+    mq = SimpleSQLiteMQBroker(os.path.join(mq_path, "mq"))
+    broker_cost = benchmark_broker(mq, message_count)
+    print("broker add/get/commit            : %s messages, %.3f s, %.1f msg/s" % (
+        message_count, broker_cost, message_count / broker_cost))
+    os._exit(0)